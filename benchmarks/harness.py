@@ -0,0 +1,196 @@
+"""
+=======
+Harness
+=======
+@file_name: harness.py
+@author: Bin Liang
+@date: 2024-05-31
+The harness of the benchmarks: the scenarios, the profiles of the mock LLM backend, the measurement and the comparison
+with a baseline.
+"""
+
+__all__ = ["PROFILES", "Scenario", "scenario", "scenarios", "run_scenario", "compare"]
+
+import time
+import statistics
+import importlib.util
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+import httpx
+
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.openai_client import OpenAIClient
+from xyz.utils.llm.retry import RetryPolicy
+from xyz.utils.profiling import ProfileSession, profile_session
+
+# The profiles of the mock backend. "overhead" has no model time at all, so the latency of a call is the cost of the
+# orchestration only, which is the number to watch for the regressions.
+PROFILES = {
+    "overhead": {},
+    "realistic": {"latency": 0.4, "tokens_per_second": 80., "jitter": 0.2},
+    "flaky": {"latency": 0.4, "tokens_per_second": 80., "jitter": 0.2, "error_rate": 0.1},
+}
+
+
+@dataclass
+class Scenario:
+    """
+    A benchmark: `build(client)` is a context manager which builds the agents on the mock client and gives the
+    function of one call, `call(i)`. The scenarios which need more packages than the package itself (`requires`) are
+    only in the default suite if the packages are installed, see the "benchmarks" extra of the setup.
+    """
+    name: str
+    build: Callable[[Any], AbstractContextManager]
+    replies: Any = None
+    description: str = ""
+    requires: tuple = ()
+    client_args: dict = field(default_factory=dict)
+
+    def missing_packages(self) -> list:
+        """
+        The packages of `requires` which are not installed.
+        """
+
+        return [package for package in self.requires if importlib.util.find_spec(package) is None]
+
+
+# The registered scenarios, in the order of the registration.
+scenarios = {}
+
+
+def scenario(name: str, replies: Any = None, description: str = "", requires: tuple = (), **client_args) -> Callable:
+    """
+    Register a scenario. The replies are the rules of the `MockLLMTransport`, `requires` are the packages which the
+    scenario needs besides the package itself, and the other arguments are given to the mock client.
+
+    Examples
+    --------
+    >>> @scenario("llm_agent", replies="The answer is 42.")
+    >>> @contextmanager
+    >>> def llm_agent(client):
+    >>>     agent = LLMAgent(template=template, llm_client=client, stream=False)
+    >>>     yield lambda i: agent(question=f"What is {i} + 1?")
+    """
+
+    def register(build: Callable) -> Callable:
+        scenarios[name] = Scenario(name=name, build=build, replies=replies, description=description,
+                                   requires=tuple(requires), client_args=client_args)
+        return build
+
+    return register
+
+
+def run_scenario(bench: Scenario, profile: str = "overhead", calls: int = 20, concurrency: int = 1,
+                 warmup: int = 2, seed: int = 0, transport: httpx.BaseTransport = None,
+                 session: ProfileSession = None) -> dict:
+    """
+    Build a scenario on a fresh mock backend, warm it up, then make the calls (by `concurrency` threads).
+
+    Parameters
+    ----------
+    bench: Scenario
+        The scenario.
+    profile: str
+        The name of the profile of the mock backend, see `PROFILES`.
+    calls: int
+        The number of the measured calls.
+    concurrency: int
+        The number of the calls at the same time.
+    warmup: int
+        The number of the calls before the measurement (the imports, the caches of the templates and the regexes).
+    seed: int
+        The seed of the mock backend.
+    transport: httpx.BaseTransport, optional
+        The backend instead of the mock, i.e. a `RecordingTransport` or a `ReplayTransport` of a cassette. The
+        profile is then only the label of the results.
+    session: ProfileSession, optional
+        If it is set, the measured calls are profiled in it (see `profile_session`).
+
+    Returns
+    -------
+    dict
+        The wall time, the throughput (calls per second), the latency of the calls (mean, p50, p95, max), the CPU
+        time per call, and the LLM requests and the simulated model seconds per call.
+    """
+
+    assert calls >= 1 and concurrency >= 1, "The calls and the concurrency must be at least 1."
+
+    # The failed requests of the "flaky" profile are retried at once, the server says "retry-after-ms: 0".
+    client_args = dict({"retry_policy": RetryPolicy(base_delay=0.01, max_delay=0.1)}, **bench.client_args)
+    if transport is None:
+        transport = MockLLMTransport(replies=bench.replies, seed=seed, **PROFILES[profile])
+        client = create_mock_client(transport, **client_args)
+    else:
+        # The key is only needed to record the real API.
+        client = OpenAIClient(api_key=OpenAIClient.resolve_api_key() or "cassette",
+                              transport=httpx.Client(transport=transport, timeout=600.), **client_args)
+
+    def timed(i: int) -> float:
+        started_at = time.perf_counter()
+        call(i)
+        return time.perf_counter() - started_at
+
+    with bench.build(client) as call:
+        for i in range(warmup):
+            call(i)
+        if isinstance(transport, MockLLMTransport):
+            transport.reset_stats()
+        # The stats of a replay count the warmup too, the recording has none.
+        stats = getattr(transport, "stats", {})
+        requests = stats.get("requests", 0)
+
+        cpu_started_at, started_at = time.process_time(), time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor, \
+                profile_session(session) if session is not None else nullcontext():
+            # The threads run in the context of the caller, so they are in its profile session.
+            futures = [executor.submit(contextvars.copy_context().run, timed, i)
+                       for i in range(warmup, warmup + calls)]
+            latencies = sorted(future.result() for future in futures)
+        wall, cpu = time.perf_counter() - started_at, time.process_time() - cpu_started_at
+
+    return {"profile": profile, "calls": calls, "concurrency": concurrency, "wall": wall,
+            "throughput": calls / wall, "mean": statistics.fmean(latencies), "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95), "max": latencies[-1], "cpu_per_call": cpu / calls,
+            "requests_per_call": (stats.get("requests", 0) - requests) / calls,
+            "model_seconds_per_call": stats.get("simulated_seconds", 0.) / calls}
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.25, metric: str = "mean") -> list:
+    """
+    Compare the results with a baseline (the same shape: {name: result}).
+
+    Parameters
+    ----------
+    results: dict
+        The new results.
+    baseline: dict
+        The results of the baseline run.
+    threshold: float
+        The relative slowdown which is a regression, by default 25%.
+    metric: str
+        The metric to compare, by default the mean latency.
+
+    Returns
+    -------
+    list
+        The regressions: [(name, baseline value, new value)].
+    """
+
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old or "skipped" in result or "skipped" in old or old.get("profile") != result.get("profile"):
+            continue
+        if result[metric] > old[metric] * (1. + threshold):
+            regressions.append((name, old[metric], result[metric]))
+
+    return regressions
+
+
+def _percentile(values: list, q: float) -> float:
+    # The values are sorted, the nearest rank.
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
@@ -0,0 +1,142 @@
+"""
+=============
+RunBenchmarks
+=============
+@file_name: run_benchmarks.py
+@author: Bin Liang
+@date: 2024-05-31
+Run the benchmarks on the mock LLM backend, without the network and the API key:
+
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --profile overhead --output bench.json
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --profile overhead --baseline bench.json
+
+With a baseline, the exit code is 1 if a benchmark is slower than the threshold.
+
+To load the orchestration with the real timing of the model, record the real API once, then replay it (at the
+original or a scaled speed), and write the flamegraph of each scenario:
+
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --only auto_company --record cassettes/auto_company.jsonl.gz
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --only auto_company --replay cassettes/auto_company.jsonl.gz \
+        --speed 1 --concurrency 8 --flamegraph profiles
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+from xyz.utils.llm.cassette import RecordingTransport, ReplayTransport
+from xyz.utils.profiling import ProfileSession
+
+from benchmarks.harness import PROFILES, compare, run_scenario, scenarios
+import benchmarks.scenarios  # noqa: F401 (the scenarios are registered on import)
+
+
+def set_args():
+    parser = argparse.ArgumentParser(description="The benchmarks of the agents and the companies on a mock LLM.")
+    parser.add_argument("--only", nargs="*", default=None, choices=list(scenarios),
+                        help="The scenarios to run, by default all whose packages are installed.")
+    parser.add_argument("--profile", default="overhead", choices=list(PROFILES),
+                        help="The profile of the mock backend. 'overhead' has no model time.")
+    parser.add_argument("--calls", type=int, default=20, help="The measured calls of each scenario.")
+    parser.add_argument("--concurrency", type=int, default=1, help="The calls at the same time.")
+    parser.add_argument("--warmup", type=int, default=2, help="The calls before the measurement.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the mock backend.")
+    parser.add_argument("--output", type=str, default=None, help="Save the results as JSON.")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare with the JSON results of a baseline.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="The relative slowdown of a regression.")
+    parser.add_argument("--record", type=str, default=None,
+                        help="Call the real API (with the OpenAI API key) and record it into this cassette.")
+    parser.add_argument("--replay", type=str, default=None, help="Replay this cassette instead of the mock.")
+    parser.add_argument("--speed", type=float, default=1., help="The speed of the replay, 0 means no waiting.")
+    parser.add_argument("--flamegraph", type=str, default=None,
+                        help="Profile the calls and write the folded stacks of each scenario into this directory.")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the agents.")
+
+    return parser.parse_args()
+
+
+def get_cassette(record: str | None, replay: str | None, speed: float):
+    """
+    The transport of the cassette, or None for the mock backend. The scenarios share the cassette, their requests
+    are told apart by the prompts.
+    """
+
+    if record:
+        return RecordingTransport(record)
+    if replay:
+        return ReplayTransport(replay, speed=speed)
+
+    return None
+
+
+def main() -> int:
+    args = set_args()
+    assert not (args.record and args.replay), "Record or replay, not both."
+    output, baseline, record, replay, flamegraph = [os.path.abspath(path) if path else None for path in
+                                                    (args.output, args.baseline, args.record, args.replay,
+                                                     args.flamegraph)]
+    profile = "record" if record else "replay" if replay else args.profile
+
+    # The companies write their logs in the working directory.
+    os.chdir(tempfile.mkdtemp(prefix="xyz_bench_"))
+
+    # The scenarios which need the packages of the "benchmarks" extra are only run by default if they are installed.
+    names = args.only or [name for name, bench in scenarios.items() if not bench.missing_packages()]
+    not_run = [name for name in scenarios if name not in names]
+    if not_run and not args.only:
+        print(f"Not run, their packages are not installed (pip install -e .[benchmarks]): {', '.join(not_run)}")
+
+    results = {}
+    print(f"{'scenario':<26}{'calls':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'calls/s':>10}"
+          f"{'cpu ms':>9}{'requests':>10}")
+    for name in names:
+        missing = scenarios[name].missing_packages()
+        if missing:
+            results[name] = {"profile": profile, "skipped": f"Not installed: {', '.join(missing)}"}
+            print(f"{name:<26}skipped, {results[name]['skipped']} (pip install -e .[benchmarks])")
+            continue
+        try:
+            with open(os.devnull, "w") as devnull, redirect_stdout(sys.stdout if args.verbose else devnull), \
+                    redirect_stderr(sys.stderr if args.verbose else devnull):
+                session = ProfileSession() if flamegraph else None
+                result = run_scenario(scenarios[name], profile=profile, calls=args.calls,
+                                      concurrency=args.concurrency, warmup=args.warmup, seed=args.seed,
+                                      transport=get_cassette(record, replay, args.speed), session=session)
+            if session is not None:
+                session.write_folded(os.path.join(flamegraph, f"{name}.folded"))
+        except ImportError as error:
+            # The example agents may need the packages of their own requirements.
+            results[name] = {"profile": profile, "skipped": f"{type(error).__name__}: {error}"}
+            print(f"{name:<26}skipped, {results[name]['skipped']}")
+            continue
+        except Exception:
+            results[name] = {"profile": profile, "skipped": traceback.format_exc(limit=3)}
+            print(f"{name:<26}failed\n{results[name]['skipped']}")
+            continue
+
+        results[name] = result
+        print(f"{name:<26}{result['calls']:>7}{result['mean'] * 1e3:>10.1f}{result['p50'] * 1e3:>10.1f}"
+              f"{result['p95'] * 1e3:>10.1f}{result['throughput']:>10.1f}{result['cpu_per_call'] * 1e3:>9.1f}"
+              f"{result['requests_per_call']:>10.1f}")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if baseline:
+        with open(baseline, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), threshold=args.threshold)
+        for name, old, new in regressions:
+            print(f"Regression: {name} {old * 1e3:.1f} ms -> {new * 1e3:.1f} ms")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
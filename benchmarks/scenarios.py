@@ -0,0 +1,116 @@
+"""
+=========
+Scenarios
+=========
+@file_name: scenarios.py
+@author: Bin Liang
+@date: 2024-05-31
+The benchmarks of the agents and the companies on the mock LLM backend. The replies of the mock are chosen by the
+system prompts of the agents, so every call goes through the same parsing as with the real API. The agents which need
+more packages are imported by their scenarios, and the scenario names the packages (`requires`), so it is only run
+when they are installed (`pip install -e .[benchmarks]`).
+"""
+
+import os
+import json
+import logging
+from contextlib import contextmanager
+
+from xyz.elements.assistant.input_format_assistant import InputFormatAssistant
+from xyz.graph.auto_company import AutoCompany
+from xyz.node.basic.llm_agent import LLMAgent
+
+from benchmarks.harness import scenario
+
+QUESTION = "Find the sum. \\( \\sum_{n=1}^{10} 4n - 5 \\)"
+
+QUESTION_TEMPLATE = [
+    {"role": "system", "content": "You are a Mathematics assistant. Answer the question step by step."},
+    {"role": "user", "content": "The question is: {question}"},
+]
+
+SOLVING_REPLY = ("We need the sum of 4n - 5 for n from 1 to 10. The sum of n is 55, so the sum of 4n is 220. "
+                 "The sum of the constant part is 10 * 5 = 50. So the answer is 220 - 50 = 170.")
+
+WORK_PLAN = [{"name": "PlanAgent", "sub_task": "Make a plan to solve the question."},
+             {"name": "SolvingAgent", "sub_task": "Solve the question by the plan."},
+             {"name": "CodingAgent", "sub_task": "Check the calculation by the python code."},
+             {"name": "SummaryAgent", "sub_task": "Compare the answers and give the final one."}]
+
+# The first pattern which is found in the prompt wins, so the manager prompts (which contain the outputs of the
+# employees) come first, and the work plan before the task analysis (its prompt asks for the judgment too).
+AUTO_MATH_REPLIES = {
+    r"work liaison": "The question is: " + QUESTION,
+    r"make a plan\s+for a task": "The plan follows the skills of the employees.\n|||working-plan\n"
+                                 + json.dumps(WORK_PLAN) + "\n|||working-plan",
+    r"make a judgment if your employees": "The task is a sum of an arithmetic sequence. Our employees can plan, "
+                                          "solve, compute and summarize it. YES-WE-CAN",
+    r"direct your employees": "The step is done well.\n|||next-step\nGo on with the result above.\n|||next-step\n",
+    r"staff has\s+done all the work": "The employees solved the question, the answer is 170.",
+    r"About Planning": "1. Split the sum into two parts. 2. Compute each part. 3. Subtract.",
+    r"solve the `current question`": SOLVING_REPLY,
+    r"# Guidance": "```python\nprint(sum(4 * n - 5 for n in range(1, 11)))\n```",
+    r"Your job is to compare the": "The original answer 170 is the same as the computed one. The answer is 170.",
+}
+
+
+@scenario("llm_agent", replies=SOLVING_REPLY, description="One LLMAgent request: render, trim, request, parse.")
+@contextmanager
+def llm_agent(client):
+    agent = LLMAgent(template=QUESTION_TEMPLATE, llm_client=client, stream=False)
+    yield lambda i: agent(question=f"{QUESTION} (case {i})")
+
+
+@scenario("llm_agent_stream", replies=SOLVING_REPLY, description="One streamed LLMAgent request, consumed fully.")
+@contextmanager
+def llm_agent_stream(client):
+    agent = LLMAgent(template=QUESTION_TEMPLATE, llm_client=client, stream=True)
+    yield lambda i: "".join(agent(question=f"{QUESTION} (case {i})"))
+
+
+@scenario("input_format_assistant", replies=QUESTION, description="Fill the parameters of an agent by a tool call.")
+@contextmanager
+def input_format_assistant(client):
+    assistant = InputFormatAssistant(client)
+    functions_list = [{"type": "function", "function": {
+        "name": "SolvingAgent", "description": "Solve the question by the plan.",
+        "parameters": {"type": "object", "required": ["question", "plan"],
+                       "properties": {"question": {"type": "string", "description": "The question."},
+                                      "plan": {"type": "string", "description": "The plan."}}}}}]
+    yield lambda i: assistant(input_content=f"{QUESTION} (case {i})", functions_list=functions_list, messages=[])
+
+
+@scenario("auto_company", replies=AUTO_MATH_REPLIES,
+          description="An AutoCompany run of the auto_math agents: task analysis, work plan, 4 steps, summary.")
+@contextmanager
+def auto_company(client):
+    from example.auto_math.agents.coding_agent import CodingAgent
+    from example.auto_math.agents.plan_agent import PlanAgent
+    from example.auto_math.agents.solving_agent import SolvingAgent
+    from example.auto_math.agents.summary_agent import SummaryAgent
+
+    os.makedirs("logs", exist_ok=True)
+    company = AutoCompany(llm_client=client, logger_path="logs/auto_company.log")
+    company.add_agent([PlanAgent(client), SolvingAgent(client), CodingAgent(client), SummaryAgent(client)])
+    # The console is the UI of a live run, the benchmark keeps the file and the run log only.
+    for handler in company.logger.sink.handlers:
+        if not isinstance(handler, logging.FileHandler):
+            handler.setLevel(logging.CRITICAL + 1)
+    try:
+        yield lambda i: company(user_input=f"{QUESTION} (case {i})")
+    finally:
+        company.close()
+
+
+@scenario("rank_prompts", replies={r"rank the quality of two outputs": "A", r".": SOLVING_REPLY},
+          description="RankPrompts of 3 prompts on 2 test cases (12 generations and 12 rankings).",
+          requires=("prettytable", "tenacity", "tqdm"))
+@contextmanager
+def rank_prompts(client):
+    from xyz.elements.assistant.prompt_assistants.rank_prompts import RankPrompts
+
+    ranker = RankPrompts(generation_agent=client, score_agent=client, k=32)
+    prompts = ["You are a Mathematics assistant.", "Solve the question step by step.", "Answer briefly."]
+    test_cases = [{"task": QUESTION}, {"task": "What is the sum of the first 100 positive integers?"}]
+    yield lambda i: ranker(test_cases=test_cases, description=f"Solve the math questions (case {i}).",
+                           prompts=prompts)
@@ -18,8 +18,10 @@ import traceback
 from xyz.node.agent import Agent
 from xyz.utils.llm.openai_client import OpenAIClient
 from xyz.node.basic.llm_agent import LLMAgent
+from xyz.utils.profiling import profiled
 
 
+@profiled
 def extract_code_blocks(text):
     import re
 
@@ -51,8 +53,11 @@ class CodingAgent(Agent):
         })
         self.input_type = "str"
         self.output_type = "str"
-
-        self.repeat_time = 0
+        self.set_output_schema({
+            "type": "object",
+            "properties": {"coding_answer": {"type": "string",
+                                            "description": "The result which be computed by the python code."}},
+        })
 
         self.coding_agent = LLMAgent(template=coding_prompt, llm_client=llm_client, stream=True)
         self.debug_agent = LLMAgent(template=debug_prompt, llm_client=llm_client, stream=False)
@@ -103,7 +108,7 @@ class CodingAgent(Agent):
             except:
                 return ""
 
-    def run_code(self, sample):
+    def run_code(self, sample, repeat_time: int = 0):
 
         if "```" in sample:
             sample = extract_code_blocks(sample)
@@ -116,20 +121,22 @@ class CodingAgent(Agent):
 
         try:
             with contextlib.redirect_stdout(output):
-                exec(sample, globals())
+                # A fresh namespace for each run, so the calls at the same time do not share their variables.
+                exec(sample, dict(globals()))
         except Exception:
             error_message = traceback.format_exc()
 
         print_output = output.getvalue()
 
         if error_message:
-            self.repeat_time += 1
-            if self.repeat_time >= 4:
+            # The number of the debugging attempts is counted in each call, not in the agent.
+            repeat_time += 1
+            if repeat_time >= 4:
                 return "The code is error."
 
             new_sample = self.debug_agent(code=sample, error=error_message)
             new_code = new_sample.split("|||Code:")[-1]
-            new_result = self.run_code(new_code)
+            new_result = self.run_code(new_code, repeat_time)
             return new_result
         else:
             return print_output
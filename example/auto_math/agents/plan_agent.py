@@ -43,6 +43,11 @@ class PlanAgent(Agent):
         )
         self.input_type = "str"
         self.output_type = "str"
+        self.set_output_schema({
+            "type": "object",
+            "properties": {"plan": {"type": "string",
+                                   "description": "The plan for solving the question step by step."}},
+        })
 
         self.llm_plan = LLMAgent(template=plan_prompt, llm_client=llm_client, stream=True)
 
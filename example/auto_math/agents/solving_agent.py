@@ -37,6 +37,11 @@ class SolvingAgent(Agent):
         })
         self.input_type = "str"
         self.output_type = "str"
+        self.set_output_schema({
+            "type": "object",
+            "properties": {"full_solving_process": {"type": "string",
+                                                   "description": "The full solving process answer."}},
+        })
 
         self.llm_solving = LLMAgent(template=solving_prompt, llm_client=llm_client, stream=True)
 
@@ -9,6 +9,7 @@ Verify and vote
 
 from typing import Any
 from xyz.node.agent import Agent
+from xyz.utils.profiling import profiled
 from .base_code_interpreter import BaseCodeInterpreter
 
 class VerifyAndVote(Agent):
@@ -70,6 +71,7 @@ def add_verify_function(code_string, value):
     except Exception as e:
         return f"Error during execution: {e}"
 
+@profiled
 def auto_round(num_str):
     import re
     match = re.search(r'(\.(\d*?)(9{3,}|0{3,}|1{3,}|2{3,}|3{3,}|4{3,}|5{3,}|6{3,}|7{3,}|8{3,})\d*)', num_str)
@@ -1,4 +1,12 @@
 export PYTHONPATH=.:$PYTHONPATH
 
-python example/auto_math/auto_company/auto_math_company.py
+# The unit tests run offline, on the mock LLM backend.
+python -m pytest -q tests
 
+# The benchmarks run on the mock LLM backend, without the network and the API key.
+python benchmarks/run_benchmarks.py --profile overhead --calls 10
+
+# The live run needs the OpenAI API key (in the environment or the .env file).
+if [ -n "$OPENAI_API_KEY" ] || [ -f .env ]; then
+    python example/auto_math/auto_company/auto_math_company.py
+fi
@@ -8,6 +8,7 @@ setup(
     packages=find_packages(),
     install_requires=[
         'openai',
+        'numpy',
         'langchain',
         'openpyxl',
         'networkx',
@@ -15,6 +16,14 @@ setup(
         'pymongo',
         'pytest',
     ],
+    extras_require={
+        # Export the usage ledger to Parquet.
+        'parquet': ['pyarrow'],
+        # The exact token counts of the prompts, they are estimated without it.
+        'tokens': ['tiktoken'],
+        # The benchmark scenarios of the prompt assistants (see `benchmarks/scenarios.py`).
+        'benchmarks': ['prettytable', 'tenacity', 'tqdm'],
+    },
     # commandline-app 
     # entry_points={
     #     'console_scripts': [
@@ -0,0 +1,137 @@
+"""
+========
+AgentMap
+========
+@file_name: test_agent_map.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the bounded-concurrency Agent.map and Agent.amap.
+"""
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from xyz.node.agent import Agent
+
+
+class SleepAgent(Agent):
+    """
+    Sleep `seconds`, then return `value`. It counts the calls in flight, and fails when `value` is an exception.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started = 0
+
+    def enter(self):
+        with self.lock:
+            self.started += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def flowing(self, value, seconds: float = 0.):
+        self.enter()
+        try:
+            time.sleep(seconds)
+        finally:
+            self.leave()
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    async def aflowing(self, value, seconds: float = 0.):
+        self.enter()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.leave()
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+def test_map_keeps_the_order_and_the_concurrency_bound():
+    agent = SleepAgent()
+    inputs = [{"value": i, "seconds": 0.05 * (i % 3)} for i in range(12)]
+
+    assert list(agent.map(inputs, max_concurrency=3)) == [(i, i) for i in range(12)]
+    assert agent.max_in_flight == 3
+
+
+def test_unordered_map_yields_the_fast_calls_first():
+    agent = SleepAgent()
+    inputs = [{"value": "slow", "seconds": 0.3}, {"value": "fast", "seconds": 0.}]
+
+    assert [result for _, result in agent.map(inputs, max_concurrency=2, ordered=False)] == ["fast", "slow"]
+
+
+def test_map_yields_or_raises_the_errors():
+    agent = SleepAgent()
+    inputs = [{"value": 1}, {"value": ValueError("bad")}]
+
+    results = dict(agent.map(inputs, max_concurrency=1))
+    assert isinstance(results[1], ValueError)
+    with pytest.raises(ValueError):
+        list(agent.map(inputs, max_concurrency=1, return_exceptions=False))
+
+
+def test_stop_when_does_not_wait_for_the_calls_in_flight():
+    agent = SleepAgent()
+    inputs = [{"value": 0}] + [{"value": i, "seconds": 1.} for i in range(1, 20)]
+
+    started_at = time.perf_counter()
+    results = list(agent.map(inputs, max_concurrency=3, ordered=False, stop_when=lambda i, result: i == 0))
+    seconds = time.perf_counter() - started_at
+
+    assert results == [(0, 0)]
+    assert seconds < 0.5
+    # Only the calls in flight have started, the others are cancelled.
+    assert agent.started <= 4
+
+
+def test_broken_consumer_does_not_wait_for_the_calls_in_flight():
+    agent = SleepAgent()
+    inputs = [{"value": 0}] + [{"value": i, "seconds": 1.} for i in range(1, 5)]
+
+    started_at = time.perf_counter()
+    for _ in agent.map(inputs, max_concurrency=3, ordered=False):
+        break
+
+    assert time.perf_counter() - started_at < 0.5
+
+
+def test_map_reads_a_lazy_input_as_the_workers_are_free():
+    agent = SleepAgent()
+    progress = []
+
+    results = list(agent.map(({"value": i} for i in range(5)), max_concurrency=2,
+                             on_progress=lambda done, total: progress.append((done, total))))
+
+    assert results == [(i, i) for i in range(5)]
+    assert progress == [(i, None) for i in range(1, 6)]
+
+
+def test_amap_keeps_the_order_and_stops():
+    agent = SleepAgent()
+    inputs = [{"value": i, "seconds": 0.02 * (5 - i)} for i in range(5)]
+
+    async def main():
+        ordered = [item async for item in agent.amap(inputs, max_concurrency=5)]
+        stopped = [item async for item in agent.amap(inputs, max_concurrency=5, ordered=False,
+                                                        stop_when=lambda i, result: True)]
+        return ordered, stopped
+
+    ordered, stopped = asyncio.run(main())
+    assert ordered == [(i, i) for i in range(5)]
+    assert stopped == [(4, 4)]
+    assert agent.max_in_flight == 5
@@ -0,0 +1,80 @@
+"""
+=================
+AsyncOpenAIClient
+=================
+@file_name: test_async_client.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the asyncio client and of the awaitable agents.
+"""
+
+import time
+import asyncio
+
+from xyz.node.agent import Agent
+from xyz.node.basic.llm_agent import LLMAgent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.openai_client import AsyncOpenAIClient
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+class AddAgent(Agent):
+
+    def flowing(self, a: int, b: int) -> int:
+        time.sleep(0.05)
+        return a + b
+
+
+def test_arun_and_astream_run():
+    client = create_mock_client(MockLLMTransport(replies="Hi there, friend."), client_class=AsyncOpenAIClient)
+
+    async def main():
+        response = await client.arun(MESSAGES)
+        chunks = [text async for text in client.astream_run(MESSAGES, images=[])]
+        return response.choices[0].message.content, chunks
+
+    content, chunks = asyncio.run(main())
+    assert content == "Hi there, friend."
+    assert len(chunks) > 1 and "".join(chunks) == content
+
+
+def test_arun_runs_the_requests_concurrently():
+    transport = MockLLMTransport(latency=0.2)
+    client = create_mock_client(transport, client_class=AsyncOpenAIClient)
+
+    async def main():
+        started_at = time.perf_counter()
+        await asyncio.gather(*(client.arun(MESSAGES) for _ in range(5)))
+        return time.perf_counter() - started_at
+
+    assert asyncio.run(main()) < 0.6
+    assert transport.stats["requests"] == 5
+
+
+def test_agent_acall_runs_flowing_in_a_thread():
+    agent = AddAgent()
+
+    async def main():
+        started_at = time.perf_counter()
+        results = await asyncio.gather(*(agent.acall(a=i, b=1) for i in range(5)))
+        return results, time.perf_counter() - started_at
+
+    results, seconds = asyncio.run(main())
+    assert results == [1, 2, 3, 4, 5]
+    assert seconds < 0.2
+
+
+def test_llm_agent_acall_and_astream():
+    transport = MockLLMTransport(replies="The answer is 2.")
+    template = [{"role": "user", "content": "{question}"}]
+    agent = LLMAgent(template, create_mock_client(transport, client_class=AsyncOpenAIClient))
+    stream_agent = LLMAgent(template, agent.llm_client, stream=True)
+
+    async def main():
+        answer = await agent.acall(question="What is 1 + 1?")
+        words = [word async for word in await stream_agent.acall(question="What is 1 + 1?")]
+        return answer, "".join(words)
+
+    assert asyncio.run(main()) == ("The answer is 2.", "The answer is 2.")
+    assert agent.last_request_info["messages"][-1]["content"] == "What is 1 + 1?"
@@ -0,0 +1,385 @@
+"""
+===========
+AutoCompany
+===========
+@file_name: test_auto_company.py
+@author: Bin Liang
+@date: 2024-05-20
+The tests of the AutoCompany on the mock LLM backend: the checks of the work plan, the routing of the manager and the
+parameters of the steps.
+"""
+
+import json
+
+import pytest
+
+from xyz.graph.auto_company import MAX_REROUTES, AutoCompany
+from xyz.node.agent import Agent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+
+PLAN = [{"name": "A", "sub_task": "Do the part A."}, {"name": "B", "sub_task": "Do the part B."},
+        {"name": "C", "sub_task": "Do the part C."}, {"name": "D", "sub_task": "Do the part D."}]
+
+
+class StepAgent(Agent):
+    """
+    An agent without the LLM, which records its calls and returns "{name} is done".
+    """
+
+    def __init__(self, name: str, calls: list):
+        super().__init__()
+        self.set_information({"type": "function", "function": {
+            "name": name, "description": f"Do the part {name}.",
+            "parameters": {"type": "object", "required": ["question"],
+                           "properties": {"question": {"type": "string", "description": "The question."}}}}})
+        self.input_type = "str"
+        self.output_type = "str"
+        self.calls = calls
+
+    def flowing(self, question: str) -> str:
+        name = self.information["function"]["name"]
+        self.calls.append(name)
+        return f"{name} is done"
+
+
+class TypedAgent(Agent):
+    """
+    An agent without the LLM, with the typed parameters and outputs. It records its keyword arguments.
+    """
+
+    def __init__(self, name: str, parameters: list, output: dict, calls: dict):
+        super().__init__()
+        self.set_information({"type": "function", "function": {
+            "name": name, "description": f"Do the part {name}.",
+            "parameters": {"type": "object", "required": parameters,
+                           "properties": {parameter: {"type": "string", "description": parameter}
+                                          for parameter in parameters}}}})
+        if output:
+            self.set_output_schema({"type": "object", "properties": {key: {"type": "string"} for key in output}})
+        self.input_type = "str"
+        self.output_type = "dict"
+        self.output_values = output
+        self.calls = calls
+
+    def flowing(self, **kwargs) -> dict:
+        self.calls[self.information["function"]["name"]] = kwargs
+        return self.output_values
+
+
+def step_summary(routes: dict, next_steps: dict = None):
+    """
+    The replies of the manager: the step summaries name the next employee by `routes` {step: [names in turn]}, or
+    nobody (the plan goes on). The next step of a step is in `next_steps` {step: next step}, by default "Go on.".
+    """
+
+    def reply(body: dict) -> str:
+        contents = "\n".join(message["content"] for message in body["messages"] if message["content"])
+        if "direct your employees" not in contents:
+            return "The staff can do it. YES-WE-CAN" if "make a judgment" in contents else "All done."
+        current = [name for name in {**routes, **(next_steps or {})}
+                   if f"{name} is done" in body["messages"][-1]["content"]]
+        next_step = (next_steps or {}).get(current[0], "Go on.") if current else "Go on."
+        names = routes.get(current[0]) if current else None
+        if not names:
+            return f"The step is done.\n|||next-step\n{next_step}\n|||next-step\n"
+        return (f"The step is done.\n|||next-employee\n{json.dumps({'name': names.pop(0)})}\n|||next-employee\n"
+                f"|||next-step\n{next_step}\n|||next-step\n")
+
+    return reply
+
+
+def make_company(tmp_path, replies=None, **company_args):
+    client = create_mock_client(MockLLMTransport(replies=replies or step_summary({})))
+    company = AutoCompany(llm_client=client, logger_path=str(tmp_path / "company.log"), **company_args)
+    calls = []
+    company.add_agent([StepAgent(step["name"], calls) for step in PLAN])
+
+    return company, calls
+
+
+@pytest.fixture
+def company(tmp_path):
+    company, _ = make_company(tmp_path)
+    yield company
+    company.close()
+
+
+def test_read_work_plan_chains_the_steps(company):
+    work_plan = company.read_work_plan(json.dumps(PLAN))
+
+    assert company.get_dependencies(work_plan) == {"A": [], "B": ["A"], "C": ["B"], "D": ["C"]}
+    assert [step["position"] for step in work_plan.values()] == ["start", "in-progress", "in-progress", "end"]
+
+
+def test_read_work_plan_rejects_an_unknown_dependency(company):
+    plan = [dict(PLAN[0], depends_on=[]), dict(PLAN[1], depends_on=["A", "Z"])]
+
+    with pytest.raises(ValueError, match=r"unknown steps \['Z'\]"):
+        company.read_work_plan(plan)
+
+
+def test_read_work_plan_rejects_the_duplicate_steps(company):
+    with pytest.raises(ValueError, match=r"duplicate steps \['A'\]"):
+        company.read_work_plan(PLAN + [PLAN[0]])
+
+
+def test_read_work_plan_rejects_the_steps_which_are_not_agents(company):
+    with pytest.raises(ValueError, match=r"\['E'\].*not the agents"):
+        company.read_work_plan(PLAN + [{"name": "E", "sub_task": "Do the part E."}])
+
+
+def test_read_work_plan_rejects_a_cycle(company):
+    plan = [dict(PLAN[0], depends_on=["B"]), dict(PLAN[1], depends_on=["A"])]
+
+    with pytest.raises(ValueError, match="cycle"):
+        company.read_work_plan(plan)
+
+
+def test_get_dependencies_rejects_an_unknown_next_step():
+    with pytest.raises(ValueError, match=r"unknown steps \['Z'\]"):
+        AutoCompany.get_dependencies({"A": {"next": ["Z"]}})
+
+
+def test_execute_work_plan_checks_the_agents_before_any_step(tmp_path):
+    company, calls = make_company(tmp_path)
+    work_plan = {"A": {"name": "A", "sub_task": "Do the part A.", "next": ["E"]},
+                 "E": {"name": "E", "sub_task": "Do the part E.", "next": []}}
+
+    with pytest.raises(ValueError, match="not the agents"):
+        company.execute_work_plan(user_input="question", task="task", work_plan=work_plan)
+    assert calls == []
+    company.close()
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_the_plan_goes_on_without_routing(tmp_path, max_concurrency):
+    company, calls = make_company(tmp_path, max_concurrency=max_concurrency)
+    company(user_input="question", work_plan=company.read_work_plan(PLAN))
+    company.close()
+
+    assert calls == ["A", "B", "C", "D"]
+
+
+def test_the_manager_routes_the_work_to_another_step(tmp_path):
+    company, calls = make_company(tmp_path, replies=step_summary({"A": ["C"]}))
+    company(user_input="question", work_plan=company.read_work_plan(PLAN))
+    company.close()
+
+    assert calls == ["A", "C", "D"]
+
+
+def test_the_manager_routes_the_work_back(tmp_path):
+    company, calls = make_company(tmp_path, replies=step_summary({"C": ["B"]}))
+    company(user_input="question", work_plan=company.read_work_plan(PLAN))
+    company.close()
+
+    assert calls == ["A", "B", "C", "B", "C", "D"]
+
+
+def test_the_routing_can_not_loop_forever(tmp_path):
+    company, calls = make_company(tmp_path, replies=step_summary({"C": ["B"] * 10}))
+    company(user_input="question", work_plan=company.read_work_plan(PLAN))
+    company.close()
+
+    assert calls == ["A"] + ["B", "C"] * (MAX_REROUTES + 1)
+
+
+def test_an_employee_out_of_the_plan_terminates_the_task(tmp_path):
+    company, calls = make_company(tmp_path, replies=step_summary({"B": ["Nobody"]}))
+    _, solving_record = company(user_input="question", work_plan=company.read_work_plan(PLAN))
+    company.close()
+
+    assert calls == ["A", "B"]
+    assert solving_record.endswith("All done.")
+    assert "This task is terminate with some error." in (tmp_path / "company.log").read_text()
+
+
+def test_the_rerouted_step_gets_the_new_instructions(tmp_path):
+    # The known values of B are the same when the work of C is routed back to it, only the next step is new.
+    calls = {}
+    agents = [TypedAgent(name, ["question", "instructions"] if name == "B" else ["question"],
+                         {"result": f"{name} is done"}, calls) for name in ["A", "B", "C", "D"]]
+    client = create_mock_client(MockLLMTransport(replies=step_summary({"C": ["B"]}, {"C": "Redo B with care."})))
+    company = AutoCompany(llm_client=client, logger_path=str(tmp_path / "company.log"))
+    company.add_agent(agents)
+    company(user_input="question", work_plan=company.read_work_plan(PLAN))
+    company.close()
+
+    assert calls["B"] == {"question": "question", "instructions": "Redo B with care."}
+    assert company.format_stats == {"direct": 6, "llm": 0}
+
+
+def test_the_llm_fills_the_parameters_of_the_rerouted_step(tmp_path):
+    requests = []
+    summary = step_summary({"C": ["B"]}, {"C": "Redo B with care."})
+
+    def reply(body: dict) -> str:
+        if body.get("tools"):
+            requests.append(body)
+        return summary(body)
+
+    company, calls = make_company(tmp_path, replies=reply)
+    company(user_input="question", work_plan=company.read_work_plan(PLAN))
+    company.close()
+
+    assert calls == ["A", "B", "C", "B", "C", "D"]
+    assert company.format_stats == {"direct": 5, "llm": 1}
+    assert len(requests) == 1 and "Redo B with care." in requests[0]["messages"][-1]["content"]
+
+
+def run_typed_plan(tmp_path, agents: list, plan: list, **company_args) -> AutoCompany:
+    client = create_mock_client(MockLLMTransport(replies=step_summary({})))
+    company = AutoCompany(llm_client=client, logger_path=str(tmp_path / "company.log"), **company_args)
+    company.add_agent(agents)
+    company(user_input="the raw question", work_plan=company.read_work_plan(plan))
+    company.close()
+
+    return company
+
+
+def test_the_sub_task_of_a_step_wins_over_the_outputs_of_its_parents(tmp_path):
+    calls = {}
+    agents = [TypedAgent("A", ["question"], {"sub_task": "the sub task of A", "plan": "the plan"}, calls),
+              TypedAgent("B", ["sub_task", "plan"], {}, calls)]
+    run_typed_plan(tmp_path, agents, [{"name": "A", "sub_task": "Plan it."}, {"name": "B", "sub_task": "Solve it."}])
+
+    assert calls["A"] == {"question": "the raw question"}
+    assert calls["B"] == {"sub_task": "Solve it.", "plan": "the plan"}
+
+
+def test_the_nearer_parent_wins(tmp_path):
+    calls = {}
+    agents = [TypedAgent("A", ["question"], {"answer": "the answer of A"}, calls),
+              TypedAgent("B", ["answer"], {"answer": "the answer of B"}, calls),
+              TypedAgent("C", ["answer"], {}, calls)]
+    plan = [{"name": "A", "sub_task": "Try it.", "depends_on": []},
+            {"name": "B", "sub_task": "Check it.", "depends_on": ["A"]},
+            {"name": "C", "sub_task": "Write it.", "depends_on": ["B", "A"]}]
+    run_typed_plan(tmp_path, agents, plan, max_concurrency=1)
+
+    assert calls["C"] == {"answer": "the answer of B"}
+
+
+def test_the_user_input_only_fills_the_unfilled_parameters(tmp_path):
+    calls = {}
+    agents = [TypedAgent("A", ["question"], {"question": "the refined question"}, calls),
+              TypedAgent("B", ["question"], {}, calls)]
+    company = run_typed_plan(tmp_path, agents, [{"name": "A", "sub_task": "Refine it."},
+                                                {"name": "B", "sub_task": "Solve it."}])
+
+    assert calls["A"] == {"question": "the raw question"}
+    assert calls["B"] == {"question": "the refined question"}
+    assert company.format_stats == {"direct": 2, "llm": 0}
+
+
+def test_the_user_input_parameters_can_be_left_to_the_llm(tmp_path):
+    calls = {}
+    agents = [TypedAgent("A", ["question"], {}, calls), TypedAgent("B", ["question"], {}, calls)]
+    company = run_typed_plan(tmp_path, agents, [{"name": "A", "sub_task": "Refine it."},
+                                                {"name": "B", "sub_task": "Solve it."}], user_input_parameters=())
+
+    assert company.format_stats == {"direct": 0, "llm": 2}
+    assert calls["B"]["question"] != "the raw question"
+
+
+def structured_manager(work_plan: str, summaries: dict):
+    """
+    The replies of the manager in the structured mode: the work plan, and the step summaries by {step: reply}.
+    """
+
+    def reply(body: dict) -> str:
+        contents = "\n".join(message["content"] for message in body["messages"])
+        if "direct your employees" in contents:
+            current = [name for name in summaries if f"{name} is done" in body["messages"][-1]["content"]]
+            return summaries[current[0]] if current else '{"next_employee": "", "next_step": "Go on.", "summary": "ok"}'
+        if "make a plan" in contents:
+            return work_plan
+        return "The staff can do it. YES-WE-CAN" if "make a judgment" in contents else "All done."
+
+    return reply
+
+
+LEGACY_PLAN = "The plan follows the skills.\n|||working-plan\n" + json.dumps(PLAN) + "\n|||working-plan"
+LEGACY_SUMMARY = ("The step is done.\n|||next-employee\n{\"name\": \"C\"}\n|||next-employee\n"
+                  "|||next-step\nGo on with C.\n|||next-step\n")
+
+
+@pytest.mark.parametrize("work_plan", [LEGACY_PLAN, json.dumps({"reason": "By the skills.", "work_plan": PLAN}),
+                                       "```json\n" + json.dumps({"reason": "By the skills.", "work_plan": PLAN})
+                                       + "\n```"])
+def test_structured_mode_reads_the_work_plan_of_both_formats(tmp_path, work_plan):
+    company, calls = make_company(tmp_path, replies=structured_manager(work_plan, {}), structured_output=True)
+    work_plan, _ = company(user_input="question")
+    company.close()
+
+    assert list(work_plan) == ["A", "B", "C", "D"]
+    assert calls == ["A", "B", "C", "D"]
+
+
+def test_structured_mode_reads_a_summary_of_the_old_format(tmp_path):
+    company, calls = make_company(tmp_path, replies=structured_manager(LEGACY_PLAN, {"A": LEGACY_SUMMARY}),
+                                  structured_output=True)
+    _, solving_record = company(user_input="question")
+    company.close()
+
+    # The object in the `|||next-employee` part is not read as the summary, the manager routes the work to C.
+    assert calls == ["A", "C", "D"]
+    assert "Go on with C." in solving_record
+
+
+@pytest.mark.parametrize("summary", ['{"next_employee": "B" "next_step": "Go on.", "summary": "ok"}',
+                                     '{"next_employee": "B", "next_step": "Go on.", "summ',
+                                     'Sure! [{"next_step": "nothing"}]'])
+def test_structured_mode_survives_a_malformed_summary(tmp_path, summary):
+    company, calls = make_company(tmp_path, replies=structured_manager(LEGACY_PLAN, {"A": summary}),
+                                  structured_output=True)
+    _, solving_record = company(user_input="question")
+    company.close()
+
+    assert calls == ["A", "B", "C", "D"]
+    assert summary in solving_record
+
+
+def run_speculative(tmp_path, routes: dict) -> tuple:
+    # The summaries are slower than the agents, so the next steps always start before the routes are decided.
+    transport = MockLLMTransport(replies=step_summary(routes), latency=0.05)
+    company = AutoCompany(llm_client=create_mock_client(transport), logger_path=str(tmp_path / "company.log"),
+                          speculative=True)
+    calls = []
+    company.add_agent([StepAgent(step["name"], calls) for step in PLAN])
+    _, solving_record = company(user_input="question", work_plan=company.read_work_plan(PLAN))
+    company.close()
+
+    return company, calls, transport.stats["requests"], solving_record
+
+
+def test_speculation_hits_keep_the_next_steps(tmp_path):
+    company, calls, requests, _ = run_speculative(tmp_path, {})
+
+    assert calls == ["A", "B", "C", "D"]
+    assert company.speculation_stats["hits"] == company.speculation_stats["speculations"] == 3
+    assert company.speculation_stats["hit_rate"] == 1.
+    # The task analysis, the summaries of A, B and C, and the final summary.
+    assert requests == 5
+
+
+def test_speculation_miss_dispatches_the_step_which_the_manager_names(tmp_path):
+    company, calls, requests, solving_record = run_speculative(tmp_path, {"A": ["C"]})
+
+    # B runs once speculatively and is discarded, it is never run again. The work goes to C, then D.
+    assert calls == ["A", "B", "C", "D"]
+    # C is dispatched after the route is decided, so only B and D are speculative.
+    assert company.speculation_stats == dict(company.speculation_stats, speculations=2, hits=1, misses=1,
+                                             hit_rate=0.5)
+    assert "B:" not in solving_record
+    # B is not summarized, and the LLM fills the parameters of C from the instructions of the manager.
+    assert requests == 5
+
+
+def test_speculation_miss_to_an_employee_out_of_the_plan_terminates_the_task(tmp_path):
+    company, calls, requests, _ = run_speculative(tmp_path, {"A": ["Nobody"]})
+
+    assert calls == ["A", "B"]
+    assert company.speculation_stats == dict(company.speculation_stats, speculations=1, hits=0, misses=1)
+    assert "This task is terminate with some error." in (tmp_path / "company.log").read_text()
+    assert requests == 3
@@ -0,0 +1,53 @@
+"""
+=====
+Batch
+=====
+@file_name: test_batch.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the offline batch mode of the LLMAgent, on the local batch backend.
+"""
+
+import pytest
+
+from xyz.node.basic.llm_agent import LLMAgent
+from xyz.utils.llm.batch import BatchBackend, BatchItemError, LocalBatchBackend, run_batch
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.retry import RetryPolicy
+
+TEMPLATE = [{"role": "user", "content": "Translate: {text}"}]
+
+
+class PendingBackend(BatchBackend):
+
+    def submit(self, requests: list) -> str:
+        return "batch_pending"
+
+    def status(self, batch_id: str) -> str:
+        return "in_progress"
+
+
+def test_agent_batch_returns_the_results_in_order(tmp_path):
+    client = create_mock_client(MockLLMTransport(replies=lambda body: body["messages"][-1]["content"].upper()))
+    agent = LLMAgent(TEMPLATE, client)
+    backend = LocalBatchBackend(client, directory=str(tmp_path))
+
+    results = agent.batch([{"text": "cat"}, {"text": "dog"}, {"text": "fish"}], backend=backend, poll_interval=0.)
+
+    assert results == ["TRANSLATE: CAT", "TRANSLATE: DOG", "TRANSLATE: FISH"]
+
+
+def test_failed_request_is_a_batch_item_error(tmp_path):
+    client = create_mock_client(MockLLMTransport(error_rate=1., error_status=400),
+                                retry_policy=RetryPolicy(max_attempts=1))
+    backend = LocalBatchBackend(client, directory=str(tmp_path))
+
+    results = LLMAgent(TEMPLATE, client).batch([{"text": "cat"}], backend=backend, poll_interval=0.)
+
+    assert isinstance(results[0], BatchItemError)
+    assert results[0].custom_id == "request-0"
+
+
+def test_run_batch_times_out():
+    with pytest.raises(TimeoutError):
+        run_batch(PendingBackend(), [{"custom_id": "a", "body": {}}], poll_interval=0.01, timeout=0.05)
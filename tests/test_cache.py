@@ -0,0 +1,112 @@
+"""
+=============
+ResponseCache
+=============
+@file_name: test_cache.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the exact-match response cache and its backends.
+"""
+
+import pytest
+
+from xyz.utils.llm.cache import MemoryBackend, MmapShardBackend, ResponseCache, SQLiteBackend
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+
+MESSAGES = [{"role": "user", "content": "What is 1 + 1?"}]
+
+
+@pytest.fixture(params=["memory", "sqlite", "mmap"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "cache.sqlite"))
+
+    return MmapShardBackend(str(tmp_path / "shards"), num_shards=2)
+
+
+def test_backend_set_get_delete(backend):
+    backend.set("a", b"1")
+    backend.set("b", b"2")
+    backend.set("a", b"3")
+
+    assert backend.get("a") == b"3"
+    assert len(backend) == 2
+    backend.delete("a")
+    assert backend.get("a") is None
+    backend.clear()
+    assert len(backend) == 0
+
+
+def test_mmap_backend_reads_a_copy_of_the_value(tmp_path):
+    backend = MmapShardBackend(str(tmp_path / "shards"), num_shards=2, shard_bytes=4096)
+    backend.set("a", b"value")
+    value = backend.get("a")
+    backend.clear()
+    backend.close()
+
+    assert type(value) is bytes and value == b"value"
+
+
+def test_memory_backend_evicts_the_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", b"1")
+    backend.set("b", b"2")
+    backend.get("a")
+    backend.set("c", b"3")
+
+    assert backend.get("b") is None
+    assert backend.get("a") == b"1"
+    assert backend.evictions == 1
+
+
+def test_only_deterministic_requests_are_cacheable():
+    cache = ResponseCache()
+
+    assert cache.is_cacheable({"temperature": 0.})
+    assert not cache.is_cacheable({"temperature": 0.7})
+    assert not cache.is_cacheable({"temperature": 0., "n": 2})
+    assert ResponseCache(only_deterministic=False).is_cacheable({"temperature": 0.7})
+
+
+def test_key_depends_on_every_part_of_the_request():
+    key = ResponseCache.make_key({"model": "a"}, MESSAGES)
+
+    assert key == ResponseCache.make_key({"model": "a"}, [dict(MESSAGES[0])])
+    assert key != ResponseCache.make_key({"model": "b"}, MESSAGES)
+    assert key != ResponseCache.make_key({"model": "a"}, MESSAGES, stream=True)
+    assert key != ResponseCache.make_key({"model": "a"}, MESSAGES, tools=[{"type": "function"}])
+
+
+def test_expired_entry_is_a_miss():
+    cache = ResponseCache(ttl=-1.)
+    cache.set_chunks("key", ["a", "b"])
+
+    assert cache.get_chunks("key") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_client_serves_the_same_request_from_the_cache():
+    transport = MockLLMTransport(replies="2")
+    cache = ResponseCache()
+    client = create_mock_client(transport, cache=cache, temperature=0.)
+
+    first = client.run(MESSAGES)
+    second = client.run(MESSAGES)
+
+    assert second.choices[0].message.content == first.choices[0].message.content == "2"
+    assert transport.stats["requests"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_client_replays_a_cached_stream():
+    transport = MockLLMTransport(replies="one two three")
+    client = create_mock_client(transport, cache=ResponseCache(), temperature=0.)
+
+    first = "".join(client.stream_run(MESSAGES, images=[]))
+    second = "".join(client.stream_run(MESSAGES, images=[]))
+
+    assert first == second == "one two three"
+    assert transport.stats["requests"] == 1
+    assert client.last_stream_stats.from_cache
@@ -0,0 +1,179 @@
+"""
+========
+Cassette
+========
+@file_name: test_cassette.py
+@author: Bin Liang
+@date: 2024-06-01
+The tests of the cassettes: the recording of the requests, their replay and the replay of a run of the AutoCompany.
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import openai
+import pytest
+
+from xyz.graph.auto_company import AutoCompany
+from xyz.node.agent import Agent
+from xyz.utils.llm.cassette import Cassette, RecordingTransport, ReplayTransport, cassette_from_env
+from xyz.utils.llm.mock_transport import MockLLMTransport
+from xyz.utils.llm.openai_client import AsyncOpenAIClient, OpenAIClient
+
+PLAN = [{"name": "A", "sub_task": "Do the part A."}, {"name": "B", "sub_task": "Do the part B."}]
+REPLIES = {r"make a plan\s+for a task": "|||working-plan\n" + json.dumps(PLAN) + "\n|||working-plan",
+           r"make a judgment": "We can do it. YES-WE-CAN",
+           r"direct your employees": "Done.\n|||next-step\nGo on.\n|||next-step\n",
+           r"staff has\s+done all the work": "All done.",
+           r"first": "The first answer, é 😀.",
+           r".": "Another answer."}
+
+
+class EchoAgent(Agent):
+    """
+    An agent without the LLM which answers the question.
+    """
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.set_information({"type": "function", "function": {
+            "name": name, "description": f"Do the part {name}.",
+            "parameters": {"type": "object", "required": ["question"],
+                           "properties": {"question": {"type": "string", "description": "The question."}}}}})
+        self.input_type = "str"
+        self.output_type = "str"
+
+    def flowing(self, question: str) -> str:
+        return f"{self.information['function']['name']} is done"
+
+
+def make_client(transport) -> OpenAIClient:
+    return OpenAIClient(api_key="cassette", transport=httpx.Client(transport=transport))
+
+
+def ask(client: OpenAIClient, content: str, stream: bool = False) -> str:
+    messages = [{"role": "user", "content": content}]
+    if stream:
+        return "".join(client.stream_run(messages, images=[]))
+
+    return client.run(messages).choices[0].message.content
+
+
+def record(path: str, **mock_args) -> MockLLMTransport:
+    mock = MockLLMTransport(replies=REPLIES, **mock_args)
+    client = make_client(RecordingTransport(path, transport=mock, async_transport=mock))
+    assert ask(client, "first") == "The first answer, é 😀."
+    assert ask(client, "second", stream=True) == "Another answer."
+
+    return mock
+
+
+@pytest.mark.parametrize("name", ["run.jsonl", "run.jsonl.gz"])
+def test_recorded_requests_are_replayed(name, tmp_path):
+    path = str(tmp_path / "cassettes" / name)
+    record(path)
+
+    interactions = Cassette(path).load()
+    assert [interaction["request"]["body"]["messages"][0]["content"] for interaction in interactions] == [
+        "first", "second"]
+    assert all(interaction["status"] == 200 for interaction in interactions)
+
+    replay = ReplayTransport(path, speed=0.)
+    client = make_client(replay)
+    # The order of the requests does not matter, and a request which is made again is answered again.
+    assert ask(client, "second", stream=True) == "Another answer."
+    assert ask(client, "first") == "The first answer, é 😀."
+    assert ask(client, "first") == "The first answer, é 😀."
+    assert replay.stats == {"requests": 3, "hits": 3, "misses": 0}
+
+
+def test_replay_keeps_the_timing_of_the_stream(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    record(path, latency=0.05, tokens_per_second=100.)
+    recorded = Cassette(path).load()[1]
+    assert recorded["chunks"][-1][0] >= 0.05
+
+    for speed, at_least, at_most in [(1., 0.05, None), (0., 0., 0.04)]:
+        started_at = time.perf_counter()
+        assert ask(make_client(ReplayTransport(path, speed=speed)), "second", stream=True) == "Another answer."
+        seconds = time.perf_counter() - started_at
+        assert seconds >= at_least and (at_most is None or seconds < at_most)
+
+
+def test_unknown_request_is_a_miss(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    record(path)
+
+    replay = ReplayTransport(path, speed=0.)
+    with pytest.raises(openai.NotFoundError, match="not in the cassette"):
+        ask(make_client(replay), "third")
+    assert replay.stats == {"requests": 1, "hits": 0, "misses": 1}
+
+    # Without the strict match, the recorded answer of the same kind is used.
+    loose = ReplayTransport(path, speed=0., strict=False)
+    assert ask(make_client(loose), "third", stream=True) == "Another answer."
+    assert loose.stats == {"requests": 1, "hits": 0, "misses": 1}
+
+
+def test_sequence_match_replays_in_the_recorded_order(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    record(path)
+
+    client = make_client(ReplayTransport(path, speed=0., match="sequence"))
+    assert ask(client, "anything") == "The first answer, é 😀."
+
+
+def test_empty_cassette_is_an_error(tmp_path):
+    (tmp_path / "empty.jsonl").write_text("")
+    with pytest.raises(ValueError, match="no interactions"):
+        ReplayTransport(str(tmp_path / "empty.jsonl"))
+
+
+def test_asyncio_requests_are_replayed(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    record(path)
+    replay = ReplayTransport(path, speed=0.)
+    client = AsyncOpenAIClient(api_key="cassette", transport=httpx.AsyncClient(transport=replay))
+
+    async def main():
+        completion = await client.arun([{"role": "user", "content": "first"}])
+        return completion.choices[0].message.content
+
+    assert asyncio.run(main()) == "The first answer, é 😀."
+
+
+def test_cassette_of_the_environment(tmp_path, monkeypatch):
+    path = str(tmp_path / "run.jsonl")
+    record(path)
+
+    monkeypatch.delenv("XYZ_CASSETTE", raising=False)
+    assert cassette_from_env() is None
+    monkeypatch.setenv("XYZ_CASSETTE", f"replay:{path}")
+    monkeypatch.setenv("XYZ_CASSETTE_SPEED", "4")
+    transport = cassette_from_env()
+    assert isinstance(transport, ReplayTransport) and transport.speed == 4.
+    monkeypatch.setenv("XYZ_CASSETTE", path)
+    with pytest.raises(ValueError, match="XYZ_CASSETTE"):
+        cassette_from_env()
+
+
+def test_run_of_the_company_is_replayed_offline(tmp_path):
+    path = str(tmp_path / "company.jsonl.gz")
+    mock = MockLLMTransport(replies=REPLIES)
+
+    def run(transport):
+        company = AutoCompany(llm_client=make_client(transport), logger_path=str(tmp_path / "company.log"))
+        company.add_agent([EchoAgent(step["name"]) for step in PLAN])
+        try:
+            return company(user_input="question")
+        finally:
+            company.close()
+
+    recorded = run(RecordingTransport(path, transport=mock, async_transport=mock))
+    replay = ReplayTransport(path, speed=0.)
+    replayed = run(replay)
+
+    assert replayed == recorded
+    assert replay.stats["misses"] == 0 and replay.stats["requests"] == mock.stats["requests"]
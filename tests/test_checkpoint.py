@@ -0,0 +1,128 @@
+"""
+==========
+Checkpoint
+==========
+@file_name: test_checkpoint.py
+@author: Bin Liang
+@date: 2024-05-25
+The tests of the checkpoint stores, the state of a run and the resume of the AutoCompany.
+"""
+
+import json
+
+import pytest
+
+from xyz.graph.auto_company import AutoCompany
+from xyz.graph.checkpoint import FileCheckpointStore, RunCheckpoint, SQLiteCheckpointStore
+from xyz.node.agent import Agent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+
+PLAN = [{"name": "A", "sub_task": "Do the part A."}, {"name": "B", "sub_task": "Do the part B."},
+        {"name": "C", "sub_task": "Do the part C."}]
+
+
+class FlakyAgent(Agent):
+    """
+    An agent without the LLM which records its calls, and fails while `broken` is set.
+    """
+
+    def __init__(self, name: str, calls: list):
+        super().__init__()
+        self.set_information({"type": "function", "function": {
+            "name": name, "description": f"Do the part {name}.",
+            "parameters": {"type": "object", "required": ["question"],
+                           "properties": {"question": {"type": "string", "description": "The question."}}}}})
+        self.input_type = "str"
+        self.output_type = "str"
+        self.calls = calls
+        self.broken = False
+
+    def flowing(self, question: str) -> str:
+        name = self.information["function"]["name"]
+        if self.broken:
+            raise RuntimeError(f"{name} is broken")
+        self.calls.append(name)
+        return f"{name} is done"
+
+
+def make_store(kind: str, tmp_path):
+    if kind == "file":
+        return FileCheckpointStore(str(tmp_path / "checkpoints"))
+    return SQLiteCheckpointStore(str(tmp_path / "checkpoints.sqlite"))
+
+
+@pytest.mark.parametrize("kind", ["file", "sqlite"])
+def test_store_keeps_the_records_of_each_run_in_order(kind, tmp_path):
+    store = make_store(kind, tmp_path)
+    for i in range(3):
+        store.append("run-1", {"i": i})
+    store.append("run-2", {"i": 9})
+
+    assert store.load("run-1") == [{"i": 0}, {"i": 1}, {"i": 2}]
+    assert store.load("unknown") == []
+    assert store.run_ids() == ["run-1", "run-2"]
+
+
+def test_file_store_ignores_a_cut_last_line(tmp_path):
+    store = FileCheckpointStore(str(tmp_path))
+    store.append("run", {"i": 0})
+    with open(tmp_path / "run.jsonl", "a", encoding="utf-8") as file:
+        file.write('{"i": 1, "cut')
+
+    assert store.load("run") == [{"i": 0}]
+
+
+def test_file_store_checks_the_run_id(tmp_path):
+    with pytest.raises(AssertionError):
+        FileCheckpointStore(str(tmp_path)).append("../escape", {})
+
+
+def test_load_state_replays_the_records(tmp_path):
+    checkpoint = RunCheckpoint(FileCheckpointStore(str(tmp_path)), "run")
+    with pytest.raises(ValueError, match="No checkpoint"):
+        checkpoint.load_state()
+
+    checkpoint.save("start", user_input="question", work_plan=None)
+    checkpoint.save("plan", task_analysis="analysis", work_plan={"A": {}})
+    checkpoint.save("step", name="A", output={"handoff": "A is done", "values": {}})
+    checkpoint.save("history", name="A", content="summary of A", message=True)
+    state = checkpoint.load_state()
+
+    assert state["task_analysis"] == "analysis" and state["work_plan"] == {"A": {}}
+    assert state["steps"] == {"A": {"handoff": "A is done", "values": {}}}
+    assert state["history"] == {"A": "summary of A"}
+    assert state["messages"] == [{"role": "assistant", "content": "summary of A"}]
+    assert "result" not in state
+
+
+@pytest.mark.parametrize("kind", ["file", "sqlite"])
+def test_resume_continues_from_the_unfinished_steps(kind, tmp_path):
+    transport = MockLLMTransport(replies={r"make a plan\s+for a task": "|||working-plan\n" + json.dumps(PLAN)
+                                          + "\n|||working-plan",
+                                          r"make a judgment": "We can do it. YES-WE-CAN",
+                                          r"direct your employees": "Done.\n|||next-step\nGo on.\n|||next-step\n",
+                                          r".": "All done."})
+    company = AutoCompany(llm_client=create_mock_client(transport), logger_path=str(tmp_path / "company.log"),
+                          checkpoint_store=make_store(kind, tmp_path))
+    calls = []
+    agents = [FlakyAgent(step["name"], calls) for step in PLAN]
+    company.add_agent(agents)
+
+    agents[2].broken = True
+    with pytest.raises(RuntimeError, match="C is broken"):
+        company(user_input="question")
+    run_id, requests = company.last_run_id, transport.stats["requests"]
+    assert calls == ["A", "B"]
+
+    agents[2].broken = False
+    work_plan, solving_record = company.resume(run_id)
+
+    # The planning and the finished steps are not done again, only C and the final summary are.
+    assert calls == ["A", "B", "C"]
+    assert transport.stats["requests"] - requests == 1
+    assert list(work_plan) == ["A", "B", "C"]
+    assert "A:Done." in solving_record and solving_record.endswith("All done.")
+    # A finished run gives its result without running again.
+    assert company.resume(run_id) == (work_plan, solving_record)
+    assert calls == ["A", "B", "C"]
+    company.close()
@@ -0,0 +1,171 @@
+"""
+===========
+DAGExecutor
+===========
+@file_name: test_dag_executor.py
+@author: Bin Liang
+@date: 2024-05-20
+The tests of the DAG executor: the order, the inputs, the concurrency, the checkpointed nodes and the routing.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from xyz.graph.dag_executor import DAGExecutor, topological_order
+
+CHAIN = {"a": [], "b": ["a"], "c": ["b"], "d": ["c"]}
+DIAMOND = {"plan": [], "solve": ["plan"], "code": ["plan"], "summary": ["solve", "code"]}
+
+
+class Recorder:
+    """
+    A `run_node` which records the calls and returns "{node}{number of the call}".
+    """
+
+    def __init__(self, delay: float = 0.):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, node: str, inputs: dict) -> str:
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls.append((node, dict(inputs)))
+            return f"{node}{len(self.calls)}"
+
+    @property
+    def nodes(self) -> list:
+        return [node for node, _ in self.calls]
+
+
+def test_topological_order_keeps_the_order_of_the_ties():
+    assert topological_order(DIAMOND) == ["plan", "solve", "code", "summary"]
+
+
+def test_topological_order_rejects_the_unknown_dependencies_and_the_cycles():
+    with pytest.raises(ValueError, match="unknown"):
+        topological_order({"a": ["z"]})
+    with pytest.raises(ValueError, match="cycle"):
+        topological_order({"a": ["b"], "b": ["a"]})
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_run_gives_the_outputs_of_the_dependencies(max_concurrency):
+    recorder = Recorder()
+    outputs = DAGExecutor(max_concurrency).run(DIAMOND, recorder)
+
+    assert set(outputs) == set(DIAMOND)
+    inputs = dict(recorder.calls)
+    assert inputs["plan"] == {}
+    assert inputs["summary"] == {"solve": outputs["solve"], "code": outputs["code"]}
+
+
+def test_run_runs_the_independent_nodes_concurrently():
+    recorder = Recorder(delay=0.2)
+    started = time.perf_counter()
+    DAGExecutor(4).run({"a": [], "b": [], "c": [], "d": []}, recorder)
+
+    assert time.perf_counter() - started < 0.6
+
+
+def test_run_skips_the_completed_nodes():
+    recorder = Recorder()
+    outputs = DAGExecutor(2).run(CHAIN, recorder, completed={"a": "restored"})
+
+    assert recorder.nodes == ["b", "c", "d"]
+    assert recorder.calls[0] == ("b", {"a": "restored"})
+    assert list(outputs) == ["a", "b", "c", "d"]
+
+
+def test_run_raises_the_error_of_a_node():
+    def run_node(node, inputs):
+        if node == "b":
+            raise RuntimeError("broken")
+        return node
+
+    with pytest.raises(RuntimeError, match="broken"):
+        DAGExecutor(2).run(CHAIN, run_node)
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_route_skips_to_a_later_node(max_concurrency):
+    recorder = Recorder()
+    routes = {"a": ["c"]}
+    outputs = DAGExecutor(max_concurrency).run(CHAIN, recorder, route=lambda node, output: routes.pop(node, None))
+
+    assert recorder.nodes == ["a", "c", "d"]
+    assert recorder.calls[1] == ("c", {"a": outputs["a"]})
+    assert "b" not in outputs
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_route_back_runs_the_node_and_its_downstream_again(max_concurrency):
+    recorder = Recorder()
+    routes = {"c": ["a"]}
+    outputs = DAGExecutor(max_concurrency).run(CHAIN, recorder, route=lambda node, output: routes.pop(node, None))
+
+    assert recorder.nodes == ["a", "b", "c", "a", "b", "c", "d"]
+    assert recorder.calls[3] == ("a", {"c": "c3"})
+    assert outputs == {"a": "a4", "b": "b5", "c": "c6", "d": "d7"}
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_route_to_nothing_stops_the_run(max_concurrency):
+    recorder = Recorder()
+    done = []
+    outputs = DAGExecutor(max_concurrency).run(CHAIN, recorder, on_node_done=lambda node, output: done.append(node),
+                                               route=lambda node, output: [] if node == "b" else None)
+
+    assert recorder.nodes == ["a", "b"]
+    assert done == ["a", "b"]
+    assert list(outputs) == ["a", "b"]
+
+
+def test_route_skips_the_nodes_whose_dependencies_are_all_skipped():
+    recorder = Recorder()
+    graph = {"a": [], "b": ["a"], "c": ["b"], "d": ["a"], "e": ["c", "d"]}
+    outputs = DAGExecutor(2).run(graph, recorder, route=lambda node, output: ["d"] if node == "a" else None)
+
+    # "b" is skipped, so is "c" which only depends on it, and "e" runs with the output of "d" only.
+    assert sorted(recorder.nodes) == ["a", "d", "e"]
+    assert recorder.calls[-1] == ("e", {"d": outputs["d"]})
+
+
+def test_route_to_an_unknown_node_is_an_error():
+    with pytest.raises(ValueError, match="unknown"):
+        DAGExecutor(2).run(CHAIN, Recorder(), route=lambda node, output: ["z"])
+
+
+def test_max_width():
+    assert DAGExecutor.max_width(CHAIN) == 1
+    assert DAGExecutor.max_width(DIAMOND) == 2
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+@pytest.mark.parametrize("targets, kept", [(None, ["a", "b", "c", "d"]), (["c"], ["a", "c", "d"]), ([], ["a"])])
+def test_late_route_keeps_or_discards_the_speculative_nodes(max_concurrency, targets, kept):
+    decided = Future()
+    done = []
+
+    def run_node(node, inputs):
+        if node == "b":
+            # The speculative node waits for the route before it is finished, as the AutoCompany does.
+            decided.result(timeout=5)
+        return f"{node} with {sorted(inputs)}"
+
+    def route(node, output):
+        if node != "a":
+            return None
+        threading.Timer(0.1, decided.set_result, [targets]).start()
+        return decided
+
+    outputs = DAGExecutor(max_concurrency).run(CHAIN, run_node, on_node_done=lambda node, output: done.append(node),
+                                               route=route)
+
+    assert done == kept
+    assert list(outputs) == kept
+    if targets:
+        assert outputs["c"] == "c with ['a']"
@@ -0,0 +1,85 @@
+"""
+==========
+JSONStream
+==========
+@file_name: test_json_stream.py
+@author: Bin Liang
+@date: 2024-05-23
+The tests of the incremental JSON parser and of the lenient parser of the JSON replies.
+"""
+
+import json
+
+import pytest
+
+from xyz.utils.llm.json_stream import JSONStreamParser, parse_json
+
+REPLY = {"next_employee": "Alice", "next_step": "Solve \"x\" \\ the équation 😀", "n": -1.5, "ok": True,
+         "none": None, "steps": [{"name": "A", "text": "a } ] \" b"}], "summary": "done"}
+
+
+def feed_pieces(parser: JSONStreamParser, text: str, size: int) -> list:
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i:i + size]))
+    return events
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_fields_and_deltas_do_not_depend_on_the_pieces(size):
+    text = json.dumps(REPLY)
+    parser = JSONStreamParser()
+    events = feed_pieces(parser, text, size)
+
+    assert parser.done and parser.close() == REPLY
+    deltas = "".join(piece for kind, key, piece in events if kind == "delta" and key == "next_step")
+    assert deltas == REPLY["next_step"]
+    assert [key for kind, key, _ in events if kind == "field"] == list(REPLY)
+
+
+def test_escapes_split_between_the_pieces():
+    text = json.dumps({"text": "aéb😀c"}, ensure_ascii=True)
+    parser = JSONStreamParser()
+    feed_pieces(parser, text, 1)
+
+    assert parser.fields == {"text": "aéb😀c"}
+
+
+def test_field_is_ready_before_the_object_is_finished():
+    parser = JSONStreamParser()
+    parser.feed('```json\n{"next_step": "Go on.", "summary": "The step')
+
+    assert parser.fields == {"next_step": "Go on."}
+    assert not parser.done
+    with pytest.raises(ValueError, match="not complete"):
+        parser.close()
+
+
+@pytest.mark.parametrize("text", ["The plan is: [{\"name\": \"A\"}]", "[{\"name\": \"A\"}]",
+                                  "|||next-employee\n{\"name\": \"B\"}\n|||next-employee"])
+def test_nested_objects_are_not_read_as_the_reply(text):
+    parser = JSONStreamParser(strict=False)
+    parser.feed(text)
+
+    assert not parser.done
+    assert parser.fields == {}
+    assert parser.error is not None
+    with pytest.raises(ValueError, match="not a JSON object"):
+        JSONStreamParser().feed(text)
+
+
+def test_non_strict_parser_keeps_the_fields_before_the_error():
+    parser = JSONStreamParser(strict=False)
+    parser.feed('{"next_employee": "B" "next_step": "Go on."}')
+
+    assert parser.fields == {"next_employee": "B"}
+    assert parser.error is not None
+    assert parser.feed('more') == []
+
+
+def test_parse_json_ignores_the_fence_and_the_text_around():
+    assert parse_json('```json\n{"a": 1}\n```') == {"a": 1}
+    assert parse_json('The answer is {"a": [1, 2]}. Bye.') == {"a": [1, 2]}
+    assert parse_json("[1, 2]") == [1, 2]
+    with pytest.raises(ValueError, match="No valid JSON"):
+        parse_json("no JSON {here")
@@ -0,0 +1,184 @@
+"""
+=======
+LogSink
+=======
+@file_name: test_log_sink.py
+@author: Bin Liang
+@date: 2024-05-28
+The tests of the asynchronous logging sink, the JSON-lines run log and the logs of the AutoCompany.
+"""
+
+import json
+import logging
+import threading
+
+from xyz.graph.auto_company import PROCESS_LEVEL_NUM, AutoCompany
+from xyz.node.agent import Agent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.usage import usage_scope
+from xyz.utils.log_sink import AsyncLogSink, JSONLinesHandler
+
+PLAN = [{"name": "A", "sub_task": "Do the part A."}]
+
+
+class EchoAgent(Agent):
+    """
+    An agent without the LLM which answers the question.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.set_information({"type": "function", "function": {
+            "name": "A", "description": "Do the part A.",
+            "parameters": {"type": "object", "required": ["question"],
+                           "properties": {"question": {"type": "string", "description": "The question."}}}}})
+        self.input_type = "str"
+        self.output_type = "str"
+
+    def flowing(self, question: str) -> str:
+        return f"A is done for {question}"
+
+
+class RecordHandler(logging.Handler):
+    """
+    A handler which keeps the messages and counts the flushes. The first record waits until `gate` is set, so the
+    next records pile up in the queue.
+    """
+
+    def __init__(self, level: int = logging.NOTSET):
+        super().__init__(level)
+        self.messages = []
+        self.flushes = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.gate.wait(5)
+        self.messages.append(record.getMessage())
+
+    def flush(self) -> None:
+        self.flushes += 1
+
+
+def make_logger(name: str, sink: AsyncLogSink) -> logging.Logger:
+    logger = logging.Logger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(sink.handler)
+    return logger
+
+
+def read_lines(path) -> list:
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_records_are_written_in_order_and_flushed_in_batches():
+    handler = RecordHandler()
+    handler.gate.clear()
+    sink = AsyncLogSink([handler], max_batch=64)
+    logger = make_logger("batches", sink)
+
+    for i in range(200):
+        logger.info("record %d", i)
+    handler.gate.set()
+
+    assert sink.flush(timeout=5)
+    assert handler.messages == [f"record {i}" for i in range(200)]
+    # The first record is flushed alone, the others which piled up behind it in batches of 64.
+    assert handler.flushes <= 1 + 200 // 64 + 2
+    sink.close()
+
+
+def test_each_handler_only_gets_the_records_of_its_level():
+    info, warning = RecordHandler(logging.INFO), RecordHandler(logging.WARNING)
+    sink = AsyncLogSink([info, warning])
+    logger = make_logger("levels", sink)
+    logger.debug("debug")
+    logger.info("info")
+    logger.warning("warning")
+    sink.flush(timeout=5)
+
+    assert info.messages == ["info", "warning"]
+    assert warning.messages == ["warning"]
+    sink.close()
+
+
+def test_close_writes_the_queue_and_stops_the_sink(tmp_path):
+    handler = JSONLinesHandler(str(tmp_path / "run.jsonl"))
+    sink = AsyncLogSink([handler])
+    logger = make_logger("close", sink)
+    for i in range(10):
+        logger.info("record %d", i)
+    sink.close()
+
+    assert [line["message"] for line in read_lines(tmp_path / "run.jsonl")] == [f"record {i}" for i in range(10)]
+    assert not sink.flush(timeout=1)
+    sink.close()
+
+
+def test_records_have_the_labels_of_the_thread_which_logs(tmp_path):
+    sink = AsyncLogSink([JSONLinesHandler(str(tmp_path / "run.jsonl"))])
+    logger = make_logger("labels", sink)
+
+    def run(run_id):
+        with usage_scope(run_id=run_id):
+            logger.info("from %s", run_id)
+            with usage_scope(agent="Solver"):
+                logger.info("solving", extra={"step": "Solve"})
+
+    threads = [threading.Thread(target=run, args=(f"run-{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sink.close()
+
+    lines = read_lines(tmp_path / "run.jsonl")
+    assert len(lines) == 8
+    for line in lines:
+        if line["message"].startswith("from"):
+            assert line["message"] == f"from {line['run_id']}" and line["agent"] is None
+        else:
+            assert (line["step"], line["agent"]) == ("Solve", "Solver") and line["run_id"].startswith("run-")
+
+
+def test_streamed_records_of_a_step_are_merged_into_one_line(tmp_path):
+    handler = JSONLinesHandler(str(tmp_path / "run.jsonl"), merge_levels=(PROCESS_LEVEL_NUM,))
+    logger = logging.Logger("merge")
+    logger.addHandler(handler)
+    for word in ["The ", "answer ", "is 2."]:
+        logger.log(PROCESS_LEVEL_NUM, word, extra={"step": "Solve", "agent": "A"})
+    logger.log(PROCESS_LEVEL_NUM, "Other.", extra={"step": "Solve", "agent": "B"})
+    logger.info("Done.", extra={"step": "Solve", "agent": "B"})
+    logger.log(PROCESS_LEVEL_NUM, "Late ", extra={"step": "Solve", "agent": "B"})
+    handler.flush()
+    logger.log(PROCESS_LEVEL_NUM, "words.", extra={"step": "Solve", "agent": "B"})
+
+    # A flush between the words does not cut the line, the last line is written when the handler is closed.
+    assert len(read_lines(tmp_path / "run.jsonl")) == 3
+    handler.close()
+    lines = read_lines(tmp_path / "run.jsonl")
+    assert [(line["agent"], line["message"]) for line in lines] == [("A", "The answer is 2."), ("B", "Other."),
+                                                                    ("B", "Done."), ("B", "Late words.")]
+    assert lines[0]["level"] == "PROCESS" and lines[2]["level"] == "INFO"
+
+
+def test_company_writes_the_run_log(tmp_path):
+    transport = MockLLMTransport(replies={r"make a plan\s+for a task": "|||working-plan\n" + json.dumps(PLAN)
+                                          + "\n|||working-plan",
+                                          r"make a judgment": "We can do it. YES-WE-CAN",
+                                          r"direct your employees": "Done.\n|||next-step\nGo on.\n|||next-step\n",
+                                          r".": "All done."})
+    company = AutoCompany(llm_client=create_mock_client(transport), logger_path=str(tmp_path / "company.log"))
+    company.add_agent([EchoAgent()])
+    company(user_input="question")
+    company.close()
+
+    lines = read_lines(tmp_path / "company.jsonl")
+    assert {line["run_id"] for line in lines} == {company.last_run_id}
+    # The streamed words of each reply are one line, however fast the writer thread is.
+    streamed = [line["message"].strip() for line in lines if line["level"] == "PROCESS"]
+    assert "We can do it. YES-WE-CAN" in streamed and "All done." in streamed
+    assert "|||working-plan\n" + json.dumps(PLAN) + "\n|||working-plan" in streamed
+    with open(tmp_path / "company.log", encoding="utf-8") as file:
+        assert "All done." in file.read()
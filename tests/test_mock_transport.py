@@ -0,0 +1,151 @@
+"""
+=============
+MockTransport
+=============
+@file_name: test_mock_transport.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the mock of the chat completions API and of the harness of the benchmarks which runs on it.
+"""
+
+import json
+import time
+
+import httpx
+import pytest
+
+from benchmarks.harness import Scenario, compare, run_scenario, scenarios
+import benchmarks.scenarios  # noqa: F401 (the scenarios are registered on import)
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client, split_tokens
+from xyz.utils.llm.retry import RetryPolicy
+
+TOOL = {"type": "function", "function": {"name": "Solve", "description": "Solve it.",
+                                         "parameters": {"type": "object", "required": ["question", "hint"],
+                                                        "properties": {"question": {"type": "string"},
+                                                                       "hint": {"type": "string"}}}}}
+
+
+def post(transport: MockLLMTransport, body: dict, path: str = "/v1/chat/completions") -> httpx.Response:
+    with httpx.Client(transport=transport, base_url="http://mock") as client:
+        return client.post(path, json=dict({"model": "gpt-4-turbo"}, **body))
+
+
+def user(content: str) -> dict:
+    return {"messages": [{"role": "user", "content": content}]}
+
+
+def test_split_tokens_joins_back_to_the_text():
+    text = "The answer  is\n170, isn't it?"
+    assert "".join(split_tokens(text)) == text
+    assert all(len(token.strip()) <= 4 for token in split_tokens(text))
+
+
+@pytest.mark.parametrize("replies, expected", [
+    (None, ["first", "second"]),
+    ("fixed", ["fixed", "fixed"]),
+    (["a", "b", "c"], ["a", "b"]),
+    ({r"sec\w+": "matched", r"nothing": "no"}, ["first", "matched"]),
+    (lambda body: body["messages"][-1]["content"].upper(), ["FIRST", "SECOND"]),
+])
+def test_rules_of_the_replies(replies, expected):
+    client = create_mock_client(MockLLMTransport(replies=replies))
+    answers = [client.run([{"role": "user", "content": content}]).choices[0].message.content
+               for content in ("first", "second")]
+
+    assert answers == expected
+
+
+def test_tool_call_of_a_text_reply_fills_the_required_parameters():
+    client = create_mock_client(MockLLMTransport(replies="42"))
+    message = client.run([{"role": "user", "content": "Solve"}], tools=[TOOL]).choices[0].message
+
+    assert message.content is None
+    assert message.tool_calls[0].function.name == "Solve"
+    assert json.loads(message.tool_calls[0].function.arguments) == {"question": "42", "hint": "42"}
+
+
+def test_tool_call_reply_is_sent_as_it_is():
+    # A dict is the rules of the replies, so the tool call is in a list.
+    transport = MockLLMTransport(replies=[{"name": "Solve", "arguments": {"question": "q"}}])
+    response = post(transport, dict(user("Solve"), tools=[TOOL])).json()
+
+    assert response["choices"][0]["finish_reason"] == "tool_calls"
+    assert json.loads(response["choices"][0]["message"]["tool_calls"][0]["function"]["arguments"]) == {"question": "q"}
+
+
+def test_stream_gives_the_tokens_and_the_usage():
+    transport = MockLLMTransport(replies="The answer is 170.")
+    response = post(transport, dict(user("question"), stream=True, stream_options={"include_usage": True}))
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines()
+              if line.startswith("data: ") and line != "data: [DONE]"]
+
+    text = "".join(event["choices"][0]["delta"].get("content") or "" for event in events if event["choices"])
+    assert text == "The answer is 170."
+    assert events[-1]["usage"]["completion_tokens"] == len(split_tokens(text))
+    assert response.text.rstrip().endswith("data: [DONE]")
+    assert transport.stats["streams"] == 1
+
+
+def test_streamed_tokens_come_at_the_speed_of_the_model():
+    transport = MockLLMTransport(replies="word " * 10, latency=0.05, tokens_per_second=200.)
+    client = create_mock_client(transport)
+    started_at = time.perf_counter()
+    words = list(client.stream_run([{"role": "user", "content": "question"}], images=[]))
+
+    assert "".join(words) == "word " * 10
+    tokens = len(split_tokens("word " * 10))
+    assert time.perf_counter() - started_at >= 0.05 + (tokens - 1) / 200.
+    assert transport.stats["simulated_seconds"] == pytest.approx(0.05 + tokens / 200.)
+
+
+def test_errors_are_seeded_and_retried_by_the_client():
+    transport = MockLLMTransport(replies="ok", error_rate=0.5, error_status=503, retry_after=0., seed=1)
+    client = create_mock_client(transport, retry_policy=RetryPolicy(base_delay=0.001, max_delay=0.01))
+    for _ in range(10):
+        assert client.run([{"role": "user", "content": "question"}]).choices[0].message.content == "ok"
+
+    assert transport.stats["requests"] - transport.stats["errors"] == 10
+    assert transport.stats["errors"] > 0
+    # The same seed fails the same requests.
+    other = MockLLMTransport(replies="ok", error_rate=0.5, error_status=503, seed=1)
+    statuses = [post(other, user("question")).status_code for _ in range(transport.stats["requests"])]
+    assert statuses.count(503) == transport.stats["errors"] and set(statuses) == {200, 503}
+
+
+def test_unknown_path_and_stats_reset():
+    transport = MockLLMTransport()
+    assert post(transport, {}, path="/v1/embeddings").status_code == 404
+    post(transport, user("question"))
+    assert transport.stats["requests"] == 1 and transport.stats["prompt_tokens"] > 0
+
+    transport.reset_stats()
+    assert transport.stats == {"requests": 0, "streams": 0, "errors": 0, "prompt_tokens": 0,
+                               "completion_tokens": 0, "simulated_seconds": 0.}
+
+
+def test_default_scenarios_run_on_the_mock(tmp_path, monkeypatch):
+    # The companies write their logs in the working directory.
+    monkeypatch.chdir(tmp_path)
+    runnable = [bench for bench in scenarios.values() if not bench.missing_packages()]
+    assert {"llm_agent", "llm_agent_stream", "input_format_assistant", "auto_company"} <= {
+        bench.name for bench in runnable}
+
+    for bench in runnable:
+        result = run_scenario(bench, calls=2, warmup=1, concurrency=2)
+        assert result["calls"] == 2 and result["requests_per_call"] >= 1
+
+
+def test_scenario_names_its_missing_packages():
+    bench = Scenario(name="extra", build=None, requires=("json", "surely_not_installed_package"))
+
+    assert bench.missing_packages() == ["surely_not_installed_package"]
+    assert scenarios["rank_prompts"].requires == ("prettytable", "tenacity", "tqdm")
+
+
+def test_compare_finds_the_regressions_of_the_same_profile():
+    baseline = {"a": {"profile": "overhead", "mean": 1.}, "b": {"profile": "overhead", "mean": 1.},
+                "c": {"profile": "realistic", "mean": 1.}}
+    results = {"a": {"profile": "overhead", "mean": 1.2}, "b": {"profile": "overhead", "mean": 1.3},
+               "c": {"profile": "overhead", "mean": 9.}, "d": {"profile": "overhead", "skipped": "Not installed"}}
+
+    assert compare(results, baseline) == [("b", 1., 1.3)]
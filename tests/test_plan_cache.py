@@ -0,0 +1,128 @@
+"""
+=========
+PlanCache
+=========
+@file_name: test_plan_cache.py
+@author: Bin Liang
+@date: 2024-05-21
+The tests of the plan cache: the signatures, the exact and the semantic tiers, the revalidation and the AutoCompany.
+"""
+
+import json
+
+import numpy as np
+
+from xyz.graph.auto_company import AutoCompany
+from xyz.graph.plan_cache import PlanCache, get_roster_key, normalize_task
+from xyz.node.agent import Agent
+from xyz.utils.llm.cache import SQLiteBackend
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.semantic_cache import SemanticCache
+
+WORK_PLAN = {"SolvingAgent": {"name": "SolvingAgent", "sub_task": "Solve it.", "next": [], "position": "start"}}
+
+
+class SolvingAgent(Agent):
+
+    def __init__(self, description: str = "Solve the question."):
+        super().__init__()
+        self.set_information({"type": "function", "function": {
+            "name": "SolvingAgent", "description": description,
+            "parameters": {"type": "object", "required": ["question"],
+                           "properties": {"question": {"type": "string", "description": "The question."}}}}})
+        self.input_type = "str"
+        self.output_type = "str"
+
+    def flowing(self, question: str) -> str:
+        return f"The answer of {question}"
+
+
+def embed_words(text: str) -> np.ndarray:
+    # The counts of a few words, so the tasks which only differ by the other words are the same vector.
+    return np.array([text.count(word) + 0.01 for word in ("solve", "sum", "equation", "prove")], dtype=np.float32)
+
+
+AGENTS = {"SolvingAgent": SolvingAgent()}
+
+
+def test_normalize_task_ignores_the_case_the_numbers_and_the_spaces():
+    assert normalize_task("Solve 3x + 5 = 11") == normalize_task("solve  4x + 2 = 10.5 ")
+    assert normalize_task("Solve 3x + 5 = 11") != normalize_task("Prove 3x + 5 = 11")
+
+
+def test_roster_key_depends_on_the_names_and_the_descriptions():
+    assert get_roster_key(AGENTS) == get_roster_key({"SolvingAgent": SolvingAgent()})
+    assert get_roster_key(AGENTS) != get_roster_key({"SolvingAgent": SolvingAgent("Solve it by the code.")})
+
+
+def test_exact_hit_reuses_the_plan_of_the_same_kind_of_task():
+    cache = PlanCache()
+    assert cache.lookup("Solve 3x + 5 = 11", AGENTS) is None
+    cache.add("Solve 3x + 5 = 11", AGENTS, "The analysis of 3x + 5 = 11", WORK_PLAN)
+
+    assert cache.lookup("Solve 3x + 5 = 11", AGENTS) == ("The analysis of 3x + 5 = 11", WORK_PLAN)
+    task_analysis, work_plan = cache.lookup("solve 4x + 2 = 10", AGENTS)
+    # The analysis of the old task is not reused for the new numbers.
+    assert "4x + 2 = 10" in task_analysis and "3x" not in task_analysis
+    assert work_plan == WORK_PLAN
+    assert cache.stats() == {"hits": 2, "exact_hits": 2, "semantic_hits": 0, "misses": 1, "revalidations": 0,
+                             "sets": 1}
+
+
+def test_another_roster_misses():
+    cache = PlanCache()
+    cache.add("Solve 3x + 5 = 11", AGENTS, "analysis", WORK_PLAN)
+
+    assert cache.lookup("Solve 3x + 5 = 11", {"SolvingAgent": SolvingAgent("Solve it by the code.")}) is None
+
+
+def test_entry_is_revalidated_after_its_hits_or_its_age():
+    cache = PlanCache(revalidate_every=2)
+    cache.add("Solve 3x + 5 = 11", AGENTS, "analysis", WORK_PLAN)
+    assert cache.lookup("Solve 3x + 5 = 11", AGENTS) is not None
+    assert cache.lookup("Solve 3x + 5 = 11", AGENTS) is not None
+    assert cache.lookup("Solve 3x + 5 = 11", AGENTS) is None
+    assert cache.stats()["revalidations"] == 1
+
+    cache = PlanCache(revalidate_after=-1.)
+    cache.add("Solve 3x + 5 = 11", AGENTS, "analysis", WORK_PLAN)
+    assert cache.lookup("Solve 3x + 5 = 11", AGENTS) is None
+
+
+def test_semantic_tier_finds_a_similar_task():
+    cache = PlanCache(semantic_cache=SemanticCache(embed_words, max_distance=0.01))
+    cache.add("Please solve the equation 3x + 5 = 11", AGENTS, "analysis", WORK_PLAN)
+
+    assert cache.lookup("solve this equation: 2x = 8", AGENTS)[1] == WORK_PLAN
+    assert cache.lookup("prove that 2 is prime", AGENTS) is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_plans_are_shared_by_the_backend(tmp_path):
+    path = str(tmp_path / "plans.sqlite")
+    PlanCache(backend=SQLiteBackend(path)).add("Solve 3x + 5 = 11", AGENTS, "analysis", WORK_PLAN)
+
+    assert PlanCache(backend=SQLiteBackend(path)).lookup("Solve 3x + 5 = 11", AGENTS) == ("analysis", WORK_PLAN)
+
+
+def test_company_skips_the_planning_calls_of_a_cached_kind_of_task(tmp_path):
+    plan = [{"name": "SolvingAgent", "sub_task": "Solve it."}]
+    transport = MockLLMTransport(replies={
+        r"make a plan\s+for a task": "|||working-plan\n" + json.dumps(plan) + "\n|||working-plan",
+        r"make a judgment if your employees": "We can do it. YES-WE-CAN",
+        r".": "All done."})
+    plan_cache = PlanCache()
+    company = AutoCompany(llm_client=create_mock_client(transport), logger_path=str(tmp_path / "company.log"),
+                          plan_cache=plan_cache)
+    company.add_agent([SolvingAgent()])
+
+    company(user_input="Solve 3x + 5 = 11")
+    planned_requests = transport.stats["requests"]
+    work_plan, _ = company(user_input="Solve 4x + 2 = 10")
+    company.close()
+
+    # The task analysis and the work plan are not asked again, only the final summary is.
+    assert planned_requests == 3
+    assert transport.stats["requests"] - planned_requests == 1
+    assert list(work_plan) == ["SolvingAgent"]
+    assert plan_cache.stats()["exact_hits"] == 1
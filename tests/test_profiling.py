@@ -0,0 +1,146 @@
+"""
+=========
+Profiling
+=========
+@file_name: test_profiling.py
+@author: Bin Liang
+@date: 2024-05-30
+The tests of the profiler: the self times, the folded stacks, the streams, the memory and the profiled runs.
+"""
+
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+
+from xyz.graph.auto_company import AutoCompany
+from xyz.node.agent import Agent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.profiling import aprofile_call, current_profile_session, profile_call, profile_session, profiled
+
+PLAN = [{"name": "A", "sub_task": "Do the part A."}]
+
+
+class EchoAgent(Agent):
+    """
+    An agent without the LLM which answers the question.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.set_information({"type": "function", "function": {
+            "name": "A", "description": "Do the part A.",
+            "parameters": {"type": "object", "required": ["question"],
+                           "properties": {"question": {"type": "string", "description": "The question."}}}}})
+        self.input_type = "str"
+        self.output_type = "str"
+
+    def flowing(self, question: str) -> str:
+        return "A is done"
+
+
+@profiled
+def inner(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+@profiled
+def outer(seconds: float) -> None:
+    time.sleep(seconds)
+    inner(seconds)
+
+
+def test_nothing_is_recorded_without_a_session():
+    assert current_profile_session() is None
+    assert profile_call("key", lambda: 1, {}) == 1
+    outer(0.)
+
+
+def test_self_time_is_without_the_profiled_calls_inside():
+    with profile_session() as session:
+        outer(0.05)
+    stats = session.stats()
+
+    assert set(stats) == {"outer", "inner"}
+    outer_stat, inner_stat = stats["outer"], stats["inner"]
+    assert outer_stat["calls"] == inner_stat["calls"] == 1
+    assert outer_stat["wall"] >= 0.1 and 0.05 <= outer_stat["self_wall"] < 0.1
+    assert inner_stat["self_wall"] == inner_stat["wall"] >= 0.05
+    # Sleeping takes no CPU.
+    assert outer_stat["cpu"] < 0.05
+
+
+def test_folded_stacks_have_the_self_time_of_each_stack(tmp_path):
+    with profile_session() as session:
+        outer(0.01)
+        inner(0.01)
+    folded = dict(line.rsplit(" ", 1) for line in session.to_folded().splitlines())
+
+    assert set(folded) == {"outer", "outer;inner", "inner"}
+    assert all(int(microseconds) >= 10000 for microseconds in folded.values())
+    session.write_folded(str(tmp_path / "profiles" / "run.folded"), metric="cpu")
+    with open(tmp_path / "profiles" / "run.folded", encoding="utf-8") as file:
+        assert len(file.readlines()) == 3
+    assert session.report().splitlines()[0].startswith("key")
+
+
+def test_stream_is_profiled_while_it_runs_not_while_it_is_consumed():
+    def stream():
+        for _ in range(3):
+            time.sleep(0.01)
+            yield "word"
+
+    with profile_session() as session:
+        for _ in profile_call("stream", stream, {}):
+            time.sleep(0.03)
+    stat = session.stats()["stream"]
+
+    assert stat["calls"] == 1
+    assert 0.03 <= stat["wall"] < 0.09
+
+
+def test_async_calls_are_profiled():
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        with profile_session() as session:
+            results = await asyncio.gather(*[aprofile_call("work", work, {}) for _ in range(3)])
+        return session, results
+
+    session, results = asyncio.run(main())
+    assert results == ["done"] * 3
+    assert session.stats()["work"]["calls"] == 3
+
+
+def test_memory_peak_is_traced_only_in_the_session():
+    def allocate():
+        return len(bytearray(4 * 1024 * 1024))
+
+    with profile_session(trace_memory=True) as session:
+        assert tracemalloc.is_tracing()
+        profile_call("allocate", allocate, {})
+    assert not tracemalloc.is_tracing()
+
+    assert session.stats()["allocate"]["alloc_peak"] >= 4 * 1024 * 1024
+
+
+def test_profiled_run_writes_the_folded_stacks(tmp_path):
+    transport = MockLLMTransport(replies={r"make a plan\s+for a task": "|||working-plan\n" + json.dumps(PLAN)
+                                          + "\n|||working-plan",
+                                          r"make a judgment": "We can do it. YES-WE-CAN",
+                                          r".": "All done."})
+    company = AutoCompany(llm_client=create_mock_client(transport), logger_path=str(tmp_path / "company.log"),
+                          profile_dir=str(tmp_path / "profiles"))
+    company.add_agent([EchoAgent()])
+    company(user_input="question")
+    company.close()
+
+    path = tmp_path / "profiles" / f"{company.last_run_id}.folded"
+    with open(path, encoding="utf-8") as file:
+        stacks = [line.rsplit(" ", 1)[0] for line in file]
+    assert all(stack.startswith("AutoCompany._run") for stack in stacks)
+    assert any(stack.endswith("EchoAgent.flowing") for stack in stacks)
+    assert os.listdir(tmp_path / "profiles") == [path.name]
@@ -0,0 +1,58 @@
+"""
+==============
+PromptTemplate
+==============
+@file_name: test_prompt_template.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the precompiled templates of the LLMAgent.
+"""
+
+import copy
+import json
+
+import pytest
+
+from xyz.node.basic.llm_agent import LLMAgent
+from xyz.node.basic.prompt_template import FrozenMessage, PromptTemplate
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+
+TEMPLATE = [{"role": "system", "content": "You are a {{story}} writer."},
+            {"role": "user", "content": "Write about {content} in {words} words."},
+            {"role": "user", "content": "Style: {style[name]:>8}"}]
+
+
+def test_render_is_the_same_as_str_format():
+    kwargs = {"content": "a dog", "words": 100, "style": {"name": "funny"}}
+
+    assert PromptTemplate(TEMPLATE).render(**kwargs) == [dict(message, content=message["content"].format(**kwargs))
+                                                         for message in TEMPLATE]
+    assert PromptTemplate(TEMPLATE).placeholders == {"content", "words", "style[name]"}
+
+
+def test_static_messages_are_shared_and_read_only():
+    template = PromptTemplate(TEMPLATE)
+    first = template.render(content="a", words=1, style={"name": "x"})
+    second = template.render(content="b", words=2, style={"name": "y"})
+
+    assert first[0] is second[0]
+    assert isinstance(first[0], FrozenMessage)
+    with pytest.raises(TypeError):
+        first[0]["content"] = "changed"
+    assert type(copy.deepcopy(first[0])) is dict
+    assert json.loads(json.dumps(first[0])) == {"role": "system", "content": "You are a {story} writer."}
+
+
+def test_missing_placeholder_raises_key_error():
+    with pytest.raises(KeyError):
+        PromptTemplate(TEMPLATE).render(content="a dog")
+
+
+def test_agent_does_not_change_its_template():
+    transport = MockLLMTransport()
+    template = [{"role": "system", "content": "Be short."}, {"role": "user", "content": "{question}"}]
+    agent = LLMAgent(template, create_mock_client(transport))
+
+    assert agent(question="first") == "first"
+    assert agent(question="second") == "second"
+    assert template[1]["content"] == "{question}"
@@ -0,0 +1,123 @@
+"""
+===========
+RateLimiter
+===========
+@file_name: test_rate_limiter.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the RPM/TPM token buckets and of their settlement by the clients.
+"""
+
+import asyncio
+
+import pytest
+
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.openai_client import AsyncOpenAIClient
+from xyz.utils.llm.rate_limiter import RateLimiter, TokenBucket
+from xyz.utils.llm.retry import RetryError, RetryPolicy
+
+MESSAGES = [{"role": "user", "content": "Hello, how are you?"}]
+
+
+def test_bucket_goes_into_debt_and_asks_to_wait():
+    bucket = TokenBucket(per_minute=60)
+    now = bucket.updated
+
+    assert bucket.reserve(60, now) == 0.
+    # One token per second, so a debt of 3 tokens is 3 seconds.
+    assert bucket.reserve(3, now) == pytest.approx(3.)
+
+
+def test_unconfigured_model_is_not_limited():
+    limiter = RateLimiter()
+
+    assert limiter.acquire("gpt-4o", 10 ** 9) == 0.
+    assert limiter.stats() == {}
+
+
+def test_star_budget_is_copied_for_each_model():
+    limiter = RateLimiter()
+    limiter.configure("*", tpm=1000)
+    limiter.acquire("a", 600)
+    limiter.acquire("b", 600)
+
+    stats = limiter.stats()
+    assert stats["a"]["tpm_available"] == pytest.approx(400., abs=1.)
+    assert stats["b"]["tpm_available"] == pytest.approx(400., abs=1.)
+
+
+def test_record_charges_the_completion_tokens():
+    limiter = RateLimiter()
+    limiter.configure("gpt-4o", tpm=1000)
+    limiter.acquire("gpt-4o", 100)
+    limiter.record("gpt-4o", 100, 250)
+
+    stats = limiter.stats()["gpt-4o"]
+    assert stats["tokens"] == 250
+    assert stats["tpm_available"] == pytest.approx(750., abs=1.)
+
+
+def test_successful_request_is_settled_with_its_usage():
+    limiter = RateLimiter()
+    limiter.configure("gpt-4o", tpm=10000)
+    client = create_mock_client(MockLLMTransport(replies="Fine, thanks."), rate_limiter=limiter, model="gpt-4o")
+    response = client.run(MESSAGES)
+
+    assert limiter.stats()["gpt-4o"]["tokens"] == response.usage.total_tokens
+
+
+def test_failed_request_gives_the_reservation_back():
+    limiter = RateLimiter()
+    limiter.configure("gpt-4o", tpm=10000)
+    client = create_mock_client(MockLLMTransport(error_rate=1.), rate_limiter=limiter, model="gpt-4o",
+                                retry_policy=RetryPolicy(max_attempts=2, base_delay=0., jitter=False))
+
+    for _ in range(3):
+        with pytest.raises(RetryError):
+            client.run(MESSAGES)
+
+    stats = limiter.stats()["gpt-4o"]
+    # Every attempt is a request.
+    assert stats["requests"] == 6
+    assert stats["tokens"] == 0
+    assert stats["tpm_available"] == pytest.approx(10000., abs=1.)
+
+
+def test_failed_async_request_gives_the_reservation_back():
+    limiter = RateLimiter()
+    limiter.configure("gpt-4o", tpm=10000)
+    client = create_mock_client(MockLLMTransport(error_rate=1.), client_class=AsyncOpenAIClient,
+                                rate_limiter=limiter, model="gpt-4o",
+                                retry_policy=RetryPolicy(max_attempts=2, base_delay=0., jitter=False))
+
+    with pytest.raises(RetryError):
+        asyncio.run(client.arun(MESSAGES))
+
+    assert limiter.stats()["gpt-4o"]["tokens"] == 0
+
+
+def test_every_attempt_takes_a_request_of_the_budget():
+    limiter = RateLimiter()
+    limiter.configure("gpt-4o", rpm=10000, tpm=100000)
+    transport = MockLLMTransport(replies="Fine, thanks.", error_rate=0.5, error_status=503, retry_after=0., seed=1)
+    policy = RetryPolicy(max_attempts=10, base_delay=0., jitter=False)
+    client = create_mock_client(transport, rate_limiter=limiter, model="gpt-4o", retry_policy=policy)
+    async_client = create_mock_client(transport, client_class=AsyncOpenAIClient, rate_limiter=limiter,
+                                      model="gpt-4o", retry_policy=policy)
+
+    async def main():
+        await async_client.arun(MESSAGES)
+        return "".join([text async for text in async_client.astream_run(MESSAGES, images=[])])
+
+    total_tokens = 0
+    for _ in range(3):
+        total_tokens += client.run(MESSAGES).usage.total_tokens
+        assert "".join(client.stream_run(MESSAGES, images=[])) == "Fine, thanks."
+        total_tokens += client.last_stream_stats.usage.total_tokens
+    assert asyncio.run(main()) == "Fine, thanks."
+
+    stats = limiter.stats()["gpt-4o"]
+    assert transport.stats["errors"] > 0
+    assert stats["requests"] == transport.stats["requests"]
+    assert stats["tokens"] >= total_tokens
@@ -0,0 +1,135 @@
+"""
+===========
+RetryPolicy
+===========
+@file_name: test_retry.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the retry policy of the LLM requests.
+"""
+
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.retry import RetryError, RetryPolicy
+
+
+def status_error(status: int, headers: dict = None) -> openai.APIStatusError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+class Flaky:
+    """
+    A function which fails with the given errors, then returns "ok".
+    """
+
+    def __init__(self, *errors: BaseException) -> None:
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.mark.parametrize("status, retryable", [(400, False), (401, False), (404, False), (408, True),
+                                               (409, True), (429, True), (500, True), (503, True), (529, True)])
+def test_status_classification(status, retryable):
+    assert RetryPolicy().is_retryable(status_error(status)) is retryable
+
+
+def test_connection_errors_are_retryable():
+    policy = RetryPolicy()
+
+    assert policy.is_retryable(TimeoutError())
+    assert policy.is_retryable(ConnectionError())
+    assert not policy.is_retryable(ValueError())
+
+
+def test_delay_is_exponential_and_capped():
+    policy = RetryPolicy(base_delay=1., max_delay=5., jitter=False)
+
+    assert [policy.get_delay(attempt) for attempt in range(1, 6)] == [1., 2., 4., 5., 5.]
+
+
+@pytest.mark.parametrize("headers, delay", [({"retry-after-ms": "1500"}, 1.5), ({"retry-after": "3"}, 3.),
+                                            ({"x-ratelimit-remaining-tokens": "0",
+                                              "x-ratelimit-reset-tokens": "6m0s"}, 360.),
+                                            ({"x-ratelimit-remaining-tokens": "10",
+                                              "x-ratelimit-reset-tokens": "6m0s"}, None)])
+def test_server_delay(headers, delay):
+    assert RetryPolicy.get_server_delay(status_error(429, headers)) == delay
+
+
+@pytest.mark.parametrize("duration, seconds", [("1s", 1.), ("6m0s", 360.), ("20ms", 0.02), ("1h2m3.5s", 3723.5),
+                                               ("0.5", 0.5), ("soon", None)])
+def test_parse_duration(duration, seconds):
+    assert RetryPolicy.parse_duration(duration) == seconds
+
+
+def test_server_delay_wins_over_a_shorter_backoff():
+    policy = RetryPolicy(base_delay=0.1, max_delay=10., jitter=False)
+
+    assert policy.get_delay(1, status_error(429, {"retry-after": "2"})) == 2.
+
+
+def test_call_retries_until_success():
+    attempts = []
+    policy = RetryPolicy(base_delay=0., jitter=False, on_attempt=attempts.append)
+    func = Flaky(status_error(429), TimeoutError())
+
+    assert policy.call(func) == "ok"
+    assert func.calls == 3
+    assert [attempt["error"] for attempt in attempts] == ["APIStatusError", "TimeoutError"]
+    metrics = policy.metrics()
+    assert (metrics["successes"], metrics["retries"], metrics["failures"]) == (1, 2, 0)
+
+
+def test_call_raises_retry_error_after_the_last_attempt():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.)
+    func = Flaky(*[status_error(503)] * 5)
+
+    with pytest.raises(RetryError) as info:
+        policy.call(func)
+    assert func.calls == 3
+    assert info.value.attempts == 3
+    assert isinstance(info.value.__cause__, openai.APIStatusError)
+
+
+def test_fatal_error_is_raised_at_once():
+    policy = RetryPolicy(base_delay=0.)
+    func = Flaky(status_error(400))
+
+    with pytest.raises(openai.APIStatusError):
+        policy.call(func)
+    assert func.calls == 1
+    assert policy.metrics()["fatal"] == 1
+
+
+def test_acall_retries_until_success():
+    policy = RetryPolicy(base_delay=0.)
+    func = Flaky(status_error(500))
+
+    async def call():
+        return func()
+
+    assert asyncio.run(policy.acall(call)) == "ok"
+    assert func.calls == 2
+
+
+def test_client_retries_the_failed_requests():
+    transport = MockLLMTransport(replies="Hi", error_rate=0.5, seed=1)
+    policy = RetryPolicy(max_attempts=20, base_delay=0.)
+    client = create_mock_client(transport, retry_policy=policy)
+
+    for _ in range(5):
+        assert client.run([{"role": "user", "content": "Hello"}]).choices[0].message.content == "Hi"
+    assert transport.stats["errors"] == policy.metrics()["retries"] > 0
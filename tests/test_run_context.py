@@ -0,0 +1,123 @@
+"""
+==========
+RunContext
+==========
+@file_name: test_run_context.py
+@author: Bin Liang
+@date: 2024-05-27
+The tests of the state of a run: the conversation of a run and the runs of one company at the same time.
+"""
+
+import json
+import re
+import threading
+
+from xyz.graph.auto_company import AutoCompany
+from xyz.graph.run_context import RunContext
+from xyz.node.agent import Agent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+
+PLAN = [{"name": "A", "sub_task": "Do the part A."}, {"name": "B", "sub_task": "Do the part B."},
+        {"name": "C", "sub_task": "Do the part C."}]
+QUESTION = re.compile(r"question \d+")
+
+
+class DetailAgent(Agent):
+    """
+    An agent without the LLM which needs a "detail" besides the question, so the InputFormatAssistant (and the
+    conversation of the run) is used for every step.
+    """
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.set_information({"type": "function", "function": {
+            "name": name, "description": f"Do the part {name}.",
+            "parameters": {"type": "object", "required": ["question", "detail"],
+                           "properties": {"question": {"type": "string", "description": "The question."},
+                                          "detail": {"type": "string", "description": "The detail."}}}}})
+        self.input_type = "str"
+        self.output_type = "str"
+
+    def flowing(self, question: str, detail: str) -> str:
+        return f"{self.information['function']['name']} is done for {question}"
+
+
+class Replies:
+    """
+    The replies of the LLM, which are about the question of the request, and the requests which see the questions of
+    the other runs.
+    """
+
+    def __init__(self):
+        self.mixed = []
+
+    def __call__(self, body: dict):
+        text = "\n".join(str(message.get("content") or "") for message in body["messages"])
+        questions = QUESTION.findall(text)
+        if len(set(questions)) > 1:
+            self.mixed.append(sorted(set(questions)))
+        question = questions[-1] if questions else "no question"
+
+        if body.get("tools"):
+            return {"name": body["tools"][0]["function"]["name"],
+                    "arguments": {"question": question, "detail": "d"}}
+        if re.search(r"make a plan\s+for a task", text):
+            return "|||working-plan\n" + json.dumps(PLAN) + "\n|||working-plan"
+        if "make a judgment" in text:
+            return "We can do it. YES-WE-CAN"
+        if "direct your employees" in text:
+            return f"The step is done for {question}.\n|||next-step\nGo on.\n|||next-step\n"
+        return f"All done for {question}."
+
+
+def test_messages_are_copied():
+    run = RunContext(user_input="question")
+    run.add_messages([{"role": "assistant", "content": "a"}])
+    messages = run.get_messages()
+    messages.append({"role": "user", "content": "b"})
+
+    assert run.get_messages() == [{"role": "assistant", "content": "a"}]
+    # A run without a checkpoint saves nothing.
+    run.save("step", name="A", output={})
+
+
+def test_resumed_run_starts_from_the_messages_of_the_state():
+    state = {"messages": [{"role": "assistant", "content": "summary of A"}]}
+    run = RunContext(user_input="question", run_id="run", state=state)
+    run.add_messages([{"role": "assistant", "content": "summary of B"}])
+
+    assert run.run_id == "run"
+    assert [message["content"] for message in run.get_messages()] == ["summary of A", "summary of B"]
+    assert len(state["messages"]) == 1
+
+
+def test_runs_at_the_same_time_keep_their_own_state(tmp_path):
+    replies = Replies()
+    transport = MockLLMTransport(replies=replies, latency=0.01)
+    company = AutoCompany(llm_client=create_mock_client(transport), logger_path=str(tmp_path / "company.log"))
+    company.add_agent([DetailAgent(step["name"]) for step in PLAN])
+
+    results = {}
+
+    def run(i):
+        results[i] = company(user_input=f"question {i}")
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # No request of a run sees the working history or the conversation of another run.
+    assert replies.mixed == []
+    assert len(results) == 6
+    for i, (work_plan, solving_record) in results.items():
+        assert list(work_plan) == ["A", "B", "C"]
+        assert set(QUESTION.findall(solving_record)) == {f"question {i}"}
+        assert solving_record.endswith(f"All done for question {i}.")
+
+    # The usage of the company is split by the runs, each run has the same calls.
+    runs = company.usage.summary(by=("run_id",))
+    assert len(runs) == 6
+    assert {totals["calls"] for totals in runs.values()} == {transport.stats["requests"] // 6}
+    company.close()
@@ -0,0 +1,44 @@
+"""
+=============
+SchemaMapping
+=============
+@file_name: test_schema_mapping.py
+@author: Bin Liang
+@date: 2024-05-22
+The tests of the mapping of the typed outputs of the agents to the parameters of the next agent.
+"""
+
+from xyz.graph.schema_mapping import get_output_values, map_parameters
+
+PARAMETERS = {"type": "object", "required": ["question", "n"],
+              "properties": {"question": {"type": "string"}, "n": {"type": "integer"},
+                             "hint": {"type": "string"}}}
+
+
+def test_output_values_are_the_keys_of_the_schema():
+    schema = {"type": "object", "properties": {"plan": {"type": "string"}, "n": {"type": "integer"}}}
+
+    assert get_output_values(schema, {"plan": "p", "n": 3, "other": 1}) == {"plan": "p", "n": 3}
+    assert get_output_values(None, {"plan": "p"}) == {}
+
+
+def test_text_output_is_the_value_of_the_only_property():
+    assert get_output_values({"properties": {"plan": {"type": "string"}}}, "the plan") == {"plan": "the plan"}
+    assert get_output_values({"properties": {"plan": {}, "n": {}}}, "the plan") == {}
+
+
+def test_map_parameters_fills_the_required_parameters_by_their_types():
+    assert map_parameters(PARAMETERS, {"question": "q", "n": 3, "other": 1}) == {"question": "q", "n": 3}
+    assert map_parameters(PARAMETERS, {"question": "q", "n": 3, "hint": "h"}) == {"question": "q", "n": 3,
+                                                                                  "hint": "h"}
+
+
+def test_map_parameters_gives_up_if_a_required_parameter_is_missing_or_mistyped():
+    assert map_parameters(PARAMETERS, {"question": "q"}) is None
+    assert map_parameters(PARAMETERS, {"question": "q", "n": "three"}) is None
+    # A bool is not an integer in JSON.
+    assert map_parameters(PARAMETERS, {"question": "q", "n": True}) is None
+
+
+def test_map_parameters_reads_the_other_values_as_a_text():
+    assert map_parameters(PARAMETERS, {"question": {"text": "q"}, "n": 3}) == {"question": '{"text": "q"}', "n": 3}
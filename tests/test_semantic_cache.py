@@ -0,0 +1,120 @@
+"""
+=============
+SemanticCache
+=============
+@file_name: test_semantic_cache.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the semantic cache tier of the LLMAgent, in the blocking and the asyncio calls.
+"""
+
+import asyncio
+
+import numpy as np
+
+from xyz.node.basic.llm_agent import LLMAgent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.openai_client import AsyncOpenAIClient
+from xyz.utils.llm.semantic_cache import BruteForceIndex, IVFIndex, SemanticCache
+
+TEMPLATE = [{"role": "system", "content": "You answer the math questions."},
+            {"role": "user", "content": "{question}"}]
+
+
+def embed_letters(text: str) -> np.ndarray:
+    # The counts of the letters and the digits, so the texts which differ only by the spaces are the same vector.
+    vector = np.zeros(36, dtype=np.float32)
+    for char in text.lower():
+        if char.isascii() and char.isalnum():
+            vector[int(char, 36)] += 1.
+    return vector
+
+
+def build_agent(transport: MockLLMTransport, client_class: type = None, stream: bool = False) -> LLMAgent:
+    client = create_mock_client(transport, client_class=client_class)
+    return LLMAgent(TEMPLATE, client, stream=stream, semantic_cache=SemanticCache(embed_letters, max_distance=0.01))
+
+
+def test_brute_force_and_ivf_find_the_nearest_vector():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    brute, ivf = BruteForceIndex(), IVFIndex(nprobe=16, min_train_size=64)
+    for i, vector in enumerate(vectors):
+        brute.add(i, vector)
+        ivf.add(i, vector)
+
+    assert brute.search(vectors[42])[0][0] == 42
+    assert ivf.search(vectors[42])[0][0] == 42
+    brute.remove(42)
+    assert brute.search(vectors[42])[0][0] != 42
+
+
+def test_cache_hits_only_in_the_same_namespace():
+    cache = SemanticCache(embed_letters, max_distance=0.01)
+    _, vector = cache.lookup("a", "What is 1 + 1?")
+    cache.add("a", vector, "2")
+
+    assert cache.lookup("a", "What is 1+1 ?")[0] == "2"
+    assert cache.lookup("b", "What is 1+1 ?")[0] is None
+    assert cache.lookup("a", "What is 2 + 2?")[0] is None
+
+
+def test_cache_evicts_the_least_hit_entries_over_the_cap():
+    cache = SemanticCache(embed_letters, max_entries=10)
+    for i in range(10):
+        cache.add("a", cache.embed("x" * (i + 1) + "y"), i)
+    cache.lookup("a", "xy")
+    cache.add("a", cache.embed("zzz"), "z")
+
+    # Down to 90% of the capacity, and the entry with a hit is kept.
+    assert cache.stats()["entries"] == 9
+    assert cache.lookup("a", "xy")[0] == 0
+
+
+def test_agent_serves_a_close_prompt_from_the_cache():
+    transport = MockLLMTransport(replies="2")
+    agent = build_agent(transport)
+
+    assert agent(question="What is 1 + 1?") == "2"
+    assert agent(question="What is 1+1 ?") == "2"
+    assert transport.stats["requests"] == 1
+    assert agent.last_request_info["semantic_cache"]
+
+
+def test_async_agent_uses_the_cache():
+    transport = MockLLMTransport(replies="2")
+    agent = build_agent(transport, client_class=AsyncOpenAIClient)
+
+    async def main():
+        return [await agent.acall(question="What is 1 + 1?"), await agent.acall(question="What is 1+1 ?")]
+
+    assert asyncio.run(main()) == ["2", "2"]
+    assert transport.stats["requests"] == 1
+    assert agent.semantic_cache.stats()["hits"] == 1
+
+
+def test_async_stream_is_recorded_and_replayed():
+    transport = MockLLMTransport(replies="The answer is 2.")
+    agent = build_agent(transport, client_class=AsyncOpenAIClient, stream=True)
+
+    async def main():
+        answers = []
+        for question in ("What is 1 + 1?", "What is 1+1 ?"):
+            answers.append("".join([word async for word in await agent.acall(question=question)]))
+        return answers
+
+    assert asyncio.run(main()) == ["The answer is 2.", "The answer is 2."]
+    assert transport.stats["requests"] == 1
+
+
+def test_amap_shares_the_cache():
+    transport = MockLLMTransport(replies="2")
+    agent = build_agent(transport, client_class=AsyncOpenAIClient)
+
+    async def main():
+        first = await agent.acall(question="What is 1 + 1?")
+        return [first] + [result async for _, result in agent.amap([{"question": "What is 1+1 ?"}] * 3)]
+
+    assert asyncio.run(main()) == ["2"] * 4
+    assert transport.stats["requests"] == 1
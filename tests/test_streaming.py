@@ -0,0 +1,165 @@
+"""
+=========
+Streaming
+=========
+@file_name: test_streaming.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the streaming engine: resume, finish reason, usage, the budget of the attempts and the backpressure.
+"""
+
+import asyncio
+
+import pytest
+from openai.types.chat import ChatCompletionChunk
+
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.openai_client import AsyncOpenAIClient
+from xyz.utils.llm.retry import RetryError, RetryPolicy
+from xyz.utils.llm.streaming import StreamInterruptedError, StreamStats, astream_text, stream_text
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def make_chunk(text: str = None, finish_reason: str = None, usage: dict = None) -> ChatCompletionChunk:
+    choices = [] if text is None and finish_reason is None else \
+        [{"index": 0, "delta": {"content": text}, "finish_reason": finish_reason}]
+    return ChatCompletionChunk.model_validate({"id": "chunk", "object": "chat.completion.chunk", "created": 0,
+                                               "model": "mock", "choices": choices, "usage": usage})
+
+
+class Server:
+    """
+    Opens the streams of `texts`. The listed opens fail before the stream, and the listed streams break after
+    `break_after` chunks.
+    """
+
+    def __init__(self, texts: list, failed_opens: set = (), broken_streams: set = (), break_after: int = 1):
+        self.texts = texts
+        self.failed_opens = set(failed_opens)
+        self.broken_streams = set(broken_streams)
+        self.break_after = break_after
+        self.opens = 0
+
+    def chunks(self, number: int):
+        for i, text in enumerate(self.texts):
+            if number in self.broken_streams and i == self.break_after:
+                raise ConnectionError("The connection is reset.")
+            yield make_chunk(text)
+        yield make_chunk(finish_reason="stop")
+        yield make_chunk(usage={"prompt_tokens": 3, "completion_tokens": len(self.texts), "total_tokens": 6})
+
+    def open(self):
+        self.opens += 1
+        if self.opens in self.failed_opens:
+            raise ConnectionError("The connection is refused.")
+        return self.chunks(self.opens)
+
+    async def aopen(self):
+        chunks = self.open()
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+
+        return stream()
+
+
+def policy(max_attempts: int = 3) -> RetryPolicy:
+    return RetryPolicy(max_attempts=max_attempts, base_delay=0.)
+
+
+def test_stream_records_the_finish_reason_and_the_usage():
+    stats = StreamStats()
+    text = "".join(stream_text(Server(["a", "b", "c"]).open, policy(), stats))
+
+    assert text == "abc"
+    assert stats.finish_reason == "stop"
+    assert stats.usage.total_tokens == 6
+    assert stats.chunks == 3 and stats.ttft is not None
+
+
+def test_broken_stream_is_resumed_without_duplicates():
+    server = Server(["a", "b", "c"], broken_streams={1}, break_after=2)
+    stats = StreamStats()
+
+    assert "".join(stream_text(server.open, policy(), stats)) == "abc"
+    assert server.opens == 2
+    assert stats.retries == 1
+
+
+def test_diverging_resume_raises_with_the_partial_text():
+    server = Server(["a", "b", "c"], broken_streams={1}, break_after=2)
+    original = server.chunks
+
+    def chunks(number):
+        if number == 2:
+            server.texts = ["x", "y", "z"]
+        return original(number)
+
+    server.chunks = chunks
+    with pytest.raises(StreamInterruptedError) as info:
+        list(stream_text(server.open, policy(), StreamStats()))
+    assert info.value.partial_text == "ab"
+
+
+def test_failed_opens_share_the_budget_of_the_attempts():
+    # Each stream breaks after "a", and the two opens after it fail.
+    server = Server(["a", "b"], failed_opens={2, 3, 5, 6, 8, 9}, broken_streams={1, 4, 7, 10})
+
+    with pytest.raises(StreamInterruptedError):
+        list(stream_text(server.open, policy(max_attempts=3)))
+    assert server.opens == 3
+
+
+def test_open_and_stream_failures_share_the_budget_of_the_attempts():
+    # The first stream breaks after "a", then every open fails.
+    server = Server(["a", "b"], failed_opens={2, 3, 4, 5, 6, 7, 8, 9}, broken_streams={1})
+
+    with pytest.raises(StreamInterruptedError) as info:
+        list(stream_text(server.open, policy(max_attempts=3)))
+    assert info.value.partial_text == "a"
+    assert server.opens == 3
+
+
+def test_async_failed_opens_share_the_budget_of_the_attempts():
+    server = Server(["a", "b"], failed_opens={1, 2})
+
+    async def read(max_attempts):
+        return "".join([text async for text in astream_text(server.aopen, policy(max_attempts))])
+
+    assert asyncio.run(read(3)) == "ab"
+    server.opens = 0
+    with pytest.raises(RetryError):
+        asyncio.run(read(2))
+    assert server.opens == 2
+
+
+@pytest.mark.parametrize("buffer_size", [0, 2])
+def test_buffered_stream_gives_the_same_text(buffer_size):
+    server = Server(list("streaming"), broken_streams={1}, break_after=4)
+    stats = StreamStats()
+
+    assert "".join(stream_text(server.open, policy(), stats, buffer_size=buffer_size)) == "streaming"
+    assert stats.max_buffered <= buffer_size
+
+
+def test_client_stream_on_a_failing_server_costs_max_attempts_requests():
+    transport = MockLLMTransport(error_rate=1.)
+    client = create_mock_client(transport, retry_policy=policy(max_attempts=3))
+
+    with pytest.raises(RetryError):
+        list(client.stream_run(MESSAGES, images=[]))
+    assert transport.stats["requests"] == 3
+
+
+def test_async_client_stream_on_a_failing_server_costs_max_attempts_requests():
+    transport = MockLLMTransport(error_rate=1.)
+    client = create_mock_client(transport, client_class=AsyncOpenAIClient, retry_policy=policy(max_attempts=3))
+
+    async def main():
+        return [text async for text in client.astream_run(MESSAGES, images=[])]
+
+    with pytest.raises(RetryError):
+        asyncio.run(main())
+    assert transport.stats["requests"] == 3
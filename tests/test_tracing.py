@@ -0,0 +1,183 @@
+"""
+=======
+Tracing
+=======
+@file_name: test_tracing.py
+@author: Bin Liang
+@date: 2024-05-29
+The tests of the spans, the exporters and the traces of the runs of the AutoCompany.
+"""
+
+import json
+import threading
+
+import pytest
+
+from xyz.graph.auto_company import AutoCompany
+from xyz.node.agent import Agent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.tracing import (InMemorySpanExporter, OTLPFileExporter, Tracer, current_span, start_span, trace_call,
+                               tracer)
+
+PLAN = [{"name": "A", "sub_task": "Do the part A."}, {"name": "B", "sub_task": "Do the part B."}]
+
+
+class EchoAgent(Agent):
+    """
+    An agent without the LLM which answers the question.
+    """
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.set_information({"type": "function", "function": {
+            "name": name, "description": f"Do the part {name}.",
+            "parameters": {"type": "object", "required": ["question"],
+                           "properties": {"question": {"type": "string", "description": "The question."}}}}})
+        self.input_type = "str"
+        self.output_type = "str"
+
+    def flowing(self, question: str) -> str:
+        return f"{self.information['function']['name']} is done"
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemorySpanExporter()
+    tracer.add_exporter(exporter)
+    yield exporter
+    tracer.remove_exporter(exporter)
+
+
+def by_name(spans: list) -> dict:
+    return {span.name: span for span in spans}
+
+
+def test_spans_are_free_without_an_exporter():
+    assert not Tracer().enabled
+    with start_span("nothing") as span:
+        span.set_attribute("key", "value")
+        assert current_span() is span
+        assert span.duration is None
+
+
+def test_nested_spans_form_a_tree(exporter):
+    with start_span("root", attributes={"n": 1}) as root:
+        with start_span("child") as child:
+            assert current_span() is child
+        assert current_span() is root
+
+    spans = by_name(exporter.spans)
+    assert list(spans) == ["child", "root"]
+    assert spans["child"].parent_span_id == root.span_id and spans["child"].trace_id == root.trace_id
+    assert root.parent_span_id is None and root.duration >= spans["child"].duration
+
+
+def test_error_is_recorded_in_the_span(exporter):
+    with pytest.raises(RuntimeError):
+        with start_span("broken"):
+            raise RuntimeError("broken")
+
+    span = exporter.spans[0]
+    assert span.status == "error" and span.status_message == "RuntimeError: broken"
+    assert span.events[0][1] == "exception"
+
+
+def test_span_of_a_stream_lasts_until_the_stream_is_consumed(exporter):
+    def stream():
+        # The span of the call is the current one while the generator runs.
+        yield current_span().name
+        yield current_span().name
+
+    words = trace_call("stream", stream, {})
+    assert exporter.spans == []
+    assert current_span().name is None
+    assert list(words) == ["stream", "stream"]
+    assert [span.name for span in exporter.spans] == ["stream"]
+
+
+def test_threads_do_not_share_the_current_span(exporter):
+    names = {}
+
+    def run(i):
+        with start_span(f"run {i}"):
+            threading.Event().wait(0.01)
+            names[i] = current_span().name
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert names == {i: f"run {i}" for i in range(4)}
+    assert len({span.trace_id for span in exporter.spans}) == 4
+
+
+def test_summary_puts_the_slowest_first(exporter):
+    for seconds in (0.02, 0.01):
+        with start_span("slow"):
+            threading.Event().wait(seconds)
+    with start_span("fast"):
+        pass
+
+    summary = exporter.summary()
+    assert list(summary) == ["slow", "fast"]
+    assert summary["slow"]["count"] == 2 and summary["slow"]["max_seconds"] <= summary["slow"]["total_seconds"]
+
+
+def test_otlp_file_exporter_writes_the_spans_in_batches(tmp_path):
+    path = tmp_path / "traces" / "traces.jsonl"
+    file_exporter = OTLPFileExporter(str(path), service_name="test", max_batch=2)
+    local_tracer = Tracer([file_exporter])
+    for name in ("a", "b", "c"):
+        local_tracer.start_span(name, kind="client", attributes={"n": 1, "ok": True, "x": 0.5, "list": [1]}).end()
+    with open(path, encoding="utf-8") as file:
+        assert len(file.readlines()) == 1
+    local_tracer.shutdown()
+
+    with open(path, encoding="utf-8") as file:
+        requests = [json.loads(line) for line in file]
+    spans = [span for request in requests for span in request["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+    assert [span["name"] for span in spans] == ["a", "b", "c"]
+    assert requests[0]["resourceSpans"][0]["resource"]["attributes"] == [{"key": "service.name",
+                                                                          "value": {"stringValue": "test"}}]
+    assert spans[0]["kind"] == 3
+    assert spans[0]["attributes"] == [{"key": "n", "value": {"intValue": "1"}},
+                                      {"key": "ok", "value": {"boolValue": True}},
+                                      {"key": "x", "value": {"doubleValue": 0.5}},
+                                      {"key": "list", "value": {"arrayValue": {"values": [{"intValue": "1"}]}}}]
+
+
+def test_run_of_the_company_is_one_trace(exporter, tmp_path):
+    transport = MockLLMTransport(replies={r"make a plan\s+for a task": "|||working-plan\n" + json.dumps(PLAN)
+                                          + "\n|||working-plan",
+                                          r"make a judgment": "We can do it. YES-WE-CAN",
+                                          r"direct your employees": "Done.\n|||next-step\nGo on.\n|||next-step\n",
+                                          r".": "All done."})
+    company = AutoCompany(llm_client=create_mock_client(transport), logger_path=str(tmp_path / "company.log"))
+    company.add_agent([EchoAgent(step["name"]) for step in PLAN])
+    company(user_input="question")
+    company.close()
+
+    spans = exporter.spans
+    roots = [span for span in spans if span.parent_span_id is None]
+    assert len(roots) == 1 and roots[0].attributes["xyz.run_id"] == company.last_run_id
+    assert {span.trace_id for span in spans} == {roots[0].trace_id}
+
+    # The agents of the steps are the children of the spans of the steps.
+    named = by_name(spans)
+    assert named["A"].parent_span_id == named["step A"].span_id
+    assert named["step B"].attributes["xyz.step.sub_task"] == "Do the part B."
+    # Every LLM request has a span.
+    requests = [span for span in spans if span.kind == "client"]
+    assert len(requests) == transport.stats["requests"]
+    ancestors = {span.span_id: span.parent_span_id for span in spans}
+
+    def is_under(span, parent):
+        span_id = span.parent_span_id
+        while span_id is not None and span_id != parent.span_id:
+            span_id = ancestors[span_id]
+        return span_id is not None
+
+    assert any(is_under(span, named["Manager-Assistant: task analysis"]) for span in requests)
+    assert any(is_under(span, named["step A"]) for span in requests)
@@ -0,0 +1,63 @@
+"""
+=========
+Transport
+=========
+@file_name: test_transport.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the shared HTTP transports of the LLM clients.
+"""
+
+import pytest
+
+from xyz.utils.llm.mock_transport import MockLLMTransport
+from xyz.utils.llm.openai_client import OpenAIClient
+from xyz.utils.llm.transport import TransportRegistry, transport_registry
+
+
+def test_clients_of_a_name_are_shared():
+    registry = TransportRegistry()
+
+    assert registry.get_client("a") is registry.get_client("a")
+    assert registry.get_client("a") is not registry.get_client("b")
+    registry.close()
+
+
+def test_configure_rebuilds_the_client():
+    registry = TransportRegistry()
+    old_client = registry.get_client("a")
+    registry.configure("a", max_connections=3)
+    new_client = registry.get_client("a")
+
+    assert old_client.is_closed
+    assert new_client is not old_client
+    assert new_client._transport._pool._max_connections == 3
+    registry.close()
+
+
+def test_unknown_config_is_rejected():
+    with pytest.raises(ValueError, match="max_conections"):
+        TransportRegistry().configure("a", max_conections=3)
+
+
+def test_stats_and_prometheus_export():
+    registry = TransportRegistry()
+    registry.get_client("a")
+
+    assert registry.stats() == {"a": {"sync": {"open": 0, "idle": 0, "active": 0, "waiting": 0}, "async": None}}
+    assert 'xyz_http_pool_open{transport="a",kind="sync"} 0' in registry.to_prometheus()
+    registry.close()
+
+
+def test_openai_clients_share_a_named_transport():
+    transport = MockLLMTransport(replies="Hi")
+    transport_registry.configure("test_shared", transport=transport)
+    try:
+        clients = [OpenAIClient(api_key="mock", transport="test_shared") for _ in range(3)]
+        for client in clients:
+            client.run([{"role": "user", "content": "Hello"}])
+
+        assert transport.stats["requests"] == 3
+        assert len({id(client.client._client) for client in clients}) == 1
+    finally:
+        transport_registry.configure("test_shared", transport=None)
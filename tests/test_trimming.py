@@ -0,0 +1,180 @@
+"""
+========
+Trimming
+========
+@file_name: test_trimming.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the local token counter and of the policies which trim the prompts to the context window.
+"""
+
+from xyz.node.basic.llm_agent import LLMAgent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm import tokenizer
+from xyz.utils.llm.tokenizer import get_context_window, get_token_counter
+from xyz.utils.llm.trimming import DropOldest, KeepLastN, Summarize
+
+COUNTER = get_token_counter("gpt-4-turbo")
+
+
+def conversation(turns: int, words: int = 50) -> list:
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "word " * words})
+        messages.append({"role": "assistant", "content": f"answer {i} " + "word " * words})
+    messages.append({"role": "user", "content": "The last question?"})
+    return messages
+
+
+def test_context_window_of_the_snapshots():
+    assert get_context_window("gpt-4-turbo-2024-04-09") == 128000
+    assert get_context_window("gpt-4-0613") == 8192
+    assert get_context_window("my-model", default=1000) == 1000
+
+
+def test_counter_is_shared_and_counts_more_for_longer_prompts():
+    short = [{"role": "user", "content": "Hello"}]
+    long = [{"role": "user", "content": "Hello " * 100}]
+
+    assert get_token_counter("gpt-4-turbo") is COUNTER
+    assert COUNTER.count_messages(long) > COUNTER.count_messages(short) > 0
+    assert COUNTER.count_messages(short, tools=[{"type": "function"}]) > COUNTER.count_messages(short)
+
+
+class WordEncoding:
+    """
+    A stand-in of a tiktoken encoding: one token per word.
+    """
+
+    def encode(self, text: str, disallowed_special=()) -> list:
+        return text.split()
+
+    def decode(self, tokens: list) -> str:
+        return " ".join(tokens)
+
+
+class FakeTiktoken:
+    """
+    A stand-in of the tiktoken module, whose encodings can fail to load like a download without the network.
+    """
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.loads = 0
+
+    def encoding_for_model(self, model: str) -> WordEncoding:
+        self.loads += 1
+        if self.error is not None:
+            raise self.error
+        if model.startswith("unknown"):
+            raise KeyError(model)
+        return WordEncoding()
+
+    def get_encoding(self, name: str) -> WordEncoding:
+        return WordEncoding()
+
+
+def test_counter_is_exact_with_tiktoken(monkeypatch):
+    monkeypatch.setattr(tokenizer, "tiktoken", FakeTiktoken())
+    for model in ("gpt-4-turbo", "unknown-model"):
+        counter = tokenizer.TokenCounter(model)
+        assert counter.exact
+        assert counter.count_text("one two three") == 3
+        assert counter.count_messages([{"role": "user", "content": "one two"}]) == (
+            tokenizer.TOKENS_PER_REPLY + tokenizer.TOKENS_PER_MESSAGE + 1 + 2)
+        assert counter.truncate("a b c d e", 2) == "d e"
+
+
+def test_counter_estimates_if_the_encoding_can_not_be_loaded(monkeypatch, caplog):
+    fake = FakeTiktoken(error=ConnectionError("openaipublic.blob.core.windows.net"))
+    monkeypatch.setattr(tokenizer, "tiktoken", fake)
+    monkeypatch.setattr(tokenizer, "_counters", {})
+
+    counter = tokenizer.get_token_counter("gpt-4-turbo")
+    assert not counter.exact
+    assert counter.count_text("x" * 40) == 10
+    assert "can not be loaded" in caplog.text
+
+    # The estimate is kept for the model, the encoding is not loaded again for every request.
+    client = create_mock_client(MockLLMTransport(replies="ok"), model="gpt-4-turbo")
+    for _ in range(3):
+        assert client.run([{"role": "user", "content": "Hello"}]).choices[0].message.content == "ok"
+    assert tokenizer.get_token_counter("gpt-4-turbo") is counter
+    assert fake.loads == 1
+
+
+def test_truncate_keeps_the_head_or_the_tail():
+    text = " ".join(str(i) for i in range(1000))
+
+    assert COUNTER.truncate(text, 10, keep="tail").endswith("999")
+    assert COUNTER.truncate(text, 10, keep="head").startswith("0 1")
+    assert COUNTER.count_text(COUNTER.truncate(text, 10)) <= 10
+    assert COUNTER.truncate("short", 10) == "short"
+
+
+def test_prompt_which_fits_is_not_changed():
+    messages = conversation(2)
+
+    assert DropOldest().trim(messages, 100000, COUNTER) is messages
+
+
+def test_drop_oldest_keeps_the_system_and_the_newest_messages():
+    messages = conversation(20)
+    budget = COUNTER.count_messages(messages) // 3
+    trimmed = DropOldest().trim(messages, budget, COUNTER)
+
+    assert COUNTER.count_messages(trimmed) <= budget
+    assert trimmed[0] == messages[0] and trimmed[-1] == messages[-1]
+    assert trimmed[-2] == messages[-2]
+    assert len(trimmed) < len(messages)
+
+
+def test_tool_calls_are_dropped_with_their_results():
+    tool_call = {"id": "call_1", "type": "function", "function": {"name": "f", "arguments": "{}"}}
+    messages = conversation(3)[:-1] + [{"role": "assistant", "content": None, "tool_calls": [tool_call]},
+                                       {"role": "tool", "tool_call_id": "call_1", "content": "result " * 50},
+                                       {"role": "user", "content": "The last question?"}]
+    budget = COUNTER.count_messages(messages) - 20
+    trimmed = DropOldest().trim(messages, budget, COUNTER)
+
+    tool_ids = [message.get("tool_call_id") for message in trimmed if message["role"] == "tool"]
+    has_call = any(message.get("tool_calls") for message in trimmed)
+    assert (tool_ids == ["call_1"]) == has_call
+
+
+def test_keep_last_n():
+    messages = conversation(20)
+    trimmed = KeepLastN(4).trim(messages, COUNTER.count_messages(messages) - 1, COUNTER)
+
+    assert trimmed == [messages[0]] + messages[-5:]
+
+
+def test_too_long_last_message_is_cut():
+    messages = [{"role": "system", "content": "Be short."}, {"role": "user", "content": "word " * 5000}]
+    trimmed = DropOldest().trim(messages, 500, COUNTER)
+
+    assert COUNTER.count_messages(trimmed) <= 500
+    assert messages[1]["content"] == "word " * 5000
+
+
+def test_summarize_replaces_the_old_history_once():
+    transport = MockLLMTransport(replies="They talked about words.")
+    policy = Summarize(create_mock_client(transport, model="gpt-4-turbo"), keep_last=2)
+    messages = conversation(20)
+    budget = COUNTER.count_messages(messages) // 2
+
+    trimmed = policy.trim(messages, budget, COUNTER)
+    policy.trim(messages, budget, COUNTER)
+
+    assert "They talked about words." in trimmed[1]["content"]
+    assert trimmed[-3:] == messages[-3:]
+    assert transport.stats["requests"] == 1
+
+
+def test_agent_trims_its_requests():
+    transport = MockLLMTransport(replies="ok")
+    agent = LLMAgent([{"role": "user", "content": "{question}"}], create_mock_client(transport, model="gpt-4"),
+                     trim_policy=DropOldest(), max_prompt_tokens=300)
+    agent(messages=conversation(20), question="The question?")
+
+    assert COUNTER.count_messages(agent.last_request_info["messages"]) <= 300
@@ -0,0 +1,128 @@
+"""
+===========
+UsageLedger
+===========
+@file_name: test_usage.py
+@author: Bin Liang
+@date: 2024-05-31
+The tests of the usage ledger, the price table and the usage scopes.
+"""
+
+import csv
+import json
+
+import pytest
+
+from xyz.node.basic.llm_agent import LLMAgent
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.usage import PriceTable, UsageLedger, UsageRecord, usage_scope
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def make_record(model: str = "gpt-4o", cost: float | None = 0.01, **labels) -> UsageRecord:
+    return UsageRecord(timestamp=0., model=model, prompt_tokens=10, completion_tokens=5, cached_tokens=0,
+                       latency=0.1, cost=cost, **labels)
+
+
+def test_snapshots_use_the_price_of_their_base_model():
+    prices = PriceTable()
+
+    assert prices.get("gpt-4-turbo-2024-04-09") == prices.get("gpt-4-turbo")
+    assert prices.get("gpt-4-0613") == prices.get("gpt-4")
+    assert prices.get("gpt-4o-mini") is None
+    assert prices.cost("unknown-model", 10, 10) is None
+
+
+def test_cost_of_the_cached_prompt_tokens():
+    prices = PriceTable({"m": {"prompt": 1., "completion": 2., "cached_prompt": 0.5}})
+
+    assert prices.cost("m", 1000, 500, cached_tokens=400) == pytest.approx(0.6 + 0.2 + 1.)
+
+
+def test_price_table_is_loaded_from_a_file(tmp_path):
+    path = tmp_path / "prices.json"
+    path.write_text(json.dumps({"my-model": {"prompt": 0.1, "completion": 0.2}}))
+    prices = PriceTable()
+    prices.load(str(path))
+
+    assert prices.cost("my-model", 1000, 1000) == pytest.approx(0.3)
+    assert prices.get("gpt-4o") is not None
+    with pytest.raises(ValueError):
+        prices.update({"bad": {"prompt": 0.1}})
+
+
+def test_totals_are_exact_when_the_old_records_are_dropped():
+    ledger = UsageLedger(max_records=2)
+    for _ in range(5):
+        ledger.add(make_record())
+    ledger.add(make_record(model="unknown", cost=None))
+
+    totals = ledger.totals()
+    assert len(ledger.records()) == 2
+    assert totals["calls"] == 6
+    assert totals["cost"] == pytest.approx(0.05)
+    assert totals["unpriced_calls"] == 1
+    assert totals["models"]["gpt-4o"]["prompt_tokens"] == 50
+
+
+def test_summary_groups_the_records():
+    ledger = UsageLedger()
+    ledger.add(make_record(agent="a"))
+    ledger.add(make_record(agent="a"))
+    ledger.add(make_record(agent="b"))
+
+    summary = ledger.summary(by=("agent",))
+    assert summary[("a",)]["calls"] == 2 and summary[("b",)]["calls"] == 1
+    with pytest.raises(ValueError):
+        ledger.summary(by=("colour",))
+
+
+def test_csv_export(tmp_path):
+    ledger = UsageLedger()
+    ledger.add(make_record(agent="a"))
+    path = tmp_path / "usage.csv"
+
+    assert ledger.to_csv(str(path)) == 1
+    with open(path) as file:
+        rows = list(csv.DictReader(file))
+    assert rows[0]["agent"] == "a" and rows[0]["prompt_tokens"] == "10"
+
+
+def test_nested_scopes_record_in_all_the_ledgers_with_the_inner_labels():
+    client = create_mock_client(MockLLMTransport(replies="Hi there"), model="gpt-4o")
+    run_ledger, agent_ledger = UsageLedger(), UsageLedger()
+
+    with usage_scope(run_ledger, run_id="run-1", agent="outer"):
+        with usage_scope(agent_ledger, agent="inner"):
+            client.run(MESSAGES)
+        client.run(MESSAGES)
+
+    assert len(run_ledger.records()) == 2
+    assert [record.agent for record in run_ledger.records()] == ["inner", "outer"]
+    assert agent_ledger.records()[0].run_id == "run-1"
+    assert run_ledger.totals()["cost"] > 0
+    with pytest.raises(ValueError):
+        with usage_scope(colour="red"):
+            pass
+
+
+def test_lazy_stream_is_attributed_to_the_scope_where_it_is_created():
+    client = create_mock_client(MockLLMTransport(replies="Hi there"), model="gpt-4o")
+    ledger = UsageLedger()
+
+    with usage_scope(ledger, run_id="run-1"):
+        stream = client.stream_run(MESSAGES, images=[])
+    assert "".join(stream) == "Hi there"
+
+    record, = ledger.records()
+    assert record.stream and record.run_id == "run-1" and record.completion_tokens > 0
+
+
+def test_agent_records_its_own_usage():
+    agent = LLMAgent([{"role": "user", "content": "{question}"}],
+                     create_mock_client(MockLLMTransport(replies="2"), model="gpt-4o"))
+    agent(question="What is 1 + 1?")
+
+    record, = agent.usage.records()
+    assert record.agent == "LLMAgent"
@@ -0,0 +1,101 @@
+"""
+==============
+WorkingHistory
+==============
+@file_name: test_working_history.py
+@author: Bin Liang
+@date: 2024-05-26
+The tests of the working history: the order of the plan, the incremental rendering and the token budget.
+"""
+
+import threading
+
+from xyz.graph.working_history import WorkingHistory
+from xyz.utils.llm.mock_transport import MockLLMTransport, create_mock_client
+from xyz.utils.llm.tokenizer import get_token_counter
+from xyz.utils.llm.trimming import Summarize
+
+COUNTER = get_token_counter("gpt-4-turbo")
+
+
+def long_history(steps: int, max_tokens: int = None, summarizer: Summarize = None) -> WorkingHistory:
+    history = WorkingHistory(counter=COUNTER, max_tokens=max_tokens, summarizer=summarizer)
+    for i in range(steps):
+        history.add(f"Step{i}", f"the result of the step {i} " + "word " * 100)
+    return history
+
+
+def test_records_are_rendered_in_the_order_of_the_plan():
+    history = WorkingHistory(order=["A", "B", "C"])
+    history.add("C", "c")
+    history.add("A", "a")
+    history.add("D", "d")
+
+    assert history.render() == "A:a\n\nC:c\n\nD:d\n\n"
+    assert history.render_full() == str(history) == history.render()
+    assert len(history) == 3
+
+
+def test_new_records_append_to_the_rendered_prefix():
+    history = WorkingHistory(order=["A", "B", "C"])
+    history.add("A", "a")
+    first = history.render()
+    history.add("B", "b")
+
+    assert history.render().startswith(first)
+
+
+def test_replaced_record_is_rendered_again():
+    history = WorkingHistory(order=["A", "B"])
+    history.add("A", "a")
+    history.add("B", "b")
+    history.render()
+    history.add("A", "the new a")
+
+    assert history.render() == "A:the new a\n\nB:b\n\n"
+
+
+def test_budget_omits_the_oldest_records_without_a_summarizer():
+    history = long_history(6, max_tokens=300)
+    text = history.render()
+
+    assert COUNTER.count_text(text) <= 300
+    assert "earlier steps are omitted" in text
+    assert "Step5:" in text and "Step0:" not in text
+    # The whole history is still there for the solving record.
+    assert "Step0:" in history.render_full()
+
+
+def test_budget_folds_the_oldest_records_into_a_rolling_summary():
+    transport = MockLLMTransport(replies="The earlier steps are done.")
+    history = long_history(6, max_tokens=400, summarizer=Summarize(create_mock_client(transport)))
+    text = history.render()
+
+    assert text.startswith("The summary of the earlier steps:\nThe earlier steps are done.")
+    assert history.folded == ["Step0", "Step1", "Step2", "Step3"]
+    assert "Step4:" in text and "Step5:" in text
+    assert transport.stats["requests"] == 1
+
+    # Only the new records are summarized, with the previous summary.
+    history.add("Step6", "word " * 100)
+    history.add("Step7", "word " * 100)
+    history.render()
+    assert history.folded == ["Step0", "Step1", "Step2", "Step3", "Step4", "Step5"]
+    assert transport.stats["requests"] == 2
+
+
+def test_concurrent_adds_keep_every_record():
+    history = WorkingHistory(counter=COUNTER)
+
+    def add(i):
+        history.add(f"Step{i}", f"result {i}")
+        history.render()
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(history) == 32
+    assert all(f"Step{i}:result {i}" in history.render() for i in range(32))
@@ -70,7 +70,7 @@ class InputFormatAssistant(Agent):
         # Using the template we designed to define the assistant, which can do the main task.
         self.llm_input_format = LLMAgent(template=input_format_prompts, llm_client=llm_client, stream=False)
 
-    def flowing(self, input_content: str, functions_list: list, repeat_time: int=0) -> dict:
+    def flowing(self, input_content: str, functions_list: list, messages: list = None, repeat_time: int=0) -> dict:
         """
         The main function of the assistant, which can help user using the function calling format to interface
         the messages.
@@ -83,6 +83,9 @@ class InputFormatAssistant(Agent):
             The input of the last node.
         functions_list: list
             The list of OpenAI's Function call format information for some callables object.
+        messages: list, optional
+            The conversation history of this call (i.e. of one run of the AutoCompany). By default, the global
+            conversation history of the assistant (see `add_history`), which is shared by all the calls.
 
         Returns
         -------
@@ -90,13 +93,16 @@ class InputFormatAssistant(Agent):
             The parameters dict for the next callable object which user want to use.
         """
 
+        if messages is None:
+            messages = self.messages
         if repeat_time == 3:
             raise Exception("The manager assistant failed to distribute the tasks.")
         try:
-            completion = self.llm_input_format(messages=self.messages, input_content=input_content, tools=functions_list)
+            completion = self.llm_input_format(messages=messages, input_content=input_content, tools=functions_list)
             parameters = completion.arguments
         except Exception:
-            return self.flowing(input_content=input_content, functions_list=functions_list, repeat_time=repeat_time+1)
+            return self.flowing(input_content=input_content, functions_list=functions_list, messages=messages,
+                                repeat_time=repeat_time+1)
             
 
         return json.loads(parameters)
@@ -21,7 +21,7 @@ class ManagerAssistant(Agent):
     llm_prompt_engineer: LLMAgent
     original_task: str
 
-    def __init__(self, llm_client: OpenAIClient) -> None:
+    def __init__(self, llm_client: OpenAIClient, structured: bool = False) -> None:
         """
         The manager assistant is a class for manager task assignment and execution supervision.
 
@@ -29,6 +29,11 @@ class ManagerAssistant(Agent):
         ----------
         llm_client: OpenAIClient
             For calling the OpenAI API to generate the response.
+        structured: bool, optional
+            If True, the work plan and the step summaries are JSON objects (in the JSON mode of the API) instead of the
+            text with the `|||pattern` parts. The fields of a step summary come in the order: "next_employee",
+            "next_step", "summary". So the next step can be handed over before the summary is finished, by default
+            False.
         """
         super().__init__()
 
@@ -51,8 +56,15 @@ class ManagerAssistant(Agent):
 
         # Using the template we designed to define the assistant, which can do the main task.
         self.llm_task_analysis = LLMAgent(template=task_analysis_prompt, llm_client=llm_client, stream=True)
-        self.llm_work_plan_create = LLMAgent(template=work_plan_create_prompt, llm_client=llm_client, stream=True)
-        self.llm_step_summary = LLMAgent(template=step_summary_prompt, llm_client=llm_client, stream=True)
+        self.structured = structured
+        if structured:
+            json_client = llm_client.with_generate_args(response_format={"type": "json_object"})
+            self.llm_work_plan_create = LLMAgent(template=work_plan_create_json_prompt, llm_client=json_client,
+                                                 stream=True)
+            self.llm_step_summary = LLMAgent(template=step_summary_json_prompt, llm_client=json_client, stream=True)
+        else:
+            self.llm_work_plan_create = LLMAgent(template=work_plan_create_prompt, llm_client=llm_client, stream=True)
+            self.llm_step_summary = LLMAgent(template=step_summary_prompt, llm_client=llm_client, stream=True)
         self.llm_summary = LLMAgent(template=summary_prompt, llm_client=llm_client, stream=True)
         self.llm_dynamic_select = LLMAgent(template=dynamic_select_prompt, llm_client=llm_client, stream=True)
 
@@ -111,7 +123,7 @@ class ManagerAssistant(Agent):
         Returns
         -------
         Generator
-            The work plan for the task.
+            The work plan for the task. In the structured mode, a JSON object {"reason": str, "work_plan": list}.
         """
         return self.llm_work_plan_create(task_analysis=task_analysis,
                                          agents_info=agents_info)
@@ -132,7 +144,8 @@ class ManagerAssistant(Agent):
         Returns
         -------
         Generator
-            The summary of the work in this step. And the next step will be processed by which agent.
+            The summary of the work in this step. And the next step will be processed by which agent. In the
+            structured mode, a JSON object {"next_employee": str, "next_step": str, "summary": str}.
         """
         return self.llm_step_summary(working_history=working_history,
                                      current_response=current_response,
@@ -239,6 +252,9 @@ i.e. \\alpha \\times 3 = 3\\alpha
     It's represented by a python dictionary.: {{"name": "xxx", "sub_task": "xxx"}}
     * name: employee name
     * sub_task: information about this work step
+    * depends_on (optional): the names of the employees whose results this work step needs, i.e. ["Alice"]. The work
+    steps which do not depend on each other will be done at the same time. If no work step has depends_on, the work 
+    steps are done one by one in the order of the list.
     * Please do not write any other information in the dictionary.
     * You don't need to involve every employee in the task, you just need to choose the combination that you think best 
     solves the task.
@@ -247,7 +263,9 @@ i.e.
 |||working-plan
 [
     {{"name": "Alice", "sub_task": "Task1"}}, 
-    {{"name": "Bob", "sub_task": "Task2"}}
+    {{"name": "Bob", "sub_task": "Task2", "depends_on": ["Alice"]}},
+    {{"name": "Carol", "sub_task": "Task3", "depends_on": ["Alice"]}},
+    {{"name": "Dave", "sub_task": "Task4", "depends_on": ["Bob", "Carol"]}}
 ]
 |||working-plan
 Make sure the above content is parsed with json.loads(he current task and employee information, and record your thinking
@@ -348,6 +366,96 @@ Please use the format which you are required for this task to record the informa
      }
 ]
 
+work_plan_create_json_prompt = [
+    {"role": "system", "content": """
+Now you are a manger of a company. And you also have some employees, you know their information. You need to make a plan
+for a task which you want to do.
+
+## Your affiliation:
+You are from the Netmind.AI If anyone asks you, you can tell them that you are a manager of the Netmind.AI.
+
+## Target:
+You need to make a plan for a task which you want to do. The plan should be clear and easy to understand.
+
+### Work Plan Requirement:
+1. You have already analysis the task and make a judgment if your employees can do this task. Please use the analysis.
+2. You must refer to employee information and assign tasks to appropriate employees.
+3. As far as possible, there should be employees to plan, employees to implement, employees to inspect, and finally 
+employees to summarize.
+4. Please do not involve unhelpful employees in this work, which will waste time and resources.
+
+### Output Format:
+You must reply with only one JSON object, which has two fields in this order:
+1. "reason": why you make such a plan, and why each employee must take a specific task.
+2. "work_plan": the list of the work steps in the order of the work process. Each work step is an object:
+    * "name": employee name
+    * "sub_task": information about this work step
+    * "depends_on" (optional): the names of the employees whose results this work step needs. The work steps which do
+    not depend on each other will be done at the same time. If no work step has depends_on, the work steps are done one 
+    by one in the order of the list.
+i.e.
+{{"reason": "xxx", "work_plan": [
+    {{"name": "Alice", "sub_task": "Task1"}},
+    {{"name": "Bob", "sub_task": "Task2", "depends_on": ["Alice"]}},
+    {{"name": "Carol", "sub_task": "Task3", "depends_on": ["Alice"]}},
+    {{"name": "Dave", "sub_task": "Task4", "depends_on": ["Bob", "Carol"]}}
+]}}
+"""
+     },
+
+    {"role": "user", "content": """
+Dear manager, thank you for your analysis!
+
+Now I have already analysis the task and make a judgment if your employees can do this task:
+{task_analysis}
+
+And you know the information of the employees in this company:
+{agents_info}
+
+Please make a work plan, and reply with the JSON object.
+"""
+     }
+]
+
+step_summary_json_prompt = [
+    {"role": "system", "content": """
+Now you are a manger of a company. And you also have some employees, you know their information. You are overseeing the 
+execution of a task, and you need to direct your employees to complete the task. You need to tell which employee should
+handle the next work step, and summarize the current work.
+
+### Output Format:
+You must reply with only one JSON object, which has three fields in this order:
+1. "next_employee": the name of the employee who handles the next work step. It must be in the next list.
+2. "next_step": all the information which the next employee needs, so that the next employee can continue to work 
+without relying on the previous job. i.e. "Task target: xxx\\nThe related information: xxx\\nYou need to do: xxx"
+3. "summary": the summary of the current work: where the current process is, what your employees have done and what
+they haven't done.
+i.e.
+{{"next_employee": "Alice", "next_step": "Task target: xxx ...", "summary": "xxx"}}
+
+## Importance:
+PLEASE DO NOT REPEAT THE WORK MORE THAN 3 TIMES.
+"""
+     },
+
+    {"role": "user", "content": """
+Dear manager, thank you for your help!
+
+The working record of the working is:
+{working_history}
+
+The current step is:
+{current_response}
+
+The employees in the next list are:
+{next_list_info}
+next_employee must be selected from the next list.
+
+Please reply with the JSON object.
+"""
+     }
+]
+
 summary_prompt = [
     {"role": "system", "content": """
 Now you are a manger of a company. And you also have some employees, you know their information. Now that your staff has 
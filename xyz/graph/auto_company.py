@@ -15,7 +15,7 @@ AutoCompany
     This is a class for graph
 """
 
-__all__ = ["AutoCompany"]
+__all__ = ["AutoCompany", "CompanyLogger"]
 
 import logging
 import inspect
@@ -23,12 +23,142 @@ import os
 import time
 import re
 import json
-from typing import Any
-
+import uuid
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Generator, Iterator
+
+from xyz.graph.checkpoint import CheckpointStore, RunCheckpoint
+from xyz.graph.dag_executor import DAGExecutor, topological_order
+from xyz.graph.plan_cache import PlanCache
+from xyz.graph.run_context import RunContext
+from xyz.graph.schema_mapping import get_output_values, map_parameters
+from xyz.graph.working_history import WorkingHistory
 from xyz.node.agent import Agent
 from xyz.elements.assistant.manager_assistant import ManagerAssistant
 from xyz.elements.assistant.input_format_assistant import InputFormatAssistant
+from xyz.utils.llm.json_stream import JSONStreamParser, parse_json
 from xyz.utils.llm.openai_client import OpenAIClient
+from xyz.utils.llm.trimming import Summarize
+from xyz.utils.llm.usage import UsageLedger, usage_scope
+from xyz.utils.log_sink import AsyncLogSink, JSONLinesHandler
+from xyz.utils.profiling import profile_call, profile_session, profiled
+from xyz.utils.tracing import current_span, start_span, trace_call
+
+
+# The parameters of the agents which are filled by the user input, by default.
+USER_INPUT_PARAMETERS = ("question", "user_input")
+# The parameter of the agents which is filled by the next step that the manager writes for them.
+INSTRUCTIONS_PARAMETER = "instructions"
+# How many times the manager can route the work to a step out of the plan, so the routing can not loop forever.
+MAX_REROUTES = 3
+
+
+@lru_cache(maxsize=None)
+def _get_special_regex(pattern: str) -> re.Pattern:
+    """
+    The compiled regex of the special part `|||{pattern}...|||{pattern}`, it is compiled only once for each pattern.
+    """
+
+    pattern = re.escape("|||" + pattern)
+
+    return re.compile(pattern + '(.*?)' + pattern, re.DOTALL)
+
+
+def _then(future: Future, func) -> Future:
+    """
+    The future of `func(result)`, which is done when the future is done, without a thread waiting for it.
+    """
+
+    then = Future()
+
+    def on_done(done: Future) -> None:
+        try:
+            then.set_result(func(done.result()))
+        except BaseException as error:
+            then.set_exception(error)
+
+    future.add_done_callback(on_done)
+
+    return then
+
+
+PROCESS_LEVEL_NUM = 25
+logging.addLevelName(PROCESS_LEVEL_NUM, "PROCESS")
+
+
+class CompanyLogger(logging.Logger):
+    """
+    The logger of a company, which has the "PROCESS" level for the streamed words (they are written without a new
+    line). The records are written by the background thread of its `sink`, so logging never waits for the I/O.
+    """
+
+    sink: AsyncLogSink | None = None
+
+    def process(self, message, *args, **kws):
+        if self.isEnabledFor(PROCESS_LEVEL_NUM):
+            self._log(PROCESS_LEVEL_NUM, message, args, **kws)
+
+    def flush(self, timeout: float = None) -> None:
+        """
+        Wait until the records which are logged before are written.
+        """
+
+        if self.sink is not None:
+            self.sink.flush(timeout)
+
+    def close(self) -> None:
+        """
+        Write the records which are left, then close and remove the handlers of the logger.
+        """
+
+        for handler in list(self.handlers):
+            self.removeHandler(handler)
+            handler.close()
+        if self.sink is not None:
+            self.sink.close()
+
+
+class _ColoredFormatter(logging.Formatter):
+    RED = '\033[31m'
+    CYAN = '\033[36m'
+    GREEN = '\033[32m'
+    RESET = '\033[0m'
+
+    def format(self, record):
+        # The record is shared by the handlers, so it is not changed here.
+        record = logging.makeLogRecord(record.__dict__)
+        record.step = self.RED + str(record.step) + self.RESET
+        record.agent = self.CYAN + str(record.agent) + self.RESET
+        record.msg = self.GREEN + str(record.msg) + self.RESET
+        return super().format(record)
+
+
+class _NoNewlineMixin:
+    def emit(self, record):
+        if record.levelno == PROCESS_LEVEL_NUM:
+            msg = record.getMessage()
+        else:
+            try:
+                msg = self.format(record)
+                msg += "\n"
+            except:
+                msg = record.getMessage()
+                msg += "\n"
+        # The sink flushes the stream after each batch of records, not after each word.
+        if self.stream is None:
+            self.stream = self._open()
+        self.stream.write(msg)
+
+
+class _StreamHandlerNoNewline(_NoNewlineMixin, logging.StreamHandler):
+    pass
+
+
+class _FileHandlerNoNewline(_NoNewlineMixin, logging.FileHandler):
+    pass
 
 
 class AutoCompany(Agent):
@@ -37,8 +167,14 @@ class AutoCompany(Agent):
     agents: dict
     agents_info: str
     graph: dict
-
-    def __init__(self, llm_client: OpenAIClient, logger_path=None) -> None:
+    usage: UsageLedger
+    last_run_usage: UsageLedger | None
+
+    def __init__(self, llm_client: OpenAIClient, logger_path=None, max_concurrency: int = 4,
+                 plan_cache: PlanCache = None, structured_output: bool = False, speculative: bool = False,
+                 checkpoint_store: CheckpointStore = None, history_max_tokens: int = None,
+                 run_log_path: str = None, profile_dir: str = None,
+                 user_input_parameters: tuple = USER_INPUT_PARAMETERS) -> None:
         """
         Initialize the AutoCompany. Which you can use to manage the agents and execute the work plan automatically.
 
@@ -48,6 +184,36 @@ class AutoCompany(Agent):
             The OpenAI client which you can use to communicate with the OpenAI API.
         logger_path: str
             The path of the logger file. If you don't provide the path, the logger will be saved in the logs folder.
+        max_concurrency: int
+            The max number of the steps of the work plan which run at the same time, by default 4.
+        plan_cache: PlanCache, optional
+            If it is set, the task analysis and the work plan of the same kind of task are reused, so the planning
+            calls of the manager are skipped, by default None.
+        structured_output: bool, optional
+            If True, the manager writes the work plan and the step summaries as JSON objects, which are parsed while
+            they are streamed. The next step of the work plan starts as soon as the manager has written its
+            instructions, and the summary of the step is read in the background, by default False.
+        speculative: bool, optional
+            If True, the planned next steps start at the same time as the summary of the manager. If the manager then
+            routes the work to an agent which is not planned, the speculative results are discarded and the work goes
+            to that agent with the instructions of the manager. The hit rate and the saved seconds are in
+            `speculation_stats`, by default False.
+        checkpoint_store: CheckpointStore, optional
+            If it is set, every run is checkpointed after the planning and after every step, so a run which fails can
+            be continued by `resume(run_id)` without calling the LLM again for the finished steps, by default None.
+        history_max_tokens: int, optional
+            The token budget of the working history in the prompts of the manager. If the history is longer, its oldest
+            steps are folded into a rolling summary by the LLM, by default no budget.
+        run_log_path: str, optional
+            The path of the JSON-lines run log, by default the path of the logger file with the ".jsonl" suffix.
+        profile_dir: str, optional
+            If it is set, every run is profiled: the wall time, the CPU time and the allocation peak of each agent
+            and hot function. The folded stacks (for the flamegraph tools) are written to
+            `{profile_dir}/{run_id}.folded` and the slowest parts are logged, by default None. The profiling makes the
+            run slower.
+        user_input_parameters: tuple, optional
+            The parameters of the agents which are filled by the user input, if no typed output of a finished step
+            fills them, by default ("question", "user_input"). An empty tuple leaves them to the InputFormatAssistant.
 
         Examples
         --------
@@ -73,10 +239,28 @@ class AutoCompany(Agent):
         self.agents = {}
         self.agents_info = ""
         self.llm_client = llm_client
-        self.manager = ManagerAssistant(llm_client)
+        self.max_concurrency = max_concurrency
+        self.plan_cache = plan_cache
+        self.manager = ManagerAssistant(llm_client, structured=structured_output)
         self.input_format_agent = InputFormatAssistant(llm_client)
-
-        self.logger = self.create_logger(logger_path)
+        # How the parameters of the steps are filled: "direct" by the typed outputs, "llm" by the InputFormatAssistant.
+        self.format_stats = {"direct": 0, "llm": 0}
+        self.speculative = speculative
+        self.speculation_stats = {"speculations": 0, "hits": 0, "misses": 0, "hit_rate": 0.,
+                                  "saved_seconds": 0., "wasted_seconds": 0.}
+        self._stats_lock = threading.Lock()
+        self.checkpoint_store = checkpoint_store
+        self.history_max_tokens = history_max_tokens
+        self.history_summarizer = Summarize(llm_client) if history_max_tokens is not None else None
+        self.profile_dir = profile_dir
+        self.user_input_parameters = tuple(user_input_parameters)
+
+        # The usage of all the runs, and of the last run.
+        self.usage = UsageLedger()
+        self.last_run_usage = None
+        self.last_run_id = None
+
+        self.logger = self.create_logger(logger_path, run_log_path)
 
     def flowing(self, user_input, work_plan: dict = None) -> Any:
         """
@@ -100,43 +284,177 @@ class AutoCompany(Agent):
             The solving record which you have executed.
         """
 
-        # Step 1: Manager will analyze the task
-        agents_info = self.get_agents_info()
-        task_analysis = self.manager.analyze_task(user_input=user_input, agents_info=agents_info)
-        self.logger.info("=======Start=========", extra={'step': "Task Analysis",
-                                                         'agent': "Manager-Assistant"})
-        task_analysis = self.stream_show(task_analysis)
-        if "NO-WE-CAN-NOT" in task_analysis:
-            return None
+        run_id = uuid.uuid4().hex
+        checkpoint = RunCheckpoint(self.checkpoint_store, run_id) if self.checkpoint_store is not None else None
+        run = RunContext(user_input, run_id=run_id, checkpoint=checkpoint)
+        run.save("start", user_input=user_input, work_plan=work_plan)
+
+        return self._flowing(run, work_plan)
+
+    def resume(self, run_id: str) -> Any:
+        """
+        Continue a run from its checkpoint: the planning and the finished steps are not done again, and the work plan
+        continues from the steps which are not finished.
+
+        Parameters
+        ----------
+        run_id: str
+            The id of the run, i.e. `company.last_run_id` of the failed run.
 
-        # Step 2: Manager start to create work plan and distribute the work
-        if work_plan is None:
-            self.logger.info("=======Work-Plan=========", extra={'step': "Work Plan",
+        Returns
+        -------
+        work_plan: dict
+            The work plan which you have executed.
+        solving_record: str
+            The solving record which you have executed.
+
+        Raises
+        ------
+        ValueError
+            If the run has no checkpoint.
+        """
+
+        assert self.checkpoint_store is not None, "The company has no checkpoint_store to resume from."
+
+        checkpoint = RunCheckpoint(self.checkpoint_store, run_id)
+        state = checkpoint.load_state()
+        if "result" in state:
+            # The run is already finished.
+            return None if state["result"] is None else tuple(state["result"])
+
+        self.logger.info(f"Resume the run {run_id}, {len(state['steps'])} steps are finished.",
+                         extra={'step': "Resume", 'agent': "Netmind_AI_XYZ"})
+
+        run = RunContext(state["user_input"], run_id=run_id, checkpoint=checkpoint, state=state)
+
+        return trace_call(self._get_span_name(), self._flowing, {"run": run, "work_plan": state["work_plan"]},
+                          attributes={"xyz.agent.class": type(self).__name__, "xyz.resumed": True})
+
+    def _flowing(self, run: RunContext, work_plan: dict = None) -> Any:
+        """
+        Run (or resume) a run with its usage ledgers, see `flowing`.
+        """
+
+        # Every LLM call of this run is recorded in the ledger of the run and the ledger of the company. The "last run"
+        # is only for the convenience of the user, the runs themselves never read it.
+        self.last_run_id = run.run_id
+        self.last_run_usage = run.usage
+        current_span().set_attribute("xyz.run_id", run.run_id)
+        with usage_scope(self.usage, run_id=run.run_id), usage_scope(run.usage):
+            if self.profile_dir is not None:
+                with profile_session(trace_memory=True) as run.profile:
+                    result = profile_call(f"{type(self).__name__}._run", self._run,
+                                          {"run": run, "work_plan": work_plan})
+                self.write_profile(run)
+            else:
+                result = self._run(run, work_plan)
+
+            totals = run.usage.totals()
+            self.logger.info(f"{totals['calls']} LLM calls, {totals['prompt_tokens']} prompt tokens, "
+                             f"{totals['completion_tokens']} completion tokens, cost ${totals['cost']:.4f}",
+                             extra={'step': "Usage", 'agent': "Netmind_AI_XYZ"})
+        # The logs of the run are on the disk when it returns.
+        self.logger.flush()
+
+        return result
+
+    def _run(self, run: RunContext, work_plan: dict = None) -> Any:
+        """
+        One run of the AutoCompany, see `flowing`. If the run is resumed from a checkpoint, the planning which is done
+        is not done again.
+        """
+
+        user_input, state = run.user_input, run.state
+        # Step 0: Reuse the plan of the same kind of task, if we have one
+        planned = work_plan is None and self.plan_cache is not None and state is None
+        cached = self.plan_cache.lookup(user_input, self.agents) if planned else None
+        if state is not None and "task_analysis" in state:
+            task_analysis, work_plan = state["task_analysis"], state["work_plan"]
+        elif cached is not None:
+            task_analysis, work_plan = cached
+            self.logger.info("Reuse the work plan of the same kind of task.", extra={'step': "Plan Cache",
+                                                                                     'agent': "Manager-Assistant"})
+        else:
+            # Step 1: Manager will analyze the task
+            agents_info = self.get_agents_info()
+            with usage_scope(agent="Manager-Assistant"), start_span("Manager-Assistant: task analysis"):
+                task_analysis = self.manager.analyze_task(user_input=user_input, agents_info=agents_info)
+                self.logger.info("=======Start=========", extra={'step': "Task Analysis",
                                                                  'agent': "Manager-Assistant"})
-            work_plan_str = self.manager.create_work_plan(task_analysis, agents_info)
-            work_plan_str = self.stream_show(work_plan_str)
-            work_plan = self.read_work_plan(work_plan_str)
+                task_analysis = self.stream_show(task_analysis)
+            if "NO-WE-CAN-NOT" in task_analysis:
+                run.save("finish", result=None)
+                return None
+
+            # Step 2: Manager start to create work plan and distribute the work
+            if work_plan is None:
+                self.logger.info("=======Work-Plan=========", extra={'step': "Work Plan",
+                                                                     'agent': "Manager-Assistant"})
+                with usage_scope(agent="Manager-Assistant"), start_span("Manager-Assistant: work plan"):
+                    work_plan_str = self.manager.create_work_plan(task_analysis, agents_info)
+                    if self.manager.structured:
+                        # Only the reason is shown, the plan itself is logged by the steps.
+                        parser, chunks = JSONStreamParser(strict=False), []
+                        self.stream_show(self.stream_json(work_plan_str, parser, show=("reason",), chunks=chunks))
+                        work_plan_str = (self.read_json_fields(parser, "".join(chunks), keys=("work_plan",))
+                                         or "".join(chunks))
+                    else:
+                        work_plan_str = self.stream_show(work_plan_str)
+                work_plan = self.read_work_plan(work_plan_str)
+
+            if planned:
+                self.plan_cache.add(user_input, self.agents, task_analysis, work_plan)
+
+        if state is None or "task_analysis" not in state:
+            run.save("plan", task_analysis=task_analysis, work_plan=work_plan)
 
         # Step 3: Manager start to execute the work plan
-        solving_history = self.execute_work_plan(user_input=user_input, task=task_analysis, work_plan=work_plan)
+        solving_history = self.execute_work_plan(user_input=user_input, task=task_analysis, work_plan=work_plan,
+                                                 run=run)
 
         # Step 4: Manager do the summary
-        summary_response = self.manager.summary(solving_history)
-        self.logger.info("=======Summary=========", extra={'step': "Summary",
-                                                           'agent': "Manager-Assistant"})
-        summary_response = self.stream_show(summary_response)
+        with usage_scope(agent="Manager-Assistant"), start_span("Manager-Assistant: summary"):
+            summary_response = self.manager.summary(solving_history.render())
+            self.logger.info("=======Summary=========", extra={'step': "Summary",
+                                                               'agent': "Manager-Assistant"})
+            summary_response = self.stream_show(summary_response)
 
         solving_record = ("User Input: " + user_input + "\n" + task_analysis
-                          + solving_history + summary_response)
+                          + solving_history.render_full() + summary_response)
+
+        run.save("finish", result=[work_plan, solving_record])
 
         self.logger.info("=======Finish=========\n\t\tSee you next time!!!", extra={'step': "Finish",
                                                                                     'agent': "Netmind_AI_XYZ"})
 
         return work_plan, solving_record
 
-    def execute_work_plan(self, user_input: str, task: str, work_plan: dict):
+    def execute_work_plan(self, user_input: str, task: str, work_plan: dict, run: RunContext = None):
         """
-        Execute the work plan automatically.
+        Execute the work plan automatically. The plan is a DAG: a step starts when all the steps which it depends on
+        are finished, and the independent steps run concurrently (at most `max_concurrency` at the same time).
+        The input of a step is joined from the outputs of its dependencies.
+
+        If the typed outputs of the finished steps (see `Agent.set_output_schema`), the user input and the sub task
+        can fill all the required parameters of an agent, the agent is called with them directly. Otherwise, the
+        InputFormatAssistant asks the LLM to fill the parameters. The sub task of the step wins over the typed
+        outputs, and the user input only fills the `user_input_parameters` which are still unfilled. The next step
+        which the manager writes for the step fills its `instructions` parameter.
+
+        In the structured mode of the manager, a step is handed over as soon as the "next_step" of its summary is
+        streamed, and the rest of the summary is read in the background.
+
+        In the speculative mode, a step is handed over as soon as its agent is finished, and the summary is read in
+        the background. A downstream step keeps its result only if the manager routes the work to a planned step,
+        otherwise it is discarded and the step which the manager names runs instead (see the routing below).
+
+        The manager still routes the work as in the sequential plans: if the next employee of a step summary is not
+        one of the planned next steps, the work is handed over to that step instead (it runs again if it is finished,
+        at most `MAX_REROUTES` times), and the planned next steps are skipped. The known values of a step which the
+        work is routed to are the same as before, so its parameters are filled by the LLM from the handoff and the
+        new instructions of the manager, unless the agent has the `instructions` parameter. If the next employee is
+        not a step of the plan, the task is terminated: no step starts any more, and the manager summarizes the work
+        which is done.
 
         Parameters
         ----------
@@ -146,118 +464,505 @@ class AutoCompany(Agent):
             The task analysis
         work_plan: dict
             The work plan which you want to execute.
+        run: RunContext, optional
+            The state of the run, by default a new one. The output and the history of every step are saved in its
+            checkpoint, and the finished steps of the checkpoint which it is resumed from are not run again.
 
         Returns
         -------
-        working_history: str
-            The working history which you have executed.
-        """
+        working_history: WorkingHistory
+            The working history which you have executed. `render_full()` gives the whole text.
 
-        working_history = ""
-
-        # Prepare: Choose the start agent and end agent
-        positions = {agent_info['position']: agent_info['name'] for agent_info in work_plan.values()}
-        start_agent = positions.get('start')
-        end_agent = positions.get('end')
-
-        assert start_agent is not None, "No start agent found in the work plan"
-        assert end_agent is not None, "No end agent found in the work plan"
+        Raises
+        ------
+        ValueError
+            If the work plan is not a DAG of the agents of the company.
+        """
 
-        current_point = start_agent
-        current_content = (f"The user input is: {user_input}\n\n"
-                           f"The task analysis is: {task}\n\n"
-                           f"The Plan is: \n\n{json.dumps(work_plan)}\n\n"
-                           f"Now, we need let the first agent to start the work. "
-                           f"We must call the first function, and get the parameters from the information above.")
+        dependencies = self.check_work_plan(work_plan)
+        assert dependencies, "No step found in the work plan"
+        run = run if run is not None else RunContext(user_input)
+        state = run.state
+
+        # The tokens are shown live only when one step runs at a time, otherwise the outputs would be interleaved.
+        live = self.max_concurrency == 1 or DAGExecutor.max_width(dependencies) == 1
+        # The history of each step, which is rendered in the order of the plan.
+        order = topological_order(dependencies)
+        history = run.history = WorkingHistory(order, counter=self.llm_client.token_counter,
+                                               max_tokens=self.history_max_tokens, summarizer=self.history_summarizer)
+        summary_readers = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        summary_futures = []
+
+        completed = {}
+        if state is not None:
+            completed = {name: output for name, output in state["steps"].items() if name in dependencies}
+            for name, content in state["history"].items():
+                history.add(name, content)
+
+        def add_step_history(current_point: str, content: str, message: bool = False) -> None:
+            # The summaries of the manager are the messages of the InputFormatAssistant too.
+            history.add(current_point, content)
+            if message:
+                run.add_messages([{"role": "assistant", "content": content}])
+            run.save("history", name=current_point, content=content, message=message)
+
+        def save_step(current_point: str, output: dict) -> None:
+            run.save("step", name=current_point, output={"handoff": output["handoff"], "values": output["values"],
+                                                         "next_step": output.get("next_step", "")})
+
+        reroutes, reroutes_lock = {}, threading.Lock()
+
+        def route_step(current_point: str, output: dict) -> list | Future | None:
+            # In the speculative mode, the planned next steps start before the route is decided.
+            if "route" in output:
+                return output["route"]
+
+            return decide_route(current_point, output.get("next_employee") or "")
+
+        def decide_route(current_point: str, next_employee: str) -> list | None:
+            # The manager may name another employee than the planned next ones, as in the sequential plans.
+            if not next_employee or next_employee in work_plan[current_point].get("next", []):
+                return None
+            with reroutes_lock:
+                reroutes[next_employee] = reroutes.get(next_employee, 0) + 1
+                rerouted = reroutes[next_employee]
+            if next_employee not in work_plan or rerouted > MAX_REROUTES:
+                self.logger.info("This task is terminate with some error.", extra={'step': "Terminate",
+                                                                                 'agent': "AutoSystem"})
+                return []
+            self.logger.info(f"The manager routes the work of {current_point} to {next_employee}.",
+                             extra={'step': "Route", 'agent': "Manager-Assistant"})
+
+            return [next_employee]
+
+        def is_missed(current_point: str, routes: dict) -> bool:
+            # The manager routes the work of a dependency to another agent than this step and the planned ones.
+            return any(route["next_employee"] and route["next_employee"] != current_point
+                       and route["next_employee"] not in work_plan[name]["next"] for name, route in routes.items())
+
+        def discard(current_point: str, routes: dict) -> dict:
+            # The executor discards the result of this step, and the work goes where the manager routes it.
+            employees = {name: route["next_employee"] for name, route in routes.items() if route["next_employee"]}
+            self.logger.info(f"The manager routes the work to {employees}, the speculative run of {current_point} is "
+                             f"discarded.", extra={'step': "Speculation", 'agent': f"Company Agent: {current_point}"})
+
+            return {"handoff": "", "values": {}}
+
+        def finish_summary(current_point: str, words: Iterator, parser: JSONStreamParser, chunks: list) -> None:
+            for word in words:
+                chunks.append(word)
+                parser.feed(word)
+            # A reply which is not the JSON summary is read as the old format, like the other modes do.
+            fields = self.read_json_fields(parser, "".join(chunks)) or {"summary": "".join(chunks)}
+            current_summary_content = f"{fields.get('summary', '')}\n\n{fields.get('next_step', '')}".strip()
+            self.logger.info(current_summary_content, extra={'step': "Summarize this step",
+                                                             'agent': f"Manager-Assistant: {current_point}"})
+            add_step_history(current_point, current_summary_content, message=True)
+
+        def read_summary(current_point: str, current_response: str) -> dict:
+            # The summary of a step whose downstream steps are started speculatively, it is read in the background.
+            with usage_scope(agent="Manager-Assistant"):
+                current_summary = self.collect(self.manager.summary_step(
+                    working_history=history.render(), current_response=current_response,
+                    next_list_info=self.get_next_list_info(work_plan[current_point])))
+            route = self.read_route(current_summary, structured=self.manager.structured)
+            # The summary of the old format is the whole reply, the next step is a part of it.
+            current_summary_content = (current_summary if route["summary"] == current_summary
+                                       else f"{route['summary']}\n\n{route['next_step']}".strip())
+            self.logger.info(current_summary_content, extra={'step': "Summarize this step",
+                                                             'agent': f"Manager-Assistant: {current_point}"})
+            add_step_history(current_point, current_summary_content, message=True)
+            route["finished_at"] = time.perf_counter()
+
+            return route
+
+        def run_agent(current_point: str, inputs: dict, show: bool) -> tuple:
+            # The known values: the typed outputs of the ancestors in the order of the plan (the nearer ones win),
+            # then the sub task of this step. The user input only fills the parameters which are still unfilled.
+            known = {}
+            for name in sorted(inputs, key=order.index):
+                known.update(inputs[name]["values"])
+            values = dict(known, sub_task=work_plan[current_point]["sub_task"])
+            next_step = "\n\n".join(inputs[name]["next_step"] for name in inputs if inputs[name].get("next_step"))
+            if next_step:
+                values[INSTRUCTIONS_PARAMETER] = next_step
+            for name in self.user_input_parameters:
+                values.setdefault(name, user_input)
+
+            if inputs:
+                current_content = "\n\n".join(f"The result of {name}:\n{inputs[name]['handoff']}" for name in inputs)
+            else:
+                current_content = (f"The user input is: {user_input}\n\n"
+                                   f"The task analysis is: {task}\n\n"
+                                   f"The Plan is: \n\n{json.dumps(work_plan)}\n\n"
+                                   f"Now, we need let the first agent to start the work. "
+                                   f"We must call the first function, and get the parameters from the information above.")
 
-        while current_point != "ErrorStop":
+            # Step 0: Get the agent object
+            execute_agent = self.agents[current_point]
 
+            # Step 1: Execute the agent, the LLM fills the parameters only if the known values can not. A step which
+            # the manager routes the work to would get the same values again, so only its instructions are new.
+            parameters = execute_agent.information["function"]["parameters"]
+            rerouted = any(name not in dependencies[current_point] for name in inputs)
+            format_current_content = None
+            if not rerouted or INSTRUCTIONS_PARAMETER in parameters.get("properties", {}):
+                format_current_content = map_parameters(parameters, values)
+            with self._stats_lock:
+                self.format_stats["llm" if format_current_content is None else "direct"] += 1
+            if format_current_content is None:
+                self.logger.info("-------------\nI am communicating with this agent and arranging tasks for him. "
+                                 "Please wait.\n-------------",
+                                 extra={'step': "Analysis the parameters", 'agent': "Manager-Assistant"})
+                with usage_scope(agent="InputFormatAssistant"):
+                    format_current_content = self.input_format_agent(input_content=current_content,
+                                                                     functions_list=[execute_agent.information],
+                                                                     messages=run.get_messages())
+            with usage_scope(agent=current_point):
+                output = response = execute_agent(**format_current_content)
+                if isinstance(output, dict):
+                    response = json.dumps(output, ensure_ascii=False)
+                current_response = self.stream_show(response if live else self.collect(response)) if show \
+                    else self.collect(response)
+                if not isinstance(output, dict):
+                    output = current_response
+            # Only the typed outputs are handed over, the inputs of this step are not the values of the next ones.
+            known.update(get_output_values(execute_agent.output_schema, output))
+
+            return current_response, known
+
+        def run_traced_step(current_point: str, inputs: dict) -> dict:
+            # The spans of the agents and the LLM requests of the step are the children of its span.
+            attributes = {"xyz.step.name": current_point, "xyz.step.sub_task": work_plan[current_point]["sub_task"],
+                          "xyz.run_id": run.run_id}
+            with start_span(f"step {current_point}", attributes=attributes):
+                return run_step(current_point, inputs)
+
+        def run_step(current_point: str, inputs: dict) -> dict:
             self.logger.info("-------------", extra={'step': f"In Company Progress: {work_plan[current_point]['sub_task']}",
                                                      'agent': f"Company Agent: {current_point}"})
-            # Step 0: Get the agent object
-            execute_agent = self.agents[current_point]
 
-            # Step 1: Execute the agent
-            self.logger.info("-------------\nI am communicating with this agent and arranging tasks for him. Please wait."
-                             "\n-------------", 
-                             extra={'step': "Analysis the parameters", 'agent': "Manager-Assistant"})
-            format_current_content = self.input_format_agent(input_content=current_content,
-                                                             functions_list=[execute_agent.information])
-            response = execute_agent(**format_current_content)
-            current_response = self.stream_show(response)
-
-            if work_plan[current_point]['position'] == "end":
-                working_history += current_point + ":" + current_response + "\n\n"
-                self.logger.info("The work plan is finished", extra={'step': "Finish",
-                                                                     'agent': "None"})
-                break
+            # The dependencies whose routes are decided hand over the next step of the manager too. For the others,
+            # this step is started speculatively, before the manager has routed the work to it.
+            routed = [name for name in inputs if "route" in inputs[name]]
+            decided = {name: inputs[name]["summary"].result() for name in routed if inputs[name]["route"].done()}
+            if is_missed(current_point, decided):
+                return discard(current_point, decided)
+            inputs = {name: dict(inputs[name], handoff=f"{inputs[name]['handoff']}\n{decided[name]['next_step']}",
+                                 next_step=decided[name]["next_step"])
+                      if name in decided else inputs[name] for name in inputs}
+            speculated = [name for name in routed if name not in decided]
+            started_at = time.perf_counter()
+            current_span().set_attribute("xyz.step.speculative", bool(speculated))
+            current_response, values = run_agent(current_point, inputs, show=not speculated)
+
+            if speculated:
+                finished_at = time.perf_counter()
+                routes = {name: inputs[name]["summary"].result() for name in speculated}
+                # The route is decided before this step is finished, so the executor follows it first.
+                for name in speculated:
+                    inputs[name]["route"].result()
+                hit = not is_missed(current_point, routes)
+                self.count_speculation(hit=hit, started_at=started_at, finished_at=finished_at,
+                                       summary_finished_at=max(route["finished_at"] for route in routes.values()))
+                current_span().set_attribute("xyz.step.speculation_hit", hit)
+                if not hit:
+                    return discard(current_point, routes)
+                self.stream_show(current_response)
+
+            if not work_plan[current_point].get('next'):
+                add_step_history(current_point, current_response)
+                return {"handoff": current_response, "values": values}
+
+            if self.speculative:
+                # Start the planned next steps now, and check the routing of the manager when they are finished.
+                future = summary_readers.submit(contextvars.copy_context().run, read_summary, current_point,
+                                                current_response)
+                summary_futures.append(future)
+                route = _then(future, lambda summary: decide_route(current_point, summary["next_employee"]))
+                return {"handoff": current_response, "values": values, "summary": future, "route": route}
 
             # Step 2: Manager do the small summary
             next_list_info = self.get_next_list_info(work_plan[current_point])
-            current_summary = self.manager.summary_step(working_history=working_history,
-                                                        current_response=current_response,
-                                                        next_list_info=next_list_info)
-
-            # Step 3: Log the information
-            self.logger.info("-------Step Summary------", extra={'step': f"Summarize this step",
-                                                                 'agent': f"Manager-Assistant"})
-            current_summary_content = self.stream_show(current_summary)
+            with usage_scope(agent="Manager-Assistant"):
+                current_summary = self.manager.summary_step(working_history=history.render(),
+                                                            current_response=current_response,
+                                                            next_list_info=next_list_info)
+
+            if self.manager.structured:
+                # Hand over as soon as the next step is written, the summary is read in the background.
+                parser, chunks, words = JSONStreamParser(strict=False), [], iter(current_summary)
+                for word in words:
+                    chunks.append(word)
+                    parser.feed(word)
+                    if "next_step" in parser.fields:
+                        break
+                # If the reply is not JSON, the whole reply is read, and the next step may be in the old format.
+                next_step = (parser.fields.get("next_step")
+                             or self.get_special_part(pattern="next-step", content="".join(chunks)))
+                next_employee = (str(parser.fields.get("next_employee") or "")
+                                 or self.read_route("".join(chunks))["next_employee"])
+                summary_futures.append(summary_readers.submit(contextvars.copy_context().run, finish_summary,
+                                                              current_point, words, parser, chunks))
+
+                return {"handoff": f"{current_response}\n{next_step}", "values": values, "next_step": next_step,
+                        "next_employee": next_employee}
+
+            with usage_scope(agent="Manager-Assistant"):
+                # Step 3: Log the information
+                self.logger.info("-------Step Summary------", extra={'step': f"Summarize this step",
+                                                                     'agent': f"Manager-Assistant"})
+                current_summary_content = self.stream_show(current_summary if live else self.collect(current_summary))
 
             # Step 4: Update the working history
-            working_history += current_point + ":" + current_summary_content + "\n\n"
-            self.input_format_agent.add_history([{"role": "assistant", "content": current_summary_content}])
-
-            # Step 5: Update the current point
-            next_name = self.get_special_part(pattern="next-employee", content=current_summary_content)
-            name = json.loads(next_name)
-            next_name = name['name']
-            if next_name in work_plan:
-                current_point = next_name
-                current_content = current_response + self.get_special_part(pattern="next-step",
-                                                                           content=current_summary_content)
-            else:
-                current_point = "ErrorStop"
-                self.logger.info("This task is terminate with some error.", extra={'step': "Terminate",
-                                                                                   'agent': "AutoSystem"})
+            add_step_history(current_point, current_summary_content, message=True)
+
+            # Step 5: Hand over the result, the next step and the known values to the step which the manager names
+            next_step = self.get_special_part(pattern="next-step", content=current_summary_content)
+            return {"handoff": current_response + next_step, "values": values, "next_step": next_step,
+                    "next_employee": self.read_route(current_summary_content)["next_employee"]}
+
+        try:
+            DAGExecutor(self.max_concurrency).run(dependencies, run_traced_step, on_node_done=save_step,
+                                                  completed=completed, route=route_step)
+            for future in summary_futures:
+                future.result()
+        finally:
+            summary_readers.shutdown(wait=True)
+        if self.speculative:
+            stats = self.speculation_stats
+            self.logger.info(f"{stats['hits']}/{stats['speculations']} speculative steps are kept, "
+                             f"{stats['saved_seconds']:.1f}s saved, {stats['wasted_seconds']:.1f}s wasted",
+                             extra={'step': "Speculation", 'agent': "Netmind_AI_XYZ"})
+        self.logger.info("The work plan is finished", extra={'step': "Finish",
+                                                             'agent': "None"})
+
+        return history
+
+    def write_profile(self, run: RunContext) -> str:
+        """
+        Write the folded stacks of a profiled run to `{profile_dir}/{run_id}.folded`, and log its slowest parts.
 
-        return working_history
+        Returns
+        -------
+        str
+            The path of the file.
+        """
 
-    def read_work_plan(self, work_plan_str: str):
+        path = os.path.join(self.profile_dir, f"{run.run_id}.folded")
+        run.profile.write_folded(path)
+        self.logger.info(f"The profile is written to {path}\n{run.profile.report()}",
+                         extra={'step': "Profile", 'agent': "Netmind_AI_XYZ"})
+
+        return path
+
+    def close(self) -> None:
+        """
+        Write the logs which are left and close the log files of the company.
+        """
+
+        self.logger.close()
+
+    @profiled
+    def read_work_plan(self, work_plan_str: str | dict | list):
         """
         Read the work plan from the string. And return the work plan as a dict.
 
+        The string is the `|||working-plan` format, or a JSON object with the "work_plan" (the structured mode). The
+        parsed JSON object or list is accepted too.
+
+        A step can declare the steps which it needs by `"depends_on": [names]`. If no step declares it, the steps
+        are a chain in the order of the list. The "next" of a step is the list of the steps which depend on it.
+
         Parameters
         ----------
-        work_plan_str: str
+        work_plan_str: str or dict or list
             The work plan string.
 
         Returns
         -------
         working_graph: dict
             The work plan dict by using the json.
+
+        Raises
+        ------
+        ValueError
+            If there is no work plan in the string, a step name is duplicated or unknown, or the plan is not a DAG.
         """
 
-        matches = self.get_special_part("working-plan", work_plan_str)
+        if isinstance(work_plan_str, str):
+            matches = self.get_special_part("working-plan", work_plan_str) or work_plan_str
+            try:
+                agents = json.loads(re.sub(r'(?<!\\)\\(?!\\)', '\\\\\\\\', matches))
+            except json.JSONDecodeError:
+                agents = parse_json(matches)
+        else:
+            agents = work_plan_str
+        if isinstance(agents, dict):
+            agents = agents.get("work_plan")
+        if not isinstance(agents, list) or not all(isinstance(agent, dict) and "name" in agent for agent in agents):
+            raise ValueError(f"No work plan is found in the reply of the manager: {str(work_plan_str)[:200]!r}")
+        names = [agent["name"] for agent in agents]
+        duplicated = sorted({name for name in names if names.count(name) > 1})
+        if duplicated:
+            raise ValueError(f"The work plan has the duplicate steps {duplicated}.")
         working_graph = {}
 
-        matches = re.sub(r'(?<!\\)\\(?!\\)', '\\\\\\\\', matches)
-        agents = json.loads(matches)
-
+        declared = any("depends_on" in agent for agent in agents)
         for i, agent in enumerate(agents):
-            if i == 0:
+            if declared:
+                agent["depends_on"] = [name for name in agent.get("depends_on") or [] if name != agent["name"]]
+            else:
+                agent["depends_on"] = [agents[i - 1]["name"]] if i != 0 else []
+            working_graph[agent["name"]] = agent
+
+        for agent in agents:
+            agent["next"] = [other["name"] for other in agents if agent["name"] in other["depends_on"]]
+            if not agent["depends_on"]:
                 agent["position"] = "start"
-            elif i == len(agents) - 1:
+            elif not agent["next"]:
                 agent["position"] = "end"
             else:
                 agent["position"] = "in-progress"
 
-            working_graph[agent["name"]] = agent
-
-            if i != 0:
-                working_graph[agents[i - 1]["name"]]["next"] = [agent["name"]]
+        # Check the plan now, so a bad plan fails before any work is done.
+        self.check_work_plan(working_graph)
 
         return working_graph
 
+    def check_work_plan(self, work_plan: dict) -> dict:
+        """
+        Check that the work plan is a DAG of the agents of the company.
+
+        Parameters
+        ----------
+        work_plan: dict
+            The work plan.
+
+        Returns
+        -------
+        dict
+            {step name: [the steps which it depends on]}.
+
+        Raises
+        ------
+        ValueError
+            If a step is not an agent of the company, or the plan is not a DAG.
+        """
+
+        unknown = [name for name in work_plan if name not in self.agents]
+        if unknown:
+            raise ValueError(f"The steps {unknown} of the work plan are not the agents of the company.")
+        dependencies = self.get_dependencies(work_plan)
+        topological_order(dependencies)
+
+        return dependencies
+
+    def count_speculation(self, hit: bool, started_at: float, finished_at: float, summary_finished_at: float) -> None:
+        """
+        Count a speculative step. If it is kept, it saves the time in which it runs at the same time as the summary
+        which it would wait for. Otherwise, all its time is wasted.
+
+        Parameters
+        ----------
+        hit: bool
+            Whether the speculative result is kept.
+        started_at: float
+            When the step starts (`time.perf_counter()`).
+        finished_at: float
+            When the agent of the step is finished.
+        summary_finished_at: float
+            When the last summary of its dependencies is finished.
+        """
+
+        with self._stats_lock:
+            stats = self.speculation_stats
+            stats["speculations"] += 1
+            if hit:
+                stats["hits"] += 1
+                stats["saved_seconds"] += max(0., min(finished_at, summary_finished_at) - started_at)
+            else:
+                stats["misses"] += 1
+                stats["wasted_seconds"] += finished_at - started_at
+            stats["hit_rate"] = stats["hits"] / stats["speculations"]
+
+    @staticmethod
+    @profiled
+    def read_route(summary: str, structured: bool = False) -> dict:
+        """
+        Read the routing of the manager from a step summary.
+
+        Parameters
+        ----------
+        summary: str
+            The step summary, a JSON object in the structured mode, or the text with `|||next-employee` and
+            `|||next-step`.
+        structured: bool
+            Whether it is a summary of the structured mode.
+
+        Returns
+        -------
+        dict
+            {"next_employee": str, "next_step": str, "summary": str}. The next employee is "" if the manager does not
+            name one. If the summary of the structured mode is not a JSON object with these fields, it is read as the
+            text, and the summary is the whole text.
+        """
+
+        fields = None
+        if structured:
+            try:
+                fields = parse_json(summary)
+            except ValueError:
+                pass
+        if isinstance(fields, dict) and any(key in fields for key in ("next_employee", "next_step", "summary")):
+            return {"next_employee": str(fields.get("next_employee") or ""),
+                    "next_step": str(fields.get("next_step") or ""), "summary": str(fields.get("summary") or "")}
+
+        next_employee = AutoCompany.get_special_part(pattern="next-employee", content=summary)
+        try:
+            next_employee = parse_json(next_employee).get("name", "")
+        except (ValueError, AttributeError):
+            pass
+
+        return {"next_employee": str(next_employee or ""),
+                "next_step": AutoCompany.get_special_part(pattern="next-step", content=summary), "summary": summary}
+
+    @staticmethod
+    def get_dependencies(work_plan: dict) -> dict:
+        """
+        Get the dependencies of the steps. The plans of the old format (only "next") are supported too.
+
+        Parameters
+        ----------
+        work_plan: dict
+            The work plan.
+
+        Returns
+        -------
+        dict
+            {step name: [the steps which it depends on]}.
+
+        Raises
+        ------
+        ValueError
+            If a step depends on (or is followed by) a step which is not in the plan.
+        """
+
+        dependencies = {name: [] for name in work_plan}
+        for name, step in work_plan.items():
+            related = step["depends_on"] if "depends_on" in step else step.get("next") or []
+            unknown = [other for other in related if other not in work_plan]
+            if unknown:
+                raise ValueError(f"The step {name} refers to the unknown steps {unknown} of the work plan.")
+            if "depends_on" in step:
+                dependencies[name] = list(step["depends_on"])
+            else:
+                for child in step.get("next") or []:
+                    if name not in dependencies[child]:
+                        dependencies[child].append(name)
+
+        return dependencies
+
     def add_agent(self, agents: list) -> None:
         """
         Add the agents to the company. And you can use the agents to execute the work plan.
@@ -316,6 +1021,7 @@ class AutoCompany(Agent):
         return next_info
 
     @staticmethod
+    @profiled
     def get_special_part(pattern: str, content: str) -> str:
         """
         Get the special part from the content by using the pattern. The special part must be in the `|||{pattern}`.
@@ -333,10 +1039,8 @@ class AutoCompany(Agent):
             The special part which you have extracted from the content.
         """
 
-        pattern = "\|\|\|" + pattern
         # 使用正则表达式提取`special_char special_char`之间的内容
-        pattern = pattern + '(.*?)' + pattern
-        match = re.search(pattern, content, re.DOTALL)
+        match = _get_special_regex(pattern).search(content)
 
         if match:
             # 使用group(1)获取第一个括号内匹配的内容，并使用strip()去除前后的空白字符
@@ -347,102 +1051,105 @@ class AutoCompany(Agent):
         return result
 
     @staticmethod
-    def create_logger(logger_path=None):
+    def create_logger(logger_path=None, run_log_path=None):
         """
         Create the logger for the company. And you can use the logger to log the information in the console and the file
         In fact, this is the user's command line UI.
 
+        The records are written by a background thread (see `AsyncLogSink`), and the run log has one JSON object per
+        line with the run id, the step, the agent and the message (the streamed words of a step are one line).
+
         Parameters
         ----------
         logger_path: str
             The path of the logger file. If you don't provide the path, the logger will be saved in the logs folder.
+        run_log_path: str
+            The path of the JSON-lines run log. By default, the path of the logger file with the ".jsonl" suffix.
 
         Returns
         -------
-        logger: logging.Logger
+        logger: CompanyLogger
             The logger which you can use to log the information in the console and the file.
         """
 
-        class ColoredFormatter(logging.Formatter):
-            RED = '\033[31m'
-            CYAN = '\033[36m'
-            GREEN = '\033[32m'
-            RESET = '\033[0m'
-
-            def format(self, record):
-                record.step = self.RED + str(record.step) + self.RESET
-                record.agent = self.CYAN + str(record.agent) + self.RESET
-                record.msg = self.GREEN + str(record.msg) + self.RESET
-                return super().format(record)
-
         if logger_path is None:
             current_time = time.strftime("%Y-%m-%d_%H-%M-%S")
             os.makedirs("logs", exist_ok=True)
             local_path = f"logs/tmp_log_{current_time}.log"
         else:
             local_path = logger_path
-            logger_path = None
-
-        PROCESS_LEVEL_NUM = 25
-        logging.addLevelName(PROCESS_LEVEL_NUM, "PROCESS")
-
-        def process(self, message, *args, **kws):
-            if self.isEnabledFor(PROCESS_LEVEL_NUM):
-                self._log(PROCESS_LEVEL_NUM, message, args, **kws)
-
-        logging.Logger.process = process
-
-        class StreamHandlerNoNewline(logging.StreamHandler):
-            def emit(self, record):
-                if record.levelno == PROCESS_LEVEL_NUM:
-                    msg = record.getMessage()
-                else:
-                    try:
-                        msg = self.format(record)
-                        msg += "\n"
-                    except:
-                        msg = record.getMessage()
-                        msg += "\n"
-                if self.stream is None:
-                    self.stream = self._open()
-                self.stream.write(msg)
-                self.stream.flush()
-
-        class FileHandlerNoNewline(logging.FileHandler):
-            def emit(self, record):
-                if record.levelno == PROCESS_LEVEL_NUM:
-                    msg = record.getMessage()
-                else:
-                    try:
-                        msg = self.format(record)
-                        msg += "\n"
-                    except:
-                        msg = record.getMessage()
-                        msg += "\n"
-                if self.stream is None:
-                    self.stream = self._open()
-                self.stream.write(msg)
-                self.stream.flush()
-
-        # logger = logging.getLogger()
-        logger = logging.getLogger("Assistant")
+
+        # The logger of each company is not registered in the global `logging` tree, so it only has its own handlers,
+        # and it is garbage collected with the company.
+        logger = CompanyLogger("Assistant")
         logger.setLevel(logging.INFO)
 
-        file_handler = FileHandlerNoNewline(local_path)
+        file_handler = _FileHandlerNoNewline(local_path)
         file_handler.setLevel(logging.INFO)
-        console_handler = StreamHandlerNoNewline()
+        console_handler = _StreamHandlerNoNewline()
         console_handler.setLevel(logging.INFO)
 
-        formatter_console = ColoredFormatter('Step: %(step)s - Agent: %(agent)s - %(message)s')
+        formatter_console = _ColoredFormatter('Step: %(step)s - Agent: %(agent)s - %(message)s')
         formatter_file = logging.Formatter('Step: %(step)s - Agent: %(agent)s - %(message)s')
         console_handler.setFormatter(formatter_console)
         file_handler.setFormatter(formatter_file)
 
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        if run_log_path is None:
+            run_log_path = os.path.splitext(local_path)[0] + ".jsonl"
+        run_log_handler = JSONLinesHandler(run_log_path, merge_levels=(PROCESS_LEVEL_NUM,))
+        run_log_handler.setLevel(logging.INFO)
+
+        logger.sink = AsyncLogSink([file_handler, console_handler, run_log_handler])
+        logger.addHandler(logger.sink.handler)
 
         return logger
 
+    @staticmethod
+    def stream_json(response, parser: JSONStreamParser, show: tuple = (), chunks: list = None) -> Generator:
+        """
+        Feed a JSON reply (a generator in the stream mode) to the parser, and yield the text of the fields to show
+        while they are streamed. If the reply turns out not to be JSON, the rest of it is yielded as it is.
+        """
+
+        for word in ([response] if isinstance(response, str) else response):
+            if chunks is not None:
+                chunks.append(word)
+            events = parser.feed(word)
+            if parser.error is not None:
+                yield word
+            for kind, key, text in events:
+                if kind == "delta" and key in show:
+                    yield text
+
+    @staticmethod
+    def read_json_fields(parser: JSONStreamParser, text: str, keys: tuple = ("summary", "next_step")) -> dict | None:
+        """
+        Get the fields of a JSON reply which is fed to the parser. If the parser could not read it, the whole text is
+        parsed leniently. None if it is not a JSON object with one of the `keys`, then the reply is read by the
+        `|||pattern` parts of the old format.
+        """
+
+        if parser.done:
+            fields = parser.fields
+        else:
+            try:
+                fields = parse_json(text)
+            except ValueError:
+                return None
+
+        return fields if isinstance(fields, dict) and any(key in fields for key in keys) else None
+
+    @staticmethod
+    def collect(response) -> str:
+        """
+        Consume the response (a generator in the stream mode) without showing it.
+        """
+
+        if inspect.isgenerator(response):
+            return "".join(response)
+
+        return response
+
     def stream_show(self, response):
 
         full_content = ""
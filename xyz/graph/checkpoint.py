@@ -0,0 +1,201 @@
+"""
+==========
+Checkpoint
+==========
+@file_name: checkpoint.py
+@author: Bin Liang
+@date: 2024-05-25
+The append-only checkpoints of the AutoCompany runs, so a run which crashes can be resumed without paying again for
+the finished LLM calls.
+"""
+
+__all__ = ["CheckpointStore", "FileCheckpointStore", "SQLiteCheckpointStore", "RunCheckpoint"]
+
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from typing import List
+
+_RUN_ID = re.compile(r"[\w.-]+")
+
+
+class CheckpointStore:
+    """
+    The basic class of the checkpoint stores. A store keeps an append-only list of records (JSON objects) for each run.
+    """
+
+    def append(self, run_id: str, record: dict) -> None:
+        raise NotImplementedError
+
+    def load(self, run_id: str) -> List[dict]:
+        raise NotImplementedError
+
+    def run_ids(self) -> List[str]:
+        raise NotImplementedError
+
+
+class FileCheckpointStore(CheckpointStore):
+    """
+    One JSON-lines file for each run. Every record is flushed and synced to the disk before `append` returns. A last
+    line which is cut by a crash is ignored.
+    """
+
+    def __init__(self, directory: str = "checkpoints") -> None:
+        """
+        Parameters
+        ----------
+        directory: str
+            The directory of the files.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def append(self, run_id: str, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock, open(self._get_path(run_id), "a", encoding="utf-8") as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def load(self, run_id: str) -> List[dict]:
+        path = self._get_path(run_id)
+        if not os.path.exists(path):
+            return []
+
+        records = []
+        with self._lock, open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+
+        return records
+
+    def run_ids(self) -> List[str]:
+        return sorted(name[:-len(".jsonl")] for name in os.listdir(self.directory) if name.endswith(".jsonl"))
+
+    def _get_path(self, run_id: str) -> str:
+        assert _RUN_ID.fullmatch(run_id), f"The run id {run_id!r} can only have letters, digits, '_', '.' and '-'."
+
+        return os.path.join(self.directory, run_id + ".jsonl")
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """
+    All the runs in one SQLite database, which can be shared by the processes.
+    """
+
+    def __init__(self, path: str = "checkpoints/checkpoints.sqlite") -> None:
+        """
+        Parameters
+        ----------
+        path: str
+            The path of the SQLite database file.
+        """
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS checkpoints (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                 "run_id TEXT NOT NULL, record TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS checkpoints_run_id ON checkpoints (run_id, seq)")
+
+    def append(self, run_id: str, record: dict) -> None:
+        with self._lock:
+            self._connection.execute("INSERT INTO checkpoints (run_id, record, created_at) VALUES (?, ?, ?)",
+                                     (run_id, json.dumps(record, ensure_ascii=False, default=str), time.time()))
+
+    def load(self, run_id: str) -> List[dict]:
+        with self._lock:
+            rows = self._connection.execute("SELECT record FROM checkpoints WHERE run_id = ? ORDER BY seq",
+                                            (run_id,)).fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+    def run_ids(self) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute("SELECT DISTINCT run_id FROM checkpoints ORDER BY run_id").fetchall()
+
+        return [row[0] for row in rows]
+
+
+class RunCheckpoint:
+    """
+    The checkpoint of one run of the AutoCompany. The records are:
+
+    1. "start": the user input and the given work plan.
+    2. "plan": the task analysis and the work plan.
+    3. "step": the output of a finished step, which is handed over to the downstream steps.
+    4. "history": the working history of a step (and whether it is a message of the InputFormatAssistant).
+    5. "finish": the result of the run.
+    """
+
+    def __init__(self, store: CheckpointStore, run_id: str) -> None:
+        """
+        Parameters
+        ----------
+        store: CheckpointStore
+            The store of the records.
+        run_id: str
+            The id of the run.
+        """
+
+        self.store = store
+        self.run_id = run_id
+
+    def save(self, kind: str, **data) -> None:
+        """
+        Append a record of the run.
+        """
+
+        self.store.append(self.run_id, dict(data, kind=kind, saved_at=time.time()))
+
+    def load_state(self) -> dict:
+        """
+        Read the state of the run from its records.
+
+        Returns
+        -------
+        dict
+            "user_input", "work_plan", "task_analysis" (if planned), "steps" ({name: output}), "history"
+            ({name: content}), "messages" (of the InputFormatAssistant) and "result" (if finished).
+
+        Raises
+        ------
+        ValueError
+            If the run has no records.
+        """
+
+        records = self.store.load(self.run_id)
+        if not records or records[0]["kind"] != "start":
+            raise ValueError(f"No checkpoint is found for the run {self.run_id!r}.")
+
+        state = {"user_input": records[0]["user_input"], "work_plan": records[0]["work_plan"], "steps": {},
+                 "history": {}, "messages": []}
+        for record in records[1:]:
+            if record["kind"] == "plan":
+                state["task_analysis"] = record["task_analysis"]
+                state["work_plan"] = record["work_plan"]
+            elif record["kind"] == "step":
+                state["steps"][record["name"]] = record["output"]
+            elif record["kind"] == "history":
+                state["history"][record["name"]] = record["content"]
+                if record["message"]:
+                    state["messages"].append({"role": "assistant", "content": record["content"]})
+            elif record["kind"] == "finish":
+                state["result"] = record["result"]
+
+        return state
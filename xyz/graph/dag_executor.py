@@ -0,0 +1,318 @@
+"""
+===========
+DAGExecutor
+===========
+@file_name: dag_executor.py
+@author: Bin Liang
+@date: 2024-05-20
+The scheduler which runs the steps of a work plan as a DAG: the ready steps run concurrently, and the outputs of the
+dependencies are joined into the input of the downstream step.
+"""
+
+__all__ = ["DAGExecutor", "topological_order"]
+
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List
+
+
+def topological_order(dependencies: Dict[str, List[str]]) -> List[str]:
+    """
+    Sort the nodes so every node comes after its dependencies. The ties keep the order of the dict.
+
+    Parameters
+    ----------
+    dependencies: dict
+        {node: [the nodes which it depends on]}.
+
+    Returns
+    -------
+    list
+        The nodes in a topological order.
+
+    Raises
+    ------
+    ValueError
+        If a dependency is unknown, or the graph has a cycle.
+    """
+
+    for node, parents in dependencies.items():
+        unknown = [parent for parent in parents if parent not in dependencies]
+        if unknown:
+            raise ValueError(f"The step {node} depends on the unknown steps {unknown}.")
+
+    order = []
+    remaining = {node: set(parents) for node, parents in dependencies.items()}
+    while remaining:
+        ready = [node for node, parents in remaining.items() if not parents]
+        if not ready:
+            raise ValueError(f"The work plan has a cycle among the steps {sorted(remaining)}.")
+        for node in ready:
+            order.append(node)
+            del remaining[node]
+        for parents in remaining.values():
+            parents.difference_update(ready)
+
+    return order
+
+
+class _Schedule:
+    """
+    The state of one run of a DAGExecutor: which nodes are finished, waiting or skipped, and the routing of the work.
+    """
+
+    def __init__(self, dependencies: Dict[str, List[str]], completed: Dict[str, Any] = None) -> None:
+        self.dependencies = dependencies
+        self.order = topological_order(dependencies)
+        self.index = {node: i for i, node in enumerate(self.order)}
+        self.children = {node: [child for child in self.order if node in dependencies[child]] for node in self.order}
+        self.outputs = {node: output for node, output in (completed or {}).items() if node in dependencies}
+        self.waiting = [node for node in self.order if node not in self.outputs]
+        self.skipped = set()
+        self.running = set()
+        # The inputs of the nodes which the work is routed to, instead of the outputs of their dependencies.
+        self.routed_inputs = {}
+        # The results of a run of a node which is started before the node is reset are discarded.
+        self.generations = {node: 0 for node in self.order}
+        # {future: (node, generation)} of the routes which are decided later, the downstream nodes start before them.
+        self.pending_routes = {}
+        self.stopped = False
+
+    def take_ready(self, limit: int) -> List[tuple]:
+        """
+        Take the nodes which can start, at most `limit`. A node can start when each of its dependencies is finished
+        or skipped, and it is skipped if all of them are skipped.
+
+        Returns
+        -------
+        list
+            [(node, {dependency: output}, generation)].
+        """
+
+        ready = []
+        for node in list(self.waiting):
+            if self.stopped or len(ready) >= limit:
+                break
+            if node in self.running:
+                continue
+            parents = self.dependencies[node]
+            if node in self.routed_inputs:
+                inputs = self.routed_inputs.pop(node)
+            elif all(parent in self.outputs or parent in self.skipped for parent in parents):
+                if parents and all(parent in self.skipped for parent in parents):
+                    self.waiting.remove(node)
+                    self.skipped.add(node)
+                    continue
+                inputs = {parent: self.outputs[parent] for parent in parents if parent in self.outputs}
+            else:
+                continue
+            self.waiting.remove(node)
+            self.running.add(node)
+            ready.append((node, inputs, self.generations[node]))
+
+        return ready
+
+    def finish(self, node: str, generation: int, output: Any, on_node_done: Callable = None,
+               route: Callable = None) -> None:
+        """
+        Keep the output of a node, unless the node is reset while it runs, and follow the routing of the work.
+        """
+
+        self.running.discard(node)
+        if generation != self.generations[node] or node in self.skipped:
+            return
+        self.outputs[node] = output
+        if on_node_done is not None:
+            on_node_done(node, output)
+        targets = route(node, output) if route is not None else None
+        if isinstance(targets, Future):
+            self.pending_routes[targets] = (node, generation)
+        elif targets is not None:
+            self.reroute(node, list(targets))
+
+    def follow_routes(self) -> None:
+        """
+        Follow the routes which are decided, before the outputs of the nodes which started before them are kept.
+        """
+
+        for future in [future for future in self.pending_routes if future.done()]:
+            node, generation = self.pending_routes.pop(future)
+            targets = future.result()
+            # The route of a run of the node which is reset (or skipped) since then is not followed.
+            if targets is not None and generation == self.generations[node] and node in self.outputs:
+                self.reroute(node, list(targets))
+
+    def reroute(self, node: str, targets: List[str]) -> None:
+        """
+        Route the work of a finished node to the targets instead of its planned downstream nodes, or stop the run if
+        there is no target.
+        """
+
+        unknown = [target for target in targets if target not in self.dependencies]
+        if unknown:
+            raise ValueError(f"The work of {node} is routed to the unknown steps {unknown}.")
+
+        output = self.outputs[node]
+        rerun = set()
+        for target in targets:
+            rerun.update(self.descendants(target), [target])
+        for child in self.children[node]:
+            if child not in rerun:
+                self.reset(self.descendants(child))
+                self.waiting = [other for other in self.waiting if other != child]
+                self.skipped.add(child)
+                self.generations[child] += 1
+                self.outputs.pop(child, None)
+        self.reset(rerun)
+        for target in targets:
+            self.routed_inputs[target] = {node: output}
+        if not targets:
+            self.stopped = True
+
+    def reset(self, nodes: set) -> None:
+        """
+        Make the nodes wait to run again, the results of their runs which are not finished are discarded.
+        """
+
+        for node in nodes:
+            self.outputs.pop(node, None)
+            self.skipped.discard(node)
+            self.routed_inputs.pop(node, None)
+            self.generations[node] += 1
+            if node not in self.waiting:
+                self.waiting.append(node)
+        self.waiting.sort(key=self.index.get)
+
+    def descendants(self, node: str) -> set:
+        found, stack = set(), list(self.children[node])
+        while stack:
+            child = stack.pop()
+            if child not in found:
+                found.add(child)
+                stack.extend(self.children[child])
+
+        return found
+
+
+class DAGExecutor:
+    """
+    Run a DAG of steps with bounded concurrency. A step starts as soon as all its dependencies are finished, and it
+    gets their outputs. If a step fails, the steps which have not started are cancelled and the error is raised.
+    The work of a finished step can be routed to other steps than the planned ones, see `run`.
+
+    Examples
+    --------
+    >>> executor = DAGExecutor(max_concurrency=4)
+    >>> outputs = executor.run({"plan": [], "solve": ["plan"], "code": ["plan"], "summary": ["solve", "code"]},
+    >>>                        lambda node, inputs: f"{node} done with {sorted(inputs)}")
+    >>> outputs["summary"]
+    "summary done with ['code', 'solve']"
+    """
+
+    def __init__(self, max_concurrency: int = 4) -> None:
+        """
+        Parameters
+        ----------
+        max_concurrency: int
+            The max number of the steps which run at the same time.
+        """
+
+        assert max_concurrency >= 1, "The max_concurrency must be at least 1."
+
+        self.max_concurrency = max_concurrency
+
+    def run(self, dependencies: Dict[str, List[str]], run_node: Callable[[str, Dict[str, Any]], Any],
+            on_node_done: Callable[[str, Any], None] = None, completed: Dict[str, Any] = None,
+            route: Callable[[str, Any], List[str] | None] = None) -> Dict[str, Any]:
+        """
+        Run all the steps.
+
+        Parameters
+        ----------
+        dependencies: dict
+            {node: [the nodes which it depends on]}.
+        run_node: Callable
+            Called with (node, {dependency: output}) in a worker thread, and returns the output of the node. The worker
+            runs in a copy of the caller's context (i.e. the usage scope).
+        on_node_done: Callable, optional
+            Called with (node, output) in the caller's thread when a node is finished.
+        completed: dict, optional
+            {node: output} of the nodes which are already finished (i.e. restored from a checkpoint). They are not run
+            again, and their outputs are given to the downstream nodes.
+        route: Callable, optional
+            Called with (node, output) in the caller's thread after `on_node_done`. If it returns None, the planned
+            downstream nodes go on. If it returns a list of nodes, the work is routed to them instead: they run (again,
+            if they are finished) with the output of this node as their only input, and the nodes which depend on them
+            run again after them. The planned downstream nodes which are not routed to are skipped, and so are the
+            nodes whose dependencies are all skipped. An empty list stops the run: no node starts any more.
+            It can return a Future of the route too: the planned downstream nodes start at once (speculatively), and
+            the route is followed when it is decided. The results of the downstream nodes which it does not keep are
+            discarded, even if they are finished. A node which waits for the route in `run_node` is kept or discarded
+            by it, never before it.
+
+        Returns
+        -------
+        dict
+            {node: output} of the nodes which are finished and not skipped, the completed nodes first, then in the
+            order of completion.
+
+        Raises
+        ------
+        ValueError
+            If the graph is not a DAG, or the work is routed to an unknown node.
+        """
+
+        schedule = _Schedule(dependencies, completed)
+        if self.max_concurrency == 1:
+            # One node at a time, in the caller's thread.
+            while True:
+                schedule.follow_routes()
+                ready = schedule.take_ready(1)
+                if ready:
+                    node, inputs, generation = ready[0]
+                    output = run_node(node, inputs)
+                    schedule.follow_routes()
+                    schedule.finish(node, generation, output, on_node_done, route)
+                elif schedule.pending_routes:
+                    wait(schedule.pending_routes, return_when=FIRST_COMPLETED)
+                else:
+                    return schedule.outputs
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            running = {}
+
+            def submit_ready():
+                for node, inputs, generation in schedule.take_ready(self.max_concurrency - len(running)):
+                    future = executor.submit(contextvars.copy_context().run, run_node, node, inputs)
+                    running[future] = (node, generation)
+
+            submit_ready()
+            try:
+                while running or schedule.pending_routes:
+                    done, _ = wait([*running, *schedule.pending_routes], return_when=FIRST_COMPLETED)
+                    schedule.follow_routes()
+                    for future in done:
+                        if future in running:
+                            node, generation = running.pop(future)
+                            schedule.finish(node, generation, future.result(), on_node_done, route)
+                    submit_ready()
+            finally:
+                for future in running:
+                    future.cancel()
+
+        return schedule.outputs
+
+    @staticmethod
+    def max_width(dependencies: Dict[str, List[str]]) -> int:
+        """
+        The max number of the steps which can run at the same time, by the levels of the DAG.
+        """
+
+        levels = {}
+        for node in topological_order(dependencies):
+            levels[node] = 1 + max((levels[parent] for parent in dependencies[node]), default=0)
+        widths = {}
+        for level in levels.values():
+            widths[level] = widths.get(level, 0) + 1
+
+        return max(widths.values(), default=0)
@@ -0,0 +1,200 @@
+"""
+=========
+PlanCache
+=========
+@file_name: plan_cache.py
+@author: Bin Liang
+@date: 2024-05-21
+The cache of the task analyses and the work plans of the AutoCompany, for the recurring kinds of tasks.
+"""
+
+__all__ = ["PlanCache", "normalize_task", "get_roster_key"]
+
+import re
+import json
+import time
+import hashlib
+import threading
+
+from xyz.utils.llm.cache import CacheBackend, MemoryBackend
+from xyz.utils.llm.semantic_cache import SemanticCache
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_task(task: str) -> str:
+    """
+    The signature of the shape of a task: the case, the numbers and the spaces are ignored. So "Solve 3x + 5 = 11" and
+    "solve 4x + 2 = 10" have the same signature.
+    """
+
+    task = _NUMBER.sub("<num>", task.lower())
+
+    return _SPACES.sub(" ", task).strip()
+
+
+def get_roster_key(agents: dict) -> str:
+    """
+    The hash of the agents of a company (names and descriptions). A plan is only valid for the same roster.
+    """
+
+    roster = sorted((name, agent.information["function"]["description"]) for name, agent in agents.items())
+
+    return hashlib.sha256(json.dumps(roster, ensure_ascii=False).encode()).hexdigest()
+
+
+class PlanCache:
+    """
+    Reuse the task analysis and the work plan of a task which was planned before, so the two manager calls of the
+    planning phase are skipped.
+
+    1. The exact tier: the key is the roster and the normalized task (see `normalize_task`).
+    2. The semantic tier (optional): a `SemanticCache` finds the most similar planned task of the same roster. Its
+       `max_distance` is the confidence threshold of a hit.
+    3. An entry is planned again after `revalidate_every` hits, or `revalidate_after` seconds, so a stale plan does not
+       live forever.
+
+    Examples
+    --------
+    >>> from xyz.graph.plan_cache import PlanCache
+    >>> plan_cache = PlanCache(semantic_cache=SemanticCache(OpenAIEmbedder(llm_client), max_distance=0.08))
+    >>> company = AutoCompany(llm_client=llm_client, plan_cache=plan_cache)
+    >>> company(user_input="Find the sum. \\( \\sum_{n=1}^{10} 4n - 5 \\)")  # Planned by the manager.
+    >>> company(user_input="Find the sum. \\( \\sum_{n=1}^{20} 3n - 7 \\)")  # The plan is reused.
+    >>> plan_cache.stats()
+    {'hits': 1, 'exact_hits': 1, 'semantic_hits': 0, 'misses': 1, 'revalidations': 0, 'sets': 1}
+    """
+
+    def __init__(self, backend: CacheBackend = None, semantic_cache: SemanticCache = None,
+                 revalidate_every: int = 50, revalidate_after: float = None) -> None:
+        """
+        Parameters
+        ----------
+        backend: CacheBackend, optional
+            The storage of the plans, i.e. a `SQLiteBackend` to share the plans between the processes. By default,
+            a `MemoryBackend()`.
+        semantic_cache: SemanticCache, optional
+            The semantic tier. By default, only the tasks of the same signature can hit.
+        revalidate_every: int, optional
+            After this many hits, the entry misses once and the task is planned again. None means never.
+        revalidate_after: float, optional
+            After this many seconds since the entry was planned, the task is planned again. None means never.
+        """
+
+        self.backend = MemoryBackend() if backend is None else backend
+        self.semantic_cache = semantic_cache
+        self.revalidate_every = revalidate_every
+        self.revalidate_after = revalidate_after
+
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0, "revalidations": 0, "sets": 0}
+
+    def lookup(self, task: str, agents: dict) -> tuple | None:
+        """
+        Look up the plan of the task.
+
+        Parameters
+        ----------
+        task: str
+            The user input.
+        agents: dict
+            The agents of the company, {name: agent}.
+
+        Returns
+        -------
+        tuple or None
+            (task analysis, work plan), or None if it is a miss or the entry must be revalidated.
+        """
+
+        roster_key = get_roster_key(agents)
+        signature = normalize_task(task)
+        key = self._make_key(roster_key, signature)
+
+        entry, tier = self._get(key), "exact_hits"
+        if entry is None and self.semantic_cache is not None:
+            similar_key, _ = self.semantic_cache.lookup(roster_key, signature)
+            entry, tier = (self._get(similar_key), "semantic_hits") if similar_key is not None else (None, tier)
+
+        if entry is None or any(name not in agents for name in entry["work_plan"]):
+            self._count("misses")
+            return None
+
+        if self._is_stale(entry):
+            self._count("revalidations")
+            return None
+
+        entry["hits"] += 1
+        self.backend.set(entry["key"], json.dumps(entry, ensure_ascii=False).encode())
+        self._count("hits")
+        self._count(tier)
+
+        if entry["user_input"] == task:
+            task_analysis = entry["task_analysis"]
+        else:
+            # The analysis is about the details of the old task, only the kind of the task and its plan are reused.
+            task_analysis = (f"This task is the same kind of task as one which we have done before, so we follow the "
+                             f"same work plan.\n\nThe task is: {task}\n")
+
+        return task_analysis, entry["work_plan"]
+
+    def add(self, task: str, agents: dict, task_analysis: str, work_plan: dict) -> None:
+        """
+        Add (or revalidate) the plan of a task.
+
+        Parameters
+        ----------
+        task: str
+            The user input.
+        agents: dict
+            The agents of the company, {name: agent}.
+        task_analysis: str
+            The task analysis of the manager.
+        work_plan: dict
+            The work plan of the manager.
+        """
+
+        roster_key = get_roster_key(agents)
+        signature = normalize_task(task)
+        key = self._make_key(roster_key, signature)
+        is_new = self._get(key) is None
+
+        entry = {"key": key, "user_input": task, "signature": signature, "task_analysis": task_analysis,
+                 "work_plan": work_plan, "created_at": time.time(), "hits": 0}
+        self.backend.set(key, json.dumps(entry, ensure_ascii=False).encode())
+        self._count("sets")
+
+        if is_new and self.semantic_cache is not None:
+            self.semantic_cache.add(roster_key, self.semantic_cache.embed(signature), key)
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the cache.
+
+        Returns
+        -------
+        dict
+            The hits (exact and semantic), misses, revalidations and sets.
+        """
+
+        with self._lock:
+            return dict(self._stats)
+
+    def _is_stale(self, entry: dict) -> bool:
+        if self.revalidate_every is not None and entry["hits"] >= self.revalidate_every:
+            return True
+
+        return self.revalidate_after is not None and entry["created_at"] + self.revalidate_after < time.time()
+
+    def _get(self, key: str) -> dict | None:
+        value = self.backend.get(key)
+
+        return None if value is None else json.loads(value)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _make_key(roster_key: str, signature: str) -> str:
+        return "plan:" + hashlib.sha256(f"{roster_key}\n{signature}".encode()).hexdigest()
@@ -0,0 +1,92 @@
+"""
+==========
+RunContext
+==========
+@file_name: run_context.py
+@author: Bin Liang
+@date: 2024-05-27
+The mutable state of one run of the AutoCompany, so one company can serve many runs at the same time.
+"""
+
+__all__ = ["RunContext"]
+
+import uuid
+import threading
+from typing import List
+
+from xyz.graph.checkpoint import RunCheckpoint
+from xyz.graph.working_history import WorkingHistory
+from xyz.utils.llm.usage import UsageLedger
+from xyz.utils.profiling import ProfileSession
+
+
+class RunContext:
+    """
+    Everything which a run changes lives here instead of in the company (or its assistants): the usage of the run,
+    the working history, the conversation of the InputFormatAssistant and the checkpoint. The company itself only
+    keeps its configuration and the counters which are shared by all the runs (guarded by a lock), so it can be called
+    from many threads or asyncio tasks at the same time.
+
+    Examples
+    --------
+    >>> run = RunContext(user_input="Find the sum.")
+    >>> run.add_messages([{"role": "assistant", "content": "The plan is ..."}])
+    >>> run.get_messages()
+    [{'role': 'assistant', 'content': 'The plan is ...'}]
+    """
+
+    def __init__(self, user_input: str, run_id: str = None, checkpoint: RunCheckpoint = None,
+                 state: dict = None) -> None:
+        """
+        Parameters
+        ----------
+        user_input: str
+            The user input of the run.
+        run_id: str, optional
+            The id of the run, by default a new one.
+        checkpoint: RunCheckpoint, optional
+            The checkpoint which the records of the run are saved in.
+        state: dict, optional
+            The state of a checkpoint (see `RunCheckpoint.load_state`) which the run is resumed from.
+        """
+
+        self.run_id = run_id or uuid.uuid4().hex
+        self.user_input = user_input
+        self.checkpoint = checkpoint
+        self.state = state
+
+        # Every LLM call of the run is recorded here.
+        self.usage = UsageLedger()
+        # The working history, it is created by `AutoCompany.execute_work_plan`.
+        self.history: WorkingHistory | None = None
+        # The profile of the run, if the company profiles it.
+        self.profile: ProfileSession | None = None
+
+        self._lock = threading.Lock()
+        # The conversation of the InputFormatAssistant in this run (the summaries of the manager).
+        self._messages = list(state["messages"]) if state is not None else []
+
+    def add_messages(self, messages: List[dict]) -> None:
+        """
+        Add messages to the conversation of the InputFormatAssistant in this run.
+        """
+
+        with self._lock:
+            self._messages.extend(messages)
+
+    def get_messages(self) -> List[dict]:
+        """
+        A copy of the conversation of the InputFormatAssistant, which the steps running at the same time do not
+        change.
+        """
+
+        with self._lock:
+            return list(self._messages)
+
+    def save(self, kind: str, **data) -> None:
+        """
+        Append a record to the checkpoint of the run, if it has one. See `RunCheckpoint.save`.
+        """
+
+        if self.checkpoint is not None:
+            self.checkpoint.save(kind, **data)
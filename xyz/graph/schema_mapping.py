@@ -0,0 +1,111 @@
+"""
+=============
+SchemaMapping
+=============
+@file_name: schema_mapping.py
+@author: Bin Liang
+@date: 2024-05-22
+Map the typed outputs of the agents to the parameters of the next agent, without asking the LLM.
+"""
+
+__all__ = ["get_output_values", "map_parameters"]
+
+import json
+from typing import Any
+
+# The JSON-schema types (and the short names used in some agents) and the Python types which match them.
+_TYPES = {
+    "string": (str,), "str": (str,),
+    "integer": (int,), "int": (int,),
+    "number": (int, float), "float": (int, float),
+    "boolean": (bool,), "bool": (bool,),
+    "array": (list, tuple), "list": (list, tuple),
+    "object": (dict,), "dict": (dict,),
+}
+
+
+def get_output_values(output_schema: dict | None, output: Any) -> dict:
+    """
+    Get the typed values of the output of an agent.
+
+    1. If the agent returns a dict, its keys which are in the output schema are the values.
+    2. If the output schema has only one property and the agent returns a text (i.e. a stream), the text is the value
+       of that property.
+
+    Parameters
+    ----------
+    output_schema: dict or None
+        The output schema of the agent (the same format as the parameters of its information), see
+        `Agent.set_output_schema`.
+    output: Any
+        The output of the agent.
+
+    Returns
+    -------
+    dict
+        {name: value}. Empty if the agent declares no output schema.
+    """
+
+    if not output_schema:
+        return {}
+
+    properties = output_schema.get("properties", {})
+    if isinstance(output, dict):
+        return {name: value for name, value in output.items() if name in properties}
+    if isinstance(output, str) and len(properties) == 1:
+        return {next(iter(properties)): output}
+
+    return {}
+
+
+def map_parameters(parameters: dict, values: dict) -> dict | None:
+    """
+    Fill the parameters of an agent from the known values by their names and types.
+
+    Parameters
+    ----------
+    parameters: dict
+        The parameters of the agent, i.e. `agent.information["function"]["parameters"]`.
+    values: dict
+        The known values, {name: value}.
+
+    Returns
+    -------
+    dict or None
+        The keyword arguments of the agent. None if a required parameter has no value of a compatible type, then the
+        LLM has to fill the gap.
+    """
+
+    properties = parameters.get("properties", {})
+    required = parameters.get("required", list(properties))
+
+    kwargs = {}
+    for name, schema in properties.items():
+        if name not in values:
+            continue
+        value = _convert(values[name], schema.get("type"))
+        if value is not _MISMATCH:
+            kwargs[name] = value
+
+    if any(name not in kwargs for name in required):
+        return None
+
+    return kwargs
+
+
+_MISMATCH = object()
+
+
+def _convert(value: Any, schema_type: str | None) -> Any:
+    if schema_type is None or schema_type not in _TYPES:
+        return value
+
+    types = _TYPES[schema_type]
+    # A bool is an int in Python, but not in JSON.
+    if isinstance(value, types) and (bool in types or not isinstance(value, bool)):
+        return value
+    # Everything can be read as a text.
+    if str in types:
+        return json.dumps(value, ensure_ascii=False, default=str)
+
+    return _MISMATCH
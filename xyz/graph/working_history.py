@@ -0,0 +1,189 @@
+"""
+==============
+WorkingHistory
+==============
+@file_name: working_history.py
+@author: Bin Liang
+@date: 2024-05-26
+The working history of an AutoCompany run: the records of the steps, rendered incrementally and within a token budget.
+"""
+
+__all__ = ["WorkingHistory", "StepRecord"]
+
+import threading
+from typing import List, NamedTuple
+
+from xyz.utils.llm.tokenizer import TokenCounter
+from xyz.utils.llm.trimming import Summarize
+
+
+class StepRecord(NamedTuple):
+    name: str
+    content: str
+    text: str
+    tokens: int
+
+
+class WorkingHistory:
+    """
+    The working history is a list of step records instead of one long string, so a new step only appends its own
+    text.
+
+    1. The records are rendered in the order of the work plan. The rendered text is cached, and a new record at the
+       end only appends its text to it, so the prefix of the prompt stays the same (which the prompt caching of the
+       provider can reuse).
+    2. With `max_tokens`, the rendered history fits in the budget: the oldest records (but the last `keep_last`) are
+       folded into a rolling summary. Only the new records are summarized, with the previous summary. Without a
+       summarizer, the oldest records are omitted.
+    3. `render_full` always gives the whole history, for the solving record.
+
+    Examples
+    --------
+    >>> history = WorkingHistory(order=["PlanAgent", "SolvingAgent"], counter=llm_client.token_counter,
+    >>>                          max_tokens=2000, summarizer=Summarize(llm_client))
+    >>> history.add("PlanAgent", "The plan is ...")
+    >>> history.render()
+    'PlanAgent:The plan is ...\\n\\n'
+    """
+
+    def __init__(self, order: List[str] = None, counter: TokenCounter = None, max_tokens: int = None,
+                 summarizer: Summarize = None, keep_last: int = 2) -> None:
+        """
+        Parameters
+        ----------
+        order: list, optional
+            The order of the steps, by default the order in which they are added.
+        counter: TokenCounter, optional
+            The token counter of the model. It is needed for the budget.
+        max_tokens: int, optional
+            The token budget of the rendered history, by default no budget.
+        summarizer: Summarize, optional
+            The policy which writes the rolling summary, by default the oldest records are omitted.
+        keep_last: int
+            The number of the newest records which are never folded into the summary.
+        """
+
+        assert max_tokens is None or counter is not None, "The budget of the history needs a token counter."
+
+        self.order = list(order or [])
+        self.counter = counter
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.keep_last = keep_last
+
+        self.records = {}
+        # The rolling summary, and the names of the records which are folded into it.
+        self.summary = ""
+        self.folded = []
+
+        self._lock = threading.RLock()
+        self._rendered_names = ()
+        self._rendered_prefix = ""
+        self._rendered_text = ""
+
+    def add(self, name: str, content: str) -> None:
+        """
+        Add (or replace) the record of a step.
+        """
+
+        text = name + ":" + content + "\n\n"
+        tokens = self.counter.count_text(text) if self.counter is not None else 0
+        with self._lock:
+            if name not in self.order:
+                self.order.append(name)
+            if name in self.records:
+                # The cached text has the old version.
+                self._rendered_text = None
+            self.records[name] = StepRecord(name, content, text, tokens)
+            if name in self.folded:
+                # A replaced record is rendered again, the summary keeps the old version.
+                self.folded.remove(name)
+
+    def render(self, max_tokens: int = None) -> str:
+        """
+        Render the history within the budget.
+
+        Parameters
+        ----------
+        max_tokens: int, optional
+            The token budget, by default `self.max_tokens`.
+
+        Returns
+        -------
+        str
+            The history.
+        """
+
+        max_tokens = self.max_tokens if max_tokens is None else max_tokens
+        with self._lock:
+            names = all_names = self._get_names()
+            if max_tokens is not None and self._count(names) > max_tokens:
+                names = self._fold(names, max_tokens)
+
+            if self.summary:
+                prefix = f"The summary of the earlier steps:\n{self.summary}\n\n"
+            elif len(names) < len(all_names):
+                prefix = f"({len(all_names) - len(names)} earlier steps are omitted.)\n\n"
+            else:
+                prefix = ""
+            text = self._render(prefix, names)
+            if max_tokens is not None and self.counter.count_text(text) > max_tokens:
+                # Even the newest records are too long, keep the newest part of them.
+                text = self.counter.truncate(text, max_tokens, keep="tail")
+
+        return text
+
+    def render_full(self) -> str:
+        """
+        Render all the records, without the summary and the budget.
+        """
+
+        with self._lock:
+            return "".join(self.records[name].text for name in self.order if name in self.records)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __str__(self) -> str:
+        return self.render_full()
+
+    def _get_names(self) -> List[str]:
+        return [name for name in self.order if name in self.records and name not in self.folded]
+
+    def _count(self, names: List[str]) -> int:
+        summary_tokens = self.counter.count_text(self.summary) if self.summary else 0
+
+        return summary_tokens + sum(self.records[name].tokens for name in names)
+
+    def _fold(self, names: List[str], max_tokens: int) -> List[str]:
+        old, names = names[:max(0, len(names) - self.keep_last)], names[max(0, len(names) - self.keep_last):]
+        if not old:
+            return names
+
+        if self.summarizer is None:
+            # Omit the oldest records until the rest fits.
+            while old and self._count(old + names) > max_tokens:
+                old.pop(0)
+            return old + names
+
+        text = "".join(self.records[name].text for name in old)
+        messages = [{"role": "user", "content": text}]
+        if self.summary:
+            messages.insert(0, {"role": "assistant", "content": self.summary})
+        self.summary = self.summarizer.summarize(messages)
+        self.folded.extend(old)
+
+        return names
+
+    def _render(self, prefix: str, names: List[str]) -> str:
+        rendered = self._rendered_names
+        if (self._rendered_text is not None and self._rendered_prefix == prefix
+                and tuple(names[:len(rendered)]) == rendered):
+            # Only the new records at the end are joined.
+            text = self._rendered_text + "".join(self.records[name].text for name in names[len(rendered):])
+        else:
+            text = prefix + "".join(self.records[name].text for name in names)
+
+        self._rendered_names, self._rendered_prefix, self._rendered_text = tuple(names), prefix, text
+
+        return text
@@ -9,14 +9,22 @@ Node
 
 __all__ = ["Agent"]
 
+import asyncio
+import inspect
+import contextvars
 from abc import abstractmethod
-from typing import Callable, Any
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncGenerator, Awaitable, Callable, Generator, Iterable
+
+from xyz.utils.profiling import aprofile_call, profile_call
+from xyz.utils.tracing import atrace_call, trace_call
 
 
 class Agent:
     type: str
     information: dict
     output: dict
+    output_schema: dict | None
 
     def __init__(self):
         """
@@ -51,11 +59,14 @@ class Agent:
         super().__setattr__("type", "agent")
         super().__setattr__("information", dict)
         super().__setattr__("output", dict)
+        super().__setattr__("output_schema", None)
 
     def _wrap_call(self, **kwargs) -> Callable:
         """
         The wrap call function for the agent. The user can call the agent by `agent(**kwargs)`.
-        The agent will call the method `flowing` automatically.
+        The agent will call the method `flowing` automatically, in a tracing span which is the child of the span of the
+        caller (i.e. the agent which calls this agent). If `flowing` returns a stream, the span lasts until the stream
+        is consumed. In a `profile_session`, the call is profiled as "{class name}.flowing".
 
         Parameters
         ----------
@@ -66,10 +77,30 @@ class Agent:
             self.flowing(**kwargs)
         """
 
-        return self.flowing(**kwargs)
+        return trace_call(self._get_span_name(), self._profiled_flowing, kwargs,
+                          attributes={"xyz.agent.class": type(self).__name__})
 
     __call__: Callable[..., Any] = _wrap_call
 
+    async def _wrap_acall(self, **kwargs) -> Any:
+        """
+        The awaitable twin of `_wrap_call`. The user can call the agent by `await agent.acall(**kwargs)`.
+        The agent will await the method `aflowing` automatically.
+
+        Parameters
+        ----------
+            **kwargs:
+
+        Returns
+        -------
+            await self.aflowing(**kwargs)
+        """
+
+        return await atrace_call(self._get_span_name(), self._profiled_aflowing, kwargs,
+                                 attributes={"xyz.agent.class": type(self).__name__})
+
+    acall: Callable[..., Awaitable[Any]] = _wrap_acall
+
     @abstractmethod
     def flowing(self, *args, **kwargs) -> Any:
         """
@@ -77,6 +108,201 @@ class Agent:
         """
         ...
 
+    async def aflowing(self, *args, **kwargs) -> Any:
+        """
+        The asynchronous version of `flowing`. By default, we run the blocking `flowing` in a worker thread, so the
+        event loop is never blocked. The agent which can do the work natively in asyncio (i.e. `LLMAgent`) should
+        override this method.
+        """
+
+        return await asyncio.to_thread(self.flowing, *args, **kwargs)
+
+    def map(self, inputs: Iterable[dict], max_concurrency: int = 8, ordered: bool = True,
+            on_progress: Callable[[int, int | None], None] = None,
+            stop_when: Callable[[int, Any], bool] = None,
+            return_exceptions: bool = True) -> Generator[tuple[int, Any], None, None]:
+        """
+        Call the agent on many inputs with bounded concurrency (a thread pool), and stream the results back.
+
+        Parameters
+        ----------
+        inputs: Iterable[dict]
+            The keyword arguments of each call. It can be a lazy iterator, which is consumed as the workers are free.
+        max_concurrency: int
+            The max number of the calls in flight.
+        ordered: bool
+            If True, the results are yielded in the order of the inputs. Otherwise, as soon as they are completed.
+        on_progress: Callable, optional
+            Called with (number of the completed calls, number of the inputs or None) after each call.
+        stop_when: Callable, optional
+            Called with (index, result) of each yielded result. Once it returns True, the calls which have not started
+            are cancelled and the map stops at once, without waiting for the calls in flight.
+        return_exceptions: bool
+            If True, the error of a call is yielded in the place of its result. Otherwise, it is raised.
+
+        Yields
+        ------
+        tuple
+            (index of the input, result of the call). If the agent returns a generator (stream), it is consumed in the
+            worker and the result is the joined text.
+
+        Examples
+        --------
+        >>> for i, answer in solving_agent.map([{"question": q} for q in questions], max_concurrency=4):
+        >>>     print(i, answer)
+        """
+
+        assert max_concurrency >= 1, "The max_concurrency must be at least 1."
+
+        total = len(inputs) if hasattr(inputs, "__len__") else None
+        iterator = enumerate(inputs)
+        buffer = {}
+        next_index = 0
+        completed = 0
+
+        # The executor is not a context manager here: its exit would wait for the calls in flight, but a stopped map
+        # must return at once.
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        pending = {}
+
+        def fill():
+            for index, kwargs in iterator:
+                # Each call runs in a copy of the caller's context, so the usage scope goes with it.
+                future = executor.submit(contextvars.copy_context().run, self._map_call, kwargs)
+                pending[future] = index
+                if len(pending) >= max_concurrency:
+                    break
+
+        try:
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    error = future.exception()
+                    if error is not None and not return_exceptions:
+                        raise error
+                    buffer[index] = future.result() if error is None else error
+                    completed += 1
+                    if on_progress is not None:
+                        on_progress(completed, total)
+                fill()
+
+                ready = sorted(buffer) if not ordered else []
+                while ordered and next_index in buffer:
+                    ready.append(next_index)
+                    next_index += 1
+                for index in ready:
+                    result = buffer.pop(index)
+                    yield index, result
+                    if stop_when is not None and stop_when(index, result):
+                        return
+        finally:
+            # The calls which have not started are cancelled, the ones in flight finish in the background.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def amap(self, inputs: Iterable[dict], max_concurrency: int = 8, ordered: bool = True,
+                   on_progress: Callable[[int, int | None], None] = None,
+                   stop_when: Callable[[int, Any], bool] = None,
+                   return_exceptions: bool = True) -> AsyncGenerator[tuple[int, Any], None]:
+        """
+        The asyncio version of `map`: the calls are `await agent.acall(**kwargs)` tasks in the running event loop.
+        Once `stop_when` returns True, the tasks in flight are cancelled.
+
+        Parameters
+        ----------
+        inputs, max_concurrency, ordered, on_progress, stop_when, return_exceptions
+            The same as `map`.
+
+        Yields
+        ------
+        tuple
+            (index of the input, result of the call). If the agent returns an (async) generator, it is consumed and the
+            result is the joined text.
+        """
+
+        assert max_concurrency >= 1, "The max_concurrency must be at least 1."
+
+        total = len(inputs) if hasattr(inputs, "__len__") else None
+        iterator = enumerate(inputs)
+        buffer = {}
+        next_index = 0
+        completed = 0
+        pending = {}
+
+        def fill():
+            for index, kwargs in iterator:
+                pending[asyncio.ensure_future(self._amap_call(kwargs))] = index
+                if len(pending) >= max_concurrency:
+                    break
+
+        fill()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = pending.pop(task)
+                    error = task.exception()
+                    if error is not None and not return_exceptions:
+                        raise error
+                    buffer[index] = task.result() if error is None else error
+                    completed += 1
+                    if on_progress is not None:
+                        on_progress(completed, total)
+                fill()
+
+                ready = sorted(buffer) if not ordered else []
+                while ordered and next_index in buffer:
+                    ready.append(next_index)
+                    next_index += 1
+                for index in ready:
+                    result = buffer.pop(index)
+                    yield index, result
+                    if stop_when is not None and stop_when(index, result):
+                        return
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _map_call(self, kwargs: dict) -> Any:
+        """
+        One call of `map`. The stream is consumed here, in the worker thread.
+        """
+
+        result = self(**kwargs)
+        if inspect.isgenerator(result):
+            result = "".join(str(word) for word in result)
+
+        return result
+
+    async def _amap_call(self, kwargs: dict) -> Any:
+        """
+        One call of `amap`. The stream is consumed here, in the task.
+        """
+
+        result = await self.acall(**kwargs)
+        if inspect.isasyncgen(result):
+            result = "".join([str(word) async for word in result])
+        elif inspect.isgenerator(result):
+            result = "".join(str(word) for word in result)
+
+        return result
+
+    def _profiled_flowing(self, **kwargs) -> Any:
+        return profile_call(f"{type(self).__name__}.flowing", self.flowing, kwargs)
+
+    async def _profiled_aflowing(self, **kwargs) -> Any:
+        return await aprofile_call(f"{type(self).__name__}.aflowing", self.aflowing, kwargs)
+
+    def _get_span_name(self) -> str:
+        """
+        The name of the tracing span of the agent: its function name, or its class name if it has no information.
+        """
+
+        information = self.information if isinstance(self.information, dict) else {}
+
+        return information.get("function", {}).get("name") or type(self).__name__
+
     def set_information(self, information: dict) -> None:
         """
         Set the information of the agent. And check the format of the information.
@@ -101,6 +327,30 @@ class Agent:
 
         self.information = information
 
+    def set_output_schema(self, output_schema: dict) -> None:
+        """
+        Declare the typed output of the agent, in the same format as the parameters of the information. Then the
+        `AutoCompany` can pass the output to the parameters of the same name of the next agents directly, without
+        asking the LLM to format it.
+
+        If the schema has only one property, the agent can still return a text (or a stream), which is the value of
+        that property. Otherwise, the agent returns a dict.
+
+        Parameters
+        ----------
+            output_schema: dict
+                i.e. {"type": "object", "properties": {"plan": {"type": "string", "description": "The plan."}}}
+
+        Returns
+        -------
+            None
+        """
+
+        assert type(output_schema) is dict, "The output schema must be a dict."
+        assert output_schema.get("properties"), "The output schema must have some 'properties'."
+
+        self.output_schema = output_schema
+
     # ======= 以下是为了方便查看 multi-agents-system 的结果的。可删。
     def __str__(self) -> str:
         """
@@ -8,11 +8,21 @@ LLMAgent
 
 """
 
-from copy import deepcopy
-from typing import Generator, Any
+import json
+import asyncio
+import hashlib
+from typing import AsyncGenerator, Generator, Any
 
 from xyz.node.agent import Agent
+from xyz.node.basic.prompt_template import PromptTemplate
+from openai.types.chat import ChatCompletion
+
+from xyz.utils.llm.batch import BatchBackend, BatchItemError, OpenAIBatchBackend, run_batch
 from xyz.utils.llm.openai_client import OpenAIClient
+from xyz.utils.llm.semantic_cache import SemanticCache
+from xyz.utils.llm.trimming import TrimPolicy
+from xyz.utils.llm.usage import UsageLedger, current_usage_scope, usage_scope
+from xyz.utils.profiling import profiled
 
 __all__ = ["LLMAgent"]
 
@@ -31,9 +41,12 @@ class LLMAgent(Agent):
     node_config: dict
     template: list
     generate_parameters: dict
+    usage: UsageLedger
 
     def __init__(self, template: list, llm_client: OpenAIClient,
-                 stream: bool = False, original_response: bool = False) -> None:
+                 stream: bool = False, original_response: bool = False,
+                 semantic_cache: SemanticCache = None, trim_policy: TrimPolicy = None,
+                 max_prompt_tokens: int = None) -> None:
         # noinspection PyUnresolvedReferences
         """
         Initialize the assistant with the given template and core agent.
@@ -46,6 +59,17 @@ class LLMAgent(Agent):
             The core agent for the assistant.
         stream: bool, optional
             Whether to stream the assistant's messages, by default False.
+        original_response: bool, optional
+            Whether to return the original response of the LLM client, by default False.
+        semantic_cache: SemanticCache, optional
+            If it is set, a request whose rendered prompt is close enough to one answered before by this template
+            will be served from the cache, by default None.
+        trim_policy: TrimPolicy, optional
+            If it is set, the messages are trimmed by it (i.e. `DropOldest()`, `KeepLastN(10)`, `Summarize(client)`)
+            before each request, so the prompt always fits in the context window, by default None.
+        max_prompt_tokens: int, optional
+            The token budget of the prompt for the trim policy, by default the context window of the model minus the
+            room of the completion.
 
         Examples
         --------
@@ -62,8 +86,16 @@ class LLMAgent(Agent):
         self.llm_client = llm_client
 
         self.template = template
+        # Compile the template once, so every call only fills the placeholders.
+        self.compiled_template = PromptTemplate(template) if type(template) is list else None
         self.stream = stream
         self.original_response = original_response
+        self.semantic_cache = semantic_cache
+        self.trim_policy = trim_policy
+        self.max_prompt_tokens = max_prompt_tokens
+        self.template_key = hashlib.sha256(json.dumps(template, sort_keys=True).encode()).hexdigest()
+        # The usage and the cost of all the calls of this agent.
+        self.usage = UsageLedger()
 
         self.last_request_info = {}
 
@@ -90,15 +122,62 @@ class LLMAgent(Agent):
 
         local_messages, messages = self._reset_default_list(messages)
         local_tools, tools = self._reset_default_list(tools)
+        history_messages = list(local_messages)
         local_messages.extend(self._complete_prompts(**kwargs))
 
-        return self.request(messages=local_messages, tools=local_tools, images=images)
+        with self._usage_scope():
+            if self.semantic_cache is not None and not local_tools and not images and not self.original_response:
+                return self._semantic_request(messages=local_messages, history_messages=history_messages,
+                                              kwargs=kwargs)
+
+            return self.request(messages=local_messages, tools=local_tools, images=images)
+
+    def _semantic_request(self, messages: list, history_messages: list, kwargs: dict) -> Any:
+        """
+        Serve the request from the semantic cache if we can, otherwise request the LLM and add the answer to the cache.
+
+        Parameters
+        ----------
+        messages: list
+            The full messages of the request.
+        history_messages: list
+            The messages which are given by the caller, before the template.
+        kwargs: dict
+            The keyword arguments which complete the template.
+
+        Returns
+        -------
+        str/generator
+            The response from the assistant. If stream == True, we will return a generator.
+        """
+
+        cached, vector = self.semantic_cache.lookup(self.template_key, self._semantic_text(history_messages, kwargs))
+
+        if cached is not None:
+            self.last_request_info = {"messages": messages, "tools": [], "images": None, "semantic_cache": True}
+            return iter([cached]) if self.stream else cached
+
+        response = self.request(messages=messages, tools=[], images=None)
+        if not self.stream:
+            if isinstance(response, str):
+                self.semantic_cache.add(self.template_key, vector, response)
+            return response
+
+        def record_stream():
+            words = []
+            for word in response:
+                words.append(word)
+                yield word
+            self.semantic_cache.add(self.template_key, vector, "".join(words))
+
+        return record_stream()
 
     def request(self, messages: list, tools: list, images: list) -> Any:
         """
         Run the assistant with the given keyword arguments.
         """
 
+        messages = self._trim(messages, tools)
         self.last_request_info = {
             "messages": messages,
             "tools": tools,
@@ -109,16 +188,220 @@ class LLMAgent(Agent):
             return self._stream_run(messages=messages, images=images)
         else:
             response = self.llm_client.run(messages=messages, tools=tools, images=images)
-            if self.original_response:
-                return response
-            
-            content = response.choices[0].message.content
+            return self._parse_response(response)
+
+    async def aflowing(self, messages: list = None, tools: list = None, images: list = None, **kwargs) -> Any:
+        """
+        The asynchronous version of `flowing`. It prepares the prompts in the same way, and awaits the LLM client.
+
+        Parameters
+        ----------
+        messages: list, optional
+            The messages to use for completing the prompts, by default None.
+        tools: list, optional
+            The tools to use for completing the prompts, by default None.
+        images: list, optional
+            The images to use for completing the prompts, by default None.
+        **kwargs
+            The keyword arguments to use for completing the prompts.
+
+        Returns
+        -------
+        str/async generator
+            The response from the assistant. If stream == True, we will return an async generator.
+        """
+
+        local_messages, messages = self._reset_default_list(messages)
+        local_tools, tools = self._reset_default_list(tools)
+        history_messages = list(local_messages)
+        local_messages.extend(self._complete_prompts(**kwargs))
+
+        with self._usage_scope():
+            if self.semantic_cache is not None and not local_tools and not images and not self.original_response:
+                return await self._asemantic_request(messages=local_messages, history_messages=history_messages,
+                                                     kwargs=kwargs)
+
+            return await self.arequest(messages=local_messages, tools=local_tools, images=images)
+
+    async def _asemantic_request(self, messages: list, history_messages: list, kwargs: dict) -> Any:
+        """
+        The asynchronous version of `_semantic_request`. The embedding of the lookup is done in a thread, so it does
+        not block the event loop.
+        """
+
+        cached, vector = await asyncio.to_thread(self.semantic_cache.lookup, self.template_key,
+                                                 self._semantic_text(history_messages, kwargs))
+
+        if cached is not None:
+            self.last_request_info = {"messages": messages, "tools": [], "images": None, "semantic_cache": True}
+            if not self.stream:
+                return cached
+
+            async def replay_cached():
+                yield cached
+
+            return replay_cached()
+
+        response = await self.arequest(messages=messages, tools=[], images=None)
+        if not self.stream:
+            if isinstance(response, str):
+                self.semantic_cache.add(self.template_key, vector, response)
+            return response
+
+        async def record_stream():
+            words = []
+            async for word in response:
+                words.append(word)
+                yield word
+            self.semantic_cache.add(self.template_key, vector, "".join(words))
+
+        return record_stream()
+
+    @staticmethod
+    def _semantic_text(history_messages: list, kwargs: dict) -> str:
+        """
+        The text of a request which is embedded by the semantic cache. The static part of the template is the same
+        for every call, so only the history messages and the keyword arguments are in it.
+        """
+
+        return json.dumps({"history": history_messages, "kwargs": kwargs}, sort_keys=True, ensure_ascii=False,
+                          default=str)
+
+    async def arequest(self, messages: list, tools: list, images: list) -> Any:
+        """
+        Run the assistant with the given keyword arguments without blocking the event loop.
+        If the LLM client has no native async methods (`arun`/`astream_run`), we call the blocking ones in a thread.
+        """
+
+        messages = self._trim(messages, tools)
+        self.last_request_info = {
+            "messages": messages,
+            "tools": tools,
+            "images": images
+        }
+
+        if self.stream:
+            return self._astream_run(messages=messages, images=images)
+
+        if hasattr(self.llm_client, "arun"):
+            response = await self.llm_client.arun(messages=messages, tools=tools, images=images)
+        else:
+            response = await asyncio.to_thread(self.llm_client.run, messages=messages, tools=tools, images=images)
+
+        return self._parse_response(response)
+
+    def batch(self, kwargs_list: list, messages: list = None, tools: list = None, backend: BatchBackend = None,
+              poll_interval: float = 30., timeout: float = 24 * 3600.) -> list:
+        """
+        Render the prompts of many calls, and submit them as one offline batch job. It is much cheaper and does not
+        hold a thread for each call, but the results come back after minutes or hours.
+
+        Parameters
+        ----------
+        kwargs_list: list
+            The keyword arguments of each call, which complete the template.
+        messages: list, optional
+            The messages before the template, which are shared by all the calls, by default None.
+        tools: list, optional
+            The tools of all the calls, by default None.
+        backend: BatchBackend, optional
+            The batch backend, by default the OpenAI's Batch API. Use `LocalBatchBackend` for testing.
+        poll_interval: float, optional
+            The seconds between two polls of the batch status, by default 30.
+        timeout: float, optional
+            The max seconds to wait for the batch, by default 24 hours.
 
-            # TODO: 要检测出是否一定有 tool 的返回, 等待测试
-            if content is None:
-                return response.choices[0].message.tool_calls[0].function
-            else:
-                return content
+        Returns
+        -------
+        list
+            The response of each call in order (the same as a normal call without stream). If one call failed, its
+            place is a `BatchItemError`.
+
+        Examples
+        --------
+        >>> agent = LLMAgent(template=template, llm_client=llm_client)
+        >>> results = agent.batch([{"content": "A story about a dog."}, {"content": "A story about a cat."}])
+        """
+
+        local_messages, messages = self._reset_default_list(messages)
+        local_tools, tools = self._reset_default_list(tools)
+        backend = OpenAIBatchBackend(self.llm_client) if backend is None else backend
+
+        requests = []
+        for i, kwargs in enumerate(kwargs_list):
+            prompts = self._trim(local_messages + self._complete_prompts(**kwargs), local_tools)
+            body = dict(self.llm_client.generate_args, messages=prompts)
+            body.update(self.llm_client.get_tools_args(local_tools))
+            requests.append({"custom_id": f"request-{i}", "method": "POST", "url": "/v1/chat/completions",
+                             "body": body})
+
+        results = run_batch(backend, requests, poll_interval=poll_interval, timeout=timeout)
+
+        return [result if isinstance(result, BatchItemError) else
+                self._parse_response(ChatCompletion.model_validate(result)) for result in results]
+
+    @profiled
+    def _trim(self, messages: list, tools: list) -> list:
+        """
+        Trim the messages by the trim policy, if there is one.
+
+        Parameters
+        ----------
+        messages: list
+            The messages of the request.
+        tools: list
+            The tools of the request.
+
+        Returns
+        -------
+        list
+            The messages which fit in the token budget of the prompt.
+        """
+
+        if self.trim_policy is None:
+            return messages
+
+        budget = self.max_prompt_tokens or self.llm_client.get_prompt_budget()
+
+        return self.trim_policy.trim(messages, budget, self.llm_client.token_counter, tools)
+
+    def _usage_scope(self):
+        """
+        The usage scope of a call: it is recorded in `self.usage` with the template's hash. If the caller (i.e. the
+        `AutoCompany`) does not name the agent, the class name is used.
+        """
+
+        labels = {"template": self.template_key[:12]}
+        if current_usage_scope().labels.get("agent") is None:
+            labels["agent"] = type(self).__name__
+
+        return usage_scope(self.usage, **labels)
+
+    def _parse_response(self, response: ChatCompletion) -> Any:
+        """
+        Get the content (or the function of the tool call) from the response of the LLM client.
+
+        Parameters
+        ----------
+        response: ChatCompletion
+            The response of the LLM client.
+
+        Returns
+        -------
+        Any
+            The original response if original_response == True, the content, or the function of the tool call.
+        """
+
+        if self.original_response:
+            return response
+
+        content = response.choices[0].message.content
+
+        # TODO: 要检测出是否一定有 tool 的返回, 等待测试
+        if content is None:
+            return response.choices[0].message.tool_calls[0].function
+        else:
+            return content
 
     def _stream_run(self, messages: list, images: list) -> Generator[str, None, None]:
         """
@@ -137,6 +420,37 @@ class LLMAgent(Agent):
 
         return self.llm_client.stream_run(messages=messages, images=images)
 
+    def _astream_run(self, messages: list, images: list) -> AsyncGenerator[str, None]:
+        """
+        Run the assistant in an asynchronous streaming manner with the given messages.
+
+        Parameters
+        ----------
+        messages: list
+            The messages which be used for call the LLM API.
+
+        Returns
+        -------
+        async generator
+            The async generator for the token(already be decoded) in assistant's messages.
+        """
+
+        # The stream is created now (not when it is consumed), so it is in the usage scope of this call.
+        if hasattr(self.llm_client, "astream_run"):
+            return self.llm_client.astream_run(messages=messages, images=images)
+
+        return self._astream_in_thread(self.llm_client.stream_run(messages=messages, images=images))
+
+    @staticmethod
+    async def _astream_in_thread(stream: Generator[str, None, None]) -> AsyncGenerator[str, None]:
+        # Fallback: drive the blocking generator in a worker thread, one token at a time.
+        done = object()
+        while True:
+            word = await asyncio.to_thread(next, stream, done)
+            if word is done:
+                break
+            yield word
+
     def debug(self) -> dict[Any, Any]:
         """
         Reset the assistant's messages.
@@ -165,14 +479,17 @@ class LLMAgent(Agent):
             The value of this parameter in this time, and reset the parameter to None.
         """
 
+        # The messages and the tools are never changed in place by the LLMAgent and the LLM client (the images are
+        # packed into a new message), so a shallow copy of the list is enough.
         if parameter is None:
             local = []
         else:
-            local = deepcopy(parameter)
+            local = list(parameter)
             parameter = None
 
         return local, parameter
 
+    @profiled
     def _complete_prompts(self, **kwargs) -> list:
         """
         Complete the assistant's prompts with the given keyword arguments.
@@ -184,15 +501,14 @@ class LLMAgent(Agent):
 
         Returns
         -------
-        tuple
-            A tuple containing the system message and the user message.
+        list
+            The messages of the template. The static messages are shared and read-only.
         """
 
         if type(self.template) is list:
 
-            current_messages = deepcopy(self.template)
-
-            for i in range(len(current_messages)):
-                current_messages[i]['content'] = current_messages[i]['content'].format(**kwargs)
+            # The user may replace the template after the initialization.
+            if self.compiled_template is None or self.compiled_template.source is not self.template:
+                self.compiled_template = PromptTemplate(self.template)
 
-            return current_messages
+            return self.compiled_template.render(**kwargs)
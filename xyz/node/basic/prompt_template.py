@@ -0,0 +1,119 @@
+"""
+==============
+PromptTemplate
+==============
+@file_name: prompt_template.py
+@author: Bin Liang
+@date: 2024-05-13
+The precompiled template of the LLMAgent's prompts.
+"""
+
+__all__ = ["PromptTemplate", "FrozenMessage"]
+
+from string import Formatter
+
+from xyz.utils.profiling import profiled
+
+
+class FrozenMessage(dict):
+    """
+    A read-only message. The static messages of a template are shared by all the calls, so nobody can change them.
+    It is still a dict, so it can be sent to the OpenAI API and be dumped by json directly.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("The static message of a template is shared and read-only, please copy it before changing.")
+
+    __setitem__ = __delitem__ = _readonly
+    update = pop = popitem = clear = setdefault = _readonly
+
+    def __copy__(self) -> dict:
+        return dict(self)
+
+    def __deepcopy__(self, memo) -> dict:
+        return dict(self)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class PromptTemplate:
+    """
+    The template is compiled once: every message is split into the literal text and the placeholders by the same
+    parser as `str.format`.
+
+    1. The messages without placeholders are rendered once, and shared as `FrozenMessage` by all the calls.
+    2. The messages with simple placeholders (i.e. `{content}`) are rendered by joining the precompiled parts.
+    3. The messages with complex placeholders (i.e. `{a.b}`, `{a[0]}`, `{x:>10}`) fall back to `str.format`.
+
+    Examples
+    --------
+    >>> template = PromptTemplate([{"role": "system", "content": "You are a story writer."},
+    >>>                            {"role": "user", "content": "{content}"}])
+    >>> template.placeholders
+    {'content'}
+    >>> template.render(content="A story about a dog.")
+    [{'role': 'system', 'content': 'You are a story writer.'}, {'role': 'user', 'content': 'A story about a dog.'}]
+    """
+
+    def __init__(self, messages: list) -> None:
+        """
+        Parameters
+        ----------
+        messages: list
+            The template, which is a list of OpenAI's messages whose contents are `str.format` strings.
+        """
+
+        self.source = messages
+        self.placeholders = set()
+        self._slots = []
+
+        for message in messages:
+            parts = list(Formatter().parse(message['content']))
+            fields = [field for _, field, _, _ in parts if field is not None]
+            self.placeholders.update(fields)
+
+            if not fields:
+                rendered = dict(message, content="".join(literal for literal, _, _, _ in parts))
+                self._slots.append(("static", FrozenMessage(rendered)))
+            elif all(field.isidentifier() and not spec and not conversion
+                     for _, field, spec, conversion in parts if field is not None):
+                self._slots.append(("simple", message, [(literal, field) for literal, field, _, _ in parts]))
+            else:
+                self._slots.append(("format", message))
+
+    @profiled
+    def render(self, **kwargs) -> list:
+        """
+        Fill the placeholders with the keyword arguments.
+
+        Parameters
+        ----------
+        **kwargs
+            The values of the placeholders.
+
+        Returns
+        -------
+        list
+            The messages of this call. The static messages are shared, the dynamic ones are new dicts.
+
+        Raises
+        ------
+        KeyError
+            If a placeholder has no value, the same as `str.format`.
+        """
+
+        messages = []
+        for slot in self._slots:
+            if slot[0] == "static":
+                messages.append(slot[1])
+            elif slot[0] == "simple":
+                _, message, parts = slot
+                content = "".join(literal if field is None else literal + format(kwargs[field])
+                                  for literal, field in parts)
+                messages.append(dict(message, content=content))
+            else:
+                message = slot[1]
+                messages.append(dict(message, content=message['content'].format(**kwargs)))
+
+        return messages
@@ -0,0 +1,224 @@
+"""
+=====
+Batch
+=====
+@file_name: batch.py
+@author: Bin Liang
+@date: 2024-05-14
+The offline batch mode of the chat completions: submit many requests as one batch job, poll it, and read the results.
+"""
+
+__all__ = ["BatchBackend", "OpenAIBatchBackend", "LocalBatchBackend", "BatchItemError", "run_batch"]
+
+import os
+import json
+import time
+import uuid
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+
+class BatchItemError(Exception):
+    """
+    The error of one request in a batch. It is returned in the place of the result, so the other results are kept.
+    """
+
+    def __init__(self, custom_id: str, error) -> None:
+        super().__init__(f"The batch request {custom_id} failed: {error}")
+        self.custom_id = custom_id
+        self.error = error
+
+
+class BatchBackend:
+    """
+    The basic class of the batch backends. The requests and the results follow the format of the OpenAI's Batch API:
+
+    * request: {"custom_id": str, "method": "POST", "url": "/v1/chat/completions", "body": {...}}
+    * result: {"custom_id": str, "response": {"status_code": int, "body": {...}} or None, "error": ... or None}
+    """
+    FINISHED_STATUS = ("completed", "failed", "expired", "cancelled")
+
+    def submit(self, requests: List[dict]) -> str:
+        """
+        Submit the requests as one batch job, and return the batch id.
+        """
+        raise NotImplementedError
+
+    def status(self, batch_id: str) -> str:
+        """
+        Get the status of the batch job, i.e. "validating", "in_progress", "completed", "failed".
+        """
+        raise NotImplementedError
+
+    def results(self, batch_id: str) -> List[dict]:
+        """
+        Get the results of a finished batch job.
+        """
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    The OpenAI's Batch API: the requests are uploaded as a JSONL file, and the job is done within the completion window
+    at a lower price.
+    """
+
+    def __init__(self, llm_client, completion_window: str = "24h") -> None:
+        """
+        Parameters
+        ----------
+        llm_client: OpenAIClient
+            The client which can call the OpenAI API.
+        completion_window: str
+            The time frame within which the batch should be processed.
+        """
+
+        self.llm_client = llm_client
+        self.completion_window = completion_window
+
+    def submit(self, requests: List[dict]) -> str:
+        client = self.llm_client.client
+        content = "\n".join(json.dumps(request, ensure_ascii=False) for request in requests).encode()
+        input_file = client.files.create(file=("batch.jsonl", content), purpose="batch")
+
+        body = {"input_file_id": input_file.id, "endpoint": "/v1/chat/completions",
+                "completion_window": self.completion_window}
+        batch = client.post("/batches", body=body, cast_to=object)
+
+        return batch["id"]
+
+    def status(self, batch_id: str) -> str:
+        return self._get(batch_id)["status"]
+
+    def results(self, batch_id: str) -> List[dict]:
+        client = self.llm_client.client
+        batch = self._get(batch_id)
+
+        results = []
+        for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+            if file_id:
+                text = client.files.content(file_id).text
+                results.extend(json.loads(line) for line in text.splitlines() if line.strip())
+
+        return results
+
+    def _get(self, batch_id: str) -> dict:
+        return self.llm_client.client.get(f"/batches/{batch_id}", cast_to=object)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    A local, file-based stand-in of the Batch API for testing. The batch is written as JSONL files in a directory, and
+    the requests are done by an LLM client (i.e. a mock client) one by one when the status is polled for the first
+    time. So the whole path of the batch mode (files, polling, mapping the results) can be tested offline.
+    """
+
+    def __init__(self, llm_client, directory: str = "batches") -> None:
+        """
+        Parameters
+        ----------
+        llm_client: OpenAIClient
+            The client which does the requests.
+        directory: str
+            The directory of the batch files.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        self.llm_client = llm_client
+        self.directory = directory
+
+    def submit(self, requests: List[dict]) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        with open(self._path(batch_id, "input"), "w") as file:
+            for request in requests:
+                file.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        if not os.path.exists(self._path(batch_id, "output")):
+            self._process(batch_id)
+
+        return "completed"
+
+    def results(self, batch_id: str) -> List[dict]:
+        with open(self._path(batch_id, "output")) as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def _process(self, batch_id: str) -> None:
+        with open(self._path(batch_id, "input")) as file:
+            requests = [json.loads(line) for line in file if line.strip()]
+
+        output_path = self._path(batch_id, "output")
+        with open(output_path + ".tmp", "w") as file:
+            for request in requests:
+                body = request["body"]
+                result = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                          "response": None, "error": None}
+                try:
+                    # The generate arguments of the body are the ones of the client, only the prompts differ.
+                    response = self.llm_client.run(messages=body["messages"], tools=body.get("tools"))
+                    result["response"] = {"status_code": 200, "body": response.model_dump(mode="json")}
+                except Exception as error:
+                    result["error"] = {"code": type(error).__name__, "message": str(error)}
+                file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        os.replace(output_path + ".tmp", output_path)
+
+    def _path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+
+def run_batch(backend: BatchBackend, requests: List[dict], poll_interval: float = 30.,
+              timeout: float = 24 * 3600.) -> List[dict]:
+    """
+    Submit the requests, poll the batch job until it is finished, and map the results back in the order of the
+    requests.
+
+    Parameters
+    ----------
+    backend: BatchBackend
+        The batch backend.
+    requests: list
+        The requests of the Batch API format. The `custom_id` must be unique.
+    poll_interval: float
+        The seconds between two polls.
+    timeout: float
+        The max seconds to wait.
+
+    Returns
+    -------
+    list
+        The response body (dict) of each request, or a `BatchItemError` if the request failed.
+
+    Raises
+    ------
+    TimeoutError
+        If the batch job is not finished in time.
+    """
+
+    batch_id = backend.submit(requests)
+    logger.info("Submitted the batch %s with %d requests.", batch_id, len(requests))
+
+    deadline = time.monotonic() + timeout
+    status = backend.status(batch_id)
+    while status not in BatchBackend.FINISHED_STATUS:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"The batch {batch_id} is not finished in {timeout} seconds, the status is {status}.")
+        time.sleep(poll_interval)
+        status = backend.status(batch_id)
+
+    by_id = {result["custom_id"]: result for result in backend.results(batch_id)}
+
+    outputs = []
+    for request in requests:
+        result = by_id.get(request["custom_id"])
+        if result is None:
+            outputs.append(BatchItemError(request["custom_id"], f"no result, the batch is {status}"))
+        elif result.get("error") or (result.get("response") or {}).get("status_code") != 200:
+            outputs.append(BatchItemError(request["custom_id"], result.get("error") or result.get("response")))
+        else:
+            outputs.append(result["response"]["body"])
+
+    return outputs
@@ -0,0 +1,484 @@
+"""
+=============
+ResponseCache
+=============
+@file_name: cache.py
+@author: Bin Liang
+@date: 2024-05-09
+The exact-match response cache for the LLM clients, with in-memory LRU, SQLite and mmap'd-shard backends.
+"""
+
+__all__ = ["ResponseCache", "CacheBackend", "MemoryBackend", "SQLiteBackend", "MmapShardBackend"]
+
+import os
+import json
+import mmap
+import time
+import struct
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, List
+
+from openai.types.chat import ChatCompletion
+
+
+class CacheBackend:
+    """
+    The basic class of the cache backends. A backend is a bytes key-value store with its own size cap and eviction.
+    """
+    evictions: int = 0
+
+    def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """
+    An in-memory LRU backend, capped by the number of entries and the total bytes.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024) -> None:
+        """
+        Parameters
+        ----------
+        max_entries: int
+            The max number of the entries.
+        max_bytes: int
+            The max total size of the values.
+        """
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            old_value = self._data.pop(key, None)
+            if old_value is not None:
+                self._bytes -= len(old_value)
+            self._data[key] = value
+            self._bytes += len(value)
+
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._bytes -= len(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    An on-disk SQLite backend, capped by the number of entries. The least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = "cache/llm_cache.sqlite", max_entries: int = 1000000) -> None:
+        """
+        Parameters
+        ----------
+        path: str
+            The path of the SQLite database file.
+        max_entries: int
+            The max number of the entries.
+        """
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS cache "
+                                 "(key TEXT PRIMARY KEY, value BLOB NOT NULL, accessed_at REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO cache (key, value, accessed_at) VALUES (?, ?, ?)",
+                                     (key, value, time.time()))
+            overflow = self._count() - self.max_entries
+            if overflow > 0:
+                self._connection.execute("DELETE FROM cache WHERE key IN "
+                                         "(SELECT key FROM cache ORDER BY accessed_at LIMIT ?)", (overflow,))
+                self.evictions += overflow
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count()
+
+    def _count(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class MmapShardBackend(CacheBackend):
+    """
+    An on-disk backend made of fixed-size memory-mapped shard files. The records are appended to the current shard;
+    when it is full, the oldest shard is wiped and reused. So the eviction is by whole shard (FIFO) and the writes are
+    sequential. A read copies the value out of the page cache while the lock is held, so the shard can be wiped and
+    closed while the caller still uses the value.
+
+    The layout of a shard: [generation: uint64] [record]* [0-terminator], a record is
+    [key length: uint16] [value length: uint32] [key] [value]. A value length of 0 is a tombstone (deleted key).
+    """
+
+    SHARD_HEADER = struct.Struct("<Q")
+    RECORD_HEADER = struct.Struct("<HI")
+
+    def __init__(self, directory: str = "cache/llm_shards", num_shards: int = 8,
+                 shard_bytes: int = 64 * 1024 * 1024) -> None:
+        """
+        Parameters
+        ----------
+        directory: str
+            The directory of the shard files.
+        num_shards: int
+            The number of the shards. The total size cap is num_shards * shard_bytes.
+        shard_bytes: int
+            The size of each shard file.
+        """
+
+        assert num_shards >= 2, "We need at least two shards to evict one of them."
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.num_shards = num_shards
+        self.shard_bytes = shard_bytes
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._files = []
+        self._maps = []
+        self._generations = []
+        self._index = {}
+        self._shard_keys = [set() for _ in range(num_shards)]
+
+        for i in range(num_shards):
+            path = os.path.join(directory, f"shard-{i:03d}.bin")
+            file = open(path, "a+b")
+            if os.path.getsize(path) != shard_bytes:
+                file.truncate(shard_bytes)
+            self._files.append(file)
+            self._maps.append(mmap.mmap(file.fileno(), shard_bytes))
+            self._generations.append(self.SHARD_HEADER.unpack_from(self._maps[i], 0)[0])
+
+        # Rebuild the index from the oldest shard to the newest, so the newer records win.
+        self._offset = self.SHARD_HEADER.size
+        for i in sorted(range(num_shards), key=lambda index: self._generations[index]):
+            self._offset = self._scan(i)
+        self._current = max(range(num_shards), key=lambda index: self._generations[index])
+        if self._generations[self._current] == 0:
+            self._reset_shard(self._current, 1)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            shard, start, length = location
+            return self._maps[shard][start:start + length]
+
+    def set(self, key: str, value: bytes) -> None:
+        assert value, "The value of the cache can not be empty."
+        with self._lock:
+            self._append(key.encode(), value)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._index:
+                self._append(key.encode(), b"")
+
+    def clear(self) -> None:
+        with self._lock:
+            for i in range(self.num_shards):
+                self._reset_shard(i, 0)
+            self._reset_shard(0, 1)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def close(self) -> None:
+        with self._lock:
+            for shard_map, file in zip(self._maps, self._files):
+                shard_map.flush()
+                shard_map.close()
+                file.close()
+
+    def _append(self, key: bytes, value: bytes) -> None:
+        size = self.RECORD_HEADER.size + len(key) + len(value)
+        if size + self.SHARD_HEADER.size + self.RECORD_HEADER.size > self.shard_bytes:
+            # Too large for one shard, do not cache it.
+            return
+
+        if self._offset + size + self.RECORD_HEADER.size > self.shard_bytes:
+            oldest = min(range(self.num_shards), key=lambda index: self._generations[index])
+            self._reset_shard(oldest, max(self._generations) + 1)
+
+        shard_map = self._maps[self._current]
+        offset = self._offset
+        self.RECORD_HEADER.pack_into(shard_map, offset, len(key), len(value))
+        start = offset + self.RECORD_HEADER.size
+        shard_map[start:start + len(key)] = key
+        shard_map[start + len(key):start + size - self.RECORD_HEADER.size] = value
+        self._offset = offset + size
+        # Terminate the records, so the next scan stops here.
+        self.RECORD_HEADER.pack_into(shard_map, self._offset, 0, 0)
+
+        self._apply(self._current, key.decode(), start + len(key), len(value))
+
+    def _scan(self, shard: int) -> int:
+        shard_map = self._maps[shard]
+        offset = self.SHARD_HEADER.size
+        if self._generations[shard] == 0:
+            return offset
+
+        while offset + self.RECORD_HEADER.size <= self.shard_bytes:
+            key_length, value_length = self.RECORD_HEADER.unpack_from(shard_map, offset)
+            if key_length == 0:
+                break
+            start = offset + self.RECORD_HEADER.size
+            key = bytes(shard_map[start:start + key_length]).decode()
+            self._apply(shard, key, start + key_length, value_length)
+            offset = start + key_length + value_length
+
+        return offset
+
+    def _apply(self, shard: int, key: str, start: int, length: int) -> None:
+        if length == 0:
+            location = self._index.pop(key, None)
+            if location is not None:
+                self._shard_keys[location[0]].discard(key)
+            return
+
+        location = self._index.get(key)
+        if location is not None:
+            self._shard_keys[location[0]].discard(key)
+        self._index[key] = (shard, start, length)
+        self._shard_keys[shard].add(key)
+
+    def _reset_shard(self, shard: int, generation: int) -> None:
+        for key in self._shard_keys[shard]:
+            if self._index.get(key, (None,))[0] == shard:
+                del self._index[key]
+                self.evictions += 1
+        self._shard_keys[shard] = set()
+
+        self.SHARD_HEADER.pack_into(self._maps[shard], 0, generation)
+        self.RECORD_HEADER.pack_into(self._maps[shard], self.SHARD_HEADER.size, 0, 0)
+        self._generations[shard] = generation
+        self._current = shard
+        self._offset = self.SHARD_HEADER.size
+
+
+class ResponseCache:
+    """
+    The exact-match cache of the LLM responses. The key is the hash of the (generate_args, messages, tools) of the
+    request, so only the identical requests can hit.
+
+    1. Non-streaming requests cache the whole `ChatCompletion`.
+    2. Streaming requests cache the text chunks, and a hit replays the chunks.
+    3. By default, only the deterministic requests (temperature == 0) are cached.
+
+    Examples
+    --------
+    >>> from xyz.utils.llm.cache import ResponseCache, SQLiteBackend
+    >>> cache = ResponseCache(SQLiteBackend("cache/llm_cache.sqlite"), ttl=7 * 24 * 3600)
+    >>> client = OpenAIClient(cache=cache)
+    >>> ...
+    >>> cache.stats()
+    {'hits': 120, 'misses': 30, 'sets': 30, 'expired': 0, 'evictions': 0, 'entries': 30}
+    """
+
+    def __init__(self, backend: CacheBackend = None, ttl: float = None, only_deterministic: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        backend: CacheBackend, optional
+            The storage of the cache. By default, a `MemoryBackend()`.
+        ttl: float, optional
+            The time to live of the entries in seconds. None means the entries never expire.
+        only_deterministic: bool
+            Whether to only cache the requests with temperature == 0.
+        """
+
+        self.backend = MemoryBackend() if backend is None else backend
+        self.ttl = ttl
+        self.only_deterministic = only_deterministic
+
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "expired": 0}
+
+    def is_cacheable(self, generate_args: dict) -> bool:
+        """
+        Whether the request with these generate arguments can be cached.
+        """
+
+        if not self.only_deterministic:
+            return True
+
+        return generate_args.get("temperature", 1.) == 0 and generate_args.get("n", 1) == 1
+
+    @staticmethod
+    def make_key(generate_args: dict, messages: List, tools: List = None, stream: bool = False) -> str:
+        """
+        Make the content hash of a request.
+
+        Parameters
+        ----------
+        generate_args: dict
+            The generate arguments (model, temperature, ...) of the request.
+        messages: list
+            The messages of the request.
+        tools: list, optional
+            The tools of the request.
+        stream: bool
+            Whether it is a streaming request. The two kinds are cached separately.
+
+        Returns
+        -------
+        str
+            The sha256 hex digest.
+        """
+
+        payload = json.dumps({"generate_args": generate_args, "messages": messages, "tools": tools or [],
+                              "stream": stream}, sort_keys=True, ensure_ascii=False, default=str)
+
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_completion(self, key: str) -> ChatCompletion | None:
+        """
+        Get the cached `ChatCompletion` of a non-streaming request.
+        """
+
+        entry = self._get(key)
+        if entry is None:
+            return None
+
+        return ChatCompletion.model_validate(entry["completion"])
+
+    def set_completion(self, key: str, completion: ChatCompletion) -> None:
+        """
+        Cache the `ChatCompletion` of a non-streaming request.
+        """
+
+        self._set(key, {"completion": completion.model_dump(mode="json")})
+
+    def get_chunks(self, key: str) -> List[str] | None:
+        """
+        Get the cached text chunks of a streaming request.
+        """
+
+        entry = self._get(key)
+        if entry is None:
+            return None
+
+        return entry["chunks"]
+
+    def set_chunks(self, key: str, chunks: List[str]) -> None:
+        """
+        Cache the text chunks of a streaming request. Only call it when the stream is finished normally.
+        """
+
+        self._set(key, {"chunks": chunks})
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the cache.
+
+        Returns
+        -------
+        dict
+            The hits, misses, sets, expired entries, evictions of the backend and the number of the entries.
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+        stats["evictions"] = self.backend.evictions
+        stats["entries"] = len(self.backend)
+
+        return stats
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def _get(self, key: str) -> Any:
+        value = self.backend.get(key)
+        entry = None if value is None else json.loads(value)
+
+        if entry is not None and entry["expires_at"] is not None and entry["expires_at"] < time.time():
+            self.backend.delete(key)
+            self._count("expired")
+            entry = None
+
+        self._count("misses" if entry is None else "hits")
+
+        return entry
+
+    def _set(self, key: str, entry: dict) -> None:
+        entry["expires_at"] = None if self.ttl is None else time.time() + self.ttl
+        self.backend.set(key, json.dumps(entry, ensure_ascii=False).encode())
+        self._count("sets")
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
@@ -0,0 +1,388 @@
+"""
+========
+Cassette
+========
+@file_name: cassette.py
+@author: Bin Liang
+@date: 2024-06-01
+Record the real requests and responses of the LLM clients (with the timing of the streamed chunks) into a cassette
+file, and replay them later at the original or a scaled speed, without the network.
+"""
+
+__all__ = ["Cassette", "RecordingTransport", "ReplayTransport", "use_cassette", "cassette_from_env"]
+
+import os
+import gzip
+import json
+import time
+import codecs
+import asyncio
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Callable, List, Tuple
+
+import httpx
+
+from xyz.utils.llm.mock_transport import TimedByteStream
+
+# The response headers which are replayed, the others (i.e. the ids and the cookies) are not recorded.
+_KEPT_HEADERS = ("content-type", "retry-after", "retry-after-ms")
+
+
+class Cassette:
+    """
+    A cassette file: one JSON line for each interaction, gzipped if the path ends with ".gz". An interaction is
+
+        {"time": seconds since the recording started, "key": the hash of the request,
+         "request": {"method", "path", "body"}, "status": int, "headers": {...},
+         "latency": seconds to the response headers, "chunks": [[seconds since the headers, text], ...]}
+
+    The body of a response is kept as the chunks which are read from the network, so a stream is replayed with the
+    same parts at the same times.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> List[dict]:
+        """
+        Read all the interactions of the cassette.
+        """
+
+        with self._open("rt") as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def append(self, interaction: dict) -> None:
+        """
+        Append an interaction to the cassette, it is written at once.
+        """
+
+        line = json.dumps(interaction, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._open("at") as file:
+                file.write(line)
+
+    @staticmethod
+    def get_key(method: str, path: str, body: dict) -> str:
+        """
+        The key of a request, the same requests (the model, the messages, the arguments) have the same key.
+        """
+
+        request = json.dumps({"method": method, "path": path, "body": body}, sort_keys=True, ensure_ascii=False)
+
+        return hashlib.sha256(request.encode()).hexdigest()[:32]
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode, encoding="utf-8")
+
+        return open(self.path, mode, encoding="utf-8")
+
+
+class RecordingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    A transport which sends the requests to the real API and records them into a cassette. The time of a chunk is the
+    time when it is read, so a consumer which is slower than the network makes the chunks later.
+
+    Examples
+    --------
+    >>> recorder = RecordingTransport("cassettes/auto_math.jsonl.gz")
+    >>> client = OpenAIClient(transport=httpx.Client(transport=recorder, timeout=600.))
+    >>> company = AutoCompany(llm_client=client)
+    """
+
+    def __init__(self, path: str, transport: httpx.BaseTransport = None,
+                 async_transport: httpx.AsyncBaseTransport = None) -> None:
+        """
+        Parameters
+        ----------
+        path: str
+            The path of the cassette, the interactions are appended to it.
+        transport: httpx.BaseTransport, optional
+            The transport of the blocking requests, by default a `httpx.HTTPTransport()`.
+        async_transport: httpx.AsyncBaseTransport, optional
+            The transport of the asyncio requests, by default a `httpx.AsyncHTTPTransport()`.
+        """
+
+        self.cassette = Cassette(path)
+        self.transport = httpx.HTTPTransport() if transport is None else transport
+        self.async_transport = httpx.AsyncHTTPTransport() if async_transport is None else async_transport
+        self.started_at = time.perf_counter()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        interaction = self._get_interaction(request)
+        response = self.transport.handle_request(request)
+
+        return self._wrap(response, interaction)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        interaction = self._get_interaction(request)
+        response = await self.async_transport.handle_async_request(request)
+
+        return self._wrap(response, interaction)
+
+    def close(self) -> None:
+        self.transport.close()
+
+    async def aclose(self) -> None:
+        await self.async_transport.aclose()
+
+    def _get_interaction(self, request: httpx.Request) -> dict:
+        # The body is recorded as the text of the API, not as the compressed bytes.
+        request.headers["Accept-Encoding"] = "identity"
+        try:
+            body = json.loads(request.content or b"{}")
+        except ValueError:
+            body = request.content.decode("utf-8", errors="replace")
+        path = request.url.path
+        key = Cassette.get_key(request.method, path, body)
+
+        return {"time": round(time.perf_counter() - self.started_at, 4), "key": key,
+                "request": {"method": request.method, "path": path, "body": body}, "sent_at": time.perf_counter()}
+
+    def _wrap(self, response: httpx.Response, interaction: dict) -> httpx.Response:
+        interaction["latency"] = round(time.perf_counter() - interaction.pop("sent_at"), 4)
+        interaction["status"] = response.status_code
+        interaction["headers"] = {key: response.headers[key] for key in _KEPT_HEADERS if key in response.headers}
+
+        def save(chunks: list) -> None:
+            interaction["chunks"] = chunks
+            self.cassette.append(interaction)
+
+        return httpx.Response(response.status_code, headers=response.headers, extensions=response.extensions,
+                              stream=_RecordingStream(response.stream, save, time.perf_counter()))
+
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    A transport which answers the requests by the interactions of a cassette, with the recorded latency and times of
+    the chunks divided by the `speed`.
+
+    1. match="request": the interaction of the same request (see `Cassette.get_key`). If a request is made more times
+       than it is recorded, its interactions are used again in turn. A request which is not recorded gets a 404 error,
+       or the next interaction of the same kind (stream or not) if `strict` is False.
+    2. match="sequence": the interactions in the recorded order (and again from the start), whatever the requests are.
+
+    Examples
+    --------
+    >>> replay = ReplayTransport("cassettes/auto_math.jsonl.gz", speed=2.)
+    >>> client = OpenAIClient(transport=httpx.Client(transport=replay))
+    >>> AutoCompany(llm_client=client)(user_input="Find the sum. \\( \\sum_{n=1}^{10} 4n - 5 \\)")
+    >>> replay.stats
+    {'requests': 10, 'hits': 10, 'misses': 0}
+    """
+
+    def __init__(self, path: str, speed: float = 1., match: str = "request", strict: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        path: str
+            The path of the cassette.
+        speed: float
+            The speed of the replay, i.e. 2 is twice as fast as the recording. 0 means no waiting at all.
+        match: str
+            "request" or "sequence", see above.
+        strict: bool
+            Whether a request which is not recorded is an error, in the "request" match.
+        """
+
+        assert speed >= 0., "The speed must not be negative."
+        assert match in ("request", "sequence"), "The match must be 'request' or 'sequence'."
+
+        self.speed = speed
+        self.match = match
+        self.strict = strict
+        self.interactions = Cassette(path).load()
+        if not self.interactions:
+            raise ValueError(f"The cassette {path} has no interactions.")
+
+        self._lock = threading.Lock()
+        self._by_key = defaultdict(list)
+        for interaction in self.interactions:
+            self._by_key[interaction["key"]].append(interaction)
+        self._uses = defaultdict(int)
+        self._next = 0
+        self.stats = {"requests": 0, "hits": 0, "misses": 0}
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        delay, response = self._respond(request)
+        if delay:
+            time.sleep(delay)
+
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        delay, response = self._respond(request)
+        if delay:
+            await asyncio.sleep(delay)
+
+        return response
+
+    def _respond(self, request: httpx.Request) -> Tuple[float, httpx.Response]:
+        try:
+            body = json.loads(request.content or b"{}")
+        except ValueError:
+            body = request.content.decode("utf-8", errors="replace")
+        key = Cassette.get_key(request.method, request.url.path, body)
+        stream = _is_stream(body)
+
+        with self._lock:
+            self.stats["requests"] += 1
+            interaction = self._find(key, stream)
+            self.stats["hits" if interaction is not None and interaction["key"] == key else "misses"] += 1
+        if interaction is None:
+            return 0., httpx.Response(404, json={"error": {"message": f"The request {key} is not in the cassette.",
+                                                           "type": "cassette_miss"}})
+
+        scale = 1. / self.speed if self.speed else 0.
+        chunks = [(offset * scale, text.encode("utf-8")) for offset, text in interaction["chunks"]]
+
+        return interaction["latency"] * scale, httpx.Response(interaction["status"], headers=interaction["headers"],
+                                                              stream=TimedByteStream(chunks))
+
+    def _find(self, key: str, stream: bool) -> dict | None:
+        """
+        The interaction which answers a request, it must be called with the lock.
+        """
+
+        if self.match == "sequence":
+            interaction = self.interactions[self._next % len(self.interactions)]
+            self._next += 1
+            return interaction
+
+        candidates = self._by_key.get(key)
+        if not candidates:
+            if self.strict:
+                return None
+            candidates = [interaction for interaction in self.interactions
+                          if _is_stream(interaction["request"]["body"]) == stream] or self.interactions
+        interaction = candidates[self._uses[key] % len(candidates)]
+        self._uses[key] += 1
+
+        return interaction
+
+
+def use_cassette(path: str, mode: str = "replay", name: str = "default", **kwargs):
+    """
+    Record or replay all the clients of a named transport of the `transport_registry` (by default, all the clients
+    which are built with the default arguments). The clients which already exist keep their connections, so call it
+    before the clients are built.
+
+    Parameters
+    ----------
+    path: str
+        The path of the cassette.
+    mode: str
+        "record" or "replay".
+    name: str
+        The name of the transport.
+    **kwargs
+        The arguments of the `RecordingTransport` or the `ReplayTransport`.
+
+    Returns
+    -------
+    RecordingTransport or ReplayTransport
+        The transport of the cassette.
+
+    Examples
+    --------
+    >>> use_cassette("cassettes/pai.jsonl.gz", mode="replay", speed=1.)
+    >>> client = OpenAIClient()
+    """
+
+    from xyz.utils.llm.transport import transport_registry
+
+    transport = _build_transport(path, mode, **kwargs)
+    transport_registry.configure(name, transport=transport)
+
+    return transport
+
+
+def cassette_from_env():
+    """
+    The cassette transport of the environment, i.e. XYZ_CASSETTE=record:cassettes/run.jsonl.gz or
+    XYZ_CASSETTE=replay:cassettes/run.jsonl.gz (with XYZ_CASSETTE_SPEED=2), or None.
+    """
+
+    value = os.getenv("XYZ_CASSETTE")
+    if not value:
+        return None
+    mode, _, path = value.partition(":")
+    if not path:
+        raise ValueError(f"XYZ_CASSETTE must be 'record:path' or 'replay:path', not {value!r}.")
+    kwargs = {"speed": float(os.environ["XYZ_CASSETTE_SPEED"])} \
+        if mode == "replay" and os.getenv("XYZ_CASSETTE_SPEED") else {}
+
+    return _build_transport(path, mode, **kwargs)
+
+
+def _is_stream(body) -> bool:
+    return isinstance(body, dict) and bool(body.get("stream"))
+
+
+def _build_transport(path: str, mode: str, **kwargs):
+    if mode == "record":
+        return RecordingTransport(path, **kwargs)
+    if mode == "replay":
+        return ReplayTransport(path, **kwargs)
+
+    raise ValueError(f"The mode of a cassette must be 'record' or 'replay', not {mode!r}.")
+
+
+class _RecordingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """
+    The body of a recorded response: the chunks are passed on as they are read, with their time and text, and saved
+    when the response is closed.
+    """
+
+    def __init__(self, stream, on_close: Callable[[list], None], started_at: float) -> None:
+        self.stream = stream
+        self.on_close = on_close
+        self.started_at = started_at
+        self.chunks = []
+        # A chunk may end in the middle of a character.
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._closed = False
+
+    def __iter__(self):
+        for data in self.stream:
+            self._add(data)
+            yield data
+
+    async def __aiter__(self):
+        async for data in self.stream:
+            self._add(data)
+            yield data
+
+    def close(self) -> None:
+        try:
+            self.stream.close()
+        finally:
+            self._finish()
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            self._finish()
+
+    def _add(self, data: bytes) -> None:
+        self.chunks.append([round(time.perf_counter() - self.started_at, 4), self._decoder.decode(data)])
+
+    def _finish(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        tail = self._decoder.decode(b"", final=True)
+        if tail:
+            self.chunks.append([round(time.perf_counter() - self.started_at, 4), tail])
+        self.on_close(self.chunks)
@@ -0,0 +1,318 @@
+"""
+==========
+JSONStream
+==========
+@file_name: json_stream.py
+@author: Bin Liang
+@date: 2024-05-23
+The incremental parser of a JSON object which is streamed by the LLM, and the lenient parser of a JSON reply.
+"""
+
+__all__ = ["JSONStreamParser", "parse_json"]
+
+import re
+import json
+from typing import Any, List, Tuple
+
+from xyz.utils.profiling import profiled
+
+_FENCE = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+_HEX = "0123456789abcdefABCDEF"
+
+
+@profiled
+def parse_json(text: str) -> Any:
+    """
+    Parse a JSON reply of the LLM. The markdown code fence and the text around the outermost object (or array) are
+    ignored.
+
+    Parameters
+    ----------
+    text: str
+        The reply.
+
+    Returns
+    -------
+    Any
+        The parsed object.
+
+    Raises
+    ------
+    ValueError
+        If there is no valid JSON in the reply.
+    """
+
+    text = text.strip()
+    match = _FENCE.match(text)
+    if match:
+        text = match.group(1)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if starts:
+        start = min(starts)
+        end = text.rfind("}" if text[start] == "{" else "]")
+        try:
+            return json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            pass
+
+    raise ValueError(f"No valid JSON in the reply: {text[:200]!r}")
+
+
+class JSONStreamParser:
+    """
+    Parse a JSON object while it is streamed, so a field can be used as soon as it arrives, before the whole reply is
+    finished. Only the spaces and a code fence can come before the object: a reply which starts with another text
+    (or with an array) is not a JSON object, so the objects nested in it are never read as the reply.
+
+    `feed` returns the events of the new text:
+
+    1. ("delta", key, text): a new piece of a top-level string value, to show it live.
+    2. ("field", key, value): a top-level value is complete.
+
+    Examples
+    --------
+    >>> parser = JSONStreamParser()
+    >>> parser.feed('{"next_step": "Solve the equ')
+    [('delta', 'next_step', 'Solve the equ')]
+    >>> parser.feed('ation", "summary": ')
+    [('delta', 'next_step', 'ation'), ('field', 'next_step', 'Solve the equation')]
+    >>> parser.fields
+    {'next_step': 'Solve the equation'}
+    """
+
+    def __init__(self, strict: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        strict: bool
+            If True, a stream which is not a JSON object raises a ValueError. Otherwise, the parser stops, the error is
+            kept in `error`, and the fields which are read so far are kept.
+        """
+
+        self.strict = strict
+        self.fields = {}
+        self.done = False
+        self.error = None
+
+        self._state = "start"
+        self._key = None
+        self._raw = []
+        # The raw text of the current string value which is not decoded yet, and the decoded pieces.
+        self._pending = ""
+        self._decoded = []
+        # For a nested value: the depth, and whether we are in a string of it.
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> List[Tuple]:
+        """
+        Parse the next piece of the stream.
+
+        Parameters
+        ----------
+        text: str
+            The new text.
+
+        Returns
+        -------
+        list
+            The new events, see the class.
+
+        Raises
+        ------
+        ValueError
+            If the stream is not a JSON object, in the strict mode.
+        """
+
+        events = []
+        if self.error is not None:
+            return events
+        try:
+            for char in text:
+                if self.done:
+                    break
+                self._step(char, events)
+        except ValueError as error:
+            self.error = error
+            if self.strict:
+                raise
+            return events
+
+        if self._state == "string_value":
+            self._emit_delta(events, final=False)
+
+        return events
+
+    def close(self) -> dict:
+        """
+        Check the stream is finished.
+
+        Returns
+        -------
+        dict
+            All the fields.
+
+        Raises
+        ------
+        ValueError
+            If the object is not complete.
+        """
+
+        if not self.done:
+            raise ValueError(f"The JSON object is not complete, the fields {sorted(self.fields)} are read.")
+
+        return self.fields
+
+    def _step(self, char: str, events: list) -> None:
+        state = self._state
+
+        if state == "start":
+            if char == "{":
+                self._state = "key_wait"
+            elif char == "`":
+                self._state = "fence"
+            elif not char.isspace():
+                raise ValueError(f"The reply is not a JSON object, it starts with {char!r}.")
+        elif state == "fence":
+            # The rest of the first line of a code fence, i.e. "```json".
+            if char == "\n":
+                self._state = "start"
+            elif char == "{":
+                self._state = "key_wait"
+        elif state == "key_wait":
+            if char == '"':
+                self._state, self._raw = "key", []
+            elif char == "}":
+                self.done = True
+            elif not (char.isspace() or char == ","):
+                raise ValueError(f"Unexpected {char!r} before a key of the JSON object.")
+        elif state == "key":
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._key = json.loads('"' + "".join(self._raw) + '"')
+                self._state = "colon"
+                return
+            self._raw.append(char)
+        elif state == "colon":
+            if char == ":":
+                self._state = "value_wait"
+            elif not char.isspace():
+                raise ValueError(f"Unexpected {char!r} after the key {self._key!r}.")
+        elif state == "value_wait":
+            if char.isspace():
+                return
+            if char == '"':
+                self._state, self._pending, self._decoded = "string_value", "", []
+            else:
+                self._state, self._raw = "value", [char]
+                self._depth = 1 if char in "{[" else 0
+                self._in_string = False
+        elif state == "string_value":
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._emit_delta(events, final=True)
+                self._add_field("".join(self._decoded), events)
+                return
+            self._pending += char
+        elif state == "value":
+            self._step_value(char, events)
+        elif state == "after_value":
+            if char == ",":
+                self._state = "key_wait"
+            elif char == "}":
+                self.done = True
+            elif not char.isspace():
+                raise ValueError(f"Unexpected {char!r} after the value of {self._key!r}.")
+
+    def _step_value(self, char: str, events: list) -> None:
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+            self._raw.append(char)
+            return
+
+        if self._depth == 0 and (char in ",}" or char.isspace()):
+            # The end of a number, true, false or null.
+            self._add_field(json.loads("".join(self._raw)), events)
+            if char != "," and char != "}":
+                return
+            self._step(char, events)
+            return
+
+        self._raw.append(char)
+        if char == '"':
+            self._in_string = True
+        elif char in "{[":
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._add_field(json.loads("".join(self._raw)), events)
+
+    def _add_field(self, value: Any, events: list) -> None:
+        self.fields[self._key] = value
+        events.append(("field", self._key, value))
+        self._state = "after_value"
+
+    def _emit_delta(self, events: list, final: bool) -> None:
+        pending = self._pending
+        if not final:
+            # Keep an incomplete escape (or the first half of a surrogate pair) until the rest of it arrives.
+            cut = self._safe_length(pending)
+            pending, self._pending = pending[:cut], pending[cut:]
+        else:
+            self._pending = ""
+        if not pending:
+            return
+
+        text = json.loads('"' + pending + '"')
+        self._decoded.append(text)
+        events.append(("delta", self._key, text))
+
+    @staticmethod
+    def _safe_length(pending: str) -> int:
+        # Find where the escapes start, the escaped backslashes are skipped in pairs.
+        starts, i = [], 0
+        while i < len(pending):
+            if pending[i] == "\\":
+                starts.append(i)
+                i += 2
+            else:
+                i += 1
+        if not starts:
+            return len(pending)
+
+        last = starts[-1]
+        escape = pending[last:last + 6]
+        if len(escape) >= 2 and escape[1] != "u":
+            return len(pending)
+        if len(escape) == 6 and not _is_high_surrogate(escape):
+            return len(pending)
+
+        # An incomplete escape, or the first half of a surrogate pair, waits for the rest of it. So does the first half
+        # of a surrogate pair just before an incomplete escape.
+        if len(starts) > 1 and starts[-2] == last - 6 and _is_high_surrogate(pending[last - 6:last]):
+            return last - 6
+
+        return last
+
+
+def _is_high_surrogate(escape: str) -> bool:
+    return (escape[1] == "u" and all(char in _HEX for char in escape[2:])
+            and 0xD800 <= int(escape[2:], 16) <= 0xDBFF)
@@ -0,0 +1,365 @@
+"""
+=============
+MockTransport
+=============
+@file_name: mock_transport.py
+@author: Bin Liang
+@date: 2024-05-31
+A local HTTP transport which speaks the chat completions API of OpenAI, so the clients, the agents and the companies
+can run (and be benchmarked) without the network, the API key or the bill.
+"""
+
+__all__ = ["MockLLMTransport", "TimedByteStream", "create_mock_client", "split_tokens"]
+
+import re
+import json
+import time
+import random
+import asyncio
+import itertools
+import threading
+from typing import Any, Callable, Iterable, List, Tuple
+
+import httpx
+from openai import OpenAI
+
+# About 4 characters of the text in a token, with the spaces in front of them.
+_TOKEN_REGEX = re.compile(r"\s*\S{1,4}|\s+")
+
+
+class MockLLMTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    An in-process `/chat/completions` server for the `OpenAIClient`. The requests go through the whole client (the
+    retry policy, the rate limiter, the streaming, the usage), only the HTTP connection is replaced, so the time of a
+    call is the time of the orchestration plus the simulated time of the model.
+
+    The replies are deterministic: they are chosen by the rules below, and the errors and the jitter come from a
+    seeded random generator. A reply is the text of the answer, or a tool call {"name": str, "arguments": dict}.
+
+    1. `replies` is None: the content of the last message is echoed.
+    2. a str: it is always the reply.
+    3. a list: the replies in turn (and again from the start).
+    4. a dict {regex: reply}: the reply of the first regex which is found in the contents of the messages, otherwise
+       the echo.
+    5. a callable: `replies(body)` with the JSON body of the request.
+
+    If the request has tools but the reply is a text, the first tool is called with all its required parameters set to
+    the text.
+
+    Examples
+    --------
+    >>> transport = MockLLMTransport(replies={"make a plan": "|||working-plan\\n[...]\\n|||working-plan"},
+    >>>                              latency=0.3, tokens_per_second=50.)
+    >>> client = create_mock_client(transport, model="gpt-4o")
+    >>> client.run([{"role": "user", "content": "Hello"}]).choices[0].message.content
+    'Hello'
+    >>> transport.stats["requests"], transport.stats["completion_tokens"]
+    (1, 2)
+    """
+
+    def __init__(self, replies: str | list | dict | Callable[[dict], Any] = None, latency: float = 0.,
+                 tokens_per_second: float = None, jitter: float = 0., error_rate: float = 0., error_status: int = 429,
+                 retry_after: float = 0., seed: int = 0) -> None:
+        """
+        Parameters
+        ----------
+        replies: str or list or dict or callable, optional
+            How the replies are chosen, see above. By default, the echo of the last message.
+        latency: float
+            The seconds before the first token (the time to the first token), by default 0.
+        tokens_per_second: float, optional
+            The speed of the generation. By default, all the tokens come at once.
+        jitter: float
+            The relative random spread of the latency and of the gaps between the tokens, i.e. 0.2 is +-20%.
+        error_rate: float
+            The part of the requests which fail with the `error_status` (before the latency), by default 0.
+        error_status: int
+            The HTTP status of the failed requests, by default 429 (rate limit).
+        retry_after: float
+            The seconds in the "retry-after-ms" header of the failed requests, by default 0.
+        seed: int
+            The seed of the errors and the jitter.
+        """
+
+        assert latency >= 0., "The latency must not be negative."
+        assert tokens_per_second is None or tokens_per_second > 0, "The tokens_per_second must be positive."
+        assert 0. <= jitter < 1., "The jitter must be in [0, 1)."
+        assert 0. <= error_rate <= 1., "The error_rate must be in [0, 1]."
+
+        self.replies = replies
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_reply = 0
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """
+        Clear the counters: the requests, the streams, the errors, the tokens and the simulated seconds of the model.
+        """
+
+        with self._lock:
+            self.stats = {"requests": 0, "streams": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                          "simulated_seconds": 0.}
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        delay, response = self._respond(request)
+        if delay:
+            time.sleep(delay)
+
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        delay, response = self._respond(request)
+        if delay:
+            await asyncio.sleep(delay)
+
+        return response
+
+    def get_reply(self, body: dict) -> str | dict:
+        """
+        Choose the reply of a request, see the rules of the class.
+
+        Parameters
+        ----------
+        body: dict
+            The JSON body of the request.
+
+        Returns
+        -------
+        str or dict
+            The text, or the tool call {"name": str, "arguments": dict or str}.
+        """
+
+        messages = body.get("messages") or []
+        if callable(self.replies):
+            return self.replies(body)
+        if isinstance(self.replies, str):
+            return self.replies
+        if isinstance(self.replies, list):
+            with self._lock:
+                reply = self.replies[self._next_reply % len(self.replies)]
+                self._next_reply += 1
+            return reply
+        if isinstance(self.replies, dict):
+            contents = "\n".join(_get_text(message.get("content")) for message in messages)
+            for pattern, reply in self.replies.items():
+                if re.search(pattern, contents):
+                    return reply
+
+        return _get_text(messages[-1].get("content")) if messages else ""
+
+    def _respond(self, request: httpx.Request) -> Tuple[float, httpx.Response]:
+        """
+        Build the response of a request, and the seconds to wait before it is sent.
+        """
+
+        if request.method != "POST" or not request.url.path.endswith("/chat/completions"):
+            return 0., httpx.Response(404, json={"error": {"message": f"Not found: {request.url.path}"}})
+
+        body = json.loads(request.content or b"{}")
+        stream = bool(body.get("stream"))
+        with self._lock:
+            self.stats["requests"] += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+        if failed:
+            return 0., httpx.Response(self.error_status, headers={"retry-after-ms": str(int(self.retry_after * 1000))},
+                                      json={"error": {"message": "The mock server fails on purpose.",
+                                                      "type": "mock_error"}})
+
+        reply = self.get_reply(body)
+        tool_call = _get_tool_call(reply, body.get("tools"))
+        tokens = split_tokens(tool_call["function"]["arguments"] if tool_call else reply)
+        usage = {"prompt_tokens": _count_prompt_tokens(body), "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = body.get("model", "mock")
+
+        with self._lock:
+            latency = self._spread(self.latency)
+            gaps = [self._spread(1. / self.tokens_per_second) if self.tokens_per_second else 0. for _ in tokens]
+            self.stats["streams"] += stream
+            self.stats["prompt_tokens"] += usage["prompt_tokens"]
+            self.stats["completion_tokens"] += usage["completion_tokens"]
+            self.stats["simulated_seconds"] += latency + sum(gaps)
+
+        if not stream:
+            message = {"role": "assistant", "content": None if tool_call else reply}
+            if tool_call:
+                message["tool_calls"] = [tool_call]
+            completion = {"id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                          "model": model, "usage": usage,
+                          "choices": [{"index": 0, "message": message,
+                                       "finish_reason": "tool_calls" if tool_call else "stop"}]}
+            return latency + sum(gaps), httpx.Response(200, json=completion)
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        chunks = _get_chunks(model, tokens, tool_call, usage if include_usage else None)
+        # The first token comes after the latency, then one token after each gap, then the end at once.
+        offsets = list(itertools.accumulate([latency + (gaps[0] if gaps else 0.)] + gaps[1:]))
+        offsets += offsets[-1:] * (len(chunks) - len(offsets))
+
+        return 0., httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  stream=TimedByteStream(zip(offsets, chunks)))
+
+    def _spread(self, seconds: float) -> float:
+        if not self.jitter or not seconds:
+            return seconds
+
+        return seconds * (1. + self._random.uniform(-self.jitter, self.jitter))
+
+
+class TimedByteStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """
+    The body of a response which is sent in parts, each of them at its time, i.e. the server-sent events of a
+    streamed completion. It can be read by the blocking and the asyncio clients.
+
+    The times are counted from the start of the reading, like the parts which wait in the buffer of a connection: if
+    the consumer is slow, the next part is ready at once, and the time of the consumer is not added to the stream.
+    """
+
+    def __init__(self, events: Iterable[Tuple[float, bytes]]) -> None:
+        """
+        Parameters
+        ----------
+        events: Iterable[Tuple[float, bytes]]
+            The (seconds since the start, bytes) of the parts, in order.
+        """
+
+        self.events = list(events)
+
+    def __iter__(self):
+        started_at = time.perf_counter()
+        for offset, data in self.events:
+            delay = started_at + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield data
+
+    async def __aiter__(self):
+        started_at = time.perf_counter()
+        for offset, data in self.events:
+            delay = started_at + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield data
+
+
+def create_mock_client(transport: MockLLMTransport = None, client_class: type = None, **generate_args):
+    """
+    Build a client (an `OpenAIClient` by default) whose requests are served by the mock transport. The other
+    arguments of the client (i.e. the retry policy, the cache, the ledger) can be given as well.
+
+    Parameters
+    ----------
+    transport: MockLLMTransport, optional
+        The mock server, by default one which echoes.
+    client_class: type, optional
+        `OpenAIClient` or `AsyncOpenAIClient` (or a subclass of them), by default `OpenAIClient`.
+    **generate_args
+        The arguments of the client.
+
+    Returns
+    -------
+    OpenAIClient
+        The client. Both the blocking and the asyncio requests of an `AsyncOpenAIClient` go to the mock.
+    """
+
+    from xyz.utils.llm.openai_client import AsyncOpenAIClient, OpenAIClient
+
+    transport = MockLLMTransport() if transport is None else transport
+    client_class = OpenAIClient if client_class is None else client_class
+    if issubclass(client_class, AsyncOpenAIClient):
+        client = client_class(api_key="mock", transport=httpx.AsyncClient(transport=transport), **generate_args)
+        # The blocking requests would go to the shared pool (the real API) otherwise.
+        client.client = OpenAI(api_key="mock", http_client=httpx.Client(transport=transport), max_retries=0)
+        return client
+
+    return client_class(api_key="mock", transport=httpx.Client(transport=transport), **generate_args)
+
+
+def split_tokens(text: str) -> List[str]:
+    """
+    Split a text into the pieces of the mock tokens (about 4 characters each), which are joined back to the text.
+    """
+
+    return _TOKEN_REGEX.findall(text)
+
+
+def _get_text(content) -> str:
+    # The content of a message with images is a list of parts.
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+    return content or ""
+
+
+def _count_prompt_tokens(body: dict) -> int:
+    characters = sum(len(_get_text(message.get("content"))) for message in body.get("messages") or [])
+    if body.get("tools"):
+        characters += len(json.dumps(body["tools"]))
+
+    return max(1, characters // 4)
+
+
+def _get_tool_call(reply: str | dict, tools: list | None) -> dict | None:
+    """
+    The tool call of the reply in the format of the API, or None if the reply is a text without tools.
+    """
+
+    if isinstance(reply, dict):
+        name, arguments = reply["name"], reply.get("arguments", {})
+    elif tools:
+        function = tools[0]["function"]
+        name = function["name"]
+        arguments = {key: reply for key in function.get("parameters", {}).get("required", [])}
+    else:
+        return None
+
+    if not isinstance(arguments, str):
+        arguments = json.dumps(arguments, ensure_ascii=False)
+
+    return {"id": "call_mock", "type": "function", "function": {"name": name, "arguments": arguments}}
+
+
+def _get_chunks(model: str, tokens: List[str], tool_call: dict | None, usage: dict | None) -> List[bytes]:
+    """
+    The server-sent events of a streamed reply: one chunk for each token, the finish reason, the usage (if it is
+    asked for) and the end. There is at least one token chunk, so the first chunk carries the time to the first token.
+    """
+
+    def event(choices: list, **extra) -> bytes:
+        chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": model, "choices": choices, **extra}
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+
+    tokens = tokens or [""]
+    chunks = []
+    for i, token in enumerate(tokens):
+        if tool_call is None:
+            delta = {"content": token}
+        else:
+            function = {"arguments": token}
+            if i == 0:
+                function["name"] = tool_call["function"]["name"]
+            delta = {"tool_calls": [{"index": 0, "function": function}]}
+            if i == 0:
+                delta["tool_calls"][0].update(id=tool_call["id"], type="function")
+        if i == 0:
+            delta["role"] = "assistant"
+        chunks.append(event([{"index": 0, "delta": delta, "finish_reason": None}]))
+
+    chunks.append(event([{"index": 0, "delta": {}, "finish_reason": "tool_calls" if tool_call else "stop"}]))
+    if usage is not None:
+        chunks.append(event([], usage=usage))
+    chunks.append(b"data: [DONE]\n\n")
+
+    return chunks
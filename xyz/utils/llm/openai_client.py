@@ -9,18 +9,33 @@ To define the BlackSheep-Agent(The BasicCLass of Agent)
 """
 
 
-__all__ = ["OpenAIClient"]
+__all__ = ["OpenAIClient", "AsyncOpenAIClient"]
 
 import os
+import copy
 import time
-import traceback
-from typing import Generator, List
+from typing import AsyncGenerator, Callable, Generator, List
 
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from openai import Stream
+from openai.types import CompletionUsage
 from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
+from xyz.utils.llm.cache import ResponseCache
+from xyz.utils.llm.rate_limiter import RateLimiter, rate_limiter as shared_rate_limiter
+from xyz.utils.llm.retry import RetryPolicy
+from xyz.utils.llm.streaming import StreamStats, astream_text, stream_text
+from xyz.utils.llm.tokenizer import TokenCounter, get_context_window, get_token_counter
+from xyz.utils.llm.transport import transport_registry
+from xyz.utils.llm.usage import (PriceTable, UsageLedger, current_usage_scope, price_table as shared_price_table,
+                                 record_usage, usage_ledger as shared_usage_ledger)
+from xyz.utils.tracing import atrace_call, current_span, trace_call
+
+# The `.env` file only need to be loaded once in one process.
+_dotenv_loaded = False
+
 
 class OpenAIClient:
     """
@@ -35,21 +50,63 @@ class OpenAIClient:
     client: OpenAI
     generate_args: dict
     last_time_price: float
-
-    def __init__(self, api_key=None, **generate_args):
+    retry_policy: RetryPolicy
+    rate_limiter: RateLimiter
+    cache: ResponseCache | None
+    ledger: UsageLedger
+    prices: PriceTable
+
+    def __init__(self, api_key=None, transport: str | httpx.Client | None = "default",
+                 retry_policy: RetryPolicy = None, rate_limiter: RateLimiter = None, cache: ResponseCache = None,
+                 stream_timeout: float = 60., stream_buffer_size: int = 0, ledger: UsageLedger = None,
+                 prices: PriceTable = None, **generate_args):
         """Initializes the OpenAI Client.
 
         Parameters
         ----------
         api_key : str, optional
             The OpenAI API key.
+        transport : str or httpx.Client or None, optional
+            The HTTP transport of the client. A str is the name of a shared connection pool in the
+            `transport_registry`, by default all the clients share the "default" pool. A `httpx.Client` will be used
+            directly. None means the OpenAI SDK builds a private pool for this client.
+        retry_policy : RetryPolicy, optional
+            The retry policy of the requests. By default, a `RetryPolicy()` with exponential backoff.
+        rate_limiter : RateLimiter, optional
+            The client-side RPM/TPM limiter. By default, all the clients share the process-wide `rate_limiter`.
+        cache : ResponseCache, optional
+            The exact-match response cache. By default, there is no cache.
+        stream_timeout : float, optional
+            The max seconds to wait for the next chunk of a stream, by default 60.
+        stream_buffer_size : int, optional
+            If > 0, a stream is read by a background thread into a bounded buffer of this many chunks, by default 0
+            (the consumer reads the stream directly).
+        ledger : UsageLedger, optional
+            The ledger which records the usage and the cost of every call. By default, all the clients share the
+            process-wide `usage_ledger`. The calls are also recorded in the ledgers of the current `usage_scope`.
+        prices : PriceTable, optional
+            The prices of the models. By default, the process-wide `price_table`, which can be loaded from a file.
         """
 
+        self.transport = transport
+        self.cache = cache
+        self.stream_timeout = stream_timeout
+        self.stream_buffer_size = stream_buffer_size
+        self.last_stream_stats = None
+        self.last_time_price = 0.
+        self.last_usage = None
+        self.ledger = shared_usage_ledger if ledger is None else ledger
+        self.prices = shared_price_table if prices is None else prices
+        self.retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+        self.rate_limiter = shared_rate_limiter if rate_limiter is None else rate_limiter
         try:
-            if api_key is None:
-                load_dotenv()
-                api_key = os.getenv('OPENAI_API_KEY')
-            self.client = OpenAI(api_key=api_key)
+            api_key = self.resolve_api_key(api_key)
+            # The retries are done by our retry policy, so the SDK should not retry by itself.
+            if isinstance(transport, str):
+                self.client = OpenAI(api_key=api_key, http_client=transport_registry.get_client(transport),
+                                     max_retries=0)
+            else:
+                self.client = OpenAI(api_key=api_key, http_client=transport, max_retries=0)
         except:
             raise ValueError("The OpenAI client is not available. Please check the OpenAI API key.")
 
@@ -77,75 +134,58 @@ class OpenAIClient:
 
         Returns
         -------
-        str
+        ChatCompletion
             The assistant's response to the messages.
 
         Raises
         ------
+        RetryError
+            If all the attempts are failed by the retryable errors (i.e. rate limit, timeout).
         Exception
-            If there is an error while processing the messages.
+            The fatal error (i.e. bad request) is raised without retry.
         """
-        
+
+        return trace_call(self._get_span_name(), self._run, {"messages": messages, "tools": tools, "images": images},
+                          kind="client", attributes=self._get_span_attributes(current_usage_scope(), stream=False))
+
+    def _run(self, messages: List, tools: List = None, images: List = None) -> ChatCompletion:
         if images:
-            last_message = messages.pop()
-            text = last_message['content']
-            content = [
-                {"type": "text","text": text},
-            ]
-            for image_url in images:
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": image_url,
-                    },
-                })
-            messages.append({
-                "role": last_message['role'],
-                "content": content
-            })
-            
+            self.pack_images(messages, images)
 
-        # If the user provides tools, use them; otherwise, this client will not use any tools
-        if tools:
-            tool_choice = "auto"
-            local_tools = tools
-            tools = None    # Reset the tools parameter to avoid errors
-        else:
-            local_tools = []
-            tool_choice = "none"
-
-        get_response_signal = False
-        count = 0
-        while not get_response_signal and count < 10:
-            try:
-                # In OpenAI's api, if we request with tools == [], it will make an error. Caz the OpenAI use the default
-                # value is 'NOT_GIVEN' which is a special type designed by them.
-                if tool_choice == "auto":
-                    response = self.client.chat.completions.create(
-                        messages=messages,
-                        tools=local_tools,
-                        tool_choice="auto",
-                        **self.generate_args
-                    )
-                else:
-                    response = self.client.chat.completions.create(
-                        messages=messages,
-                        **self.generate_args
-                    )
-                get_response_signal = True
-
-                prompt_tokens = response.usage.prompt_tokens
-                completion_tokens = response.usage.completion_tokens
-                self.last_time_price = self.get_oai_fees(self.generate_args['model'], prompt_tokens, completion_tokens)
+        tools_args = self.get_tools_args(tools)
+        started_at = time.perf_counter()
+
+        cache_key = self._get_cache_key(messages, tools)
+        if cache_key is not None:
+            response = self.cache.get_completion(cache_key)
+            if response is not None:
+                self._record_usage(None, started_at, from_cache=True)
                 return response
-            except Exception:
-                count += 1
-                error_message = str(traceback.format_exc())
-                print(f"The error: {error_message}")
-                print(f"The messages: {messages}")
-                time.sleep(2)
 
-    def stream_run(self, messages: List, images: List) -> Generator[str, None, None]:
+        model = self.generate_args['model']
+        reserved_tokens = self.token_counter.count_messages(messages, tools)
+
+        # A failed request gives its reserved tokens back, so they are not debited again by the next attempt.
+        used_tokens = 0
+        try:
+            response = self.retry_policy.call(self._limit_attempts(model, reserved_tokens,
+                                                                   self.client.chat.completions.create),
+                                              messages=messages,
+                                              **tools_args,
+                                              **self.generate_args)
+            used_tokens = response.usage.total_tokens
+        finally:
+            self.rate_limiter.record(model, reserved_tokens, used_tokens)
+        self._record_usage(response.usage, started_at)
+        current_span().set_attribute("gen_ai.response.finish_reasons",
+                                     [choice.finish_reason for choice in response.choices])
+
+        if cache_key is not None:
+            self.cache.set_completion(cache_key, response)
+
+        return response
+
+    def stream_run(self, messages: List, images: List, stats: StreamStats = None) -> Generator[str, None, None]:
         """
         Run the assistant with the given messages in a streaming manner.
 
@@ -155,6 +195,9 @@ class OpenAIClient:
             A list of image URLs to be used by the assistant.
         messages : list
             A list of messages to be processed by the assistant.
+        stats : StreamStats, optional
+            The statistics (TTFT, inter-token latency, finish reason, usage) of this call will be filled in it. The
+            statistics of the last stream are also kept in `self.last_stream_stats`.
 
         Yields
         ------
@@ -163,49 +206,343 @@ class OpenAIClient:
 
         Raises
         ------
+        RetryError
+            If the stream can not be opened after all the attempts.
+        StreamInterruptedError
+            If the stream fails after it has yielded some text, and it can not be resumed without duplicating or
+            changing the text.
         Exception
-            If there is an error while processing the messages.
+            The fatal error.
         """
-        
+
+        # The body of the generator runs when it is consumed, maybe out of the caller's usage scope. The span lasts
+        # until the stream is consumed.
+        scope = current_usage_scope()
+        return trace_call(self._get_span_name(), self._stream_run,
+                          {"messages": messages, "images": images, "stats": stats, "scope": scope},
+                          kind="client", attributes=self._get_span_attributes(scope, stream=True))
+
+    def _stream_run(self, messages: List, images: List, stats: StreamStats, scope) -> Generator[str, None, None]:
+        started_at = time.perf_counter()
         if images:
-            last_message = messages.pop()
-            text = last_message['content']
-            content = [
-                {"type": "text","text": text},
-            ]
-            for image_url in images:
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": image_url,
-                    },
-                })
-            messages.append({
-                "role": last_message['role'],
-                "content": content
+            self.pack_images(messages, images)
+
+        stats = StreamStats() if stats is None else stats
+        self.last_stream_stats = stats
+
+        cache_key = self._get_cache_key(messages, stream=True)
+        if cache_key is not None:
+            chunks = self.cache.get_chunks(cache_key)
+            if chunks is not None:
+                stats.from_cache = True
+                self._record_usage(None, started_at, stream=True, from_cache=True, scope=scope)
+                for text in chunks:
+                    stats.on_text(text)
+                    yield text
+                return None
+
+        model = self.generate_args['model']
+        reserved_tokens = self.token_counter.count_messages(messages)
+
+        @self._limit_attempts(model, reserved_tokens)
+        def open_stream():
+            return self.client.chat.completions.create(messages=messages, stream=True,
+                                                       **self._get_stream_args(), **self.generate_args)
+
+        chunks = []
+        try:
+            for text in stream_text(open_stream, self.retry_policy, stats, self.stream_buffer_size):
+                chunks.append(text)
+                yield text
+        finally:
+            current_span().set_attributes(self._get_stream_span_attributes(stats))
+            usage = self._get_stream_usage(stats, reserved_tokens)
+            self.rate_limiter.record(model, reserved_tokens, usage.total_tokens)
+            # A broken stream is paid too, so it is recorded as well, unless it is never opened.
+            if stats.usage is not None or stats.characters:
+                self._record_usage(usage, started_at, stream=True, scope=scope)
+
+        # Only the stream which is finished normally can be cached.
+        if cache_key is not None:
+            self.cache.set_chunks(cache_key, chunks)
+
+    @property
+    def token_counter(self) -> TokenCounter:
+        """
+        The local token counter of the current model.
+        """
+
+        return get_token_counter(self.generate_args['model'])
+
+    def count_tokens(self, messages: List, tools: List = None) -> int:
+        """
+        Count the prompt tokens of a request locally, before it is sent.
+
+        Parameters
+        ----------
+        messages : list
+            The messages of the request.
+        tools : list, optional
+            The tools of the request.
+
+        Returns
+        -------
+        int
+            The number of the prompt tokens. It is exact with `tiktoken`, and estimated without it.
+        """
+
+        return self.token_counter.count_messages(messages, tools)
+
+    def get_prompt_budget(self, completion_tokens: int = 1024) -> int:
+        """
+        Get the max prompt tokens of a request: the context window of the model minus the room of the completion.
+
+        Parameters
+        ----------
+        completion_tokens : int
+            The room of the completion when `max_tokens` is not in the generate arguments, by default 1024.
+
+        Returns
+        -------
+        int
+            The token budget of the prompt.
+        """
+
+        completion_tokens = self.generate_args.get('max_tokens') or completion_tokens
+
+        return get_context_window(self.generate_args['model']) - completion_tokens
+
+    def with_generate_args(self, **generate_args) -> "OpenAIClient":
+        """
+        Get a client which has the same connection, cache, rate limiter and ledger, but other generate arguments. i.e.
+        `client.with_generate_args(response_format={"type": "json_object"})` for the JSON replies.
+
+        Parameters
+        ----------
+        **generate_args
+            The generate arguments to update.
+
+        Returns
+        -------
+        OpenAIClient
+            The new client (of the same class).
+        """
+
+        client = copy.copy(self)
+        client.generate_args = dict(self.generate_args, **generate_args)
+
+        return client
+
+    def _get_cache_key(self, messages: List, tools: List = None, stream: bool = False) -> str | None:
+        """
+        Get the cache key of the request, or None if the request should not be cached.
+
+        Parameters
+        ----------
+        messages : list
+            The messages of the request (images are already packed).
+        tools : list, optional
+            The tools of the request.
+        stream : bool
+            Whether it is a streaming request.
+
+        Returns
+        -------
+        str or None
+            The cache key.
+        """
+
+        if self.cache is None or not self.cache.is_cacheable(self.generate_args):
+            return None
+
+        return self.cache.make_key(self.generate_args, messages, tools, stream=stream)
+
+    def _get_stream_args(self) -> dict:
+        """
+        The arguments of a streaming request: the timeout between two chunks, and the usage in the last chunk.
+        """
+
+        return {"timeout": httpx.Timeout(self.stream_timeout, connect=5.),
+                "extra_body": {"stream_options": {"include_usage": True}}}
+
+    @staticmethod
+    def _get_stream_usage(stats: StreamStats, reserved_tokens: int) -> CompletionUsage:
+        """
+        The usage of a stream: the one sent by the server, otherwise estimated from the prompt and the text.
+        """
+
+        if stats.usage is not None:
+            return stats.usage
+
+        completion_tokens = stats.characters // 4
+        return CompletionUsage(prompt_tokens=reserved_tokens, completion_tokens=completion_tokens,
+                               total_tokens=reserved_tokens + completion_tokens)
+
+    def _limit_attempts(self, model: str, reserved_tokens: int, create: Callable = None) -> Callable:
+        """
+        Wrap the function which sends a request, so every attempt (a retry or a resumed stream) waits for one request
+        of the RPM budget. The prompt tokens are reserved by the first attempt only, since a failed attempt gives its
+        tokens back (see `RateLimiter.record`). It can be used as a decorator.
+        """
+
+        if create is None:
+            return lambda function: self._limit_attempts(model, reserved_tokens, function)
+        tokens = reserved_tokens
+
+        def limited(*args, **kwargs):
+            nonlocal tokens
+            self.rate_limiter.acquire(model, tokens)
+            tokens = 0
+            return create(*args, **kwargs)
+
+        return limited
+
+    def _alimit_attempts(self, model: str, reserved_tokens: int, create: Callable = None) -> Callable:
+        """
+        The asynchronous version of `_limit_attempts`, the `create` must return an awaitable.
+        """
+
+        if create is None:
+            return lambda function: self._alimit_attempts(model, reserved_tokens, function)
+        tokens = reserved_tokens
+
+        async def limited(*args, **kwargs):
+            nonlocal tokens
+            await self.rate_limiter.aacquire(model, tokens)
+            tokens = 0
+            return await create(*args, **kwargs)
+
+        return limited
+
+    def _record_usage(self, usage: CompletionUsage | None, started_at: float, stream: bool = False,
+                      from_cache: bool = False, scope=None) -> None:
+        """
+        Record the usage and the cost of a call in the ledgers, and update `last_usage` and `last_time_price`.
+
+        Parameters
+        ----------
+        usage : CompletionUsage or None
+            The usage of the call. None for a cache hit.
+        started_at : float
+            The `time.perf_counter()` when the call started.
+        stream : bool
+            Whether it is a streaming call.
+        from_cache : bool
+            Whether the call is served by the response cache.
+        scope : optional
+            The usage scope of the call, by default the current one.
+        """
+
+        scope = current_usage_scope() if scope is None else scope
+        self.last_usage = record_usage(self.ledger, scope, self.generate_args['model'], usage,
+                                       latency=time.perf_counter() - started_at, stream=stream,
+                                       from_cache=from_cache, prices=self.prices)
+        # None means the model is not in the price table, we can not know the price, but the response is still good.
+        self.last_time_price = self.last_usage.cost
+        current_span().set_attributes({"gen_ai.usage.input_tokens": self.last_usage.prompt_tokens,
+                                       "gen_ai.usage.output_tokens": self.last_usage.completion_tokens,
+                                       "xyz.llm.cached_tokens": self.last_usage.cached_tokens,
+                                       "xyz.llm.cost": self.last_usage.cost,
+                                       "xyz.llm.from_cache": from_cache})
+
+    def _get_span_name(self) -> str:
+        return f"chat {self.generate_args['model']}"
+
+    def _get_span_attributes(self, scope, stream: bool) -> dict:
+        """
+        The attributes of the span of a request, in the semantic conventions of the OpenTelemetry for the GenAI, and
+        the labels of its usage scope.
+        """
+
+        return {"gen_ai.system": "openai", "gen_ai.operation.name": "chat",
+                "gen_ai.request.model": self.generate_args['model'], "xyz.llm.stream": stream,
+                "xyz.agent": scope.labels.get("agent"), "xyz.run_id": scope.labels.get("run_id")}
+
+    @staticmethod
+    def _get_stream_span_attributes(stats: StreamStats) -> dict:
+        return {"xyz.llm.ttft": stats.ttft, "xyz.llm.retries": stats.retries, "xyz.llm.chunks": stats.chunks,
+                "gen_ai.response.finish_reasons": [stats.finish_reason] if stats.finish_reason else None}
+
+    @staticmethod
+    def resolve_api_key(api_key: str = None) -> str:
+        """
+        Resolve the OpenAI API key. If the user does not provide it, we load it from the `.env` file or environment.
+
+        Parameters
+        ----------
+        api_key : str, optional
+            The OpenAI API key.
+
+        Returns
+        -------
+        str
+            The API key which will be used by the client.
+        """
+
+        global _dotenv_loaded
+
+        if api_key is None:
+            if not _dotenv_loaded:
+                load_dotenv()
+                _dotenv_loaded = True
+            api_key = os.getenv('OPENAI_API_KEY')
+
+        return api_key
+
+    @staticmethod
+    def pack_images(messages: List, images: List) -> None:
+        """
+        Pack the image URLs into the content of the last message, following the OpenAI's vision message format.
+        The messages list is modified in place.
+
+        Parameters
+        ----------
+        messages : list
+            A list of messages, the last one will carry the images.
+        images : list
+            A list of image URLs.
+        """
+
+        last_message = messages.pop()
+        text = last_message['content']
+        content = [
+            {"type": "text", "text": text},
+        ]
+        for image_url in images:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": image_url,
+                },
             })
+        messages.append({
+            "role": last_message['role'],
+            "content": content
+        })
+
+    @staticmethod
+    def get_tools_args(tools: List = None) -> dict:
+        """
+        Get the tools arguments for the chat completions request.
+
+        In OpenAI's api, if we request with tools == [], it will make an error. Caz the OpenAI use the default
+        value is 'NOT_GIVEN' which is a special type designed by them. So we only send the tools when we have some.
 
-        get_response_signal = False
-        count = 0
-        while not get_response_signal and count < 10:
-            try:
-                for response in self.client.chat.completions.create(
-                        messages=messages,
-                        stream=True,
-                        timeout=5,
-                        **self.generate_args
-                ):
-                    if response.choices[0].delta.content is None:
-                        return None
-                    else:
-                        text = response.choices[0].delta.content
-                        yield text
-            except Exception:
-                count += 1
-                error_message = str(traceback.format_exc())
-                print(f"The error: {error_message}")
-                print(f"The messages: {messages}")
-                time.sleep(2)
+        Parameters
+        ----------
+        tools : list, optional
+            A list of tools to be used by the assistant.
+
+        Returns
+        -------
+        dict
+            The keyword arguments about the tools for `chat.completions.create`.
+        """
+
+        if tools:
+            return {"tools": tools, "tool_choice": "auto"}
+
+        return {}
 
     @staticmethod
     def check_generate_args(generate_args: dict) -> None:
@@ -220,10 +557,11 @@ class OpenAIClient:
 
         assert "llm" in generate_args
 
-    @staticmethod  # dollars per 1k tokens, REF: https://openai.com/pricings Source: He Yan
+    @staticmethod
     def get_oai_fees(model_name: str, prompt_tokens: int, completion_tokens: int) -> float:
         """
         Calculate the fees for using OpenAI models based on the model name, prompt tokens, and completion tokens.
+        The prices are read from the process-wide `price_table`, which can be updated by `price_table.load(path)`.
 
         Parameters:
         model_name (str): The name of the OpenAI model.
@@ -238,43 +576,202 @@ class OpenAIClient:
 
         """
 
-        openai_price = {
-            "gpt-4-turbo": {
-                "prompt": 0.01,
-                "completion": 0.03
-            },
-            "gpt-4": {
-                "prompt": 0.03,
-                "completion": 0.06
-            },
-            "gpt-4-32k": {
-                "prompt": 0.06,
-                "completion": 0.12
-            },
-            "gpt-4-1106-preview": {
-                "prompt": 0.01,
-                "completion": 0.03
-            },
-            "gpt-4-0125-preview": {
-                "prompt": 0.01,
-                "completion": 0.03
-            },
-            "gpt-3.5-turbo-instruct": {
-                "prompt": 0.0015,
-                "completion": 0.002
-            },
-            "gpt-3.5-turbo-0125": {
-                "prompt": 0.0005,
-                "completion": 0.0015
-            }
-        }
-
-        if model_name in openai_price:
-            pass
-        else:
+        fee = shared_price_table.cost(model_name, prompt_tokens, completion_tokens)
+        if fee is None:
             raise ValueError(f"Unknown model name {model_name}")
 
-        fee = (openai_price[model_name]["prompt"] * prompt_tokens + openai_price[model_name][
-            "completion"] * completion_tokens) / 1000
-
         return fee
+
+
+class AsyncOpenAIClient(OpenAIClient):
+    """
+    The asyncio twin of the `OpenAIClient`. It keeps the same retry, image-packing and tool semantics, but the
+    requests are awaitable, so one event loop can multiplex many in-flight completions without holding a thread
+    for each of them.
+
+    The blocking `run` and `stream_run` are still available, so this client can be used anywhere an `OpenAIClient`
+    is expected.
+
+    Examples
+    --------
+    >>> client = AsyncOpenAIClient()
+    >>> response = await client.arun([{"role": "user", "content": "Hello, how are you?"}])
+    >>> print(response.choices[0].message.content)
+    >>> async for word in client.astream_run([{"role": "user", "content": "Hello"}], images=[]):
+    >>>     print(word, end="")
+    """
+    async_client: AsyncOpenAI
+
+    def __init__(self, api_key=None, transport: str | httpx.AsyncClient | None = "default",
+                 retry_policy: RetryPolicy = None, rate_limiter: RateLimiter = None, cache: ResponseCache = None,
+                 stream_timeout: float = 60., stream_buffer_size: int = 0, ledger: UsageLedger = None,
+                 prices: PriceTable = None, **generate_args):
+        """Initializes the asynchronous OpenAI Client.
+
+        Parameters
+        ----------
+        api_key : str, optional
+            The OpenAI API key.
+        transport : str or httpx.AsyncClient or None, optional
+            The HTTP transport of the client. A str is the name of a shared connection pool in the
+            `transport_registry`. A `httpx.AsyncClient` will be used directly (and the blocking methods will use the
+            "default" pool). None means the OpenAI SDK builds private pools for this client.
+        retry_policy : RetryPolicy, optional
+            The retry policy of the requests. By default, a `RetryPolicy()` with exponential backoff.
+        rate_limiter : RateLimiter, optional
+            The client-side RPM/TPM limiter. By default, all the clients share the process-wide `rate_limiter`.
+        cache : ResponseCache, optional
+            The exact-match response cache. By default, there is no cache.
+        stream_timeout : float, optional
+            The max seconds to wait for the next chunk of a stream, by default 60.
+        stream_buffer_size : int, optional
+            If > 0, a stream is read by a background task into a bounded buffer of this many chunks, by default 0.
+        ledger : UsageLedger, optional
+            The ledger which records the usage and the cost of every call, by default the `usage_ledger`.
+        prices : PriceTable, optional
+            The prices of the models, by default the `price_table`.
+        """
+
+        sync_transport = transport if isinstance(transport, str) or transport is None else "default"
+        super().__init__(api_key=api_key, transport=sync_transport, retry_policy=retry_policy,
+                         rate_limiter=rate_limiter, cache=cache, stream_timeout=stream_timeout,
+                         stream_buffer_size=stream_buffer_size, ledger=ledger, prices=prices, **generate_args)
+        self.transport = transport
+
+        try:
+            if isinstance(transport, str):
+                http_client = transport_registry.get_async_client(transport)
+            else:
+                http_client = transport
+            self.async_client = AsyncOpenAI(api_key=self.client.api_key, http_client=http_client, max_retries=0)
+        except:
+            raise ValueError("The OpenAI client is not available. Please check the OpenAI API key.")
+
+    async def arun(self, messages: List, tools: List = None, images: List = None) -> ChatCompletion:
+        """
+        Run the assistant with the given messages without blocking the event loop.
+
+        Parameters
+        ----------
+        messages : list
+            A list of messages to be processed by the assistant.
+        tools : list, optional
+            A list of tools to be used by the assistant, by default [].
+        images : list, optional
+            A list of image URLs to be used by the assistant, by default [].
+
+        Returns
+        -------
+        ChatCompletion
+            The assistant's response to the messages.
+        """
+
+        return await atrace_call(self._get_span_name(), self._arun,
+                                 {"messages": messages, "tools": tools, "images": images},
+                                 kind="client", attributes=self._get_span_attributes(current_usage_scope(),
+                                                                                     stream=False))
+
+    async def _arun(self, messages: List, tools: List = None, images: List = None) -> ChatCompletion:
+        if images:
+            self.pack_images(messages, images)
+
+        tools_args = self.get_tools_args(tools)
+        started_at = time.perf_counter()
+
+        cache_key = self._get_cache_key(messages, tools)
+        if cache_key is not None:
+            response = self.cache.get_completion(cache_key)
+            if response is not None:
+                self._record_usage(None, started_at, from_cache=True)
+                return response
+
+        model = self.generate_args['model']
+        reserved_tokens = self.token_counter.count_messages(messages, tools)
+
+        # A failed request gives its reserved tokens back, so they are not debited again by the next attempt.
+        used_tokens = 0
+        try:
+            response = await self.retry_policy.acall(self._alimit_attempts(model, reserved_tokens,
+                                                                           self.async_client.chat.completions.create),
+                                                     messages=messages,
+                                                     **tools_args,
+                                                     **self.generate_args)
+            used_tokens = response.usage.total_tokens
+        finally:
+            self.rate_limiter.record(model, reserved_tokens, used_tokens)
+        self._record_usage(response.usage, started_at)
+        current_span().set_attribute("gen_ai.response.finish_reasons",
+                                     [choice.finish_reason for choice in response.choices])
+
+        if cache_key is not None:
+            self.cache.set_completion(cache_key, response)
+
+        return response
+
+    def astream_run(self, messages: List, images: List, stats: StreamStats = None) -> AsyncGenerator[str, None]:
+        """
+        Run the assistant with the given messages in a streaming manner without blocking the event loop.
+
+        Parameters
+        ----------
+        messages : list
+            A list of messages to be processed by the assistant.
+        images : list
+            A list of image URLs to be used by the assistant.
+        stats : StreamStats, optional
+            The statistics (TTFT, inter-token latency, finish reason, usage) of this call will be filled in it.
+
+        Yields
+        ------
+        str
+            The assistant's response to the messages, yielded one piece at a time.
+        """
+
+        scope = current_usage_scope()
+        return trace_call(self._get_span_name(), self._astream_run,
+                          {"messages": messages, "images": images, "stats": stats, "scope": scope},
+                          kind="client", attributes=self._get_span_attributes(scope, stream=True))
+
+    async def _astream_run(self, messages: List, images: List, stats: StreamStats, scope) -> AsyncGenerator[str, None]:
+        started_at = time.perf_counter()
+        if images:
+            self.pack_images(messages, images)
+
+        stats = StreamStats() if stats is None else stats
+        self.last_stream_stats = stats
+
+        cache_key = self._get_cache_key(messages, stream=True)
+        if cache_key is not None:
+            chunks = self.cache.get_chunks(cache_key)
+            if chunks is not None:
+                stats.from_cache = True
+                self._record_usage(None, started_at, stream=True, from_cache=True, scope=scope)
+                for text in chunks:
+                    stats.on_text(text)
+                    yield text
+                return
+
+        model = self.generate_args['model']
+        reserved_tokens = self.token_counter.count_messages(messages)
+
+        @self._alimit_attempts(model, reserved_tokens)
+        async def open_stream():
+            return await self.async_client.chat.completions.create(messages=messages, stream=True,
+                                                                   **self._get_stream_args(), **self.generate_args)
+
+        chunks = []
+        try:
+            async for text in astream_text(open_stream, self.retry_policy, stats, self.stream_buffer_size):
+                chunks.append(text)
+                yield text
+        finally:
+            current_span().set_attributes(self._get_stream_span_attributes(stats))
+            usage = self._get_stream_usage(stats, reserved_tokens)
+            self.rate_limiter.record(model, reserved_tokens, usage.total_tokens)
+            # A broken stream is paid too, so it is recorded as well, unless it is never opened.
+            if stats.usage is not None or stats.characters:
+                self._record_usage(usage, started_at, stream=True, scope=scope)
+
+        # Only the stream which is finished normally can be cached.
+        if cache_key is not None:
+            self.cache.set_chunks(cache_key, chunks)
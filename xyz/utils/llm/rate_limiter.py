@@ -0,0 +1,254 @@
+"""
+===========
+RateLimiter
+===========
+@file_name: rate_limiter.py
+@author: Bin Liang
+@date: 2024-05-08
+The client-side token-bucket rate limiter (requests per minute and tokens per minute) keyed by the model name.
+"""
+
+__all__ = ["RateLimiter", "TokenBucket", "rate_limiter", "estimate_tokens"]
+
+import json
+import time
+import asyncio
+import threading
+from typing import List
+
+
+def estimate_tokens(messages: List, tools: List = None) -> int:
+    """
+    A cheap estimation of the prompt tokens: about 4 characters per token, and some tokens for each message's format.
+
+    Parameters
+    ----------
+    messages: list
+        The OpenAI's messages.
+    tools: list, optional
+        The tools of the request.
+
+    Returns
+    -------
+    int
+        The estimated number of tokens.
+    """
+
+    chars = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    if tools:
+        chars += len(json.dumps(tools))
+
+    return chars // 4 + 4 * len(messages) + 3
+
+
+class TokenBucket:
+    """
+    A token bucket which refills continuously. A reservation is taken immediately even if the bucket goes into debt,
+    and the caller waits until the debt is paid. So the callers are served in their arrival order and the traffic is
+    smooth instead of bursty.
+    """
+
+    def __init__(self, per_minute: float, capacity: float = None) -> None:
+        """
+        Parameters
+        ----------
+        per_minute: float
+            The refill rate per minute (RPM or TPM).
+        capacity: float, optional
+            The max burst. By default, it is the budget of one minute.
+        """
+
+        assert per_minute > 0, "The rate of the bucket must be positive."
+
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.
+        self.capacity = per_minute if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Take the amount from the bucket, and return how long the caller must wait.
+        """
+
+        self.refill(now)
+        self.tokens -= amount
+
+        return 0. if self.tokens >= 0 else -self.tokens / self.rate
+
+    def adjust(self, amount: float, now: float) -> None:
+        """
+        Take more (positive amount) or give back (negative amount) without waiting, i.e. when the real usage of
+        a request is known.
+        """
+
+        self.refill(now)
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """
+    The shared client-side rate limiter. Every model has its own budget of requests per minute (RPM) and tokens per
+    minute (TPM). The prompt tokens are reserved before the request is sent, and the completion tokens are charged
+    when the response is back. The clients take one request for every attempt, so the retries and the resumed
+    streams are limited too. The models without a configured budget are not limited.
+
+    Examples
+    --------
+    >>> from xyz.utils.llm.rate_limiter import rate_limiter
+    >>> rate_limiter.configure("gpt-4-turbo", rpm=500, tpm=300000)
+    >>> client = OpenAIClient(model="gpt-4-turbo")  # All the clients share the `rate_limiter` by default.
+    >>> rate_limiter.stats()
+    {'gpt-4-turbo': {'requests': 12, 'tokens': 5321, 'waited_seconds': 0.0, 'rpm_available': 488.1, ...}}
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._stats = {}
+
+    def configure(self, model: str, rpm: float = None, tpm: float = None) -> None:
+        """
+        Set the budget of a model. Use the model name "*" to set the budget of all the other models.
+
+        Parameters
+        ----------
+        model: str
+            The model name, which is the same as `generate_args["model"]` of the client.
+        rpm: float, optional
+            The requests per minute. None means no limit.
+        tpm: float, optional
+            The tokens per minute. None means no limit.
+        """
+
+        with self._lock:
+            self._buckets[model] = (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+
+    def acquire(self, model: str, tokens: int) -> float:
+        """
+        Wait (block) until the model has the budget for one request with the given prompt tokens.
+
+        Parameters
+        ----------
+        model: str
+            The model name.
+        tokens: int
+            The estimated prompt tokens of the request.
+
+        Returns
+        -------
+        float
+            The seconds which the caller has waited.
+        """
+
+        wait = self._reserve(model, tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+    async def aacquire(self, model: str, tokens: int) -> float:
+        """
+        The asynchronous version of `acquire`, which does not block the event loop.
+        """
+
+        wait = self._reserve(model, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        return wait
+
+    def record(self, model: str, reserved_tokens: int, used_tokens: int) -> None:
+        """
+        Charge the real usage of a request. The difference between the reserved and the used tokens (mostly the
+        completion tokens) is taken from (or given back to) the token budget.
+
+        Parameters
+        ----------
+        model: str
+            The model name.
+        reserved_tokens: int
+            The tokens which are reserved by `acquire`.
+        used_tokens: int
+            The real total tokens (prompt + completion) of the request.
+        """
+
+        with self._lock:
+            buckets = self._get_buckets(model)
+            if buckets is None:
+                return
+            _, tpm_bucket = buckets
+            if tpm_bucket is not None:
+                tpm_bucket.adjust(used_tokens - reserved_tokens, time.monotonic())
+            stats = self._stats.setdefault(model, {"requests": 0, "tokens": 0, "waited_seconds": 0.})
+            stats["tokens"] += used_tokens - reserved_tokens
+
+    def stats(self) -> dict:
+        """
+        Get the statistics of the limiter for each model.
+
+        Returns
+        -------
+        dict
+            {model: {"requests", "tokens", "waited_seconds", "rpm_available", "tpm_available"}}
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            result = {}
+            for model, stats in self._stats.items():
+                rpm_bucket, tpm_bucket = self._get_buckets(model) or (None, None)
+                for bucket in (rpm_bucket, tpm_bucket):
+                    if bucket is not None:
+                        bucket.refill(now)
+                result[model] = dict(stats,
+                                     rpm_available=None if rpm_bucket is None else rpm_bucket.tokens,
+                                     tpm_available=None if tpm_bucket is None else tpm_bucket.tokens)
+
+        return result
+
+    def _reserve(self, model: str, tokens: int) -> float:
+        with self._lock:
+            buckets = self._get_buckets(model)
+            if buckets is None:
+                return 0.
+
+            now = time.monotonic()
+            rpm_bucket, tpm_bucket = buckets
+            wait = 0.
+            if rpm_bucket is not None:
+                wait = max(wait, rpm_bucket.reserve(1, now))
+            if tpm_bucket is not None:
+                wait = max(wait, tpm_bucket.reserve(tokens, now))
+
+            stats = self._stats.setdefault(model, {"requests": 0, "tokens": 0, "waited_seconds": 0.})
+            stats["requests"] += 1
+            stats["tokens"] += tokens
+            stats["waited_seconds"] += wait
+
+        return wait
+
+    def _get_buckets(self, model: str) -> tuple | None:
+        if model in self._buckets:
+            return self._buckets[model]
+        if "*" in self._buckets:
+            # Every unknown model gets its own copy of the "*" budget.
+            rpm_bucket, tpm_bucket = self._buckets["*"]
+            self._buckets[model] = (TokenBucket(rpm_bucket.per_minute) if rpm_bucket else None,
+                                    TokenBucket(tpm_bucket.per_minute) if tpm_bucket else None)
+            return self._buckets[model]
+
+        return None
+
+
+rate_limiter = RateLimiter()
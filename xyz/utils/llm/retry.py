@@ -0,0 +1,373 @@
+"""
+===========
+RetryPolicy
+===========
+@file_name: retry.py
+@author: Bin Liang
+@date: 2024-05-07
+The retry engine for the LLM clients: exponential backoff with jitter, rate-limit headers and error classification.
+"""
+
+__all__ = ["RetryPolicy", "RetryError"]
+
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter, deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable
+
+import openai
+
+from xyz.utils.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+
+class RetryError(Exception):
+    """
+    Raised when all the attempts of a retryable request are failed. The last error is kept in `__cause__`.
+    """
+
+    def __init__(self, attempts: int, last_error: BaseException) -> None:
+        super().__init__(f"The request failed after {attempts} attempts: {last_error!r}")
+        self.attempts = attempts
+        self.last_error = last_error
+
+
+class RetryPolicy:
+    """
+    The retry policy for the LLM requests.
+
+    1. The errors are classified as retryable (connection, timeout, 408, 409, 429, 5xx) or fatal (the other 4xx,
+       i.e. a bad request). Fatal errors are raised immediately.
+    2. The delay is exponential with jitter. If the server tells us when to come back (`Retry-After`,
+       `retry-after-ms`, `x-ratelimit-reset-*`), we honor it.
+    3. Every attempt is counted in the metrics, so we can see how much the retries cost.
+
+    Examples
+    --------
+    >>> policy = RetryPolicy(max_attempts=5, base_delay=0.5, max_delay=30.)
+    >>> client = OpenAIClient(retry_policy=policy)
+    >>> ...
+    >>> policy.metrics()
+    {'attempts': 12, 'successes': 10, 'retries': 2, 'failures': 0, 'fatal': 0, 'sleep_seconds': 1.3, ...}
+    """
+
+    RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(self, max_attempts: int = 10, base_delay: float = 1., max_delay: float = 60., multiplier: float = 2.,
+                 jitter: bool = True, respect_headers: bool = True,
+                 on_attempt: Callable[[dict], None] = None) -> None:
+        """
+        Parameters
+        ----------
+        max_attempts: int
+            The max number of attempts (the first request is included).
+        base_delay: float
+            The delay (seconds) before the first retry.
+        max_delay: float
+            The upper bound of the delay (seconds).
+        multiplier: float
+            The exponential factor of the delay.
+        jitter: bool
+            Whether to use the "full jitter", which spreads the retries of many clients in time.
+        respect_headers: bool
+            Whether to honor the `Retry-After` and `x-ratelimit-reset-*` headers of the server.
+        on_attempt: Callable, optional
+            A hook which is called with the record of every failed attempt.
+        """
+
+        assert max_attempts >= 1, "The max_attempts must be at least 1."
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.respect_headers = respect_headers
+        self.on_attempt = on_attempt
+
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._errors = Counter()
+        self._sleep_seconds = 0.
+        self.recent_attempts = deque(maxlen=100)
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Call the function with the retry policy.
+
+        Parameters
+        ----------
+        func: Callable
+            The function to call.
+        *args, **kwargs
+            The arguments of the function.
+
+        Returns
+        -------
+        Any
+            The return value of the function.
+
+        Raises
+        ------
+        RetryError
+            If all the attempts are failed by the retryable errors.
+        Exception
+            The fatal error, which is raised immediately.
+        """
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                delay = self.handle_error(attempt, error)
+                time.sleep(delay)
+            else:
+                self.handle_success()
+                return result
+
+    async def acall(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        The asynchronous version of `call`. The `func` must return an awaitable.
+        """
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as error:
+                delay = self.handle_error(attempt, error)
+                await asyncio.sleep(delay)
+            else:
+                self.handle_success()
+                return result
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """
+        Classify the error as retryable or fatal.
+
+        Parameters
+        ----------
+        error: BaseException
+            The error which is raised by the request.
+
+        Returns
+        -------
+        bool
+            True if the request can be retried.
+        """
+
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        if isinstance(error, openai.RateLimitError) and getattr(error, "code", None) == "insufficient_quota":
+            # The quota will not come back by waiting.
+            return False
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in self.RETRYABLE_STATUS or error.status_code >= 500
+        if isinstance(error, (TimeoutError, ConnectionError)):
+            return True
+
+        return False
+
+    def get_delay(self, attempt: int, error: BaseException = None) -> float:
+        """
+        Compute the delay before the next attempt.
+
+        Parameters
+        ----------
+        attempt: int
+            The number of the attempt which just failed, starting from 1.
+        error: BaseException, optional
+            The error of this attempt, which may carry the headers of the server.
+
+        Returns
+        -------
+        float
+            The delay in seconds.
+        """
+
+        backoff = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            backoff = random.uniform(0, backoff)
+
+        if self.respect_headers and error is not None:
+            server_delay = self.get_server_delay(error)
+            if server_delay is not None:
+                return min(self.max_delay, max(backoff, server_delay))
+
+        return backoff
+
+    @classmethod
+    def get_server_delay(cls, error: BaseException) -> float | None:
+        """
+        Read how long the server wants us to wait from the response headers of the error.
+
+        Parameters
+        ----------
+        error: BaseException
+            The error which is raised by the request.
+
+        Returns
+        -------
+        float or None
+            The delay in seconds, or None if the server says nothing.
+        """
+
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+
+        retry_after = headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                try:
+                    return max(0., parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+
+        # The x-ratelimit headers only matter when the budget is exhausted.
+        delays = []
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            reset = headers.get(f"x-ratelimit-reset-{kind}")
+            if reset is not None and remaining is not None and remaining.strip() == "0":
+                reset_seconds = cls.parse_duration(reset)
+                if reset_seconds is not None:
+                    delays.append(reset_seconds)
+
+        return max(delays) if delays else None
+
+    @staticmethod
+    def parse_duration(duration: str) -> float | None:
+        """
+        Parse the duration format of the OpenAI's rate limit headers, i.e. "1s", "6m0s", "20ms", "1h2m3.5s".
+
+        Parameters
+        ----------
+        duration: str
+            The duration string.
+
+        Returns
+        -------
+        float or None
+            The duration in seconds, or None if the format is unknown.
+        """
+
+        units = {"h": 3600., "m": 60., "s": 1., "ms": 0.001}
+        parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", duration.strip())
+        if not parts:
+            try:
+                return float(duration)
+            except ValueError:
+                return None
+
+        return sum(float(value) * units[unit] for value, unit in parts)
+
+    def metrics(self) -> dict:
+        """
+        Get the metrics of all the attempts which are done with this policy.
+
+        Returns
+        -------
+        dict
+            The counters of the attempts, successes, retries, failures, fatal errors, the total sleep time and the
+            count of each error type.
+        """
+
+        with self._lock:
+            metrics = {key: self._counters[key] for key in ("attempts", "successes", "retries", "failures", "fatal")}
+            metrics["sleep_seconds"] = self._sleep_seconds
+            metrics["errors"] = dict(self._errors)
+
+        return metrics
+
+    def handle_success(self) -> None:
+        """
+        Count a successful attempt. Like `handle_error`, it is used by the callers which drive their own attempts.
+        """
+
+        self._count("successes")
+
+    def handle_error(self, attempt: int, error: BaseException) -> float:
+        """
+        Record the failed attempt, and decide to retry (return the delay) or to raise. It is used by `call`, and by
+        the callers which drive their own attempts (i.e. the streaming engine).
+
+        Parameters
+        ----------
+        attempt: int
+            The number of the attempt which just failed, starting from 1.
+        error: BaseException
+            The error of this attempt.
+
+        Returns
+        -------
+        float
+            The delay in seconds before the next attempt.
+
+        Raises
+        ------
+        RetryError
+            If this was the last attempt.
+        Exception
+            The error itself, if it is fatal.
+        """
+
+        retryable = self.is_retryable(error)
+        record = {"attempt": attempt, "error": type(error).__name__, "message": str(error)[:200],
+                  "status_code": getattr(error, "status_code", None), "retryable": retryable, "delay": None}
+
+        if not retryable:
+            self._count("fatal", error)
+            self._record(record)
+            raise error
+
+        if attempt >= self.max_attempts:
+            self._count("failures", error)
+            self._record(record)
+            raise RetryError(attempt, error) from error
+
+        delay = self.get_delay(attempt, error)
+        record["delay"] = delay
+        self._count("retries", error, delay)
+        self._record(record)
+        logger.warning("LLM request failed (attempt %d/%d, %s: %s), retry in %.2fs.",
+                       attempt, self.max_attempts, record["error"], record["message"], delay)
+
+        return delay
+
+    def _count(self, key: str, error: BaseException = None, delay: float = 0.) -> None:
+        with self._lock:
+            self._counters["attempts"] += 1
+            self._counters[key] += 1
+            self._sleep_seconds += delay
+            if error is not None:
+                self._errors[type(error).__name__] += 1
+
+    def _record(self, record: dict) -> None:
+        self.recent_attempts.append(record)
+        # The failed attempts are the events of the span of the request.
+        span = current_span()
+        span.add_event("xyz.llm.attempt_failed", record)
+        if record["delay"] is not None:
+            span.set_attribute("xyz.llm.retries", record["attempt"])
+        if self.on_attempt is not None:
+            self.on_attempt(record)
@@ -0,0 +1,359 @@
+"""
+=============
+SemanticCache
+=============
+@file_name: semantic_cache.py
+@author: Bin Liang
+@date: 2024-05-10
+The embedding-similarity cache for the LLMAgent, with a local NumPy brute-force index and an IVF index.
+"""
+
+__all__ = ["SemanticCache", "OpenAIEmbedder", "BruteForceIndex", "IVFIndex"]
+
+import time
+import itertools
+import threading
+from typing import Any, Callable, List
+
+import numpy as np
+
+
+class OpenAIEmbedder:
+    """
+    Embed the text by the OpenAI's embeddings API, reusing the HTTP client and the retry policy of an `OpenAIClient`.
+    """
+
+    def __init__(self, llm_client, model: str = "text-embedding-3-small") -> None:
+        """
+        Parameters
+        ----------
+        llm_client: OpenAIClient
+            The client which can call the OpenAI API.
+        model: str
+            The embedding model.
+        """
+
+        self.llm_client = llm_client
+        self.model = model
+
+    def __call__(self, text: str) -> np.ndarray:
+        response = self.llm_client.retry_policy.call(self.llm_client.client.embeddings.create,
+                                                     input=text, model=self.model)
+
+        return np.asarray(response.data[0].embedding, dtype=np.float32)
+
+
+class BruteForceIndex:
+    """
+    The exact cosine-similarity index. The vectors are normalized and stored in one contiguous matrix, so a search is
+    one matrix-vector product. It is the fastest choice for the small caches.
+    """
+
+    def __init__(self) -> None:
+        self._ids = []
+        self._positions = {}
+        self._matrix = None
+
+    def add(self, entry_id: int, vector: np.ndarray) -> None:
+        if self._matrix is None:
+            self._matrix = np.empty((16, vector.shape[0]), dtype=np.float32)
+        elif len(self._ids) == self._matrix.shape[0]:
+            self._matrix = np.concatenate([self._matrix, np.empty_like(self._matrix)])
+
+        self._positions[entry_id] = len(self._ids)
+        self._matrix[len(self._ids)] = vector
+        self._ids.append(entry_id)
+
+    def remove(self, entry_id: int) -> None:
+        position = self._positions.pop(entry_id)
+        last_id = self._ids.pop()
+        if last_id != entry_id:
+            # Move the last vector into the hole.
+            self._matrix[position] = self._matrix[len(self._ids)]
+            self._ids[position] = last_id
+            self._positions[last_id] = position
+
+    def search(self, vector: np.ndarray, k: int = 1) -> List[tuple]:
+        """
+        Search the k most similar vectors.
+
+        Returns
+        -------
+        list
+            [(entry_id, cosine similarity)], the most similar first.
+        """
+
+        if not self._ids:
+            return []
+
+        similarities = self._matrix[:len(self._ids)] @ vector
+        k = min(k, len(self._ids))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+
+        return [(self._ids[i], float(similarities[i])) for i in top]
+
+    def vectors(self) -> tuple:
+        if self._matrix is None:
+            return [], None
+        return list(self._ids), self._matrix[:len(self._ids)]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class IVFIndex:
+    """
+    The inverted-file index for the large caches. The vectors are clustered by k-means, and a search only scans the
+    `nprobe` clusters whose centroids are the nearest to the query. So it is approximate, but much faster than the
+    brute force when the cache is large. The clusters are re-trained when the index has doubled since the last time.
+    """
+
+    def __init__(self, nprobe: int = 4, min_train_size: int = 256, seed: int = 0) -> None:
+        """
+        Parameters
+        ----------
+        nprobe: int
+            The number of the clusters to scan in a search.
+        min_train_size: int
+            Before the index has this many vectors, it is just a brute-force index.
+        seed: int
+            The random seed of the k-means.
+        """
+
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.seed = seed
+
+        self._centroids = None
+        self._lists = [BruteForceIndex()]
+        self._assignments = {}
+        self._trained_size = 0
+
+    def add(self, entry_id: int, vector: np.ndarray) -> None:
+        cluster = 0 if self._centroids is None else int(np.argmax(self._centroids @ vector))
+        self._lists[cluster].add(entry_id, vector)
+        self._assignments[entry_id] = cluster
+
+        if len(self) >= max(self.min_train_size, 2 * self._trained_size):
+            self.train()
+
+    def remove(self, entry_id: int) -> None:
+        cluster = self._assignments.pop(entry_id)
+        self._lists[cluster].remove(entry_id)
+
+    def search(self, vector: np.ndarray, k: int = 1) -> List[tuple]:
+        if self._centroids is None:
+            return self._lists[0].search(vector, k)
+
+        probes = np.argsort(-(self._centroids @ vector))[:self.nprobe]
+        results = list(itertools.chain.from_iterable(self._lists[i].search(vector, k) for i in probes))
+        results.sort(key=lambda item: -item[1])
+
+        return results[:k]
+
+    def train(self, iterations: int = 10) -> None:
+        """
+        Cluster all the vectors again by the spherical k-means, with about sqrt(n) clusters.
+        """
+
+        ids, matrix = [], []
+        for index in self._lists:
+            local_ids, local_matrix = index.vectors()
+            if local_ids:
+                ids.extend(local_ids)
+                matrix.append(local_matrix)
+        if not ids:
+            return
+        matrix = np.concatenate(matrix)
+
+        nlist = max(1, int(np.sqrt(len(ids))))
+        rng = np.random.default_rng(self.seed)
+        centroids = matrix[rng.choice(len(ids), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(matrix @ centroids.T, axis=1)
+            for i in range(nlist):
+                members = matrix[assignments == i]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[i] = centroid / (np.linalg.norm(centroid) or 1.)
+        assignments = np.argmax(matrix @ centroids.T, axis=1)
+
+        self._centroids = centroids
+        self._lists = [BruteForceIndex() for _ in range(nlist)]
+        self._assignments = {}
+        for entry_id, vector, cluster in zip(ids, matrix, assignments):
+            self._lists[cluster].add(entry_id, vector)
+            self._assignments[entry_id] = int(cluster)
+        self._trained_size = len(ids)
+
+    def __len__(self) -> int:
+        return len(self._assignments)
+
+
+class SemanticCache:
+    """
+    The semantic cache tier of the `LLMAgent`. If a new rendered prompt is close enough (cosine distance) to a prompt
+    which was answered before by the same template, the old answer is returned without calling the LLM.
+
+    1. Each template has its own index, so the prompts of different agents never match each other.
+    2. The index is a `BruteForceIndex` while it is small, and becomes an `IVFIndex` when it is large.
+    3. The entries are evicted by age (ttl) and, when the cache is full, the entries with the fewest hits go first.
+
+    Examples
+    --------
+    >>> from xyz.utils.llm.semantic_cache import SemanticCache, OpenAIEmbedder
+    >>> llm_client = OpenAIClient()
+    >>> cache = SemanticCache(OpenAIEmbedder(llm_client), max_distance=0.05)
+    >>> agent = LLMAgent(template=template, llm_client=llm_client, semantic_cache=cache)
+    >>> agent(question="What is 1 + 1?")
+    >>> agent(question="What is 1+1 ?")  # Served by the cache.
+    """
+
+    def __init__(self, embedder: Callable[[str], Any], max_distance: float = 0.05, max_entries: int = 10000,
+                 ttl: float = None, ivf_threshold: int = 5000, nprobe: int = 4) -> None:
+        """
+        Parameters
+        ----------
+        embedder: Callable
+            A function which maps a text to its embedding vector, i.e. `OpenAIEmbedder`.
+        max_distance: float
+            The max cosine distance (1 - cosine similarity) of a hit.
+        max_entries: int
+            The max number of the entries of all the templates.
+        ttl: float, optional
+            The time to live of the entries in seconds. None means the entries never expire.
+        ivf_threshold: int
+            When the index of a template has more entries than this, it is rebuilt as an `IVFIndex`.
+        nprobe: int
+            The number of the clusters to scan in a search of the `IVFIndex`.
+        """
+
+        self.embedder = embedder
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._indexes = {}
+        self._entries = {}
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+
+    def embed(self, text: str) -> np.ndarray:
+        """
+        Embed the text and normalize the vector.
+        """
+
+        vector = np.asarray(self.embedder(text), dtype=np.float32)
+
+        return vector / (np.linalg.norm(vector) or 1.)
+
+    def lookup(self, namespace: str, text: str) -> tuple:
+        """
+        Look up the answer of the most similar prompt in the namespace.
+
+        Parameters
+        ----------
+        namespace: str
+            The namespace, i.e. the hash of the agent's template.
+        text: str
+            The rendered prompt.
+
+        Returns
+        -------
+        tuple
+            (the cached response or None, the embedding vector of the text). Pass the vector to `add` after a miss,
+            so the text is not embedded twice.
+        """
+
+        vector = self.embed(text)
+
+        with self._lock:
+            index = self._indexes.get(namespace)
+            for entry_id, similarity in (index.search(vector, k=4) if index is not None else []):
+                entry = self._entries[entry_id]
+                if self._is_expired(entry):
+                    self._remove(entry_id)
+                    continue
+                if 1. - similarity <= self.max_distance:
+                    entry["hits"] += 1
+                    entry["last_hit"] = time.time()
+                    self._stats["hits"] += 1
+                    return entry["response"], vector
+                break
+
+            self._stats["misses"] += 1
+
+        return None, vector
+
+    def add(self, namespace: str, vector: np.ndarray, response: Any) -> None:
+        """
+        Add an answered prompt to the cache.
+
+        Parameters
+        ----------
+        namespace: str
+            The namespace, i.e. the hash of the agent's template.
+        vector: np.ndarray
+            The embedding vector of the prompt, which is returned by `lookup`.
+        response: Any
+            The answer of the prompt.
+        """
+
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {"namespace": namespace, "response": response, "created_at": time.time(),
+                                       "last_hit": None, "hits": 0}
+            index = self._indexes.setdefault(namespace, BruteForceIndex())
+            index.add(entry_id, vector)
+            self._stats["sets"] += 1
+
+            if isinstance(index, BruteForceIndex) and len(index) > self.ivf_threshold:
+                self._indexes[namespace] = self._to_ivf(index)
+
+            if len(self._entries) > self.max_entries:
+                self._evict()
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the cache.
+
+        Returns
+        -------
+        dict
+            The hits, misses, sets, evictions and the number of the entries.
+        """
+
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+    def _to_ivf(self, index: BruteForceIndex) -> IVFIndex:
+        ivf_index = IVFIndex(nprobe=self.nprobe, min_train_size=self.ivf_threshold)
+        ids, matrix = index.vectors()
+        for entry_id, vector in zip(ids, matrix):
+            ivf_index.add(entry_id, vector.copy())
+
+        return ivf_index
+
+    def _is_expired(self, entry: dict) -> bool:
+        return self.ttl is not None and entry["created_at"] + self.ttl < time.time()
+
+    def _evict(self) -> None:
+        # First, the expired entries. Then, the entries with the fewest hits, the older first.
+        for entry_id in [entry_id for entry_id, entry in self._entries.items() if self._is_expired(entry)]:
+            self._remove(entry_id)
+
+        # Evict down to 90% of the capacity, so the sort is not paid on every add.
+        overflow = len(self._entries) - int(self.max_entries * 0.9)
+        if overflow > 0:
+            victims = sorted(self._entries, key=lambda i: (self._entries[i]["hits"], self._entries[i]["created_at"]))
+            for entry_id in victims[:overflow]:
+                self._remove(entry_id)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        self._indexes[entry["namespace"]].remove(entry_id)
+        self._stats["evictions"] += 1
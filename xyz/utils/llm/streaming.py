@@ -0,0 +1,368 @@
+"""
+=========
+Streaming
+=========
+@file_name: streaming.py
+@author: Bin Liang
+@date: 2024-05-16
+The streaming engine of the LLM clients: clean resume on failure, finish reasons, usage, latency and backpressure.
+"""
+
+__all__ = ["StreamStats", "StreamInterruptedError", "stream_text", "astream_text"]
+
+import time
+import queue
+import asyncio
+import inspect
+import threading
+from typing import AsyncGenerator, AsyncIterable, Awaitable, Callable, Generator, Iterable
+
+from openai.types import CompletionUsage
+
+from xyz.utils.llm.retry import RetryPolicy
+
+_END = object()
+
+
+class StreamInterruptedError(Exception):
+    """
+    Raised when a stream fails after it has yielded some text, and it can not be resumed cleanly (the retries are
+    exhausted, or the new stream does not reproduce the text which was already yielded).
+    """
+
+    def __init__(self, partial_text: str, reason: str) -> None:
+        super().__init__(f"The stream is interrupted after {len(partial_text)} characters: {reason}")
+        self.partial_text = partial_text
+        self.reason = reason
+
+
+class StreamStats:
+    """
+    The statistics of one streaming call: time-to-first-token (TTFT), inter-token latency (ITL), finish reason, usage,
+    retries and the max depth of the buffer.
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.last_token_at = None
+        self.ttft = None
+        self.inter_token_latencies = []
+        self.chunks = 0
+        self.characters = 0
+        self.finish_reason = None
+        self.usage = None
+        self.retries = 0
+        self.max_buffered = 0
+        self.from_cache = False
+
+    def on_chunk(self, chunk) -> str:
+        """
+        Read a `ChatCompletionChunk`: record the finish reason and the usage, and return its text ("" if none).
+        """
+
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            # The old SDKs do not know the usage of a chunk, and keep it as a dict.
+            self.usage = CompletionUsage.model_validate(usage) if isinstance(usage, dict) else usage
+        if not chunk.choices:
+            return ""
+
+        choice = chunk.choices[0]
+        if choice.finish_reason is not None:
+            self.finish_reason = choice.finish_reason
+
+        return choice.delta.content or ""
+
+    def on_text(self, text: str) -> None:
+        """
+        Record the timing of a piece of text which is yielded to the consumer.
+        """
+
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+            self.ttft = now - self.started_at
+        else:
+            self.inter_token_latencies.append(now - self.last_token_at)
+        self.last_token_at = now
+        self.chunks += 1
+        self.characters += len(text)
+
+    def summary(self) -> dict:
+        """
+        Get the summary of the statistics.
+
+        Returns
+        -------
+        dict
+            ttft, itl_mean, itl_p50, itl_p95, itl_max (seconds), chunks, characters, finish_reason, usage, retries,
+            max_buffered and from_cache.
+        """
+
+        latencies = sorted(self.inter_token_latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+
+        return {
+            "ttft": self.ttft,
+            "itl_mean": sum(latencies) / len(latencies) if latencies else None,
+            "itl_p50": percentile(0.5),
+            "itl_p95": percentile(0.95),
+            "itl_max": latencies[-1] if latencies else None,
+            "chunks": self.chunks,
+            "characters": self.characters,
+            "finish_reason": self.finish_reason,
+            "usage": None if self.usage is None else self.usage.model_dump(),
+            "retries": self.retries,
+            "max_buffered": self.max_buffered,
+            "from_cache": self.from_cache,
+        }
+
+
+class _Replay:
+    """
+    After a failure, the new stream must reproduce the text which was already yielded. This class skips that prefix,
+    and detects if the new stream diverges from it.
+    """
+
+    def __init__(self, prefix: str) -> None:
+        self.prefix = prefix
+        self.position = 0
+
+    def feed(self, text: str) -> str:
+        """
+        Return the part of the text which is new to the consumer.
+        """
+
+        if self.position >= len(self.prefix):
+            return text
+
+        overlap = self.prefix[self.position:self.position + len(text)]
+        if not text.startswith(overlap):
+            raise StreamInterruptedError(self.prefix, "the resumed stream diverges from the yielded text")
+        self.position += len(text)
+
+        return text[len(overlap):]
+
+    def finish(self) -> None:
+        if self.position < len(self.prefix):
+            raise StreamInterruptedError(self.prefix, "the resumed stream is shorter than the yielded text")
+
+
+def _buffered(stream: Iterable, buffer_size: int, stats: StreamStats) -> Generator:
+    """
+    Read the stream in a background thread into a bounded queue. When the consumer is slow, the queue is full and the
+    reader stops reading the socket, so the backpressure goes back to the server through TCP.
+    """
+
+    chunks = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for chunk in stream:
+                if not put(chunk):
+                    return
+            put(_END)
+        except BaseException as error:
+            put(error)
+
+    reader = threading.Thread(target=read, name="xyz-stream-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            stats.max_buffered = max(stats.max_buffered, chunks.qsize())
+            item = chunks.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def stream_text(open_stream: Callable[[], Iterable], retry_policy: RetryPolicy, stats: StreamStats = None,
+                buffer_size: int = 0) -> Generator[str, None, None]:
+    """
+    Drive a chat-completions stream and yield its text.
+
+    1. All the chunks are read until the end of the stream, so the tool-call, finish and usage chunks never truncate
+       the text. The finish reason and the usage are recorded in the stats.
+    2. If the stream fails, it is re-opened by the retry policy. The text which was already yielded is skipped in the
+       new stream, so nothing is duplicated; if the new stream diverges from it, `StreamInterruptedError` is raised.
+       The failures to open the stream and the failures in the middle of it share one budget of attempts.
+    3. TTFT and inter-token latencies are recorded in the stats.
+    4. With buffer_size > 0, the stream is read by a background thread into a bounded buffer.
+
+    Parameters
+    ----------
+    open_stream: Callable
+        A function which opens a new stream (an iterable of `ChatCompletionChunk`).
+    retry_policy: RetryPolicy
+        The retry policy for opening and resuming the stream.
+    stats: StreamStats, optional
+        The statistics which will be filled.
+    buffer_size: int
+        The size of the bounded buffer. 0 means the stream is read directly by the consumer.
+
+    Yields
+    ------
+    str
+        The text of the stream.
+    """
+
+    stats = StreamStats() if stats is None else stats
+    yielded = []
+    attempt = 0
+
+    while True:
+        attempt += 1
+        replay = _Replay("".join(yielded)) if yielded else None
+        try:
+            stream = open_stream()
+        except Exception as error:
+            delay = _handle_stream_error(retry_policy, attempt, error, yielded)
+            stats.retries += 1
+            time.sleep(delay)
+            continue
+        retry_policy.handle_success()
+        try:
+            for chunk in (_buffered(stream, buffer_size, stats) if buffer_size > 0 else stream):
+                text = stats.on_chunk(chunk)
+                if text and replay is not None:
+                    text = replay.feed(text)
+                if text:
+                    stats.on_text(text)
+                    yielded.append(text)
+                    yield text
+            if replay is not None:
+                replay.finish()
+            return
+        except StreamInterruptedError:
+            raise
+        except Exception as error:
+            delay = _handle_stream_error(retry_policy, attempt, error, yielded)
+            stats.retries += 1
+            time.sleep(delay)
+        finally:
+            _close(stream)
+
+
+async def astream_text(open_stream: Callable[[], Awaitable[AsyncIterable]], retry_policy: RetryPolicy,
+                       stats: StreamStats = None, buffer_size: int = 0) -> AsyncGenerator[str, None]:
+    """
+    The asyncio version of `stream_text`. With buffer_size > 0, the stream is read by a background task into a bounded
+    `asyncio.Queue`.
+    """
+
+    stats = StreamStats() if stats is None else stats
+    yielded = []
+    attempt = 0
+
+    while True:
+        attempt += 1
+        replay = _Replay("".join(yielded)) if yielded else None
+        try:
+            stream = await open_stream()
+        except Exception as error:
+            delay = _handle_stream_error(retry_policy, attempt, error, yielded)
+            stats.retries += 1
+            await asyncio.sleep(delay)
+            continue
+        retry_policy.handle_success()
+        try:
+            chunks = _abuffered(stream, buffer_size, stats) if buffer_size > 0 else stream
+            async for chunk in chunks:
+                text = stats.on_chunk(chunk)
+                if text and replay is not None:
+                    text = replay.feed(text)
+                if text:
+                    stats.on_text(text)
+                    yielded.append(text)
+                    yield text
+            if replay is not None:
+                replay.finish()
+            return
+        except StreamInterruptedError:
+            raise
+        except Exception as error:
+            delay = _handle_stream_error(retry_policy, attempt, error, yielded)
+            stats.retries += 1
+            await asyncio.sleep(delay)
+        finally:
+            await _aclose(stream)
+
+
+async def _abuffered(stream: AsyncIterable, buffer_size: int, stats: StreamStats) -> AsyncGenerator:
+    chunks = asyncio.Queue(maxsize=buffer_size)
+
+    async def read():
+        try:
+            async for chunk in stream:
+                await chunks.put(chunk)
+            await chunks.put(_END)
+        except Exception as error:
+            await chunks.put(error)
+
+    reader = asyncio.ensure_future(read())
+    try:
+        while True:
+            stats.max_buffered = max(stats.max_buffered, chunks.qsize())
+            item = await chunks.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        reader.cancel()
+
+
+def _close(stream) -> None:
+    """
+    Close the stream (the HTTP response), best effort: the reader thread of the buffer may still be using it.
+    """
+
+    try:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    except Exception:
+        pass
+
+
+async def _aclose(stream) -> None:
+    try:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+    except Exception:
+        pass
+
+
+def _handle_stream_error(retry_policy: RetryPolicy, attempt: int, error: Exception, yielded: list) -> float:
+    """
+    Ask the retry policy whether to open the stream again. If it gives up after some text was yielded, raise
+    `StreamInterruptedError` with the partial text.
+    """
+
+    try:
+        return retry_policy.handle_error(attempt, error)
+    except Exception as final_error:
+        if yielded:
+            raise StreamInterruptedError("".join(yielded), repr(error)) from final_error
+        raise
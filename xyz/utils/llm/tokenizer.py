@@ -0,0 +1,230 @@
+"""
+=========
+Tokenizer
+=========
+@file_name: tokenizer.py
+@author: Bin Liang
+@date: 2024-05-18
+The local token counter of the prompts, and the context windows of the models.
+"""
+
+__all__ = ["TokenCounter", "get_token_counter", "get_context_window"]
+
+import json
+import logging
+import threading
+from functools import lru_cache
+from typing import List
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from xyz.utils.llm.rate_limiter import estimate_tokens
+from xyz.utils.llm.usage import _is_snapshot
+
+logger = logging.getLogger(__name__)
+
+# The context window (prompt + completion tokens) of the models.
+CONTEXT_WINDOWS = {
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106-preview": 128000,
+    "gpt-4-0125-preview": 128000,
+    "gpt-4-vision-preview": 128000,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-0125": 16385,
+    "gpt-3.5-turbo-instruct": 4096,
+}
+
+# The tokens of the format of each message, and of the priming of the reply. REF: the OpenAI cookbook.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+# An image in high detail costs 85 tokens plus 170 tokens per 512px tile, we count a 1024px square image.
+TOKENS_PER_IMAGE = 765
+
+
+def get_context_window(model: str, default: int = 8192) -> int:
+    """
+    Get the context window of the model, by its name or the name of its base model (i.e. "gpt-4-turbo-2024-04-09").
+
+    Parameters
+    ----------
+    model: str
+        The model name.
+    default: int
+        The context window of an unknown model.
+
+    Returns
+    -------
+    int
+        The max tokens of the prompt and the completion.
+    """
+
+    if model in CONTEXT_WINDOWS:
+        return CONTEXT_WINDOWS[model]
+
+    bases = [name for name in CONTEXT_WINDOWS if _is_snapshot(model, name)]
+
+    return CONTEXT_WINDOWS[max(bases, key=len)] if bases else default
+
+
+class TokenCounter:
+    """
+    Count the tokens of the prompts locally, before they are sent.
+
+    With `tiktoken`, the count is exact. Without it (or if its encoding can not be loaded, i.e. its BPE file can not
+    be downloaded offline), the count is the same cheap estimation as the rate limiter (about 4 characters per
+    token). The counts of the texts are cached, because the same history is counted again and again
+    in a long conversation.
+
+    Examples
+    --------
+    >>> counter = get_token_counter("gpt-4-turbo")
+    >>> counter.count_messages([{"role": "user", "content": "Hello, how are you?"}])
+    13
+    """
+
+    def __init__(self, model: str, cache_size: int = 4096) -> None:
+        """
+        Parameters
+        ----------
+        model: str
+            The model name, which selects the encoding.
+        cache_size: int
+            The number of the texts whose counts are cached.
+        """
+
+        self.model = model
+        self.encoding = self._get_encoding(model)
+        self.exact = self.encoding is not None
+        self.count_text = lru_cache(maxsize=cache_size)(self._count_text)
+
+    def count_messages(self, messages: List, tools: List = None) -> int:
+        """
+        Count the prompt tokens of a chat-completions request.
+
+        Parameters
+        ----------
+        messages: list
+            The OpenAI's messages.
+        tools: list, optional
+            The tools of the request.
+
+        Returns
+        -------
+        int
+            The number of the prompt tokens.
+        """
+
+        if not self.exact:
+            return estimate_tokens(messages, tools)
+
+        tokens = TOKENS_PER_REPLY
+        for message in messages:
+            tokens += self.count_message(message)
+        if tools:
+            tokens += self.count_text(json.dumps(tools, ensure_ascii=False, sort_keys=True))
+
+        return tokens
+
+    def count_message(self, message: dict) -> int:
+        """
+        Count the tokens of one message, with the tokens of its format.
+        """
+
+        if not self.exact:
+            return estimate_tokens([message]) - TOKENS_PER_REPLY
+
+        tokens = TOKENS_PER_MESSAGE + self.count_text(message.get("role", ""))
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            tokens += self.count_text(content)
+        else:
+            for part in content:
+                if part.get("type") == "image_url":
+                    tokens += TOKENS_PER_IMAGE
+                else:
+                    tokens += self.count_text(part.get("text", ""))
+        if message.get("name"):
+            tokens += TOKENS_PER_NAME + self.count_text(message["name"])
+        if message.get("tool_calls"):
+            tokens += self.count_text(json.dumps(message["tool_calls"], ensure_ascii=False, default=str))
+
+        return tokens
+
+    def truncate(self, text: str, max_tokens: int, keep: str = "tail") -> str:
+        """
+        Cut the text to at most max_tokens tokens.
+
+        Parameters
+        ----------
+        text: str
+            The text.
+        max_tokens: int
+            The max tokens of the result.
+        keep: str
+            "tail" keeps the end of the text (the newest part of a history), "head" keeps the beginning.
+
+        Returns
+        -------
+        str
+            The truncated text.
+        """
+
+        if max_tokens <= 0:
+            return ""
+        if self.count_text(text) <= max_tokens:
+            return text
+
+        if self.exact:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            tokens = tokens[-max_tokens:] if keep == "tail" else tokens[:max_tokens]
+            return self.encoding.decode(tokens)
+
+        chars = max_tokens * 4
+        return text[-chars:] if keep == "tail" else text[:chars]
+
+    def _count_text(self, text: str) -> int:
+        if self.exact:
+            return len(self.encoding.encode(text, disallowed_special=()))
+
+        return len(text) // 4
+
+    @staticmethod
+    def _get_encoding(model: str):
+        if tiktoken is None:
+            return None
+        try:
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                # A new model which tiktoken does not know yet.
+                return tiktoken.get_encoding("o200k_base" if model.startswith("gpt-4o") else "cl100k_base")
+        except Exception as error:
+            # The counter of the model is shared (see `get_token_counter`), so this is logged and tried once per model.
+            logger.warning("The tiktoken encoding of %s can not be loaded (%s: %s), the tokens are estimated.", model,
+                           type(error).__name__, error)
+            return None
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """
+    Get the shared `TokenCounter` of the model, so its cache is shared by all the clients and agents.
+    """
+
+    with _counters_lock:
+        counter = _counters.get(model)
+        if counter is None:
+            counter = _counters[model] = TokenCounter(model)
+
+    return counter
@@ -0,0 +1,229 @@
+"""
+=========
+Transport
+=========
+@file_name: transport.py
+@author: Bin Liang
+@date: 2024-05-06
+To share the HTTP connection pools between all the LLM clients in one process.
+"""
+
+__all__ = ["TransportRegistry", "transport_registry"]
+
+import os
+import threading
+from importlib.util import find_spec
+
+import httpx
+
+
+class TransportRegistry:
+    """
+    A process-wide registry of the HTTP clients which are used by the LLM clients. Every named transport owns one
+    keep-alive connection pool (and one for asyncio), so all the `OpenAIClient` which use the same name share the
+    connections and TLS sessions instead of building their own pools.
+
+    Examples
+    --------
+    >>> from xyz.utils.llm.transport import transport_registry
+    >>> transport_registry.configure("default", max_connections=200, max_keepalive_connections=50)
+    >>> http_client = transport_registry.get_client("default")
+    >>> transport_registry.stats()
+    {'default': {'sync': {'open': 2, 'idle': 1, 'active': 1, 'waiting': 0}, 'async': None}}
+    """
+
+    default_config = {
+        "max_connections": 100,
+        "max_keepalive_connections": 20,
+        "keepalive_expiry": 30.,
+        "http2": True,
+        "timeout": 600.,
+        "connect_timeout": 5.,
+        "transport": None,
+    }
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._configs = {}
+        self._clients = {}
+        self._async_clients = {}
+        # The cassette of the XYZ_CASSETTE environment, it is shared by all the transports without their own.
+        self._env_transport = None
+
+    def configure(self, name: str = "default", **config) -> None:
+        """
+        Set the pool limits of a named transport. The clients which already exist will be closed, and the new ones
+        will be built with the new limits when they are requested next time.
+
+        Parameters
+        ----------
+        name: str
+            The name of the transport.
+        **config
+            Any keys of `TransportRegistry.default_config`: max_connections, max_keepalive_connections,
+            keepalive_expiry, http2, timeout, connect_timeout, and transport (a httpx transport which replaces the
+            connection pool, i.e. a cassette of `xyz.utils.llm.cassette`, it must support the blocking and the asyncio
+            requests).
+        """
+
+        unknown = set(config) - set(self.default_config)
+        if unknown:
+            raise ValueError(f"Unknown transport config: {sorted(unknown)}")
+
+        with self._lock:
+            local_config = dict(self._configs.get(name, self.default_config))
+            local_config.update(config)
+            self._configs[name] = local_config
+            old_client = self._clients.pop(name, None)
+            self._async_clients.pop(name, None)
+
+        if old_client is not None:
+            old_client.close()
+
+    def get_client(self, name: str = "default") -> httpx.Client:
+        """
+        Get the shared blocking HTTP client of the transport. It will be created at the first time.
+
+        Parameters
+        ----------
+        name: str
+            The name of the transport.
+
+        Returns
+        -------
+        httpx.Client
+            The shared HTTP client.
+        """
+
+        with self._lock:
+            if name not in self._clients:
+                self._clients[name] = httpx.Client(**self._client_kwargs(name))
+            return self._clients[name]
+
+    def get_async_client(self, name: str = "default") -> httpx.AsyncClient:
+        """
+        Get the shared asyncio HTTP client of the transport. It will be created at the first time.
+        The asyncio connections are bound to the event loop which opens them, so use one event loop per process.
+
+        Parameters
+        ----------
+        name: str
+            The name of the transport.
+
+        Returns
+        -------
+        httpx.AsyncClient
+            The shared asyncio HTTP client.
+        """
+
+        with self._lock:
+            if name not in self._async_clients:
+                self._async_clients[name] = httpx.AsyncClient(**self._client_kwargs(name))
+            return self._async_clients[name]
+
+    def stats(self) -> dict:
+        """
+        Get the statistics of all the connection pools, which can be scraped by the monitor.
+
+        Returns
+        -------
+        dict
+            {name: {"sync": pool_stats or None, "async": pool_stats or None}}, the pool_stats is a dict with the
+            number of the open, idle, active connections and the waiting requests.
+        """
+
+        with self._lock:
+            names = set(self._clients) | set(self._async_clients)
+            return {name: {"sync": self._pool_stats(self._clients.get(name)),
+                           "async": self._pool_stats(self._async_clients.get(name))}
+                    for name in sorted(names)}
+
+    def to_prometheus(self) -> str:
+        """
+        Export the statistics of the connection pools in the Prometheus text format.
+
+        Returns
+        -------
+        str
+            The metrics text.
+        """
+
+        lines = []
+        for name, kinds in self.stats().items():
+            for kind, pool_stats in kinds.items():
+                if pool_stats is None:
+                    continue
+                for key, value in pool_stats.items():
+                    lines.append(f'xyz_http_pool_{key}{{transport="{name}",kind="{kind}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        """
+        Close all the blocking clients. The asyncio clients are just dropped, because they must be closed in their
+        event loop by `await client.aclose()`.
+        """
+
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._async_clients.clear()
+
+        for client in clients:
+            client.close()
+
+    def _client_kwargs(self, name: str) -> dict:
+        """
+        Build the keyword arguments for `httpx.Client` and `httpx.AsyncClient` of a named transport.
+        """
+
+        config = self._configs.get(name, self.default_config)
+        limits = httpx.Limits(max_connections=config["max_connections"],
+                              max_keepalive_connections=config["max_keepalive_connections"],
+                              keepalive_expiry=config["keepalive_expiry"])
+        timeout = httpx.Timeout(config["timeout"], connect=config["connect_timeout"])
+
+        # HTTP/2 needs the optional `h2` package. Without it we stay on HTTP/1.1 keep-alive.
+        http2 = config["http2"] and find_spec("h2") is not None
+        kwargs = {"limits": limits, "timeout": timeout, "http2": http2, "follow_redirects": True}
+
+        transport = config.get("transport") or self._get_env_transport()
+        if transport is not None:
+            kwargs["transport"] = transport
+
+        return kwargs
+
+    def _get_env_transport(self):
+        """
+        The cassette of the environment (XYZ_CASSETTE=record:path or replay:path), it is built only once. It must be
+        called with the lock.
+        """
+
+        if self._env_transport is None and os.getenv("XYZ_CASSETTE"):
+            from xyz.utils.llm.cassette import cassette_from_env
+
+            self._env_transport = cassette_from_env()
+
+        return self._env_transport
+
+    @staticmethod
+    def _pool_stats(client) -> dict | None:
+        """
+        Read the statistics from the connection pool of a httpx client.
+        """
+
+        if client is None:
+            return None
+
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        if pool is None:
+            return None
+
+        connections = list(pool.connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        waiting = sum(1 for request in list(getattr(pool, "_requests", [])) if request.is_queued())
+
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle, "waiting": waiting}
+
+
+transport_registry = TransportRegistry()
@@ -0,0 +1,235 @@
+"""
+========
+Trimming
+========
+@file_name: trimming.py
+@author: Bin Liang
+@date: 2024-05-18
+The policies which trim the messages of a request to the context window before it is sent.
+"""
+
+__all__ = ["TrimPolicy", "DropOldest", "KeepLastN", "Summarize"]
+
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List
+
+from xyz.utils.llm.tokenizer import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+
+class TrimPolicy:
+    """
+    The basic class of the trimming policies. A policy gets the messages of a request and the token budget of the
+    prompt, and returns the messages which fit in it.
+
+    1. The system messages and the last message (the current question) are always kept.
+    2. An assistant message with tool calls and its tool messages are kept or dropped together.
+    3. If the kept messages are still too long, the longest message is cut and its newest part is kept. So a request
+       is never sent over the budget.
+    """
+
+    def trim(self, messages: List, budget: int, counter: TokenCounter, tools: List = None) -> List:
+        """
+        Trim the messages to the budget.
+
+        Parameters
+        ----------
+        messages: list
+            The messages of the request. It is not changed.
+        budget: int
+            The max prompt tokens.
+        counter: TokenCounter
+            The token counter of the model.
+        tools: list, optional
+            The tools of the request, which are counted in the budget too.
+
+        Returns
+        -------
+        list
+            The trimmed messages. If they already fit, the same list is returned.
+        """
+
+        if counter.count_messages(messages, tools) <= budget:
+            return messages
+
+        trimmed = self.select(messages, budget, counter, tools)
+
+        return self.truncate(trimmed, budget, counter, tools)
+
+    def select(self, messages: List, budget: int, counter: TokenCounter, tools: List = None) -> List:
+        """
+        Choose the messages to keep. The subclasses must implement it.
+        """
+
+        raise NotImplementedError
+
+    @staticmethod
+    def split(messages: List) -> tuple:
+        """
+        Split the messages into the system messages, the history groups and the last message. A group is one message,
+        or an assistant message with tool calls and its tool messages.
+        """
+
+        system = [message for message in messages[:-1] if message.get("role") == "system"]
+        groups = []
+        for message in messages[:-1]:
+            if message.get("role") == "system":
+                continue
+            if message.get("role") == "tool" and groups:
+                groups[-1].append(message)
+            else:
+                groups.append([message])
+
+        return system, groups, messages[-1:]
+
+    @staticmethod
+    def truncate(messages: List, budget: int, counter: TokenCounter, tools: List = None) -> List:
+        """
+        Cut the longest text messages until the messages fit in the budget. The newest part of the text is kept.
+        """
+
+        messages = list(messages)
+        over = counter.count_messages(messages, tools) - budget
+        while over > 0:
+            candidates = [i for i, message in enumerate(messages) if isinstance(message.get("content"), str)
+                          and message["content"]]
+            if not candidates:
+                break
+            i = max(candidates, key=lambda index: counter.count_text(messages[index]["content"]))
+            content = messages[i]["content"]
+            size = counter.count_text(content)
+            messages[i] = dict(messages[i], content=counter.truncate(content, max(0, size - over - 1)))
+            logger.warning("The message %d is cut from %d to about %d tokens to fit in the context window.",
+                           i, size, max(0, size - over - 1))
+            new_over = counter.count_messages(messages, tools) - budget
+            if new_over >= over:
+                break
+            over = new_over
+
+        return messages
+
+
+class DropOldest(TrimPolicy):
+    """
+    Drop the oldest messages of the history (not the system messages) until the request fits.
+    """
+
+    def select(self, messages: List, budget: int, counter: TokenCounter, tools: List = None) -> List:
+        system, groups, last = self.split(messages)
+        tokens = counter.count_messages(system + last, tools)
+
+        kept = []
+        for group in reversed(groups):
+            size = sum(counter.count_message(message) for message in group)
+            if tokens + size > budget:
+                break
+            kept.insert(0, group)
+            tokens += size
+
+        return system + [message for group in kept for message in group] + last
+
+
+class KeepLastN(TrimPolicy):
+    """
+    Keep the system messages and the last N messages of the history (a tool-call group counts as one). If they are
+    still too long, drop the oldest of them.
+    """
+
+    def __init__(self, n: int = 10) -> None:
+        """
+        Parameters
+        ----------
+        n: int
+            The number of the history messages to keep, besides the system messages and the current message.
+        """
+
+        self.n = n
+
+    def select(self, messages: List, budget: int, counter: TokenCounter, tools: List = None) -> List:
+        system, groups, last = self.split(messages)
+        groups = groups[-self.n:] if self.n > 0 else []
+        messages = system + [message for group in groups for message in group] + last
+
+        return DropOldest().select(messages, budget, counter, tools)
+
+
+class Summarize(TrimPolicy):
+    """
+    Replace the oldest messages of the history by a summary, which is written by the LLM. The last `keep_last`
+    messages are kept as they are. The summaries are cached, so the same history is summarized only once.
+    """
+
+    PROMPT = ("Summarize the following conversation in a concise way. Keep all the facts, numbers, decisions and "
+              "results which may be needed later. Only output the summary.\n\n{conversation}")
+
+    def __init__(self, llm_client, keep_last: int = 4, max_summary_tokens: int = 512, cache_size: int = 64) -> None:
+        """
+        Parameters
+        ----------
+        llm_client: OpenAIClient
+            The client which writes the summary. A cheap model is good enough.
+        keep_last: int
+            The number of the newest history messages which are not summarized.
+        max_summary_tokens: int
+            The max tokens of a summary.
+        cache_size: int
+            The number of the cached summaries.
+        """
+
+        self.llm_client = llm_client
+        self.keep_last = keep_last
+        self.max_summary_tokens = max_summary_tokens
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def select(self, messages: List, budget: int, counter: TokenCounter, tools: List = None) -> List:
+        system, groups, last = self.split(messages)
+        if len(groups) <= self.keep_last:
+            return DropOldest().select(messages, budget, counter, tools)
+
+        old = [message for group in groups[:len(groups) - self.keep_last] for message in group]
+        recent = [message for group in groups[len(groups) - self.keep_last:] for message in group]
+        summary = {"role": "system", "content": "The summary of the earlier conversation:\n" + self.summarize(old)}
+        messages = system + [summary] + recent + last
+
+        return DropOldest().select(messages, budget, counter, tools)
+
+    def summarize(self, messages: List) -> str:
+        """
+        Summarize the messages by the LLM, or get the summary from the cache.
+        """
+
+        conversation = "\n".join(f"{message.get('role')}: {self._text(message)}" for message in messages)
+        key = hashlib.sha256(conversation.encode()).hexdigest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        response = self.llm_client.run(messages=[{"role": "user",
+                                                  "content": self.PROMPT.format(conversation=conversation)}])
+        summary = response.choices[0].message.content or ""
+        summary = self.llm_client.token_counter.truncate(summary, self.max_summary_tokens, keep="head")
+
+        with self._lock:
+            self._cache[key] = summary
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return summary
+
+    @staticmethod
+    def _text(message: dict) -> str:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        if message.get("tool_calls"):
+            content = (content or "") + json.dumps(message["tool_calls"], ensure_ascii=False, default=str)
+
+        return content or ""
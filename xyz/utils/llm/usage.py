@@ -0,0 +1,415 @@
+"""
+=====
+Usage
+=====
+@file_name: usage.py
+@author: Bin Liang
+@date: 2024-05-17
+The usage ledger and the cost accounting of the LLM calls: a loadable price table, the per-call records, and the
+aggregation per run and per agent.
+"""
+
+__all__ = ["PriceTable", "UsageRecord", "UsageLedger", "usage_scope", "current_usage_scope", "record_usage",
+           "price_table", "usage_ledger"]
+
+import os
+import re
+import csv
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterable, List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Dollars per 1k tokens, REF: https://openai.com/pricing
+DEFAULT_PRICES = {
+    "gpt-4-turbo": {"prompt": 0.01, "completion": 0.03},
+    "gpt-4": {"prompt": 0.03, "completion": 0.06},
+    "gpt-4-32k": {"prompt": 0.06, "completion": 0.12},
+    "gpt-4-1106-preview": {"prompt": 0.01, "completion": 0.03},
+    "gpt-4-0125-preview": {"prompt": 0.01, "completion": 0.03},
+    "gpt-4o": {"prompt": 0.005, "completion": 0.015},
+    "gpt-3.5-turbo": {"prompt": 0.0005, "completion": 0.0015},
+    "gpt-3.5-turbo-instruct": {"prompt": 0.0015, "completion": 0.002},
+    "gpt-3.5-turbo-0125": {"prompt": 0.0005, "completion": 0.0015},
+}
+
+
+_SNAPSHOT_SUFFIX = re.compile(r"-\d{4}(-\d{2}-\d{2})?(-preview)?")
+
+
+def _is_snapshot(model: str, base_model: str) -> bool:
+    """
+    Whether the model is a dated snapshot of the base model, i.e. "gpt-4-turbo-2024-04-09" or "gpt-4-0613".
+    """
+
+    return model.startswith(base_model) and _SNAPSHOT_SUFFIX.fullmatch(model[len(base_model):]) is not None
+
+
+class PriceTable:
+    """
+    The prices of the models in dollars per 1k tokens. The table can be loaded from a JSON file, so a new model or a
+    new price does not need a new release:
+
+    {"gpt-4o": {"prompt": 0.005, "completion": 0.015, "cached_prompt": 0.0025}, ...}
+
+    A dated snapshot which is not in the table uses the price of its base model, i.e. "gpt-4-turbo-2024-04-09" uses
+    the price of "gpt-4-turbo", but "gpt-4o-mini" is not "gpt-4o". The "cached_prompt" price is optional, the "prompt" price is used by default.
+    """
+
+    def __init__(self, prices: dict = None) -> None:
+        """
+        Parameters
+        ----------
+        prices: dict, optional
+            {model: {"prompt": float, "completion": float, "cached_prompt": float}}. By default, the OpenAI's prices.
+        """
+
+        self._lock = threading.Lock()
+        self._prices = {}
+        self.update(DEFAULT_PRICES if prices is None else prices)
+
+    @classmethod
+    def from_file(cls, path: str) -> "PriceTable":
+        """
+        Load a price table from a JSON file.
+        """
+
+        with open(path) as file:
+            return cls(json.load(file))
+
+    def load(self, path: str) -> None:
+        """
+        Update this table from a JSON file. The models in the file replace the known ones, the others are kept.
+        """
+
+        with open(path) as file:
+            self.update(json.load(file))
+
+    def update(self, prices: dict) -> None:
+        for model, price in prices.items():
+            if "prompt" not in price or "completion" not in price:
+                raise ValueError(f"The price of {model} must have the 'prompt' and the 'completion' prices.")
+        with self._lock:
+            self._prices.update({model: dict(price) for model, price in prices.items()})
+
+    def get(self, model: str) -> dict | None:
+        """
+        Get the price of the model, by its name or the name of its base model. None if the model is unknown.
+        """
+
+        with self._lock:
+            if model in self._prices:
+                return self._prices[model]
+            prefixes = [name for name in self._prices if _is_snapshot(model, name)]
+
+            return self._prices[max(prefixes, key=len)] if prefixes else None
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float | None:
+        """
+        Calculate the cost of a call.
+
+        Parameters
+        ----------
+        model: str
+            The name of the model.
+        prompt_tokens: int
+            The prompt tokens, including the cached ones.
+        completion_tokens: int
+            The completion tokens.
+        cached_tokens: int
+            The prompt tokens which are served by the prompt cache of the provider.
+
+        Returns
+        -------
+        float or None
+            The cost in dollars, or None if the model is unknown.
+        """
+
+        price = self.get(model)
+        if price is None:
+            return None
+
+        cached_price = price.get("cached_prompt", price["prompt"])
+
+        return ((prompt_tokens - cached_tokens) * price["prompt"] + cached_tokens * cached_price
+                + completion_tokens * price["completion"]) / 1000
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {model: dict(price) for model, price in self._prices.items()}
+
+
+class UsageRecord(NamedTuple):
+    """
+    The usage of one LLM call.
+    """
+    timestamp: float
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    latency: float
+    cost: float | None
+    agent: str | None = None
+    template: str | None = None
+    run_id: str | None = None
+    stream: bool = False
+    from_cache: bool = False
+
+
+class UsageLedger:
+    """
+    A thread-safe ledger of the `UsageRecord`s.
+
+    The totals (per model) are aggregated when a record is added, so they are exact even if the ledger only keeps the
+    last `max_records` records. The grouped summary and the exports use the kept records.
+
+    Examples
+    --------
+    >>> ledger = UsageLedger()
+    >>> with usage_scope(ledger, run_id="run-1"):
+    >>>     agent(content="A story about a dog.")
+    >>> ledger.totals()
+    >>> ledger.summary(by=("agent", "model"))
+    >>> ledger.to_csv("usage.csv")
+    """
+
+    def __init__(self, max_records: int = None) -> None:
+        """
+        Parameters
+        ----------
+        max_records: int, optional
+            The max number of the kept records, the oldest are dropped first. None means all the records are kept.
+        """
+
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=max_records)
+        self._totals = {}
+
+    def add(self, record: UsageRecord) -> None:
+        with self._lock:
+            self._records.append(record)
+            self._accumulate(self._totals.setdefault(record.model, self._empty()), record)
+
+    def records(self) -> List[UsageRecord]:
+        with self._lock:
+            return list(self._records)
+
+    def totals(self) -> dict:
+        """
+        Get the totals of all the records ever added.
+
+        Returns
+        -------
+        dict
+            {"calls", "prompt_tokens", "completion_tokens", "cached_tokens", "latency", "cost", "unpriced_calls",
+            "cache_hits", "models": {model: the same totals}}.
+        """
+
+        with self._lock:
+            models = {model: dict(total) for model, total in self._totals.items()}
+
+        totals = self._empty()
+        for total in models.values():
+            for key, value in total.items():
+                totals[key] += value
+        totals["models"] = models
+
+        return totals
+
+    def summary(self, by: Iterable[str] = ("model",)) -> dict:
+        """
+        Group the kept records by some fields of the `UsageRecord`, i.e. ("agent",), ("run_id", "model").
+
+        Returns
+        -------
+        dict
+            {tuple of the field values: totals}.
+        """
+
+        by = tuple(by)
+        unknown = set(by) - set(UsageRecord._fields)
+        if unknown:
+            raise ValueError(f"Unknown fields of UsageRecord: {sorted(unknown)}")
+
+        groups = {}
+        for record in self.records():
+            key = tuple(getattr(record, field) for field in by)
+            self._accumulate(groups.setdefault(key, self._empty()), record)
+
+        return groups
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+            self._totals.clear()
+
+    def to_csv(self, path: str) -> int:
+        """
+        Export the kept records to a CSV file.
+
+        Returns
+        -------
+        int
+            The number of the exported records.
+        """
+
+        records = self.records()
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(UsageRecord._fields)
+            writer.writerows(records)
+
+        return len(records)
+
+    def to_parquet(self, path: str) -> int:
+        """
+        Export the kept records to a Parquet file. It needs the optional dependency `pyarrow`.
+
+        Returns
+        -------
+        int
+            The number of the exported records.
+
+        Raises
+        ------
+        ImportError
+            If `pyarrow` is not installed.
+        """
+
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as error:
+            raise ImportError("Exporting the usage to Parquet needs pyarrow, please `pip install pyarrow` or use "
+                              "`to_csv`.") from error
+
+        records = self.records()
+        columns = {field: [getattr(record, field) for record in records] for field in UsageRecord._fields}
+        pq.write_table(pa.table(columns), path)
+
+        return len(records)
+
+    @staticmethod
+    def _empty() -> dict:
+        return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "latency": 0.,
+                "cost": 0., "unpriced_calls": 0, "cache_hits": 0}
+
+    @staticmethod
+    def _accumulate(total: dict, record: UsageRecord) -> None:
+        total["calls"] += 1
+        total["prompt_tokens"] += record.prompt_tokens
+        total["completion_tokens"] += record.completion_tokens
+        total["cached_tokens"] += record.cached_tokens
+        total["latency"] += record.latency
+        total["cache_hits"] += record.from_cache
+        if record.cost is None:
+            total["unpriced_calls"] += 1
+        else:
+            total["cost"] += record.cost
+
+
+class _Scope(NamedTuple):
+    ledgers: tuple
+    labels: dict
+
+
+_current_scope = contextvars.ContextVar("xyz_usage_scope", default=_Scope((), {}))
+
+
+@contextmanager
+def usage_scope(ledger: UsageLedger = None, **labels):
+    """
+    Attribute the LLM calls in this block (and the threads and tasks which copy its context) to a ledger and some
+    labels. The scopes are nested: the calls are recorded in the ledgers of all the outer scopes, and the inner labels
+    win.
+
+    Parameters
+    ----------
+    ledger: UsageLedger, optional
+        The ledger which records the calls of this block.
+    **labels
+        The labels of the records: agent, template and run_id.
+
+    Examples
+    --------
+    >>> with usage_scope(run_ledger, run_id=run_id):
+    >>>     with usage_scope(agent_ledger, agent="SolvingAgent"):
+    >>>         llm_client.run(messages)  # Recorded in both ledgers.
+    """
+
+    unknown = set(labels) - {"agent", "template", "run_id"}
+    if unknown:
+        raise ValueError(f"Unknown labels of the usage scope: {sorted(unknown)}")
+
+    scope = _current_scope.get()
+    ledgers = scope.ledgers if ledger is None or ledger in scope.ledgers else scope.ledgers + (ledger,)
+    token = _current_scope.set(_Scope(ledgers, dict(scope.labels, **labels)))
+    try:
+        yield
+    finally:
+        _current_scope.reset(token)
+
+
+def current_usage_scope() -> _Scope:
+    """
+    Get the current usage scope. The streaming calls capture it when they are created, because their body runs later,
+    maybe out of the scope.
+    """
+
+    return _current_scope.get()
+
+
+def record_usage(ledger: UsageLedger | None, scope: _Scope, model: str, usage, latency: float, stream: bool = False,
+                 from_cache: bool = False, prices: PriceTable = None) -> UsageRecord:
+    """
+    Build the record of a call from its usage (`CompletionUsage` or None), and add it to the ledger and the ledgers of
+    the scope.
+    """
+
+    prices = price_table if prices is None else prices
+    if usage is None or from_cache:
+        prompt_tokens = completion_tokens = cached_tokens = 0
+    else:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        cached_tokens = _get_cached_tokens(usage)
+
+    cost = 0. if from_cache else prices.cost(model, prompt_tokens, completion_tokens, cached_tokens)
+    if cost is None:
+        logger.debug("The model %s is not in the price table, the cost of the call is unknown.", model)
+
+    record = UsageRecord(timestamp=time.time(), model=model, prompt_tokens=prompt_tokens,
+                         completion_tokens=completion_tokens, cached_tokens=cached_tokens, latency=latency, cost=cost,
+                         agent=scope.labels.get("agent"), template=scope.labels.get("template"),
+                         run_id=scope.labels.get("run_id"), stream=stream, from_cache=from_cache)
+
+    for target in scope.ledgers if ledger is None or ledger in scope.ledgers else (ledger,) + scope.ledgers:
+        target.add(record)
+
+    return record
+
+
+def _get_cached_tokens(usage) -> int:
+    # The old SDKs do not know the `prompt_tokens_details`, and keep it as a dict in the extra fields.
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is None and getattr(usage, "model_extra", None):
+        details = usage.model_extra.get("prompt_tokens_details")
+    if details is None:
+        return 0
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+price_table = PriceTable()
+# The prices can be overridden without changing the code, i.e. XYZ_PRICE_TABLE=prices.json
+if os.getenv("XYZ_PRICE_TABLE"):
+    price_table.load(os.environ["XYZ_PRICE_TABLE"])
+usage_ledger = UsageLedger(max_records=100000)
@@ -0,0 +1,206 @@
+"""
+=======
+LogSink
+=======
+@file_name: log_sink.py
+@author: Bin Liang
+@date: 2024-05-28
+The asynchronous logging sink: the records are put in a queue and written by a background thread in batches, so the
+thread which logs (i.e. the one which consumes the streamed tokens) never waits for the console or the disk.
+"""
+
+__all__ = ["AsyncLogSink", "JSONLinesHandler"]
+
+import json
+import queue
+import logging
+import threading
+import weakref
+import logging.handlers
+from typing import Iterable, List
+
+from xyz.utils.llm.usage import current_usage_scope
+
+_STOP = object()
+
+
+class AsyncLogSink:
+    """
+    A queue in front of some handlers. Add `sink.handler` to a logger, then `logger.info(...)` only puts the record
+    in the queue. The writer thread takes the records in batches (at most `max_batch`), passes them to the handlers,
+    and flushes the handlers once after each batch instead of after each record.
+
+    The labels of the current usage scope (i.e. the "run_id" and the "agent", see `usage_scope`) are added to the
+    records when they are logged, so the handlers can tell the concurrent runs apart.
+
+    Examples
+    --------
+    >>> sink = AsyncLogSink([logging.FileHandler("run.log"), JSONLinesHandler("run.jsonl")])
+    >>> logger.addHandler(sink.handler)
+    >>> logger.info("Hello", extra={"step": "Start", "agent": "None"})
+    >>> sink.flush()  # Wait until the records are written.
+    >>> sink.close()
+    """
+
+    def __init__(self, handlers: Iterable[logging.Handler], max_batch: int = 512) -> None:
+        """
+        Parameters
+        ----------
+        handlers: Iterable[logging.Handler]
+            The handlers which write the records. They are only called in the writer thread, and each of them only
+            gets the records of its level.
+        max_batch: int
+            The max number of the records which are written between two flushes.
+        """
+
+        assert max_batch >= 1, "The max_batch must be at least 1."
+
+        self.handlers = list(handlers)
+        self.max_batch = max_batch
+
+        self._queue = queue.SimpleQueue()
+        self.handler = _LabeledQueueHandler(self._queue)
+        self._thread = threading.Thread(target=_write, args=(self._queue, self.handlers, max_batch),
+                                        name="AsyncLogSink", daemon=True)
+        self._thread.start()
+        # The records in the queue are written before the sink is collected or the interpreter exits.
+        self._finalizer = weakref.finalize(self, _stop, self._queue, self._thread, self.handlers)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until the records which are logged before are written and flushed.
+
+        Returns
+        -------
+        bool
+            False if the timeout is reached (or the sink is closed) first.
+        """
+
+        if not self._finalizer.alive:
+            return False
+        done = threading.Event()
+        self._queue.put(done)
+
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        """
+        Write the records in the queue, stop the writer thread and close the handlers.
+        """
+
+        self._finalizer()
+
+
+class JSONLinesHandler(logging.FileHandler):
+    """
+    Write the records as JSON lines: {"time", "level", "run_id", "step", "agent", "message"}. The records of the
+    `merge_levels` (i.e. the streamed tokens) which follow each other in the same run, step and agent are merged into
+    one line. The merged line is written when a record of another line comes or the handler is closed, not when it is
+    flushed, so the words which are streamed slower than they are written are still one line.
+    """
+
+    def __init__(self, filename: str, merge_levels: Iterable[int] = (), encoding: str = "utf-8", **kwargs) -> None:
+        """
+        Parameters
+        ----------
+        filename: str
+            The path of the file.
+        merge_levels: Iterable[int]
+            The levels of the records which are merged.
+        """
+
+        super().__init__(filename, encoding=encoding, **kwargs)
+
+        self.merge_levels = set(merge_levels)
+        self._merged = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = self._to_dict(record)
+            if record.levelno in self.merge_levels:
+                if self._merged is not None and self._get_key(self._merged) == self._get_key(line):
+                    self._merged["message"] += line["message"]
+                    return
+                self._write_merged()
+                self._merged = line
+                return
+
+            self._write_merged()
+            self._write(line)
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.stream is not None:
+                self._write_merged()
+        super().close()
+
+    def _write_merged(self) -> None:
+        if self._merged is not None:
+            merged, self._merged = self._merged, None
+            self._write(merged)
+
+    def _write(self, line: dict) -> None:
+        if self.stream is None:
+            self.stream = self._open()
+        self.stream.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+
+    @staticmethod
+    def _to_dict(record: logging.LogRecord) -> dict:
+        labels = getattr(record, "labels", {})
+
+        return {"time": record.created, "level": record.levelname, "run_id": labels.get("run_id"),
+                "step": getattr(record, "step", None), "agent": getattr(record, "agent", labels.get("agent")),
+                "message": record.getMessage()}
+
+    @staticmethod
+    def _get_key(line: dict) -> tuple:
+        return line["level"], line["run_id"], line["step"], line["agent"]
+
+
+class _LabeledQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        # The scope of the logging thread, the writer thread has its own.
+        record.labels = dict(current_usage_scope().labels)
+
+        return record
+
+
+def _write(records: queue.SimpleQueue, handlers: List[logging.Handler], max_batch: int) -> None:
+    stopped = False
+    while not stopped:
+        batch = [records.get()]
+        while len(batch) < max_batch:
+            try:
+                batch.append(records.get_nowait())
+            except queue.Empty:
+                break
+
+        events = []
+        for record in batch:
+            if record is _STOP:
+                stopped = True
+            elif isinstance(record, threading.Event):
+                events.append(record)
+            else:
+                for handler in handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+
+        for handler in handlers:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+        for event in events:
+            event.set()
+
+
+def _stop(records: queue.SimpleQueue, thread: threading.Thread, handlers: List[logging.Handler]) -> None:
+    records.put(_STOP)
+    if thread is not threading.current_thread():
+        thread.join()
+    for handler in handlers:
+        handler.close()
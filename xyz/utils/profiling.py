@@ -0,0 +1,319 @@
+"""
+=========
+Profiling
+=========
+@file_name: profiling.py
+@author: Bin Liang
+@date: 2024-05-30
+The opt-in profiler of the hot paths: the wall time, the CPU time and the allocation peak of every agent call and
+of the marked functions, with a flamegraph-compatible (folded stacks) report.
+"""
+
+__all__ = ["ProfileSession", "profile_session", "current_profile_session", "profile_call", "aprofile_call",
+           "profiled"]
+
+import os
+import time
+import inspect
+import functools
+import threading
+import tracemalloc
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, AsyncGenerator, Awaitable, Callable, Generator
+
+_current_session = contextvars.ContextVar("xyz_profile_session", default=None)
+_current_frame = contextvars.ContextVar("xyz_profile_frame", default=None)
+# The sessions which need the tracemalloc, it is stopped when the last one ends (if it is started by them).
+_memory_lock = threading.Lock()
+_memory_sessions = 0
+_memory_started = False
+
+
+class _Frame:
+    """
+    A running call: its times and the times of its children in the same thread, which are not its own time.
+    """
+
+    __slots__ = ("key", "parent", "path", "thread", "wall", "cpu", "child_wall", "child_cpu", "memory", "peak")
+
+    def __init__(self, key: str, parent: "_Frame | None") -> None:
+        self.key = key
+        self.parent = parent
+        self.path = key if parent is None else parent.path + ";" + key
+        self.thread = threading.get_ident()
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.child_wall = self.child_cpu = 0.
+        self.memory = self.peak = 0
+
+
+class ProfileSession:
+    """
+    The records of the profiled calls in a `profile_session` block (and the threads and tasks which copy its
+    context).
+
+    1. The stats of each key ("Class.method"): the number of the calls, the wall time and the CPU time (total and
+       self, the self time is without the profiled calls inside it in the same thread), and the max allocation peak.
+    2. The self time of each stack of the keys, which is the folded format of the flamegraph tools
+       (`flamegraph.pl`, speedscope, ...).
+
+    The CPU time is the time of the thread, so a call which awaits in asyncio also counts the other tasks which run in
+    the meantime. The allocation peak needs `trace_memory`, and it is approximate if the calls run at the same time.
+    """
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        """
+        Parameters
+        ----------
+        trace_memory: bool
+            Whether to trace the allocations by `tracemalloc`, which makes the code much slower.
+        """
+
+        self.trace_memory = trace_memory
+
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"calls": 0, "wall": 0., "cpu": 0., "self_wall": 0., "self_cpu": 0.,
+                                           "alloc_peak": 0})
+        self._stacks = defaultdict(lambda: [0., 0.])
+
+    def stats(self) -> dict:
+        """
+        The stats of each key, the largest self wall time first.
+
+        Returns
+        -------
+        dict
+            {key: {"calls", "wall", "cpu", "self_wall", "self_cpu" (seconds), "alloc_peak" (bytes)}}.
+        """
+
+        with self._lock:
+            stats = {key: dict(value) for key, value in self._stats.items()}
+
+        return dict(sorted(stats.items(), key=lambda item: -item[1]["self_wall"]))
+
+    def to_folded(self, metric: str = "wall") -> str:
+        """
+        The self time of each stack in the folded format: "Outer.flowing;Inner.flowing 1234" (microseconds).
+
+        Parameters
+        ----------
+        metric: str
+            "wall" or "cpu".
+        """
+
+        assert metric in ("wall", "cpu"), "The metric must be 'wall' or 'cpu'."
+
+        index = 0 if metric == "wall" else 1
+        with self._lock:
+            lines = [f"{path} {round(times[index] * 1e6)}" for path, times in sorted(self._stacks.items())]
+
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def write_folded(self, path: str, metric: str = "wall") -> None:
+        """
+        Write the folded stacks to a file, i.e. `flamegraph.pl profile.folded > profile.svg`.
+        """
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(self.to_folded(metric))
+
+    def report(self, top: int = 10) -> str:
+        """
+        A short text table of the keys with the largest self wall time.
+        """
+
+        lines = [f"{'key':<48}{'calls':>8}{'wall':>10}{'self wall':>12}{'self cpu':>11}{'peak KiB':>11}"]
+        for key, stat in list(self.stats().items())[:top]:
+            lines.append(f"{key[:47]:<48}{stat['calls']:>8}{stat['wall']:>10.3f}{stat['self_wall']:>12.3f}"
+                         f"{stat['self_cpu']:>11.3f}{stat['alloc_peak'] / 1024:>11.1f}")
+
+        return "\n".join(lines)
+
+    def _enter(self, key: str) -> tuple:
+        parent = _current_frame.get()
+        frame = _Frame(key, parent)
+        if self.trace_memory and tracemalloc.is_tracing():
+            memory, peak = tracemalloc.get_traced_memory()
+            # The peak so far belongs to the parent, the peak from now on to this call.
+            if parent is not None:
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+            frame.memory = frame.peak = memory
+
+        return frame, _current_frame.set(frame)
+
+    def _exit(self, frame: _Frame, token: contextvars.Token, count: bool) -> None:
+        wall = time.perf_counter() - frame.wall
+        cpu = time.thread_time() - frame.cpu
+        _current_frame.reset(token)
+
+        alloc_peak = 0
+        if self.trace_memory and tracemalloc.is_tracing():
+            frame.peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+            alloc_peak = frame.peak - frame.memory
+            if frame.parent is not None:
+                frame.parent.peak = max(frame.parent.peak, frame.peak)
+            tracemalloc.reset_peak()
+
+        parent = frame.parent
+        if parent is not None and parent.thread == frame.thread:
+            parent.child_wall += wall
+            parent.child_cpu += cpu
+
+        self_wall, self_cpu = max(0., wall - frame.child_wall), max(0., cpu - frame.child_cpu)
+        with self._lock:
+            stat = self._stats[frame.key]
+            stat["calls"] += count
+            stat["wall"] += wall
+            stat["cpu"] += cpu
+            stat["self_wall"] += self_wall
+            stat["self_cpu"] += self_cpu
+            stat["alloc_peak"] = max(stat["alloc_peak"], alloc_peak)
+            stack = self._stacks[frame.path]
+            stack[0] += self_wall
+            stack[1] += self_cpu
+
+
+@contextmanager
+def profile_session(session: ProfileSession = None, trace_memory: bool = False):
+    """
+    Profile the agent calls and the marked functions in this block.
+
+    Examples
+    --------
+    >>> with profile_session(trace_memory=True) as session:
+    >>>     company(user_input="...")
+    >>> print(session.report())
+    >>> session.write_folded("profile.folded")
+    """
+
+    global _memory_sessions, _memory_started
+
+    session = ProfileSession(trace_memory=trace_memory) if session is None else session
+    if session.trace_memory:
+        with _memory_lock:
+            if _memory_sessions == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _memory_started = True
+            _memory_sessions += 1
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+        if session.trace_memory:
+            with _memory_lock:
+                _memory_sessions -= 1
+                if _memory_sessions == 0 and _memory_started:
+                    tracemalloc.stop()
+                    _memory_started = False
+
+
+def current_profile_session() -> ProfileSession | None:
+    return _current_session.get()
+
+
+def profile_call(key: str, func: Callable, kwargs: dict) -> Any:
+    """
+    Call `func(**kwargs)` as a profiled call of the key, if a session is active. If it returns a generator (a stream),
+    the time in the generator is profiled too, but not the time of the consumer between the items.
+    """
+
+    session = _current_session.get()
+    if session is None:
+        return func(**kwargs)
+
+    frame, token = session._enter(key)
+    try:
+        result = func(**kwargs)
+    finally:
+        session._exit(frame, token, count=True)
+    if inspect.isgenerator(result):
+        return _profile_generator(session, key, result)
+
+    return result
+
+
+async def aprofile_call(key: str, func: Callable[..., Awaitable], kwargs: dict) -> Any:
+    """
+    The asyncio version of `profile_call`, `func(**kwargs)` is awaited.
+    """
+
+    session = _current_session.get()
+    if session is None:
+        return await func(**kwargs)
+
+    frame, token = session._enter(key)
+    try:
+        result = await func(**kwargs)
+    finally:
+        session._exit(frame, token, count=True)
+    if inspect.isasyncgen(result):
+        return _aprofile_generator(session, key, result)
+    if inspect.isgenerator(result):
+        return _profile_generator(session, key, result)
+
+    return result
+
+
+def profiled(func: Callable) -> Callable:
+    """
+    Mark a function (or method) as a hot path, its calls are profiled by the active session under its qualified
+    name. Without a session, it costs one context variable lookup.
+
+    Examples
+    --------
+    >>> class AutoCompany(Agent):
+    >>>     @staticmethod
+    >>>     @profiled
+    >>>     def get_special_part(pattern: str, content: str) -> str:
+    >>>         ...
+    """
+
+    key = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current_session.get() is None:
+            return func(*args, **kwargs)
+
+        return profile_call(key, functools.partial(func, *args), kwargs)
+
+    return wrapper
+
+
+def _profile_generator(session: ProfileSession, key: str, generator: Generator) -> Generator:
+    while True:
+        frame, token = session._enter(key)
+        try:
+            item = next(generator)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            session._exit(frame, token, count=False)
+        try:
+            yield item
+        except GeneratorExit:
+            generator.close()
+            raise
+
+
+async def _aprofile_generator(session: ProfileSession, key: str, generator: AsyncGenerator) -> AsyncGenerator:
+    while True:
+        frame, token = session._enter(key)
+        try:
+            item = await generator.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            session._exit(frame, token, count=False)
+        try:
+            yield item
+        except GeneratorExit:
+            await generator.aclose()
+            raise
@@ -0,0 +1,449 @@
+"""
+=======
+Tracing
+=======
+@file_name: tracing.py
+@author: Bin Liang
+@date: 2024-05-29
+The OpenTelemetry-style spans of the agent calls, the LLM requests and the steps of the company, and the exporters
+which write them in the OTLP JSON format, so we can see where the time of a run goes.
+"""
+
+__all__ = ["Span", "Tracer", "SpanExporter", "OTLPFileExporter", "InMemorySpanExporter", "tracer", "start_span",
+           "use_span", "current_span", "trace_call", "atrace_call"]
+
+import os
+import json
+import time
+import inspect
+import secrets
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, AsyncGenerator, Awaitable, Callable, Generator, Iterable, List
+
+# The span kinds of the OTLP.
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+
+class Span:
+    """
+    A timed operation. The spans of a run form a tree by their parents, and share the trace id of the root span.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, parent: "Span" = None, kind: str = "internal",
+                 attributes: dict = None) -> None:
+        assert kind in SPAN_KINDS, f"The kind of the span must be one of {sorted(SPAN_KINDS)}."
+
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = "unset"
+        self.status_message = ""
+        self.start_time = time.time_ns()
+        self.end_time = None
+
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> float | None:
+        """
+        The seconds of the span, None if it is not ended.
+        """
+
+        return None if self.end_time is None else (self.end_time - self.start_time) / 1e9
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict) -> None:
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add_event(self, name: str, attributes: dict = None) -> None:
+        with self._lock:
+            self.events.append((time.time_ns(), name, dict(attributes or {})))
+
+    def record_exception(self, error: BaseException) -> None:
+        """
+        Mark the span as failed by the error.
+        """
+
+        self.add_event("exception", {"exception.type": type(error).__name__, "exception.message": str(error)[:500]})
+        self.status, self.status_message = "error", f"{type(error).__name__}: {error}"[:500]
+
+    def end(self) -> None:
+        """
+        End the span and export it. Only the first call counts.
+        """
+
+        with self._lock:
+            if self.end_time is not None:
+                return
+            self.end_time = time.time_ns()
+        self.tracer.on_end(self)
+
+    def to_otlp(self) -> dict:
+        """
+        The span in the OTLP JSON format.
+        """
+
+        span = {"traceId": self.trace_id, "spanId": self.span_id, "name": self.name, "kind": SPAN_KINDS[self.kind],
+                "startTimeUnixNano": str(self.start_time), "endTimeUnixNano": str(self.end_time or self.start_time),
+                "attributes": _to_otlp_attributes(self.attributes),
+                "events": [{"timeUnixNano": str(at), "name": name, "attributes": _to_otlp_attributes(attributes)}
+                           for at, name, attributes in self.events],
+                "status": {"code": {"unset": 0, "ok": 1, "error": 2}[self.status]}}
+        if self.parent_span_id is not None:
+            span["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+
+        return span
+
+
+class _NoopSpan:
+    """
+    The span when the tracing is off, everything is ignored.
+    """
+
+    name = None
+    duration = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict) -> None:
+        pass
+
+    def add_event(self, name: str, attributes: dict = None) -> None:
+        pass
+
+    def record_exception(self, error: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_current_span = contextvars.ContextVar("xyz_current_span", default=None)
+
+
+class SpanExporter:
+    """
+    The basic class of the exporters, which receive the ended spans.
+    """
+
+    def export(self, spans: List[Span]) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        self.flush()
+
+
+class OTLPFileExporter(SpanExporter):
+    """
+    Write the spans to a file as JSON lines, each line is an OTLP `ExportTraceServiceRequest` in the JSON encoding (the
+    format of the file exporter of the OpenTelemetry Collector), so the file can be loaded by the OTLP tools. The spans
+    are written in batches.
+    """
+
+    def __init__(self, path: str = "traces/traces.jsonl", service_name: str = "xyz", max_batch: int = 64) -> None:
+        """
+        Parameters
+        ----------
+        path: str
+            The path of the file, the spans are appended to it.
+        service_name: str
+            The "service.name" of the resource.
+        max_batch: int
+            The max number of the spans which are kept in the memory before they are written.
+        """
+
+        assert max_batch >= 1, "The max_batch must be at least 1."
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.service_name = service_name
+        self.max_batch = max_batch
+
+        self._lock = threading.Lock()
+        self._spans = []
+
+    def export(self, spans: List[Span]) -> None:
+        with self._lock:
+            self._spans.extend(spans)
+            if len(self._spans) >= self.max_batch:
+                self._write()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write()
+
+    def _write(self) -> None:
+        if not self._spans:
+            return
+        spans, self._spans = self._spans, []
+        request = {"resourceSpans": [{
+            "resource": {"attributes": _to_otlp_attributes({"service.name": self.service_name})},
+            "scopeSpans": [{"scope": {"name": "xyz"}, "spans": [span.to_otlp() for span in spans]}],
+        }]}
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+
+class InMemorySpanExporter(SpanExporter):
+    """
+    Keep the spans in the memory, i.e. to find the slowest agent after a run.
+
+    Examples
+    --------
+    >>> exporter = InMemorySpanExporter()
+    >>> tracer.add_exporter(exporter)
+    >>> company(user_input="...")
+    >>> exporter.summary()
+    {'SolvingAgent': {'count': 1, 'total_seconds': 12.3, 'max_seconds': 12.3}, ...}
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def export(self, spans: List[Span]) -> None:
+        with self._lock:
+            self.spans.extend(spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans.clear()
+
+    def summary(self) -> dict:
+        """
+        The count, the total and the max seconds of the spans of each name, the slowest first.
+        """
+
+        totals = defaultdict(lambda: {"count": 0, "total_seconds": 0., "max_seconds": 0.})
+        with self._lock:
+            for span in self.spans:
+                total = totals[span.name]
+                total["count"] += 1
+                total["total_seconds"] += span.duration
+                total["max_seconds"] = max(total["max_seconds"], span.duration)
+
+        return dict(sorted(totals.items(), key=lambda item: -item[1]["total_seconds"]))
+
+
+class Tracer:
+    """
+    Create the spans and pass the ended ones to the exporters. Without an exporter, the tracing is off and a span
+    costs nothing.
+    """
+
+    def __init__(self, exporters: Iterable[SpanExporter] = ()) -> None:
+        self._lock = threading.Lock()
+        self.exporters = list(exporters)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    def add_exporter(self, exporter: SpanExporter) -> None:
+        with self._lock:
+            self.exporters = self.exporters + [exporter]
+
+    def remove_exporter(self, exporter: SpanExporter) -> None:
+        with self._lock:
+            self.exporters = [other for other in self.exporters if other is not exporter]
+
+    def start_span(self, name: str, kind: str = "internal", attributes: dict = None) -> Span | _NoopSpan:
+        """
+        Create a span which is a child of the current span. It is not the current span until `use_span`.
+        """
+
+        if not self.enabled:
+            return _NOOP_SPAN
+
+        return Span(self, name, parent=_current_span.get(), kind=kind, attributes=attributes)
+
+    def on_end(self, span: Span) -> None:
+        for exporter in self.exporters:
+            exporter.export([span])
+
+    def flush(self) -> None:
+        for exporter in self.exporters:
+            exporter.flush()
+
+    def shutdown(self) -> None:
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+
+tracer = Tracer()
+# The tracing can be turned on without changing the code, i.e. XYZ_TRACE_FILE=traces.jsonl
+if os.getenv("XYZ_TRACE_FILE"):
+    tracer.add_exporter(OTLPFileExporter(os.environ["XYZ_TRACE_FILE"]))
+
+
+def current_span() -> Span | _NoopSpan:
+    """
+    Get the current span, or a span which ignores everything if there is none.
+    """
+
+    span = _current_span.get()
+
+    return _NOOP_SPAN if span is None else span
+
+
+@contextmanager
+def use_span(span: Span | _NoopSpan, end_on_exit: bool = False):
+    """
+    Make the span the current one in this block. The error of the block is recorded in the span.
+    """
+
+    if span is _NOOP_SPAN:
+        yield span
+        return
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as error:
+        if not isinstance(error, GeneratorExit):
+            span.record_exception(error)
+        raise
+    finally:
+        _current_span.reset(token)
+        if end_on_exit:
+            span.end()
+
+
+@contextmanager
+def start_span(name: str, kind: str = "internal", attributes: dict = None):
+    """
+    Run the block in a new span, which is the child of the current span.
+
+    Examples
+    --------
+    >>> with start_span("step SolvingAgent", attributes={"xyz.step.name": "SolvingAgent"}) as span:
+    >>>     span.set_attribute("xyz.step.speculative", False)
+    """
+
+    with use_span(tracer.start_span(name, kind=kind, attributes=attributes), end_on_exit=True) as span:
+        yield span
+
+
+def trace_call(name: str, func: Callable, kwargs: dict, kind: str = "internal", attributes: dict = None) -> Any:
+    """
+    Call `func(**kwargs)` in a new span. If it returns a generator (a stream), the span lasts until the stream is
+    consumed, and it is the current span while the generator runs.
+    """
+
+    span = tracer.start_span(name, kind=kind, attributes=attributes)
+    if span is _NOOP_SPAN:
+        return func(**kwargs)
+
+    with use_span(span):
+        try:
+            result = func(**kwargs)
+        except BaseException:
+            span.end()
+            raise
+    if inspect.isgenerator(result):
+        return _trace_generator(span, result)
+    if inspect.isasyncgen(result):
+        return _atrace_generator(span, result)
+    span.end()
+
+    return result
+
+
+async def atrace_call(name: str, func: Callable[..., Awaitable], kwargs: dict, kind: str = "internal",
+                      attributes: dict = None) -> Any:
+    """
+    The asyncio version of `trace_call`, `func(**kwargs)` is awaited.
+    """
+
+    span = tracer.start_span(name, kind=kind, attributes=attributes)
+    if span is _NOOP_SPAN:
+        return await func(**kwargs)
+
+    with use_span(span):
+        try:
+            result = await func(**kwargs)
+        except BaseException:
+            span.end()
+            raise
+    if inspect.isasyncgen(result):
+        return _atrace_generator(span, result)
+    if inspect.isgenerator(result):
+        return _trace_generator(span, result)
+    span.end()
+
+    return result
+
+
+def _trace_generator(span: Span, generator: Generator) -> Generator:
+    # The span is the current one only while the generator runs, not while the consumer handles its items.
+    try:
+        while True:
+            with use_span(span):
+                try:
+                    item = next(generator)
+                except StopIteration as stop:
+                    return stop.value
+            yield item
+    except GeneratorExit:
+        with use_span(span):
+            generator.close()
+        raise
+    finally:
+        span.end()
+
+
+async def _atrace_generator(span: Span, generator: AsyncGenerator) -> AsyncGenerator:
+    try:
+        while True:
+            with use_span(span):
+                try:
+                    item = await generator.__anext__()
+                except StopAsyncIteration:
+                    return
+            yield item
+    except GeneratorExit:
+        with use_span(span):
+            await generator.aclose()
+        raise
+    finally:
+        span.end()
+
+
+def _to_otlp_attributes(attributes: dict) -> List[dict]:
+    return [{"key": key, "value": _to_otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def _to_otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # The 64-bit integers are strings in the OTLP JSON.
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_to_otlp_value(item) for item in value]}}
+
+    return {"stringValue": str(value)}